@@ -14,18 +14,23 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from google.adk.agents.llm_agent import Agent
-from tools.nhtsa_api import decode_vin, validate_vin
-from tools.api_mocks import get_market_intelligence
+from tools.nhtsa_api import decode_vin_async, validate_vin
+from tools.vehicle_record import SUMMARY_FIELDS
+from tools.api_mocks import get_market_intelligence_async
+from tools.market_projection import project_for_llm
 from typing import Dict, Any
 
 
 # Tool wrapper functions with proper ADK signatures
-def vin_decoder_tool(vin: str) -> Dict[str, Any]:
+async def vin_decoder_tool(vin: str) -> Dict[str, Any]:
     """
     Decodes a VIN using the NHTSA API to get vehicle specifications.
 
     This uses the free NHTSA Vehicle API to retrieve accurate make, model,
-    year, trim, and other vehicle details from a 17-character VIN.
+    year, trim, and other vehicle details from a 17-character VIN. The
+    decode is async so a slow NHTSA response never blocks other appraisals
+    running on the same event loop. Only the summary fields are returned
+    (no full vPIC dump) to keep the agent's context small.
 
     Args:
         vin: Vehicle Identification Number (17 characters).
@@ -34,15 +39,21 @@ def vin_decoder_tool(vin: str) -> Dict[str, Any]:
         Dictionary containing vehicle specifications including make, model,
         year, trim, engine, fuel type, and manufacturer information.
     """
-    return decode_vin(vin)
+    return await decode_vin_async(vin, fields=SUMMARY_FIELDS)
 
 
-def market_data_tool(vin: str, zip_code: str = "33130") -> Dict[str, Any]:
+async def market_data_tool(vin: str, zip_code: str = "33130") -> Dict[str, Any]:
     """
     Retrieves comprehensive market intelligence for a vehicle.
 
     Aggregates data from multiple sources including KBB instant cash offers
-    and comparable vehicle listings from CarGurus and AutoTrader.
+    and comparable vehicle listings from CarGurus and AutoTrader. Sources
+    are queried concurrently; if one is slow or down the others are still
+    returned, with partial set and per-source status in sources.
+
+    The result is a projection sized for the model's context (see
+    tools/market_projection.py): the top comparables with only the fields
+    needed for pricing, and pre-aggregated summaries over all of them.
 
     Args:
         vin: Vehicle Identification Number to research.
@@ -52,12 +63,17 @@ def market_data_tool(vin: str, zip_code: str = "33130") -> Dict[str, Any]:
         Dictionary containing:
         - vehicle_info: Make, model, year, trim, mileage
         - kbb_valuation: Instant cash offer and trade-in range
-        - comparables: List of 5-10 similar vehicles with prices
+        - comparables: Up to 10 similar vehicles (source, price, mileage,
+          distance, days listed); comparables_omitted counts any left out
         - market_summary: Average price, min/max range, outliers removed
+        - price_bands: p10/p50/p90 listing prices for the segment
+        - market_value: Price at this vehicle's mileage and year, with a
+          confidence interval (when the segment has enough listings)
         - regional_insights: Geo-arbitrage opportunities (if available)
         - demand_insights: Days to sale, inventory levels (if available)
+        - sources: Status of each market source
     """
-    return get_market_intelligence(vin, zip_code)
+    return project_for_llm(await get_market_intelligence_async(vin, zip_code))
 
 
 # Create the Market Intelligence Agent
@@ -95,13 +111,13 @@ Return a clear, structured analysis with:
    - Mileage
    - Distance from search location
    - Days on market
-   - Dealer name
    - Source (CarGurus, AutoTrader, etc.)
 4. **Market Summary**:
    - Average market price
    - Price range (min - max)
    - Number of comparables analyzed
    - Number of outliers removed
+   - Mileage-adjusted market value and its confidence interval (market_value), when available
 5. **Key Insights**:
    - Regional arbitrage opportunities
    - Demand trends
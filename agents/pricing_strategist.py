@@ -152,6 +152,7 @@ pricing_strategist_agent = Agent(
    - KBB instant cash offer value
    - 5-10 comparable vehicle listings with prices
    - Market average price
+   - Mileage-adjusted market value with confidence interval (market_value, when available)
    - Regional pricing insights
    - Demand indicators (days to sale, inventory levels)
 
@@ -169,6 +170,8 @@ pricing_strategist_agent = Agent(
 Base Offer = Market Average Price - Net Reconditioning Adjustment
 Net Recon = Reconditioning Cost - Aftermarket Value
 ```
+When market intelligence includes market_value, use its value as the Market Average Price:
+it corrects the comparables' average for this vehicle's mileage and model year.
 
 **Step 2: Analyze Competitive Position**
 - Compare to KBB instant cash offer
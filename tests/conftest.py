@@ -0,0 +1,208 @@
+"""
+Shared pytest fixtures.
+
+Provides an isolated VIN decode cache and a local stand-in for the NHTSA vPIC
+API so decoder tests never depend on the real network.
+"""
+
+import sys
+import os
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import nhtsa_api, vpic_snapshot
+from tools.vin_cache import VinCache, set_vin_cache
+from tools.http_client import AsyncResilientSession, CircuitBreaker, ResilientSession
+
+
+# Stand-in decode table keyed on VIN positions 1-8 (WMI + VDS)
+STANDIN_VEHICLES = {
+    "1HGCV1F3": {
+        "Make": "HONDA",
+        "Model": "Accord",
+        "Model Year": "2018",
+        "Trim": "EX-L",
+        "Body Class": "Sedan/Saloon",
+        "Engine Model": "L15BE",
+        "Fuel Type - Primary": "Gasoline",
+        "Manufacturer Name": "AMERICAN HONDA MOTOR CO., INC.",
+        "Plant City": "MARYSVILLE",
+        "Vehicle Type": "PASSENGER CAR"
+    },
+    "5YJ3E1EA": {
+        "Make": "TESLA",
+        "Model": "Model 3",
+        "Model Year": "2021",
+        "Trim": "Long Range",
+        "Body Class": "Sedan/Saloon",
+        "Fuel Type - Primary": "Electric",
+        "Manufacturer Name": "TESLA, INC.",
+        "Plant City": "FREMONT",
+        "Vehicle Type": "PASSENGER CAR"
+    }
+}
+
+
+# DecodeVin variable names -> flat DecodeVinValues keys
+FLAT_KEYS = {
+    "Make": "Make",
+    "Model": "Model",
+    "Model Year": "ModelYear",
+    "Trim": "Trim",
+    "Body Class": "BodyClass",
+    "Engine Model": "EngineModel",
+    "Fuel Type - Primary": "FuelTypePrimary",
+    "Manufacturer Name": "Manufacturer",
+    "Plant City": "PlantCity",
+    "Vehicle Type": "VehicleType"
+}
+
+
+class StandInNHTSA:
+    """Records requests served by the stand-in vPIC server."""
+
+    def __init__(self):
+        self.requests = []
+        self.batches = []
+        self.fail_next = 0
+        self.delay = 0.0
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def reset(self) -> None:
+        self.requests.clear()
+        self.batches.clear()
+        self.fail_next = 0
+        self.delay = 0.0
+
+    def inject_fault(self) -> bool:
+        """Apply configured latency; return True if this request should fail."""
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail_next:
+            self.fail_next -= 1
+            return True
+        return False
+
+
+def _flat_row(vin: str) -> dict:
+    """Build a DecodeVinValues-style flat row for a VIN."""
+    row = {key: "" for key in FLAT_KEYS.values()}
+    row.update({"VIN": vin, "ABS": "", "OtherRestraintSystemInfo": "Not Applicable"})
+    vehicle = STANDIN_VEHICLES.get(vin[:8].upper())
+    if vehicle is None:
+        row["ErrorCode"] = "7"
+        return row
+    row["ErrorCode"] = "0"
+    row["Doors"] = "4"
+    for variable, value in vehicle.items():
+        row[FLAT_KEYS[variable]] = value
+    return row
+
+
+def _make_handler(state: StandInNHTSA):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, payload: dict) -> None:
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            state.requests.append(("GET", path))
+            if state.inject_fault():
+                self._send_json(503, {"Message": "unavailable"})
+                return
+
+            if path.startswith("/api/vehicles/DecodeVinValues/"):
+                vin = path.rsplit("/", 1)[-1]
+                self._send_json(200, {"Count": 1, "Results": [_flat_row(vin)]})
+                return
+
+            self._send_json(404, {"Message": "not found"})
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            state.requests.append(("POST", path))
+            length = int(self.headers.get("Content-Length", 0))
+            form = parse_qs(self.rfile.read(length).decode())
+            if state.inject_fault():
+                self._send_json(503, {"Message": "unavailable"})
+                return
+
+            if path.rstrip("/") == "/api/vehicles/DecodeVINValuesBatch":
+                vins = [v.split(",")[0] for v in form.get("data", [""])[0].split(";") if v]
+                state.batches.append(vins)
+                if len(vins) > 50:
+                    self._send_json(400, {"Message": "too many VINs"})
+                    return
+                rows = [_flat_row(vin) for vin in vins]
+                self._send_json(200, {"Count": len(rows), "Results": rows})
+                return
+
+            self._send_json(404, {"Message": "not found"})
+
+    return Handler
+
+
+@pytest.fixture(scope="session")
+def _standin_server():
+    state = StandInNHTSA()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(state))
+    state.server = server
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def nhtsa_client():
+    """Install fresh sync/async vPIC clients with fast backoff for the duration of a test."""
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30.0)
+    settings = dict(max_retries=2, backoff_base=0.001, backoff_max=0.01, attempt_timeout=2.0, deadline=5.0)
+    client = ResilientSession(breaker=breaker, **settings)
+    nhtsa_api.set_nhtsa_client(client)
+    nhtsa_api.set_nhtsa_async_client(AsyncResilientSession(breaker=breaker, **settings))
+    yield client
+    nhtsa_api.set_nhtsa_client(None)
+    nhtsa_api.set_nhtsa_async_client(None)
+    client.close()
+
+
+@pytest.fixture
+def nhtsa_standin(_standin_server, nhtsa_client, monkeypatch):
+    """Point tools.nhtsa_api at the local stand-in vPIC server, with no offline snapshot."""
+    _standin_server.reset()
+    monkeypatch.setattr(nhtsa_api, "NHTSA_API_URL", _standin_server.url)
+    monkeypatch.setattr(vpic_snapshot, "_default_snapshot", None)
+    return _standin_server
+
+
+@pytest.fixture
+def vin_cache(tmp_path):
+    """Install an isolated, file-backed VIN cache for the duration of a test."""
+    cache = VinCache(path=str(tmp_path / "vin_cache.sqlite"))
+    set_vin_cache(cache)
+    yield cache
+    set_vin_cache(None)
+    cache.close()
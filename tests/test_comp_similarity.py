@@ -0,0 +1,98 @@
+"""
+Tests for k-nearest-neighbour comparable selection.
+"""
+
+import sys
+import os
+
+import numpy as np
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.api_mocks import get_market_intelligence
+from tools.comp_similarity import ComparableIndex, resolve_weights
+
+
+def _listing(vin, mileage, distance=5.0, days=10, **extra):
+    return {
+        "comparable_vin": vin,
+        "price": 25000,
+        "mileage": mileage,
+        "distance_miles": distance,
+        "days_listed": days,
+        **extra
+    }
+
+
+class TestComparableIndex:
+    """Test scoring and top-k selection."""
+
+    def test_closest_mileage_ranks_first(self):
+        """With everything else equal, the nearest odometer reading wins."""
+        index = ComparableIndex.from_listings(
+            [_listing("A", 60000), _listing("B", 31000), _listing("C", 40000)],
+            year=2022, trim="EX-L"
+        )
+        top = index.top_k(2, year=2022, mileage=32000, trim="EX-L")
+
+        assert [comp["comparable_vin"] for _, comp in top] == ["B", "C"]
+        assert top[0][0] < top[1][0]
+
+    def test_weights_change_the_ranking(self):
+        """Weighting distance over trim prefers a nearby listing of another trim."""
+        index = ComparableIndex.from_listings([
+            _listing("same-trim-far", 32000, distance=80.0, trim="EX-L"),
+            _listing("other-trim-near", 32000, distance=1.0, trim="Sport")
+        ], year=2022)
+
+        by_trim = index.top_k(1, 2022, 32000, "EX-L", weights={"trim": 5.0, "distance": 0.1})
+        by_distance = index.top_k(1, 2022, 32000, "EX-L", weights={"trim": 0.1, "distance": 5.0})
+
+        assert by_trim[0][1]["comparable_vin"] == "same-trim-far"
+        assert by_distance[0][1]["comparable_vin"] == "other-trim-near"
+
+    def test_top_k_matches_full_sort(self):
+        """The partial sort returns the same k as sorting every score."""
+        rng = np.random.default_rng(7)
+        n = 20000
+        index = ComparableIndex(
+            list(range(n)),
+            rng.integers(2016, 2025, n),
+            rng.uniform(0, 150000, n),
+            rng.choice(["lx", "ex", "ex-l", "sport"], n).tolist(),
+            rng.uniform(0, 100, n),
+            rng.integers(0, 90, n)
+        )
+        top = index.top_k(25, year=2022, mileage=32000, trim="EX-L")
+        expected = np.argsort(index.scores(2022, 32000, "EX-L"), kind="stable")[:25]
+
+        assert [item for _, item in top] == list(expected)
+
+    def test_rejects_unknown_features(self):
+        """Weights must name a known feature."""
+        with pytest.raises(ValueError, match="color"):
+            resolve_weights({"color": 1.0})
+
+
+class TestSimilarComparables:
+    """Test k-nearest selection through get_market_intelligence."""
+
+    def test_selects_k_most_similar(self):
+        """k limits the comparables and the summary is computed over them."""
+        result = get_market_intelligence("1HGBH41JXMN109186", k=3)
+
+        assert result["success"] == True
+        assert len(result["comparables"]) == 3
+        assert result["market_summary"]["total_comparables"] == 3
+        assert result["search_params"]["k"] == 3
+        scores = [comp["similarity_distance"] for comp in result["comparables"]]
+        assert scores == sorted(scores)
+
+    def test_bad_weights_are_an_error(self):
+        """Invalid weights come back as an error result, not an exception."""
+        result = get_market_intelligence("1HGBH41JXMN109186", k=3, weights={"mileage": -1})
+
+        assert result["success"] == False
+        assert "mileage" in result["error"]
@@ -0,0 +1,122 @@
+"""
+Tests for cross-source listing deduplication.
+"""
+
+import sys
+import os
+import json
+
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.api_mocks import get_cargurus_comparables, get_market_intelligence
+from tools.listing_dedup import ListingDedupIndex, SeenVins, dedupe_listings
+from tools.market_store import DEFAULT_MARKET_DATA_PATH, MarketDataStore, set_market_store
+
+
+DEMO_VIN = "1HGBH41JXMN109186"
+
+
+def _listing(source, vin, dealer="CarMax Miami", price=24500, mileage=30000):
+    return {
+        "source": source,
+        "comparable_vin": vin,
+        "dealer_name": dealer,
+        "price": price,
+        "mileage": mileage
+    }
+
+
+class TestListingDedupIndex:
+    """Test VIN and fuzzy matching."""
+
+    def test_same_vin_is_one_car(self):
+        """Listings sharing a VIN collapse, whatever their other fields."""
+        kept, removed = dedupe_listings([
+            _listing("cargurus", "1HGCV1F32JA123456"),
+            _listing("autotrader", " 1hgcv1f32ja123456 ", dealer="CarMax", price=26000)
+        ])
+
+        assert removed == 1
+        assert kept == [{**_listing("cargurus", "1HGCV1F32JA123456"), "also_listed_on": ["autotrader"]}]
+
+    def test_fuzzy_match_without_vin(self):
+        """Without a VIN, the same dealer at a near price and mileage is the same car."""
+        index = ListingDedupIndex()
+        first, _ = index.add(_listing("cargurus", "1HGCV1F32JA123456", price=24500, mileage=30000))
+
+        # Across a bucket boundary, with the dealer name formatted differently
+        assert index.add(_listing("autotrader", None, dealer="CARMAX - Miami", price=24499, mileage=30400)) == (first, False)
+        assert index.add(_listing("autotrader", None, price=24900))[1] == True
+        assert index.add(_listing("autotrader", None, dealer="DriveTime"))[1] == True
+        assert len(index) == 3
+
+    def test_different_vins_are_never_merged(self):
+        """Two identical-looking cars with their own VINs stay separate."""
+        kept, removed = dedupe_listings([
+            _listing("cargurus", "1HGCV1F32JA123456"),
+            _listing("autotrader", "1HGCV1F33JA234567")
+        ])
+
+        assert removed == 0
+        assert len(kept) == 2
+
+    def test_seen_vins_stay_near_the_error_rate(self):
+        """SeenVins never forgets a VIN and rarely claims one it wasn't given."""
+        seen = SeenVins(capacity=5000, error_rate=0.01)
+        vins = [f"1HGCV1F3{i:09d}" for i in range(5000)]
+        assert all(seen.add(vin) for vin in vins[:10])
+        for vin in vins[10:]:
+            seen.add(vin)
+
+        assert all(vin.lower() in seen for vin in vins)
+        assert seen.add(f" {vins[0].lower()} ") == False
+        false_positives = sum(f"5YJ3E1EA{i:09d}" in seen for i in range(20000))
+        assert false_positives / 20000 < 0.02
+        assert seen.add("  ") == False
+
+    def test_rejects_bad_tolerances(self):
+        """Tolerances must be positive."""
+        with pytest.raises(ValueError):
+            ListingDedupIndex(price_tolerance=0)
+
+
+@pytest.fixture
+def duplicated_market(tmp_path):
+    """Demo market data with one Accord listing repeated on AutoTrader without its VIN."""
+    with open(DEFAULT_MARKET_DATA_PATH, "r") as f:
+        data = json.load(f)
+    comps = data[DEMO_VIN]["comparables"]
+    comps.append({**comps[0], "source": "autotrader", "comparable_vin": "", "price": comps[0]["price"] + 100,
+                  "listing_url": "https://autotrader.com/listing/99999"})
+    path = tmp_path / "market.json"
+    path.write_text(json.dumps(data))
+    set_market_store(MarketDataStore(path=str(path), check_interval=0))
+    yield data
+    set_market_store(None)
+
+
+class TestDedupedResponses:
+    """Test that market responses count each car once."""
+
+    def test_comparables_drop_cross_listed_car(self, duplicated_market):
+        """The repeated listing is dropped and the summary matches the original data."""
+        original = duplicated_market[DEMO_VIN]["comparables"][:-1]
+        result = get_cargurus_comparables(DEMO_VIN)
+
+        assert len(result["comparables"]) == len(original)
+        assert result["search_params"]["duplicates_removed"] == 1
+        assert result["market_summary"]["total_comparables"] == len(original)
+        tagged = [comp for comp in result["comparables"] if "also_listed_on" in comp]
+        assert [comp["comparable_vin"] for comp in tagged] == [original[0]["comparable_vin"]]
+        assert tagged[0]["also_listed_on"] == ["autotrader"]
+
+    def test_market_intelligence_counts_each_car_once(self, duplicated_market):
+        """get_market_intelligence reports the deduplicated listings."""
+        result = get_market_intelligence(DEMO_VIN)
+
+        vins = [comp["comparable_vin"] for comp in result["comparables"]]
+        assert len(vins) == len(set(vins)) == 5
+        assert result["market_summary"]["total_comparables"] == 5
@@ -0,0 +1,168 @@
+"""
+Tests for the columnar, memory-mapped market store.
+"""
+
+import sys
+import os
+import json
+import time
+
+import numpy as np
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.api_mocks import filter_outliers, get_market_intelligence
+from tools.comp_similarity import ComparableIndex
+from tools.market_columns import ColumnarMarketStore, open_market_columns, write_market_columns
+from tools.market_store import DEFAULT_MARKET_DATA_PATH, JsonMarketBackend, MarketDataStore, set_market_backend
+from tools.outliers import filter_outliers_batch
+from tools.price_model import PriceModel
+from tools.quantile_sketch import SegmentSketches
+
+
+DEMO_VIN = "1HGBH41JXMN109186"
+
+
+@pytest.fixture
+def entries():
+    with open(DEFAULT_MARKET_DATA_PATH, "r") as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def store(entries, tmp_path):
+    write_market_columns(entries, str(tmp_path / "market_columns"))
+    store = ColumnarMarketStore(str(tmp_path / "market_columns"))
+    yield store
+    store.close()
+
+
+class TestColumnarQueries:
+    """Test that the columnar store answers like the JSON backend."""
+
+    def test_entries_round_trip(self, entries, store):
+        """Every entry comes back as it was written, listings included."""
+        for vin, entry in entries.items():
+            assert store.get_vehicle(vin) == entry
+        assert list(store.get_vehicle(DEMO_VIN)) == list(entries[DEMO_VIN])
+        assert store.get_vehicle("UNKNOWN12345678901") is None
+        assert store.stats()["comparables"] == sum(len(entry["comparables"]) for entry in entries.values())
+
+    def test_segment_queries_match_json_backend(self, entries, store):
+        """Segment and radius searches return the JSON backend's listings."""
+        json_backend = JsonMarketBackend(MarketDataStore(DEFAULT_MARKET_DATA_PATH))
+        for entry in entries.values():
+            info = entry["vehicle_info"]
+            segment = (info["make"], info["model"], info["year"])
+            assert store.find_vehicles(*segment, info["trim"]) == json_backend.find_vehicles(*segment, info["trim"])
+            assert store.find_comparables(*segment, near=(25.77, -80.19), radius_miles=30) == \
+                json_backend.find_comparables(*segment, near=(25.77, -80.19), radius_miles=30)
+            found = store.find_comparables(*segment)
+            assert sorted(comp["comparable_vin"] for comp in found) == \
+                sorted(comp["comparable_vin"] for comp in json_backend.find_comparables(*segment))
+            assert [comp["distance_miles"] for comp in found] == sorted(comp["distance_miles"] for comp in found)
+
+    def test_market_intelligence_is_unchanged(self, store):
+        """Responses served from the columnar backend equal the JSON backend's."""
+        expected = get_market_intelligence(DEMO_VIN)
+        set_market_backend(store)
+        try:
+            result = get_market_intelligence(DEMO_VIN)
+        finally:
+            set_market_backend(None)
+
+        assert result == expected
+
+    def test_similarity_search_is_unchanged(self, store):
+        """kNN over the store's columns picks and summarizes the same listings."""
+        # Miami (in range), Orlando (radius expanded) and an unknown zip
+        for zip_code in ("33130", "32801", "10001"):
+            expected = get_market_intelligence(DEMO_VIN, zip_code=zip_code, k=3)
+            set_market_backend(store)
+            try:
+                result = get_market_intelligence(DEMO_VIN, zip_code=zip_code, k=3)
+            finally:
+                set_market_backend(None)
+
+            assert result["comparables"] == expected["comparables"]
+            assert result["market_summary"] == expected["market_summary"]
+            assert result["search_params"] == expected["search_params"]
+
+
+class TestColumnSlices:
+    """Test zero-copy segment columns and the vectorized consumers."""
+
+    def test_segment_columns_are_views(self, entries, store):
+        """A segment's columns share memory with the mapped files."""
+        columns = store.segment_columns("HONDA", "accord", 2022, fields=("price", "mileage"))
+
+        assert isinstance(store.column("price"), np.memmap)
+        assert np.shares_memory(columns["price"], store.column("price"))
+        assert sorted(columns["price"]) == sorted(comp["price"] for comp in entries[DEMO_VIN]["comparables"])
+        with pytest.raises(ValueError):
+            columns["price"][0] = 0
+
+    def test_ragged_prices_feed_outlier_filter(self, store):
+        """Filtering every segment at once matches filtering each one alone."""
+        batch = filter_outliers_batch(*store.ragged("price"))
+        segments = store.segments()
+
+        for segment, (make, model) in enumerate(zip(segments["make"], segments["model"])):
+            year, trim, region = segments["year"][segment], segments["trim"][segment], segments["region"][segment]
+            entry, = store.find_vehicles(make, model, year, trim, region)
+            assert batch["avg"][segment] == pytest.approx(filter_outliers(entry["comparables"])["avg_price"])
+
+    def test_price_model_and_bands_match_entries(self, entries, store):
+        """The regression and price bands equal those built from the parsed entries."""
+        from_columns = PriceModel.from_columns(store)
+        from_entries = PriceModel.from_entries(entries)
+        sketches = SegmentSketches.from_entries(entries, seed=0)
+
+        for entry in entries.values():
+            info = entry["vehicle_info"]
+            assert from_columns.predict(info["make"], info["model"], info["year"], info["mileage"]) == \
+                from_entries.predict(info["make"], info["model"], info["year"], info["mileage"])
+            assert store.price_bands(info["make"], info["model"], info["year"]) == \
+                sketches.price_bands(info["make"], info["model"], info["year"])
+
+    def test_comparable_index_over_segment(self, store):
+        """kNN over a segment's columns ranks listings like an index built from dicts."""
+        index = store.comparable_index("Honda", "Accord", 2022)
+        listings = store.find_comparables("Honda", "Accord", 2022)
+        expected = ComparableIndex.from_listings(listings, 2022, "EX-L").top_k(3, 2022, 30000, "EX-L")
+
+        assert [store.listing(row) for _, row in index.top_k(3, 2022, 30000, "EX-L")] == [comp for _, comp in expected]
+
+
+class TestPublishing:
+    """Test building and replacing the store on disk."""
+
+    def test_rebuilds_when_json_is_newer(self, entries, tmp_path):
+        """open_market_columns rebuilds from a changed JSON file; open stores keep working."""
+        source = tmp_path / "market.json"
+        source.write_text(json.dumps({DEMO_VIN: entries[DEMO_VIN]}))
+        path = str(tmp_path / "market_columns")
+        old = open_market_columns(path, str(source))
+        assert old.stats()["vehicles"] == 1
+
+        source.write_text(json.dumps(entries))
+        os.utime(source, (time.time() + 10, time.time() + 10))
+        store = open_market_columns(path, str(source))
+
+        assert store.stats()["vehicles"] == len(entries)
+        assert old.segment_columns("Honda", "Accord", 2022)["price"].sum() == \
+            sum(comp["price"] for comp in entries[DEMO_VIN]["comparables"])
+        assert not [name for name in os.listdir(tmp_path) if name.startswith(".market_columns-")]
+
+    def test_rejects_other_format_versions(self, store):
+        """A store written in another layout is not read."""
+        meta_path = os.path.join(store.path, "meta.json")
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        with open(meta_path, "w") as f:
+            json.dump({**meta, "format": 0}, f)
+
+        with pytest.raises(ValueError):
+            ColumnarMarketStore(store.path)
@@ -0,0 +1,363 @@
+"""
+Tests for the market data layer behind tools/api_mocks.py.
+"""
+
+import sys
+import os
+import copy
+import json
+import pickle
+import time
+import threading
+
+import numpy as np
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import api_mocks, vpic_snapshot
+from tools.api_mocks import get_market_intelligence
+from tools.geo import GeoGridIndex, haversine_miles, zip_location
+from tools.market_columns import open_market_columns
+from tools.market_db import open_market_db
+from tools.market_jsonl import open_market_jsonl
+from tools.market_store import (
+    DEFAULT_MARKET_DATA_PATH,
+    JsonMarketBackend,
+    MarketDataStore,
+    set_market_backend,
+    set_market_store
+)
+from tools.quantile_sketch import SegmentSketches
+from tools.vpic_snapshot import VpicSnapshot
+
+
+DEMO_VIN = "1HGBH41JXMN109186"
+
+
+class TestMarketCoalescing:
+    """Test singleflight coalescing of market lookups."""
+
+    def test_concurrent_lookups_share_one_load(self, monkeypatch):
+        """A burst of lookups for one VIN loads market data once."""
+        backend = JsonMarketBackend()
+        real_get = backend.get_vehicle
+        loads = []
+
+        def slow_get(vin):
+            loads.append(1)
+            time.sleep(0.1)
+            return real_get(vin)
+
+        monkeypatch.setattr(backend, "get_vehicle", slow_get)
+        monkeypatch.setattr(api_mocks, "get_market_backend", lambda: backend)
+        barrier = threading.Barrier(6)
+        results = []
+
+        def worker():
+            barrier.wait()
+            results.append(get_market_intelligence(DEMO_VIN))
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(loads) == 1
+        assert all(r["success"] for r in results)
+        # Each caller owns its result dict; nested market data is the shared read-only snapshot
+        assert len({id(r) for r in results}) == 6
+        assert len({id(r["comparables"]) for r in results}) == 1
+
+
+@pytest.fixture
+def market_file(tmp_path):
+    """A private copy of the demo market data, served through a fresh store."""
+    path = tmp_path / "market.json"
+    with open(DEFAULT_MARKET_DATA_PATH, "r") as f:
+        path.write_text(f.read())
+    store = MarketDataStore(path=str(path), check_interval=0)
+    set_market_store(store)
+    yield path
+    set_market_store(None)
+
+
+def _rewrite(path, mutate):
+    """Rewrite the market file with a change and a guaranteed new mtime."""
+    data = json.loads(path.read_text())
+    mutate(data)
+    path.write_text(json.dumps(data))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+class TestMarketDataStore:
+    """Test the load-once market data store."""
+
+    def test_file_is_parsed_once(self, market_file):
+        """Repeated lookups reuse one parsed snapshot."""
+        first = api_mocks.load_mock_market_data()
+        get_market_intelligence(DEMO_VIN)
+        api_mocks.get_kbb_instant_cash_offer(DEMO_VIN)
+        api_mocks.get_cargurus_comparables(DEMO_VIN)
+
+        assert api_mocks.load_mock_market_data() is first
+        assert api_mocks.get_market_store().stats()["loads"] == 1
+
+    def test_reloads_when_file_changes(self, market_file):
+        """A rewritten file is picked up with a new snapshot version."""
+        before = api_mocks.load_mock_market_data()
+        _rewrite(market_file, lambda d: d[DEMO_VIN]["kbb_data"].update(instant_cash_offer=1))
+
+        after = api_mocks.load_mock_market_data()
+        assert after.version == before.version + 1
+        assert api_mocks.get_kbb_instant_cash_offer(DEMO_VIN)["data"]["instant_cash_offer"] == 1
+        # Readers holding the old snapshot still see consistent data
+        assert before[DEMO_VIN]["kbb_data"]["instant_cash_offer"] != 1
+
+    def test_bad_rewrite_keeps_last_good_snapshot(self, market_file):
+        """A half-written file doesn't take market data offline."""
+        before = api_mocks.load_mock_market_data()
+        market_file.write_text("{not json")
+
+        assert api_mocks.load_mock_market_data() is before
+        assert api_mocks.get_market_store().stats()["reload_errors"] == 1
+
+    def test_invalidate_forces_reload(self, market_file):
+        """invalidate() reloads even when the file looks unchanged."""
+        before = api_mocks.load_mock_market_data()
+        api_mocks.get_market_store().invalidate()
+
+        assert api_mocks.load_mock_market_data().version == before.version + 1
+
+    def test_snapshot_is_read_only(self, market_file):
+        """Readers can't mutate shared data, but copies are ordinary containers."""
+        result = get_market_intelligence(DEMO_VIN)
+
+        with pytest.raises(TypeError):
+            result["comparables"].append({})
+        with pytest.raises(TypeError):
+            result["vehicle_info"]["make"] = "Other"
+
+        copied = copy.deepcopy(result)
+        copied["comparables"].append({})
+        assert type(copied["vehicle_info"]) is dict
+        assert type(pickle.loads(pickle.dumps(result["comparables"]))) is list
+        assert json.loads(json.dumps(result))["vin"] == DEMO_VIN
+
+
+@pytest.fixture(params=["json", "sqlite", "columnar", "jsonl"])
+def market_backend(request, tmp_path):
+    """Each market backend, loaded with the demo market data."""
+    if request.param == "json":
+        backend = JsonMarketBackend(MarketDataStore(DEFAULT_MARKET_DATA_PATH))
+    elif request.param == "sqlite":
+        backend = open_market_db(str(tmp_path / "market.sqlite"), DEFAULT_MARKET_DATA_PATH)
+    elif request.param == "columnar":
+        backend = open_market_columns(str(tmp_path / "market_columns"), DEFAULT_MARKET_DATA_PATH)
+    else:
+        backend = open_market_jsonl(str(tmp_path / "market.jsonl"), DEFAULT_MARKET_DATA_PATH)
+    set_market_backend(backend)
+    yield backend
+    set_market_backend(None)
+    if request.param != "json":
+        backend.close()
+
+
+class TestMarketSegmentSearch:
+    """Test VIN and make/model/year lookups against each market backend."""
+
+    def test_known_vin_is_unchanged(self, market_backend):
+        """VINs with their own entry return that entry's listings, nearest first."""
+        expected = json.load(open(DEFAULT_MARKET_DATA_PATH))[DEMO_VIN]
+        result = api_mocks.get_cargurus_comparables(DEMO_VIN)
+
+        by_distance = sorted(expected["comparables"], key=lambda c: c["distance_miles"])
+        assert result["comparables"] == by_distance
+        assert result["market_summary"] == expected["market_summary"]
+        assert "match" not in result
+
+    def test_unknown_vin_uses_segment(self, market_backend):
+        """An unlisted VIN gets comparables for its make/model/year, nearest first."""
+        result = api_mocks.get_cargurus_comparables("1HGCV1F39JA000002", make="HONDA", model="accord", year=2022)
+
+        assert result["success"] == True
+        assert result["match"]["type"] == "segment"
+        distances = [c["distance_miles"] for c in result["comparables"]]
+        assert distances == sorted(distances)
+        assert result["market_summary"]["total_comparables"] == len(distances)
+
+    def test_trim_falls_back_to_segment(self, market_backend):
+        """A trim with no listings widens to the whole make/model/year."""
+        result = api_mocks.get_cargurus_comparables(
+            "1HGCV1F39JA000002", make="Honda", model="Accord", year=2022, trim="Touring"
+        )
+
+        assert result["success"] == True
+        assert result["match"]["trim"] is None
+
+    def test_region_filter(self, market_backend):
+        """Segment search can be restricted to a region."""
+        assert api_mocks.get_cargurus_comparables(
+            "1HGCV1F39JA000002", make="Honda", model="Accord", year=2022, region="Southwest"
+        )["success"] == False
+        assert len(market_backend.find_vehicles("Ford", "F-150", 2019, region="Southeast")) == 1
+
+    def test_market_intelligence_decodes_unknown_vin(self, market_backend, monkeypatch):
+        """get_market_intelligence finds the segment by decoding the VIN."""
+        fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "vpic_snapshot.csv")
+        monkeypatch.setattr(vpic_snapshot, "_default_snapshot", VpicSnapshot.load(fixture))
+        result = get_market_intelligence("1HGCY1F5XRA100002")
+
+        assert result["success"] == True
+        assert result["vehicle_info"]["model"] == "Accord"
+        assert result["match"]["year"] == 2024
+        assert result["kbb_valuation"]["instant_cash_offer"] > 0
+
+    def test_sketches_come_from_the_backend(self, market_backend, tmp_path):
+        """Price bands are built from the selected backend, not MARKET_DATA_PATH."""
+        expected = SegmentSketches.from_entries(json.load(open(DEFAULT_MARKET_DATA_PATH)), seed=0)
+        set_market_store(MarketDataStore(str(tmp_path / "missing.json")))
+        try:
+            sketches = api_mocks.get_segment_sketches()
+        finally:
+            set_market_store(None)
+
+        for make, model, year in [("Honda", "Accord", 2022), ("Ford", "F-150", 2019)]:
+            assert sketches.price_bands(make, model, year) == expected.price_bands(make, model, year)
+
+    def test_unknown_segment_fails(self, market_backend):
+        """VINs with no entry and no matching segment still fail."""
+        assert get_market_intelligence("UNKNOWN12345678901")["success"] == False
+        assert api_mocks.get_kbb_instant_cash_offer(
+            "1HGCV1F39JA000002", make="Honda", model="Civic", year=2022
+        )["success"] == False
+
+
+class TestSqliteMarketStore:
+    """Test the indexed SQLite backend."""
+
+    def test_lookups_use_indexes(self, tmp_path):
+        """VIN, segment and region queries are index seeks, not table scans."""
+        store = open_market_db(str(tmp_path / "market.sqlite"), DEFAULT_MARKET_DATA_PATH)
+
+        plans = [
+            store.query_plan("SELECT payload FROM vehicles WHERE vin = ?", ("X",)),
+            store.query_plan("SELECT payload FROM comparables WHERE subject_vin = ?", ("X",)),
+            store.query_plan("SELECT payload FROM comparables WHERE subject_vin IN (?, ?)", ("X", "Y")),
+            store.query_plan(
+                "SELECT payload FROM comparables WHERE make_key = ? AND model_key = ? AND year = ?",
+                ("honda", "accord", 2022)
+            ),
+            store.query_plan("SELECT vin FROM vehicles WHERE region = ?", ("Southeast",))
+        ]
+        for plan in plans:
+            assert any("USING" in step and "INDEX" in step for step in plan), plan
+        store.close()
+
+    def test_rebuilds_when_json_is_newer(self, tmp_path):
+        """open_market_db re-imports when the source JSON changes."""
+        source = tmp_path / "market.json"
+        data = json.load(open(DEFAULT_MARKET_DATA_PATH))
+        source.write_text(json.dumps({DEMO_VIN: data[DEMO_VIN]}))
+        db_path = str(tmp_path / "market.sqlite")
+        open_market_db(db_path, str(source)).close()
+
+        source.write_text(json.dumps(data))
+        os.utime(source, (time.time() + 10, time.time() + 10))
+        store = open_market_db(db_path, str(source))
+
+        assert store.stats()["vehicles"] == len(data)
+        store.close()
+
+    def test_find_vehicles_reads_listings_in_one_query(self, tmp_path, monkeypatch):
+        """A segment's entries and all their listings take two queries, not one per vehicle."""
+        store = open_market_db(str(tmp_path / "market.sqlite"), DEFAULT_MARKET_DATA_PATH)
+        data = json.load(open(DEFAULT_MARKET_DATA_PATH))
+        vins = sorted(data)
+        # Give every entry a twin in the same segment
+        store.import_entries({**data, **{vin[:-1] + "Z": data[vin] for vin in vins}}, replace=True)
+        queries = []
+        query = store._query
+        monkeypatch.setattr(store, "_query", lambda sql, params: queries.append(sql) or query(sql, params))
+
+        for vin in vins:
+            info = data[vin]["vehicle_info"]
+            queries.clear()
+            found = store.find_vehicles(info["make"], info["model"], info["year"], info["trim"])
+
+            assert len(queries) == 2
+            assert len(found) >= 2
+            assert all(entry == data[vin] for entry in found if entry["vehicle_info"]["vin"] == vin)
+            assert [entry["comparables"] for entry in found] == \
+                [data[entry["vehicle_info"]["vin"]]["comparables"] for entry in found]
+        store.close()
+
+    def test_entries_scan_matches_json(self, tmp_path):
+        """entries() yields every entry, with its listings, like the JSON file."""
+        store = open_market_db(str(tmp_path / "market.sqlite"), DEFAULT_MARKET_DATA_PATH)
+        data = json.load(open(DEFAULT_MARKET_DATA_PATH))
+
+        assert {entry["vehicle_info"]["vin"]: entry for entry in store.entries()} == data
+        store.close()
+
+
+class TestGeoRadiusSearch:
+    """Test zip-centroid lookups and radius search for comparables."""
+
+    def test_zip_location(self):
+        """Zip codes resolve to centroids; ZIP+4 is accepted, unknown zips are None."""
+        assert zip_location("33130") == zip_location("33130-1234")
+        assert zip_location("00000") is None
+        assert haversine_miles(*zip_location("33130"), *zip_location("33301")) == pytest.approx(25, abs=1)
+
+    def test_grid_index_matches_brute_force(self):
+        """Grid queries return exactly the points a full scan finds, nearest first."""
+        rng = np.random.default_rng(7)
+        lats = rng.uniform(25.0, 27.0, 5000)
+        lons = rng.uniform(-81.0, -80.0, 5000)
+        index = GeoGridIndex((i, lat, lon) for i, (lat, lon) in enumerate(zip(lats, lons)))
+
+        for radius in (1, 10, 60):
+            hits = index.query_radius(25.77, -80.2, radius)
+            expected = {i for i in range(5000) if haversine_miles(25.77, -80.2, lats[i], lons[i]) <= radius}
+            assert {item for _, item in hits} == expected
+            assert [d for d, _ in hits] == sorted(d for d, _ in hits)
+
+    def test_radius_limits_known_vin_comparables(self, market_backend):
+        """A tighter radius drops far listings and re-summarizes the rest."""
+        result = api_mocks.get_cargurus_comparables(DEMO_VIN, zip_code="33130", radius_miles=10)
+
+        assert 0 < len(result["comparables"]) < 5
+        assert all(c["distance_miles"] <= 10 for c in result["comparables"])
+        assert result["market_summary"]["total_comparables"] == len(result["comparables"])
+        assert result["search_params"] == {"zip_code": "33130", "radius_miles": 10, "zip_located": True}
+
+    def test_distances_follow_the_customer(self, market_backend):
+        """Distances are measured from the requested zip, not baked in."""
+        near_dealer = api_mocks.get_cargurus_comparables(DEMO_VIN, zip_code="33166")
+        assert near_dealer["comparables"][0]["dealer_zip"] == "33166"
+        assert near_dealer["comparables"][0]["distance_miles"] == 0
+
+        far = get_market_intelligence(DEMO_VIN, zip_code="75201")
+        assert far["search_params"]["radius_expanded"] == True
+        assert far["comparables"][0]["distance_miles"] > 1000
+
+    def test_unknown_zip_keeps_recorded_distances(self, market_backend):
+        """Zip codes outside the centroid table fall back to the stored listings."""
+        result = api_mocks.get_cargurus_comparables(DEMO_VIN, zip_code="00000")
+
+        assert result["search_params"]["zip_located"] == False
+        assert len(result["comparables"]) == 5
+
+    def test_segment_radius_search(self, market_backend):
+        """Segment search for an unlisted VIN is also limited to the radius."""
+        result = api_mocks.get_cargurus_comparables(
+            "1HGCV1F39JA000002", make="Honda", model="Accord", year=2022, zip_code="33130", radius_miles=13
+        )
+
+        distances = [c["distance_miles"] for c in result["comparables"]]
+        assert distances and max(distances) <= 13
+        assert distances == sorted(distances)
@@ -0,0 +1,96 @@
+"""
+Tests for the indexed JSONL market store.
+"""
+
+import sys
+import os
+import json
+
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import market_jsonl
+from tools.api_mocks import get_cargurus_comparables, get_market_intelligence
+from tools.market_jsonl import JsonlMarketStore, index_is_current, index_path, write_market_jsonl
+from tools.market_store import DEFAULT_MARKET_DATA_PATH, MarketDataStore, set_market_backend, set_market_store
+
+
+DEMO_VIN = "1HGBH41JXMN109186"
+
+
+@pytest.fixture
+def entries():
+    with open(DEFAULT_MARKET_DATA_PATH, "r") as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def jsonl_path(entries, tmp_path):
+    path = str(tmp_path / "market.jsonl")
+    write_market_jsonl(entries, path)
+    return path
+
+
+class TestJsonlStore:
+    """Test byte-offset lookups into a JSONL comps file."""
+
+    def test_lookup_parses_only_its_record(self, entries, jsonl_path, monkeypatch):
+        """A VIN lookup decodes one record, and returns the entry as written."""
+        store = JsonlMarketStore(jsonl_path)
+        parsed = []
+        loads = json.loads
+        monkeypatch.setattr(market_jsonl.json, "loads", lambda data: parsed.append(data) or loads(data))
+
+        assert store.get_vehicle(DEMO_VIN) == entries[DEMO_VIN]
+        assert len(parsed) == 1
+        assert store.get_vehicle("UNKNOWN12345678901") is None
+        assert len(parsed) == 1
+        store.close()
+
+    def test_cargurus_comparables_from_jsonl(self, entries, jsonl_path):
+        """get_cargurus_comparables answers from the JSONL store like from the JSON file."""
+        expected = get_cargurus_comparables(DEMO_VIN)
+        store = JsonlMarketStore(jsonl_path)
+        set_market_backend(store)
+        try:
+            assert get_cargurus_comparables(DEMO_VIN) == expected
+            segment = get_cargurus_comparables("1HGCV1F39JA000002", make="Honda", model="Accord", year=2022)
+            assert segment["success"] == True
+        finally:
+            set_market_backend(None)
+            store.close()
+
+    def test_index_is_rebuilt_when_file_changes(self, entries, jsonl_path):
+        """Appending records makes the index stale; reopening re-indexes them."""
+        assert index_is_current(jsonl_path)
+        extra = json.loads(json.dumps(entries[DEMO_VIN]))
+        extra["vehicle_info"]["vin"] = "1HGBH41JXMN109999"
+        with open(jsonl_path, "a") as f:
+            f.write("\n" + json.dumps(extra) + "\n")
+        assert not index_is_current(jsonl_path)
+
+        store = JsonlMarketStore(jsonl_path)
+        assert index_is_current(jsonl_path)
+        assert store.get_vehicle("1HGBH41JXMN109999") == extra
+        assert store.get_vehicle(DEMO_VIN) == entries[DEMO_VIN]
+        assert len(store.find_vehicles("Honda", "Accord", 2022)) == 2
+        assert sorted(os.listdir(os.path.dirname(jsonl_path))) == ["market.jsonl", os.path.basename(index_path(jsonl_path))]
+        store.close()
+
+    def test_appraisal_without_market_json(self, entries, jsonl_path, tmp_path):
+        """A JSONL-only deployment builds price bands and the price model from the JSONL store."""
+        expected = get_market_intelligence(DEMO_VIN)
+        store = JsonlMarketStore(jsonl_path)
+        set_market_store(MarketDataStore(str(tmp_path / "missing.json")))
+        set_market_backend(store)
+        try:
+            result = get_market_intelligence(DEMO_VIN)
+        finally:
+            set_market_backend(None)
+            set_market_store(None)
+            store.close()
+
+        assert result["price_bands"] == expected["price_bands"]
+        assert result["market_value"] == expected["market_value"]
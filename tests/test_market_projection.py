@@ -0,0 +1,72 @@
+"""
+Tests for the budgeted LLM projection of market intelligence.
+"""
+
+import sys
+import os
+import asyncio
+import json
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.api_mocks import get_market_intelligence, get_market_intelligence_async
+from tools.market_projection import COMPARABLE_FIELDS, MIN_COMPARABLES, estimate_tokens, project_for_llm
+
+
+DEMO_VIN = "1FTFW1ET5DFC10234"
+
+
+def _large_result(n=500):
+    """A market result with a large comparable pool."""
+    result = dict(get_market_intelligence(DEMO_VIN))
+    comp = result["comparables"][0]
+    result["comparables"] = [
+        {**comp, "comparable_vin": f"1FTEW1E58JF{i:06d}", "distance_miles": i / 10, "price": 30000 + i}
+        for i in range(n)
+    ]
+    return result
+
+
+class TestProjection:
+    """Test field selection and budgeting."""
+
+    def test_keeps_summaries_and_drops_listing_details(self):
+        """Summaries survive; comparables keep only pricing fields."""
+        result = get_market_intelligence(DEMO_VIN)
+        projection = project_for_llm(result)
+
+        for section in ("kbb_valuation", "market_summary", "market_value", "price_bands", "regional_insights"):
+            assert section in projection
+        assert projection["market_summary"] == result["market_summary"]
+        assert len(projection["comparables"]) == len(result["comparables"])
+        assert all(set(comp) <= set(COMPARABLE_FIELDS) for comp in projection["comparables"])
+        assert "listing_url" not in json.dumps(projection)
+        assert estimate_tokens(projection) < estimate_tokens(json.loads(json.dumps(result)))
+
+    def test_large_pools_stay_within_budget(self):
+        """However many comparables there are, the projection fits the budget."""
+        projection = project_for_llm(_large_result(), max_tokens=600)
+
+        assert estimate_tokens(projection) <= 600
+        assert projection["comparables"][0]["distance_miles"] == 0
+        assert projection["comparables_omitted"] == 500 - len(projection["comparables"])
+        assert len(projection["comparables"]) <= 10
+
+    def test_tight_budget_drops_optional_sections_first(self):
+        """Comparables shrink to the minimum before optional sections go, and those before the rest."""
+        minimal = project_for_llm(_large_result(), max_tokens=10_000, max_comparables=MIN_COMPARABLES)
+        tight = project_for_llm(_large_result(), max_tokens=estimate_tokens(minimal) - 20)
+
+        assert len(tight["comparables"]) == MIN_COMPARABLES
+        assert "omitted_sections" in tight
+        assert "kbb_valuation" in tight and "market_value" in tight
+
+    def test_failures_and_async_results(self):
+        """Failed lookups pass through; async results report source status only."""
+        failed = project_for_llm(get_market_intelligence("UNKNOWN12345678901"))
+        assert failed["success"] == False
+
+        projection = project_for_llm(asyncio.run(get_market_intelligence_async(DEMO_VIN)))
+        assert projection["sources"]["kbb"] == "ok"
+        assert projection["partial"] == False
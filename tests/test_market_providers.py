@@ -0,0 +1,156 @@
+"""
+Tests for the concurrent market provider fan-out.
+"""
+
+import sys
+import os
+import asyncio
+import json
+import time
+
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.api_mocks import default_providers, get_market_intelligence, get_market_intelligence_async
+from tools.market_store import DEFAULT_MARKET_DATA_PATH
+from tools.market_providers import CallableProvider, MarketProvider, MarketRequest, fan_out
+
+
+DEMO_VIN = "1HGBH41JXMN109186"
+
+
+def _sleeper(seconds, result=None, error=None):
+    async def fetch(request):
+        await asyncio.sleep(seconds)
+        if error is not None:
+            raise error
+        return result if result is not None else {"vin": request.vin}
+    return fetch
+
+
+def _slowed(provider, seconds, **overrides):
+    """Wrap a demo provider with extra latency."""
+    async def fetch(request):
+        await asyncio.sleep(seconds)
+        return await provider.fetch(request)
+    return CallableProvider(
+        provider.name, fetch,
+        timeout=overrides.get("timeout", provider.timeout),
+        required=overrides.get("required", provider.required)
+    )
+
+
+class TestFanOut:
+    """Test concurrency, deadlines and provenance."""
+
+    def test_sources_run_concurrently(self):
+        """Latency is that of the slowest source, not the sum."""
+        providers = [CallableProvider(f"source{i}", _sleeper(0.2)) for i in range(4)]
+
+        started = time.perf_counter()
+        outcomes = asyncio.run(fan_out(providers, MarketRequest(DEMO_VIN)))
+        elapsed = time.perf_counter() - started
+
+        assert elapsed < 0.5
+        assert all(outcome["status"] == "ok" for outcome in outcomes.values())
+
+    def test_timeouts_and_errors_are_reported(self):
+        """A slow or failing source is reported; the others still return."""
+        providers = [
+            CallableProvider("fast", _sleeper(0.01)),
+            CallableProvider("slow", _sleeper(5), timeout=0.1),
+            CallableProvider("broken", _sleeper(0.01, error=RuntimeError("503 from upstream"))),
+            CallableProvider("empty", _sleeper(0.01, {"success": False, "error": "VIN not found"}))
+        ]
+
+        started = time.perf_counter()
+        outcomes = asyncio.run(fan_out(providers, MarketRequest(DEMO_VIN)))
+
+        assert time.perf_counter() - started < 1.0
+        assert outcomes["fast"]["data"] == {"vin": DEMO_VIN}
+        assert outcomes["slow"]["status"] == "timeout"
+        assert outcomes["broken"]["status"] == "error"
+        assert "503" in outcomes["broken"]["error"]
+        assert outcomes["empty"]["status"] == "no_data"
+
+    def test_optional_sources_do_not_hold_up_required(self):
+        """Optional sources still running when required ones finish are dropped as late."""
+        providers = [
+            CallableProvider("required", _sleeper(0.05)),
+            CallableProvider("optional", _sleeper(2), timeout=5, required=False)
+        ]
+
+        started = time.perf_counter()
+        outcomes = asyncio.run(fan_out(providers, MarketRequest(DEMO_VIN)))
+
+        assert time.perf_counter() - started < 0.5
+        assert outcomes["optional"]["status"] == "late"
+
+
+    def test_provider_without_fetch_cannot_be_created(self):
+        """A provider subclass missing fetch() fails at construction, not mid fan-out."""
+        class Incomplete(MarketProvider):
+            pass
+
+        with pytest.raises(TypeError):
+            Incomplete("incomplete")
+
+
+class TestAsyncMarketIntelligence:
+    """Test get_market_intelligence_async over the demo providers."""
+
+    def test_matches_serial_lookup(self):
+        """With every source answering, the listings match the serial path."""
+        concurrent = asyncio.run(get_market_intelligence_async(DEMO_VIN))
+        serial = get_market_intelligence(DEMO_VIN)
+
+        by_vin = lambda comps: sorted(comps, key=lambda c: c["comparable_vin"])
+        assert by_vin(concurrent["comparables"]) == by_vin(serial["comparables"])
+        assert concurrent["kbb_valuation"] == serial["kbb_valuation"]
+        assert concurrent["partial"] == False
+        assert set(concurrent["sources"]) == {"kbb", "cargurus", "autotrader", "market_insights"}
+
+    def test_late_source_gives_partial_result(self):
+        """A timed-out listing site leaves the other's listings, flagged partial."""
+        providers = [
+            _slowed(provider, 2, timeout=0.1) if provider.name == "autotrader" else provider
+            for provider in default_providers()
+        ]
+
+        result = asyncio.run(get_market_intelligence_async(DEMO_VIN, providers=providers))
+
+        assert result["success"] == True
+        assert result["partial"] == True
+        assert result["sources"]["autotrader"]["status"] == "timeout"
+        assert {comp["source"] for comp in result["comparables"]} == {"cargurus"}
+        assert result["market_summary"]["total_comparables"] == len(result["comparables"])
+
+    def test_listing_sites_share_one_search(self, monkeypatch):
+        """Both listing sites are served from a single comparables search."""
+        import tools.api_mocks as api_mocks
+
+        calls = []
+        search = api_mocks.get_cargurus_comparables
+
+        def counted(*args, **kwargs):
+            calls.append(args)
+            return search(*args, **kwargs)
+
+        monkeypatch.setattr(api_mocks, "get_cargurus_comparables", counted)
+        result = asyncio.run(get_market_intelligence_async(DEMO_VIN, providers=default_providers()))
+
+        assert len(calls) == 1
+        assert {comp["source"] for comp in result["comparables"]} == {"cargurus", "autotrader"}
+
+    def test_same_result_as_sync_path(self):
+        """With every source answering, the async result equals the sync one for each VIN."""
+        with open(DEFAULT_MARKET_DATA_PATH) as f:
+            vins = list(json.load(f))
+
+        for vin in vins:
+            concurrent = asyncio.run(get_market_intelligence_async(vin))
+            assert concurrent.pop("partial") == False
+            concurrent.pop("sources")
+            assert concurrent == get_market_intelligence(vin)
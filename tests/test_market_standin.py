@@ -0,0 +1,148 @@
+"""
+Tests for the stand-in market provider server and its HTTP client.
+"""
+
+import sys
+import os
+import asyncio
+
+import pytest
+import requests
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.api_mocks import (
+    default_providers,
+    get_cargurus_comparables,
+    get_kbb_instant_cash_offer,
+    get_market_intelligence_async
+)
+from tools.http_client import AsyncResilientSession, CircuitOpenError, ResilientSession
+from tools.market_client import MarketHttpClient, http_providers
+from tools.market_providers import MarketRequest
+from tools.market_standin import FaultProfile, MarketStandIn
+
+
+DEMO_VIN = "1HGBH41JXMN109186"
+
+
+@pytest.fixture
+def standin():
+    """A stand-in server with no injected faults."""
+    with MarketStandIn(seed=0) as server:
+        yield server
+
+
+def _client(url, max_retries=0):
+    """A client that doesn't retry, so injected faults show through."""
+    return MarketHttpClient(
+        url,
+        session=ResilientSession(max_retries=max_retries, backoff_base=0.01),
+        async_session=AsyncResilientSession(max_retries=max_retries, backoff_base=0.01)
+    )
+
+
+class TestStandInServer:
+    """Test the stand-in's endpoints and fault injection."""
+
+    def test_serves_the_mock_data(self, standin):
+        """KBB and listing endpoints answer with the in-process mock results."""
+        client = _client(standin.url)
+
+        assert client.kbb_instant_cash_offer(MarketRequest(DEMO_VIN)) == get_kbb_instant_cash_offer(DEMO_VIN)
+
+        listings = client.listings("cargurus", MarketRequest(DEMO_VIN))
+        expected = [comp for comp in get_cargurus_comparables(DEMO_VIN)["comparables"] if comp["source"] == "cargurus"]
+        assert listings["comparables"] == expected
+
+        missing = client.listings("cargurus", MarketRequest("UNKNOWN12345678901"))
+        assert missing["success"] == False
+
+    @pytest.mark.parametrize("query", ["radius=abc", "radius=-5", "radius=nan", "year=20x2", ""])
+    def test_bad_query_answers_400(self, standin, query):
+        """Unusable query parameters get a 400 JSON error, not a dropped connection."""
+        params = f"vin={DEMO_VIN}&{query}" if query else "zip=33130"
+        response = requests.get(f"{standin.url}/cargurus/v1/listings?{params}", timeout=5)
+
+        assert response.status_code == 400
+        assert response.json()["success"] == False
+
+    def test_error_rate_fails_requests(self, standin):
+        """With error_rate 1 every request gets a 503 and is counted."""
+        standin.set_profile("kbb", FaultProfile(error_rate=1.0))
+        client = _client(standin.url)
+
+        with pytest.raises(Exception):
+            client.kbb_instant_cash_offer(MarketRequest(DEMO_VIN))
+
+        assert standin.stats()["kbb"]["errors"] == 1
+
+    def test_rate_limit_answers_429(self, standin):
+        """Requests past the burst are turned away with 429."""
+        standin.set_profile("cargurus", FaultProfile(rate_limit=0.1, burst=2))
+        client = _client(standin.url)
+
+        failures = 0
+        for _ in range(5):
+            try:
+                client.listings("cargurus", MarketRequest(DEMO_VIN))
+            except Exception:
+                failures += 1
+
+        assert failures == 3
+        assert standin.stats()["cargurus"]["rate_limited"] == 3
+
+    def test_failing_provider_opens_only_its_breaker(self, standin):
+        """One provider's errors trip its own breaker; the others keep answering."""
+        standin.set_profile("kbb", FaultProfile(error_rate=1.0))
+        client = _client(standin.url)
+
+        for _ in range(5):
+            with pytest.raises(requests.exceptions.HTTPError):
+                client.kbb_instant_cash_offer(MarketRequest(DEMO_VIN))
+
+        with pytest.raises(CircuitOpenError):
+            client.kbb_instant_cash_offer(MarketRequest(DEMO_VIN))
+        assert client.listings("cargurus", MarketRequest(DEMO_VIN))["success"] == True
+        assert client.metrics()["breakers"]["kbb"]["state"] == "open"
+        assert client.metrics()["breakers"]["cargurus"]["state"] == "closed"
+
+
+class TestHttpProviders:
+    """Test the market fan-out over HTTP."""
+
+    def test_matches_in_process_providers(self, standin):
+        """Over HTTP the fan-out returns the same listings and valuation."""
+        providers = http_providers(_client(standin.url)) + default_providers()[3:]
+
+        remote = asyncio.run(get_market_intelligence_async(DEMO_VIN, providers=providers))
+        local = asyncio.run(get_market_intelligence_async(DEMO_VIN, providers=default_providers()))
+
+        assert remote["comparables"] == local["comparables"]
+        assert remote["kbb_valuation"] == local["kbb_valuation"]
+        assert remote["partial"] == False
+
+    def test_slow_provider_times_out(self, standin):
+        """A provider slower than its timeout leaves a partial result."""
+        standin.set_profile("autotrader", FaultProfile(latency_ms=2000))
+        client = _client(standin.url)
+        providers = [
+            provider if provider.name != "autotrader" else http_providers(client, timeout=0.2)[2]
+            for provider in http_providers(client)
+        ]
+
+        result = asyncio.run(get_market_intelligence_async(DEMO_VIN, providers=providers))
+
+        assert result["partial"] == True
+        assert result["sources"]["autotrader"]["status"] == "timeout"
+        assert {comp["source"] for comp in result["comparables"]} == {"cargurus"}
+
+    def test_market_provider_url_switches_default_providers(self, standin, monkeypatch):
+        """Setting MARKET_PROVIDER_URL routes the default listing sources to it."""
+        monkeypatch.setenv("MARKET_PROVIDER_URL", standin.url)
+
+        result = asyncio.run(get_market_intelligence_async(DEMO_VIN, providers=default_providers()))
+
+        assert result["success"] == True
+        assert standin.stats()["kbb"]["requests"] == 1
@@ -0,0 +1,137 @@
+"""
+Tests for incrementally maintained market summaries.
+"""
+
+import sys
+import os
+import json
+import random
+import statistics
+
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import api_mocks
+from tools.api_mocks import _summarize_comparables
+from tools.market_store import DEFAULT_MARKET_DATA_PATH
+from tools.market_summary import MarketSummaryAggregator
+
+
+DEMO_VIN = "1HGBH41JXMN109186"
+
+
+@pytest.fixture
+def market_entries():
+    with open(DEFAULT_MARKET_DATA_PATH, "r") as f:
+        return json.load(f)
+
+
+class TestMarketSummaryAggregator:
+    """Test Welford updates and lazy outlier counts."""
+
+    def test_seeded_summaries_match_full_recompute(self, market_entries):
+        """Seeding from the market data gives the same summaries as a full pass."""
+        for entry in market_entries.values():
+            del entry["market_summary"]
+        aggregator = MarketSummaryAggregator.from_entries(market_entries)
+
+        for vin, entry in market_entries.items():
+            assert aggregator.summary(vin) == _summarize_comparables(entry["comparables"])
+        assert aggregator.summary(MarketSummaryAggregator.segment(market_entries[DEMO_VIN]["vehicle_info"])) is not None
+
+    def test_recorded_summary_until_listings_change(self, market_entries):
+        """An entry's own market_summary is served until one of its listings changes."""
+        entry = market_entries[DEMO_VIN]
+        aggregator = MarketSummaryAggregator.from_entries(market_entries)
+        assert aggregator.summary(DEMO_VIN) == entry["market_summary"]
+
+        sold = entry["comparables"][0]
+        aggregator.remove_listing(DEMO_VIN, entry["vehicle_info"], sold["comparable_vin"])
+        assert aggregator.summary(DEMO_VIN) == _summarize_comparables(entry["comparables"][1:])
+
+    def test_shared_listing_stays_in_segment(self, market_entries):
+        """A car listed by two VINs of a segment leaves it only when both drop it."""
+        info = market_entries[DEMO_VIN]["vehicle_info"]
+        segment = MarketSummaryAggregator.segment(info)
+        aggregator = MarketSummaryAggregator()
+        aggregator.add_listing("VIN_A", info, {"comparable_vin": "SHARED", "price": 20000})
+        aggregator.add_listing("VIN_B", info, {"comparable_vin": "SHARED", "price": 20000})
+        aggregator.add_listing("VIN_B", info, {"comparable_vin": "OTHER", "price": 22000})
+        assert aggregator.stats(segment)["count"] == 2
+
+        assert aggregator.remove_listing("VIN_A", info, "SHARED")
+        assert aggregator.stats(segment)["count"] == 2
+        assert not aggregator.remove_listing("VIN_A", info, "SHARED")
+
+        assert aggregator.remove_listing("VIN_B", info, "SHARED")
+        assert aggregator.stats(segment)["count"] == 1
+        assert aggregator.stats("VIN_A") is None
+
+    def test_running_stats_track_a_live_feed(self):
+        """Mean, variance, min and max stay exact through adds, re-prices and removals."""
+        aggregator = MarketSummaryAggregator()
+        live = {}
+        rng = random.Random(0)
+        for _ in range(5000):
+            if live and rng.random() < 0.45:
+                listing = rng.choice(list(live))
+                assert aggregator.remove("segment", listing)
+                del live[listing]
+            else:
+                listing = rng.randint(0, 300)
+                live[listing] = rng.randint(15000, 45000)
+                aggregator.add("segment", listing, live[listing])
+
+        stats = aggregator.stats("segment")
+        prices = list(live.values())
+        assert stats["count"] == len(prices)
+        assert stats["mean"] == pytest.approx(statistics.mean(prices))
+        assert stats["variance"] == pytest.approx(statistics.variance(prices))
+        assert (stats["min"], stats["max"]) == (min(prices), max(prices))
+
+    def test_outliers_are_recomputed_lazily(self, market_entries):
+        """Updates don't rescan; the next read recomputes outliers once."""
+        entry = market_entries[DEMO_VIN]
+        aggregator = MarketSummaryAggregator.from_entries({DEMO_VIN: entry})
+        aggregator.summary(DEMO_VIN)
+        passes = aggregator.counters()["outlier_passes"]
+
+        for i in range(5):
+            aggregator.add_listing(DEMO_VIN, entry["vehicle_info"], {"comparable_vin": f"NEW{i}", "price": 25000})
+        aggregator.add_listing(DEMO_VIN, entry["vehicle_info"], {"comparable_vin": "JUNK", "price": 2500})
+        assert aggregator.counters()["outlier_passes"] == passes
+
+        summary = aggregator.summary(DEMO_VIN)
+        assert summary["total_comparables"] == 11
+        assert summary["outliers_removed"] == 1
+        assert summary["min_price"] == 2500
+        assert aggregator.counters()["outlier_passes"] == passes + 1
+
+        assert aggregator.remove_listing(DEMO_VIN, entry["vehicle_info"], "JUNK")
+        assert aggregator.summary(DEMO_VIN)["min_price"] == 23900
+
+    def test_refresh_batches_dirty_keys(self, market_entries):
+        """refresh() recomputes every dirty key in one pass, then nothing is dirty."""
+        aggregator = MarketSummaryAggregator.from_entries(market_entries)
+
+        assert aggregator.refresh() == len(aggregator)
+        assert aggregator.counters()["outlier_passes"] == 1
+        assert aggregator.refresh() == 0
+        assert aggregator.summary("UNKNOWN") is None
+
+
+class TestServedSummaries:
+    """Test that the mock APIs serve the live summaries."""
+
+    def test_listing_updates_reach_market_intelligence(self, market_entries, monkeypatch):
+        """A listing dropped from get_market_summaries() changes the next market_summary."""
+        monkeypatch.setattr(api_mocks, "_derived", {})
+        entry = market_entries[DEMO_VIN]
+        assert api_mocks.get_market_intelligence(DEMO_VIN)["market_summary"] == entry["market_summary"]
+
+        sold = entry["comparables"][0]
+        api_mocks.get_market_summaries().remove_listing(DEMO_VIN, entry["vehicle_info"], sold["comparable_vin"])
+        summary = api_mocks.get_market_intelligence(DEMO_VIN)["market_summary"]
+        assert summary == _summarize_comparables(entry["comparables"][1:])
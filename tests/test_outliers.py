@@ -0,0 +1,105 @@
+"""
+Tests for vectorized outlier filtering.
+"""
+
+import sys
+import os
+import random
+import statistics
+
+import numpy as np
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.api_mocks import filter_outliers
+from tools.outliers import filter_outliers_batch, outlier_mask, ragged
+
+
+def _reference_zscore(prices, threshold=2.0):
+    """The statistics-module rule filter_outliers has always applied."""
+    if len(prices) < 3:
+        return [True] * len(prices)
+    mean, std = statistics.mean(prices), statistics.stdev(prices)
+    return [abs(p - mean) <= threshold * std for p in prices]
+
+
+class TestFilterOutliers:
+    """Test filter_outliers against the original statistics-based rule."""
+
+    def test_matches_statistics_rule(self):
+        """Kept listings, counts and averages match the statistics module."""
+        rng = random.Random(3)
+        for _ in range(500):
+            prices = [rng.choice([rng.randint(20000, 30000), rng.randint(1, 90) * 1000]) for _ in range(rng.randint(1, 12))]
+            comparables = [{"price": p} for p in prices]
+            keep = _reference_zscore(prices)
+            kept = [p for p, k in zip(prices, keep) if k]
+
+            result = filter_outliers(comparables)
+
+            assert [c["price"] for c in result["filtered_comparables"]] == kept
+            assert result["outliers_removed"] == len(prices) - len(kept)
+            assert result["avg_price"] == pytest.approx(statistics.mean(kept))
+            if len(prices) >= 3:
+                assert result["std_dev"] == pytest.approx(statistics.stdev(prices))
+
+    def test_robust_methods(self):
+        """MAD and IQR drop a far-off listing too."""
+        comparables = [{"price": p} for p in (24500, 25200, 24800, 23900, 25000, 61000)]
+
+        for method in ("mad", "iqr"):
+            result = filter_outliers(comparables, method=method)
+            assert result["outliers_removed"] == 1
+            assert 61000 not in [c["price"] for c in result["filtered_comparables"]]
+
+    def test_mad_of_zero_falls_back_to_mean_deviation(self):
+        """A segment with mostly equal prices keeps near values and drops far ones."""
+        near = filter_outliers([{"price": p} for p in (20000, 20000, 20000, 21000, 25000)], method="mad")
+        far = filter_outliers([{"price": p} for p in (20000, 20000, 20000, 21000, 90000)], method="mad")
+        same = filter_outliers([{"price": 20000}] * 4, method="mad")
+
+        assert near["outliers_removed"] == 0
+        assert [c["price"] for c in far["filtered_comparables"]] == [20000, 20000, 20000, 21000]
+        assert same["outliers_removed"] == 0
+
+
+class TestBatchOutliers:
+    """Test ragged-array batch filtering."""
+
+    def test_batch_matches_per_segment(self):
+        """One batch call gives the same masks as filtering each segment alone."""
+        rng = np.random.default_rng(11)
+        groups = [rng.normal(30000, 4000, rng.integers(0, 25)).round() for _ in range(300)]
+        values, offsets = ragged(groups)
+
+        result = filter_outliers_batch(values, offsets)
+
+        for i, group in enumerate(groups):
+            segment = result["keep"][offsets[i]:offsets[i + 1]]
+            assert list(segment) == _reference_zscore(list(group))
+            assert result["outliers_removed"][i] == len(group) - segment.sum()
+
+    def test_quantile_rules_match_numpy(self):
+        """MAD and IQR use the same medians and quartiles as numpy."""
+        rng = np.random.default_rng(5)
+        groups = [rng.lognormal(10, 0.3, rng.integers(3, 30)) for _ in range(200)]
+        values, offsets = ragged(groups)
+
+        mad_keep = outlier_mask(values, offsets, "mad")
+        iqr_keep = outlier_mask(values, offsets, "iqr")
+
+        for i, group in enumerate(groups):
+            median = np.median(group)
+            mad = np.median(np.abs(group - median))
+            q1, q3 = np.percentile(group, [25, 75])
+            assert (mad_keep[offsets[i]:offsets[i + 1]] == (0.6745 * np.abs(group - median) <= 3.5 * mad)).all()
+            assert (iqr_keep[offsets[i]:offsets[i + 1]] == ((group >= q1 - 1.5 * (q3 - q1)) & (group <= q3 + 1.5 * (q3 - q1)))).all()
+
+    def test_rejects_bad_input(self):
+        """Unknown methods and offsets that don't cover the values are errors."""
+        with pytest.raises(ValueError, match="method"):
+            outlier_mask(np.ones(3), np.array([0, 3]), "trimmed")
+        with pytest.raises(ValueError, match="offsets"):
+            outlier_mask(np.ones(3), np.array([0, 2]))
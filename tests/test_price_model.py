@@ -0,0 +1,117 @@
+"""
+Tests for the per-segment mileage/age price model.
+"""
+
+import sys
+import os
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.api_mocks import filter_outliers, get_market_intelligence, get_market_intelligence_async
+from tools.price_model import PriceModel, _t_quantile, fit_segments
+
+
+def _synthetic(n, segments, seed=0):
+    """Listings priced at 30000 - $80/1k miles + $900/model year, plus noise."""
+    rng = np.random.default_rng(seed)
+    ids = rng.integers(0, segments, n)
+    years = rng.integers(2015, 2025, n)
+    mileages = rng.uniform(5000, 120000, n)
+    prices = 30000 - 0.08 * mileages + 900 * (years - 2015) + rng.normal(0, 1500, n)
+    return ids, prices, mileages, years
+
+
+class TestFitSegments:
+    """Test the batched least-squares fit."""
+
+    def test_matches_per_segment_lstsq(self):
+        """Each segment's slopes equal an independent least-squares fit."""
+        ids, prices, mileages, years = _synthetic(2000, 7)
+        fitted = fit_segments(ids, prices, mileages, years)
+
+        for segment in range(7):
+            rows = ids == segment
+            design = np.column_stack([np.ones(rows.sum()), mileages[rows] / 1000, years[rows]])
+            expected, *_ = np.linalg.lstsq(design, prices[rows], rcond=None)
+            assert fitted["slopes"][segment] == pytest.approx(expected[1:], rel=1e-6)
+
+    def test_single_year_segment_gets_zero_age_slope(self):
+        """Listings of one model year fit mileage only, instead of failing."""
+        fitted = fit_segments([0, 0, 0, 0], [25000, 24000, 23000, 22500], [20000, 30000, 40000, 45000], [2022] * 4)
+
+        assert fitted["slopes"][0][1] == 0
+        assert fitted["slopes"][0][0] < 0
+        assert fitted["dof"][0] == 2
+
+    def test_refits_millions_of_listings_quickly(self):
+        """Three million listings over 20k segments fit in about a second."""
+        ids, prices, mileages, years = _synthetic(3_000_000, 20_000)
+
+        started = time.perf_counter()
+        fitted = fit_segments(ids, prices, mileages, years)
+
+        assert time.perf_counter() - started < 5
+        assert np.median(fitted["slopes"][:, 0]) == pytest.approx(-80, abs=5)
+        assert np.median(fitted["slopes"][:, 1]) == pytest.approx(900, abs=50)
+
+    def test_t_quantile(self):
+        """The t quantile approximation is close to tabulated values."""
+        assert _t_quantile(0.95, 1) == pytest.approx(6.314, abs=1e-3)
+        assert _t_quantile(0.95, 2) == pytest.approx(2.920, abs=1e-3)
+        assert _t_quantile(0.95, 3) == pytest.approx(2.353, rel=5e-3)
+        assert _t_quantile(0.975, 10) == pytest.approx(2.228, rel=1e-3)
+
+
+class TestPriceModel:
+    """Test predictions and their use in market intelligence."""
+
+    def test_predicts_within_interval(self):
+        """The interval covers the true segment price and narrows with more data."""
+        ids, prices, mileages, years = _synthetic(5000, 2)
+        model = PriceModel.fit([("honda", f"model{i}") for i in ids], prices, mileages, years)
+
+        truth = 30000 - 0.08 * 40000 + 900 * 5
+        value = model.predict("Honda", "MODEL0", 2020, 40000, level=0.95)
+        assert value["low"] <= truth <= value["high"]
+        assert value["high"] - value["low"] < 500
+        assert value["per_1k_miles"] == pytest.approx(-80, abs=10)
+
+        assert model.predict("Honda", "Civic", 2020, 40000) is None
+        with pytest.raises(ValueError):
+            model.predict("Honda", "model0", 2020, 40000, level=1.5)
+
+    def test_no_value_off_a_single_year_segment(self):
+        """A segment of one model year prices that year only, not others."""
+        model = PriceModel.fit(
+            [("honda", "accord")] * 4, [25000, 24000, 23000, 22500], [20000, 30000, 40000, 45000], [2022] * 4
+        )
+
+        value = model.predict("Honda", "Accord", 2022, 35000)
+        assert value["low"] <= value["value"] <= value["high"]
+        assert value["per_model_year"] == 0
+        assert model.predict("Honda", "Accord", 2018, 35000) is None
+        assert model.predict("Honda", "Accord", 2024, 35000) is None
+
+    def test_market_intelligence_includes_value(self):
+        """Known VINs get a mileage-adjusted value alongside the plain average."""
+        result = get_market_intelligence("1HGBH41JXMN109186")
+        value = result["market_value"]
+
+        assert value["low"] <= value["value"] <= value["high"]
+        assert value["mileage"] == result["vehicle_info"]["mileage"]
+        assert value["per_1k_miles"] < 0
+        assert asyncio.run(get_market_intelligence_async("1HGBH41JXMN109186"))["market_value"] == value
+
+    def test_values_are_plain_numbers(self):
+        """Predictions and outlier statistics hold Python numbers, not NumPy scalars."""
+        value = get_market_intelligence("1HGBH41JXMN109186")["market_value"]
+        stats = filter_outliers([{"price": p} for p in (24500, 25200, 24800, 23900, 25001)])
+
+        assert all(type(value[name]) is int for name in ("value", "low", "high", "residual_std", "sample_size"))
+        assert all(type(stats[name]) is float for name in ("avg_price", "original_avg", "std_dev"))
@@ -0,0 +1,105 @@
+"""
+Tests for mergeable price-quantile sketches.
+"""
+
+import sys
+import os
+import json
+
+import numpy as np
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.api_mocks import get_market_intelligence
+from tools.market_store import DEFAULT_MARKET_DATA_PATH
+from tools.quantile_sketch import KLLSketch, SegmentSketches
+
+
+def _rank_error(sketch, data, qs=(0.1, 0.5, 0.9)):
+    ordered = np.sort(data)
+    return max(
+        abs(np.searchsorted(ordered, value, side="right") / len(data) - q)
+        for q, value in zip(qs, sketch.quantiles(qs))
+    )
+
+
+class TestKLLSketch:
+    """Test accuracy, memory and merging."""
+
+    def test_small_streams_are_exact(self):
+        """Below capacity the sketch keeps every value."""
+        sketch = KLLSketch()
+        sketch.update_many([24500, 25200, 26500, 24800, 23900])
+
+        assert sketch.quantiles([0, 0.5, 1]) == [23900, 24800, 26500]
+        assert sketch.rank(24800) == pytest.approx(0.6)
+
+    def test_bounded_memory_and_error(self):
+        """A million prices fit in a few hundred retained items at ~1% rank error."""
+        data = np.random.default_rng(0).lognormal(10.2, 0.25, 1_000_000)
+        sketch = KLLSketch(seed=1)
+        for chunk in np.array_split(data, 50):
+            sketch.update_many(chunk.tolist())
+
+        assert sketch.count == len(data)
+        assert sketch.retained() < 3 * sketch.k
+        assert _rank_error(sketch, data) < 0.01
+        assert (sketch.min, sketch.max) == (data.min(), data.max())
+
+    def test_merged_shards_match_one_sketch(self):
+        """Sketches built per shard merge into an equally accurate whole."""
+        data = np.random.default_rng(2).normal(30000, 4000, 200_000)
+        merged = KLLSketch(seed=0)
+        for i, shard in enumerate(np.array_split(data, 8)):
+            part = KLLSketch(seed=i)
+            for value in shard.tolist():
+                part.update(value)
+            merged.merge(KLLSketch.from_dict(json.loads(json.dumps(part.to_dict()))))
+
+        assert merged.count == len(data)
+        assert _rank_error(merged, data) < 0.01
+
+        with pytest.raises(ValueError, match="k="):
+            merged.merge(KLLSketch(k=50))
+
+
+class TestSegmentSketches:
+    """Test per-segment price bands."""
+
+    def test_bands_per_segment_and_region(self):
+        """Bands come from the segment's listings; regions merge when none is given."""
+        with open(DEFAULT_MARKET_DATA_PATH, "r") as f:
+            entries = json.load(f)
+        sketches = SegmentSketches.from_entries(entries)
+        east = SegmentSketches()
+        east.add_listing("Honda", "Accord", 2022, "Northeast", {"price": 40000, "days_listed": 3})
+
+        southeast = sketches.price_bands("HONDA", "accord", 2022, "Southeast")
+        assert (southeast["p10"], southeast["p50"], southeast["p90"]) == (23900, 24800, 26500)
+        assert sketches.price_bands("Honda", "Accord", 1999) is None
+
+        sketches.merge(east)
+        combined = sketches.price_bands("Honda", "Accord", 2022)
+        assert combined["sample_size"] == 6
+        assert combined["p90"] == 40000
+
+    def test_car_under_several_entries_counted_once(self):
+        """A comparable_vin listed under two entries, or twice under one, is one car."""
+        info = {"make": "Honda", "model": "Accord", "year": 2022}
+        car = {"comparable_vin": "1HGCV1F32JA123456", "dealer_name": "CarMax", "price": 25000, "mileage": 30000}
+        entries = [
+            {"vehicle_info": info, "comparables": [car, {**car, "source": "autotrader"}]},
+            {"vehicle_info": info, "comparables": [car, {**car, "comparable_vin": "1HGCV1F33JA234567", "price": 27000}]}
+        ]
+
+        bands = SegmentSketches.from_entries(entries, dedup_capacity=100).price_bands("Honda", "Accord", 2022)
+        assert bands["sample_size"] == 2
+
+    def test_market_intelligence_includes_bands(self):
+        """get_market_intelligence reports the segment's price bands."""
+        bands = get_market_intelligence("1HGBH41JXMN109186")["price_bands"]
+
+        assert bands["p10"] <= bands["p50"] <= bands["p90"]
+        assert bands["sample_size"] == 5
@@ -0,0 +1,150 @@
+"""
+Tests for the nightly segment snapshots.
+"""
+
+import sys
+import os
+import json
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import api_mocks
+from tools.api_mocks import get_market_intelligence
+from tools.market_store import DEFAULT_MARKET_DATA_PATH
+from tools.price_model import PriceModel
+from tools.segment_snapshots import (
+    SegmentSnapshotStore,
+    build_segment_snapshots,
+    set_segment_snapshot_store,
+    snapshot_key,
+    write_segment_snapshots
+)
+
+
+DEMO_VIN = "1HGBH41JXMN109186"
+
+
+@pytest.fixture
+def entries():
+    with open(DEFAULT_MARKET_DATA_PATH, "r") as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def published(entries, tmp_path):
+    """The demo data published as the current snapshot and served process-wide."""
+    snapshot = build_segment_snapshots(entries)
+    write_segment_snapshots(snapshot, str(tmp_path))
+    set_segment_snapshot_store(SegmentSnapshotStore(str(tmp_path), check_interval=0))
+    yield snapshot
+    set_segment_snapshot_store(None)
+
+
+class TestBuild:
+    """Test the batch aggregation."""
+
+    def test_rows_match_the_listings(self, entries):
+        """A segment row's statistics equal those computed directly from its listings."""
+        snapshot = build_segment_snapshots(entries)
+        comps = entries[DEMO_VIN]["comparables"]
+        prices = [comp["price"] for comp in comps]
+
+        row = snapshot.lookup("HONDA", "Accord", 2022, "EX-L", "Southeast")
+        assert row["segment"] == snapshot_key("Honda", "Accord", 2022, "EX-L", "Southeast")
+        assert row["comp_count"] == len(comps)
+        assert row["avg_price"] == entries[DEMO_VIN]["market_summary"]["avg_price"]
+        assert row["p50"] == np.median(prices)
+        assert (row["min_price"], row["max_price"]) == (min(prices), max(prices))
+        assert row["days_listed_median"] == np.median([comp["days_listed"] for comp in comps])
+        assert row["kbb_anchors"]["instant_cash_offer"] == entries[DEMO_VIN]["kbb_data"]["instant_cash_offer"]
+        assert row["version"] == snapshot.version
+
+    def test_lookup_falls_back_to_rollups(self, entries):
+        """Unknown trims and regions are answered from the broader segment."""
+        snapshot = build_segment_snapshots(entries)
+
+        row = snapshot.lookup("Honda", "Accord", 2022, "Sport", "Northeast")
+        assert row["segment"] == "honda|accord|2022|*|*"
+        assert snapshot.lookup("Honda", "Accord", 1999) is None
+        assert snapshot.lookup("Honda", "Accord", "unknown") is None
+
+    def test_version_tracks_time_and_content(self, entries):
+        """Same data at the same time gives the same version; changed data a new one."""
+        at = datetime(2026, 10, 17, 2, 0, tzinfo=timezone.utc)
+        first = build_segment_snapshots(entries, built_at=at)
+        assert build_segment_snapshots(entries, built_at=at).version == first.version
+        assert first.version.startswith("20261017T020000Z-")
+
+        entries[DEMO_VIN]["comparables"][0]["price"] += 1000
+        assert build_segment_snapshots(entries, built_at=at).version != first.version
+
+
+class TestPublishing:
+    """Test versioned publishing and serving."""
+
+    def test_store_serves_newest_and_keeps_history(self, entries, tmp_path):
+        """Readers move to a newly published version; old ones stay loadable until pruned."""
+        store = SegmentSnapshotStore(str(tmp_path), check_interval=0)
+        assert store.current() is None
+
+        versions = []
+        for day in range(1, 5):
+            entries[DEMO_VIN]["comparables"][0]["price"] += 100
+            snapshot = build_segment_snapshots(entries, built_at=datetime(2026, 10, day, tzinfo=timezone.utc))
+            write_segment_snapshots(snapshot, str(tmp_path), keep=3)
+            versions.append(snapshot.version)
+            assert store.current().version == snapshot.version
+
+        assert store.versions() == versions[1:]
+        assert store.load(versions[1]).version == versions[1]
+        with pytest.raises(OSError):
+            store.load(versions[0])
+
+    def test_market_intelligence_reports_snapshot_version(self, published):
+        """Appraisals read the precomputed row and record its version."""
+        result = get_market_intelligence(DEMO_VIN)
+
+        assert result["segment_snapshot"]["version"] == published.version
+        assert result["price_bands"]["p50"] == result["segment_snapshot"]["p50"]
+        assert result["price_bands"]["sample_size"] == 5
+
+    def test_prices_are_plain_numbers(self, published):
+        """market_summary and market_value hold Python numbers, never NumPy scalars."""
+        result = get_market_intelligence(DEMO_VIN)
+
+        for block in ("market_summary", "market_value", "price_bands"):
+            for name, value in result[block].items():
+                assert type(value) in (int, float, str, type(None)), f"{block}.{name} is {type(value).__name__}"
+
+    def test_snapshot_path_skips_live_aggregation(self, entries, published, monkeypatch):
+        """With a row, the summary and value come from the snapshot; no sketches or fit."""
+        def unused():
+            raise AssertionError("live aggregation on the snapshot path")
+
+        monkeypatch.setattr(api_mocks, "get_segment_sketches", unused)
+        monkeypatch.setattr(api_mocks, "get_price_model", unused)
+        result = get_market_intelligence(DEMO_VIN)
+        row = result["segment_snapshot"]
+        info = entries[DEMO_VIN]["vehicle_info"]
+
+        assert result["market_summary"]["total_comparables"] == row["comp_count"]
+        assert result["market_summary"]["avg_price"] == round(row["avg_price"])
+        assert result["market_value"] == PriceModel.from_entries(entries).predict(
+            info["make"], info["model"], info["year"], info["mileage"]
+        )
+
+    def test_without_a_snapshot_bands_come_from_sketches(self, tmp_path):
+        """Nothing published: responses fall back to the live sketches."""
+        set_segment_snapshot_store(SegmentSnapshotStore(str(tmp_path), check_interval=0))
+        try:
+            result = get_market_intelligence(DEMO_VIN)
+        finally:
+            set_segment_snapshot_store(None)
+
+        assert "segment_snapshot" not in result
+        assert result["price_bands"]["sample_size"] == 5
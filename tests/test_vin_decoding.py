@@ -0,0 +1,828 @@
+"""
+Tests for VIN decoding, caching and local VIN checks.
+
+All decoder tests run against the local NHTSA stand-in from conftest.py.
+"""
+
+import sys
+import os
+import gc
+import io
+import time
+import asyncio
+import threading
+
+import pytest
+import requests
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import http_client, nhtsa_api
+from tools.nhtsa_api import decode_vin, decode_vin_async, decode_vins, validate_vin
+from tools.vin_cache import VinCache
+from tools import vpic_snapshot
+from tools.vin_check import check_vin, check_vins, normalize_vin
+from tools.http_client import AsyncResilientSession, CircuitBreaker, DeadlineExceeded, ResilientSession
+from tools.singleflight import SingleFlight
+from tools.vpic_snapshot import VpicSnapshot, get_vpic_snapshot
+from tools.vehicle_record import DecodedVehicle, SUMMARY_FIELDS
+
+
+ACCORD_VIN = "1HGCV1F35JA123456"
+
+# Hand-written snapshot rows for the demo VINs (not vPIC data)
+SNAPSHOT_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "vpic_snapshot.csv")
+
+
+class TestVinCache:
+    """Test the two-tier VIN decode cache."""
+
+    def test_repeat_decode_is_served_from_cache(self, nhtsa_standin, vin_cache):
+        """Second decode of the same VIN makes no network call."""
+        first = decode_vin(ACCORD_VIN)
+        second = decode_vin(ACCORD_VIN)
+
+        assert first["success"] == True
+        assert second == first
+        assert len(nhtsa_standin.requests) == 1
+        assert vin_cache.stats()["memory_hits"] == 1
+
+    def test_cache_key_is_normalized(self, nhtsa_standin, vin_cache):
+        """Lowercase input hits the entry stored for the uppercase VIN."""
+        decode_vin(ACCORD_VIN)
+        result = decode_vin(ACCORD_VIN.lower())
+
+        assert result["vin"] == ACCORD_VIN.lower()
+        assert result["make"] == "HONDA"
+        assert len(nhtsa_standin.requests) == 1
+
+    def test_validate_and_specs_share_cache(self, nhtsa_standin, vin_cache):
+        """validate_vin reuses a decode made by decode_vin."""
+        decode_vin(ACCORD_VIN)
+        result = validate_vin(ACCORD_VIN)
+
+        assert result["valid"] == True
+        assert result["model"] == "Accord"
+        assert len(nhtsa_standin.requests) == 1
+
+    def test_disk_tier_survives_restart(self, nhtsa_standin, tmp_path):
+        """A new cache over the same file serves earlier decodes."""
+        path = str(tmp_path / "restart.sqlite")
+        cache = VinCache(path=path)
+        cache.put(ACCORD_VIN, {"success": True, "vin": ACCORD_VIN, "make": "HONDA"})
+        cache.close()
+
+        reopened = VinCache(path=path)
+        assert reopened.get(ACCORD_VIN)["make"] == "HONDA"
+        assert reopened.stats()["disk_hits"] == 1
+        reopened.close()
+
+    def test_expired_entries_are_misses(self, tmp_path):
+        """Entries older than the TTL are misses unless stale reads are allowed."""
+        cache = VinCache(path=str(tmp_path / "ttl.sqlite"), ttl_seconds=-1)
+        cache.put(ACCORD_VIN, {"success": True, "vin": ACCORD_VIN})
+
+        assert cache.get(ACCORD_VIN) is None
+        assert cache.stats()["expired"] == 1
+        assert cache.get(ACCORD_VIN, allow_stale=True)["vin"] == ACCORD_VIN
+        cache.close()
+
+    def test_size_caps(self, tmp_path):
+        """Both tiers stay within their configured sizes."""
+        cache = VinCache(path=str(tmp_path / "caps.sqlite"), memory_size=2, max_disk_entries=5)
+        for i in range(12):
+            cache.put(f"1HGCV1F31JA{i:06d}", {"success": True})
+
+        stats = cache.stats()
+        assert stats["memory_entries"] == 2
+        assert stats["disk_entries"] <= 5
+        assert stats["evictions"] > 0
+        cache.close()
+
+    def test_memory_hits_do_not_wait_for_sqlite(self, tmp_path):
+        """An LRU hit is answered while another thread holds SQLite."""
+        cache = VinCache(path=str(tmp_path / "locks.sqlite"))
+        cache.put(ACCORD_VIN, {"success": True, "vin": ACCORD_VIN})
+        writing, release = threading.Event(), threading.Event()
+
+        def slow_write():
+            with cache._lock:
+                writing.set()
+                release.wait(5)
+
+        writer = threading.Thread(target=slow_write)
+        writer.start()
+        writing.wait(5)
+        try:
+            started = time.monotonic()
+            assert asyncio.run(cache.aget(ACCORD_VIN))["vin"] == ACCORD_VIN
+            assert cache.get(ACCORD_VIN)["vin"] == ACCORD_VIN
+            assert cache.stats()["memory_hits"] == 2
+            assert time.monotonic() - started < 1
+        finally:
+            release.set()
+            writer.join()
+        cache.close()
+
+    def test_failed_decodes_are_not_cached(self, nhtsa_standin, vin_cache, monkeypatch):
+        """Network failures are retried on the next call."""
+        from tools import nhtsa_api
+        monkeypatch.setattr(nhtsa_api, "NHTSA_API_URL", "http://127.0.0.1:9/api")
+
+        result = decode_vin(ACCORD_VIN)
+
+        assert result["success"] == False
+        assert vin_cache.stats()["disk_entries"] == 0
+
+
+class TestVinPatternCache:
+    """Test the squish-VIN build pattern tier."""
+
+    def test_same_build_served_without_api_call(self, nhtsa_standin, vin_cache):
+        """A VIN differing only in check digit and serial reuses the build decode."""
+        decode_vin(ACCORD_VIN)
+        sibling = "1HGCV1F30JA987654"
+        result = decode_vin(sibling)
+
+        assert result["success"] == True
+        assert result["vin"] == sibling
+        assert result["model"] == "Accord"
+        assert len(nhtsa_standin.requests) == 1
+
+        stats = vin_cache.stats()
+        assert stats["pattern_hits"] == 1
+        assert stats["network_calls_saved"]["pattern"] == 1
+
+    def test_pattern_hit_is_promoted_to_exact_tier(self, nhtsa_standin, vin_cache):
+        """Repeat lookups for a pattern-served VIN become exact hits."""
+        decode_vin(ACCORD_VIN)
+        sibling = "1HGCV1F30JA987654"
+        decode_vin(sibling)
+        decode_vin(sibling)
+
+        stats = vin_cache.stats()
+        assert stats["pattern_hits"] == 1
+        assert stats["network_calls_saved"] == {
+            "exact": 1,
+            "pattern": 1,
+            "total": 2,
+            "pattern_share": 0.5
+        }
+
+    def test_different_model_year_is_not_shared(self, nhtsa_standin, vin_cache):
+        """Position 10 is part of the pattern key."""
+        decode_vin(ACCORD_VIN)
+        decode_vin("1HGCV1F33KA123456")
+
+        assert len(nhtsa_standin.requests) == 2
+
+    def test_unresolved_decode_does_not_seed_pattern(self, nhtsa_standin, vin_cache):
+        """Decodes NHTSA could not resolve are cached per VIN only."""
+        decode_vin("9ZZZZZZZ1ZZ000001")
+        decode_vin("9ZZZZZZZ2ZZ000002")
+
+        assert len(nhtsa_standin.requests) == 2
+        assert vin_cache.stats()["pattern_disk_entries"] == 0
+
+
+class TestBatchDecode:
+    """Test decode_vins against the stand-in DecodeVINValuesBatch endpoint."""
+
+    def test_results_in_input_order_with_per_vin_errors(self, nhtsa_standin, vin_cache):
+        """Each input gets a result in order; bad VINs get their own error."""
+        vins = [ACCORD_VIN, "SHORT", "5YJ3E1EA4MF000001"]
+        results = decode_vins(vins)
+
+        assert [r["vin"] for r in results] == vins
+        assert results[0]["make"] == "HONDA"
+        assert results[0]["year"] == "2018"
+        assert results[1]["success"] == False
+        assert results[2]["model"] == "Model 3"
+        assert len(nhtsa_standin.batches) == 1
+
+    def test_chunks_at_fifty_and_dedups(self, nhtsa_standin, vin_cache):
+        """Inputs are de-duplicated and sent 50 VINs per request."""
+        vins = [f"9ZZZZZZZ1ZZ{i:06d}" for i in range(120)]
+        results = decode_vins(vins + vins[:10])
+
+        assert len(results) == 130
+        assert [len(b) for b in nhtsa_standin.batches] == [50, 50, 20]
+
+    def test_batch_feeds_single_decode_cache(self, nhtsa_standin, vin_cache):
+        """VINs decoded in a batch are cache hits for decode_vin and vice versa."""
+        decode_vins([ACCORD_VIN])
+        result = decode_vin(ACCORD_VIN)
+        assert result["model"] == "Accord"
+
+        decode_vin("5YJ3E1EA4MF000001")
+        nhtsa_standin.reset()
+        results = decode_vins(["5YJ3E1EA4MF000001", "1HGCV1F39JA000002"])
+
+        assert all(r["success"] for r in results)
+        assert nhtsa_standin.requests == []
+
+    def test_failed_chunk_reports_each_vin(self, nhtsa_client, vin_cache, monkeypatch):
+        """A failed request yields an error for every VIN in the chunk."""
+        from tools import nhtsa_api
+        monkeypatch.setattr(nhtsa_api, "NHTSA_API_URL", "http://127.0.0.1:9/api")
+
+        results = decode_vins([ACCORD_VIN, "5YJ3E1EA4MF000001"])
+
+        assert [r["success"] for r in results] == [False, False]
+        assert all("API request failed" in r["error"] for r in results)
+
+
+class TestOfflineSnapshot:
+    """Test the offline vPIC snapshot decoder."""
+
+    def test_snapshot_decodes_demo_vins(self, nhtsa_standin, vin_cache, monkeypatch):
+        """Demo VINs decode with no network call."""
+        monkeypatch.setattr(vpic_snapshot, "_default_snapshot", VpicSnapshot.load(SNAPSHOT_FIXTURE))
+        result = decode_vin("1HGBH41JXMN109186")
+
+        assert result["success"] == True
+        assert result["make"] == "HONDA"
+        assert result["model"] == "Accord"
+        assert result["year"] == "2022"
+        assert result["fuel_type"] == "Gasoline"
+        assert nhtsa_standin.requests == []
+
+    def test_same_shape_as_network_decode(self, nhtsa_standin, vin_cache, monkeypatch):
+        """Offline results carry the same keys as live decodes."""
+        live = decode_vin(ACCORD_VIN)
+        monkeypatch.setattr(vpic_snapshot, "_default_snapshot", VpicSnapshot.load(SNAPSHOT_FIXTURE))
+        offline = decode_vin("1HGBH41JXMN109186")
+
+        assert set(offline) == set(live)
+
+    def test_most_specific_pattern_wins(self):
+        """Exact rows beat wildcard rows, and fewer wildcards beat more."""
+        snapshot = VpicSnapshot([
+            {"wmi": "1HG", "pattern": "CY1F5**", "model": "Accord"},
+            {"wmi": "1HG", "pattern": "CY1F5R*", "model": "Accord", "trim": "Sport"},
+            {"wmi": "1HG", "pattern": "CY1F5RA", "model": "Accord", "trim": "Sport", "plant_city": "MARYSVILLE"}
+        ])
+
+        assert snapshot.decode("1HGCY1F56RA100001")["plant_city"] == "MARYSVILLE"
+        assert snapshot.decode("1HGCY1F56RB100001")["trim"] == "Sport"
+        assert snapshot.decode("1HGCY1F56RB100001")["plant_city"] == "Unknown"
+        assert snapshot.decode("1HGCY1F56SB100001")["trim"] == "Unknown"
+        assert snapshot.decode("1HGCV1F35JA123456") is None
+
+    def test_snapshot_serves_every_vin_the_decoder_accepts(self, nhtsa_standin, vin_cache, monkeypatch):
+        """A covered VIN with a bad check digit decodes offline; strict mode rejects it first."""
+        monkeypatch.setattr(vpic_snapshot, "_default_snapshot", VpicSnapshot.load(SNAPSHOT_FIXTURE))
+        vin = "1HGCY1F56RA100001"
+
+        assert decode_vin(vin)["model"] == "Accord"
+        assert decode_vins([vin])[0]["model"] == "Accord"
+        assert asyncio.run(decode_vin_async(vin, use_cache=False))["model"] == "Accord"
+        assert nhtsa_standin.requests == [] and nhtsa_standin.batches == []
+
+        monkeypatch.setattr(nhtsa_api, "STRICT_CHECK_DIGIT", True)
+        assert "check digit" in decode_vin(vin, use_cache=False)["error"]
+        assert "check digit" in decode_vins([vin], use_cache=False)[0]["error"]
+
+    def test_no_snapshot_unless_configured(self, monkeypatch):
+        """Offline decoding is off until VPIC_SNAPSHOT_PATH names a file."""
+        monkeypatch.setattr(vpic_snapshot, "_default_snapshot", vpic_snapshot._UNLOADED)
+        monkeypatch.delenv("VPIC_SNAPSHOT_PATH", raising=False)
+        assert get_vpic_snapshot() is None
+
+        monkeypatch.setattr(vpic_snapshot, "_default_snapshot", vpic_snapshot._UNLOADED)
+        monkeypatch.setenv("VPIC_SNAPSHOT_PATH", SNAPSHOT_FIXTURE)
+        assert len(get_vpic_snapshot()) == 9
+
+    def test_uncovered_vin_falls_back_to_api(self, nhtsa_standin, vin_cache, monkeypatch):
+        """VINs outside the snapshot still decode through the live API."""
+        monkeypatch.setattr(vpic_snapshot, "_default_snapshot", VpicSnapshot.load(SNAPSHOT_FIXTURE))
+        results = decode_vins(["1HGBH41JXMN109186", ACCORD_VIN])
+
+        assert results[0]["year"] == "2022"
+        assert results[1]["year"] == "2018"
+        assert nhtsa_standin.batches == [[ACCORD_VIN]]
+
+
+class TestLocalVinCheck:
+    """Test the local validator and pre-decoder."""
+
+    def test_check_digit(self):
+        """The position-9 check digit is verified for North American VINs."""
+        assert check_vin("1HGBH41JXMN109186")["valid"] == True
+        result = check_vin("1HGBH41J1MN109186")
+        assert result["valid"] == False
+        assert result["check_digit"] == "X"
+        assert "check digit" in result["errors"][0]
+
+    def test_one_vin_normalization_everywhere(self):
+        """Validation, the decode cache and listing dedup all key VINs the same way."""
+        from tools import listing_dedup, nhtsa_api, vin_cache as vin_cache_module
+
+        assert normalize_vin(" 1hgbh41jxmn109186\n") == "1HGBH41JXMN109186"
+        assert normalize_vin(None) == ""
+        assert nhtsa_api.normalize_vin is vin_cache_module.normalize_vin is listing_dedup.normalize_vin is normalize_vin
+        assert check_vin(" 1hgbh41jxmn109186 ")["valid"] == True
+
+    def test_check_digit_optional_outside_north_america(self):
+        """European VINs with a non-computing position 9 are still valid."""
+        result = check_vin("WBAJE5C50HWY01234")
+
+        assert result["valid"] == True
+        assert result["check_digit_valid"] == False
+        assert result["make"] == "BMW"
+        assert result["country"] == "Germany"
+
+    def test_illegal_characters(self):
+        """I, O and Q are rejected."""
+        result = check_vin("1HGBH41JXMN1O9186")
+
+        assert result["structure_valid"] == False
+        assert "O" in result["errors"][0]
+
+    def test_model_year_and_wmi(self):
+        """Model year follows the position-7 cycle rule; WMI maps to a make."""
+        assert check_vin("1HGBH41JXMN109186")["model_year"] == 1991
+        result = check_vin("1HGCV1F35JA123456")
+        assert result["model_year"] == 2018
+        assert result["make"] == "Honda"
+
+    def test_batch_matches_single(self):
+        """check_vins agrees with check_vin row by row."""
+        vins = [
+            "1HGBH41JXMN109186", "1HGBH41J1MN109186", "WBAJE5C50HWY01234",
+            "1HGCV1F35JA123456", "5YJ3E1EA4MF000001", "SHORT", "",
+            "1HGBH41JXMN1O9186", "1hgcv1f35ja123456", "1HGBH41JXMN1091860"
+        ]
+        batch = check_vins(vins)
+
+        for i, vin in enumerate(vins):
+            single = check_vin(vin)
+            assert batch["valid"][i] == single["valid"]
+            assert batch["structure_valid"][i] == single["structure_valid"]
+            assert batch["check_digit_valid"][i] == single["check_digit_valid"]
+            assert batch["model_year"][i] == (single["model_year"] or 0)
+            assert batch["make"][i] == single["make"]
+
+    def test_garbage_vins_never_reach_the_api(self, nhtsa_standin, vin_cache, monkeypatch):
+        """decode_vin and decode_vins reject bad VINs locally."""
+        monkeypatch.setattr(nhtsa_api, "STRICT_CHECK_DIGIT", True)
+        assert decode_vin("1HGCV1F31JA123456")["success"] == False
+        assert decode_vin("1HGCV1F3IJA123456")["success"] == False
+        results = decode_vins(["1HGCV1F31JA123456", ACCORD_VIN])
+
+        assert results[0]["success"] == False
+        assert "check digit" in results[0]["error"]
+        assert results[1]["success"] == True
+        assert nhtsa_standin.batches == [[ACCORD_VIN]]
+        assert len(nhtsa_standin.requests) == 1
+
+    def test_validate_vin_local_only(self, nhtsa_standin, vin_cache, monkeypatch):
+        """validate_vin can answer without the network."""
+        result = validate_vin(ACCORD_VIN, local_only=True)
+
+        assert result["valid"] == True
+        assert result["make"] == "Honda"
+        assert result["year"] == "2018"
+        assert validate_vin("1HGCV1F3IJA123456", local_only=True)["valid"] == False
+        assert validate_vin("1HGCV1F31JA123456", local_only=True)["check_digit_valid"] == False
+        monkeypatch.setattr(nhtsa_api, "STRICT_CHECK_DIGIT", True)
+        assert validate_vin("1HGCV1F31JA123456", local_only=True)["valid"] == False
+        assert nhtsa_standin.requests == []
+
+    def test_bad_check_digit_is_flagged_not_rejected(self, nhtsa_standin, vin_cache):
+        """By default a wrong check digit still decodes, as it does on vPIC, and is flagged."""
+        vin = "5YJYGDEF2NF123456"
+
+        assert decode_vin(vin)["success"] == True
+        assert decode_vins([vin])[0]["success"] == True
+        assert asyncio.run(decode_vin_async(vin))["success"] == True
+        result = validate_vin("1HGCV1F31JA123456")
+        assert result["valid"] == True
+        assert result["check_digit_valid"] == False
+        assert validate_vin(ACCORD_VIN)["check_digit_valid"] == True
+
+
+class TestResilientClient:
+    """Test the pooled vPIC client: keep-alive, retries, deadlines, breaker."""
+
+    def test_connections_are_reused(self, nhtsa_standin, nhtsa_client, vin_cache):
+        """Sequential decodes share one keep-alive connection."""
+        decode_vin(ACCORD_VIN)
+        decode_vin("5YJ3E1EA4MF000001")
+        decode_vin("1HGCV1F33KA123456")
+
+        metrics = nhtsa_client.metrics()
+        assert metrics["connections_opened"] == 1
+        assert metrics["connections_reused"] == 2
+
+    def test_transient_errors_are_retried(self, nhtsa_standin, nhtsa_client, vin_cache):
+        """503s are retried with backoff until an attempt succeeds."""
+        nhtsa_standin.fail_next = 2
+        result = decode_vin(ACCORD_VIN)
+
+        assert result["success"] == True
+        assert nhtsa_client.metrics()["retries"] == 2
+
+    def test_deadline_caps_total_time(self, nhtsa_standin, nhtsa_client):
+        """A slow upstream fails at the deadline instead of the socket timeout."""
+        nhtsa_standin.delay = 0.5
+        started = time.monotonic()
+
+        with pytest.raises(DeadlineExceeded):
+            nhtsa_client.get(f"{nhtsa_standin.url}/vehicles/DecodeVin/{ACCORD_VIN}", deadline=0.2)
+
+        assert time.monotonic() - started < 0.45
+
+    def test_breaker_opens_and_fails_fast(self, nhtsa_standin, vin_cache):
+        """Once open, the breaker rejects calls without touching the network."""
+        from tools import nhtsa_api
+        client = ResilientSession(
+            max_retries=0,
+            backoff_base=0.001,
+            breaker=CircuitBreaker(failure_threshold=2, reset_timeout=30.0)
+        )
+        nhtsa_api.set_nhtsa_client(client)
+        nhtsa_standin.fail_next = 10
+
+        decode_vin(ACCORD_VIN)
+        decode_vin(ACCORD_VIN)
+        sent = len(nhtsa_standin.requests)
+        result = decode_vin(ACCORD_VIN)
+
+        assert result["success"] == False
+        assert "Circuit breaker open" in result["error"]
+        assert len(nhtsa_standin.requests) == sent
+        assert client.metrics()["breaker"]["state"] == "open"
+        client.close()
+
+    def test_breaker_half_open_probe(self):
+        """After the reset timeout one probe is allowed; success closes the breaker."""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure()
+
+        assert breaker.state == "half_open"
+        assert breaker.allow() == True
+        assert breaker.allow() == False
+        breaker.record_success()
+        assert breaker.state == "closed"
+
+    @pytest.mark.parametrize("error", [requests.exceptions.ChunkedEncodingError, KeyboardInterrupt])
+    def test_aborted_probe_releases_half_open_breaker(self, error, monkeypatch):
+        """A probe that dies without a verdict lets the next call probe again."""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure()
+        client = ResilientSession(max_retries=0, breaker=breaker)
+
+        def abort(*args, **kwargs):
+            raise error("probe aborted")
+
+        monkeypatch.setattr(client.session, "request", abort)
+        with pytest.raises(error):
+            client.get("http://upstream.invalid/")
+
+        assert breaker.state == "half_open"
+        assert breaker.allow() == True
+        client.close()
+
+    def test_spent_deadline_raises_timeout(self, monkeypatch):
+        """A deadline used up before the first attempt is a timeout, not a TypeError."""
+        client = ResilientSession(deadline=0.0)
+        monkeypatch.setattr(client.session, "request", lambda *args, **kwargs: pytest.fail("request sent"))
+
+        with pytest.raises(requests.exceptions.Timeout, match="Deadline of 0.0s"):
+            client.get("http://upstream.invalid/")
+        client.close()
+
+    def test_call_without_probe_leaves_it_taken(self, monkeypatch):
+        """A call admitted while closed doesn't free a half-open probe it never held."""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+        client = ResilientSession(max_retries=0, breaker=breaker)
+
+        def abort(*args, **kwargs):
+            # The breaker opens and another caller takes the probe meanwhile
+            breaker.record_failure()
+            assert breaker.allow() == True
+            raise requests.exceptions.ChunkedEncodingError("aborted")
+
+        monkeypatch.setattr(client.session, "request", abort)
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            client.get("http://upstream.invalid/")
+
+        assert breaker.allow() == False
+        client.close()
+
+    def test_throttling_honours_retry_after_and_spares_breaker(self, monkeypatch):
+        """A 429 waits out Retry-After and never opens the breaker."""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30.0)
+        client = ResilientSession(max_retries=2, breaker=breaker)
+        statuses = [429, 429, 200]
+        sleeps = []
+
+        def respond(*args, **kwargs):
+            response = requests.Response()
+            response.raw = io.BytesIO(b"")
+            response.status_code = statuses.pop(0)
+            response.headers["Retry-After"] = "2"
+            return response
+
+        monkeypatch.setattr(client.session, "request", respond)
+        monkeypatch.setattr(http_client.time, "sleep", sleeps.append)
+
+        assert client.get("http://upstream.invalid/").status_code == 200
+        assert sleeps == [2.0, 2.0]
+        assert breaker.state == "closed"
+        assert client.metrics()["throttled"] == 2
+        client.close()
+
+    def test_retry_after_past_deadline_gives_up(self, monkeypatch):
+        """When Retry-After outlasts the deadline the 429 is raised without waiting."""
+        client = ResilientSession(max_retries=2, deadline=1.0)
+
+        def respond(*args, **kwargs):
+            response = requests.Response()
+            response.raw = io.BytesIO(b"")
+            response.status_code = 429
+            response.headers["Retry-After"] = "Wed, 21 Oct 2099 07:28:00 GMT"
+            return response
+
+        monkeypatch.setattr(client.session, "request", respond)
+        started = time.monotonic()
+
+        with pytest.raises(requests.exceptions.HTTPError):
+            client.get("http://upstream.invalid/")
+        assert time.monotonic() - started < 0.5
+        assert client.metrics()["attempts"] == 1
+        client.close()
+
+    def test_stale_entry_served_when_upstream_down(self, nhtsa_standin, vin_cache):
+        """Expired cache entries are served, marked stale, while vPIC fails."""
+        decode_vin(ACCORD_VIN)
+        vin_cache.ttl_seconds = -1
+        nhtsa_standin.fail_next = 10
+
+        result = decode_vin(ACCORD_VIN)
+
+        assert result["success"] == True
+        assert result["stale"] == True
+        assert result["model"] == "Accord"
+
+
+class TestAsyncDecode:
+    """Test the async decode path used by the ADK tool."""
+
+    def test_async_decode_shares_cache_with_sync(self, nhtsa_standin, vin_cache):
+        """An async decode is a cache hit for decode_vin and vice versa."""
+        async def run():
+            first = await decode_vin_async(ACCORD_VIN)
+            decode_vin("5YJ3E1EA4MF000001")
+            second = await decode_vin_async("5YJ3E1EA4MF000001")
+            await nhtsa_api.get_nhtsa_async_client().aclose()
+            return first, second
+
+        first, second = asyncio.run(run())
+
+        assert first["model"] == "Accord"
+        assert second["model"] == "Model 3"
+        assert decode_vin(ACCORD_VIN) == first
+        assert len(nhtsa_standin.requests) == 2
+
+    def test_slow_decode_does_not_block_event_loop(self, nhtsa_standin, vin_cache):
+        """Other coroutines keep running while NHTSA is slow."""
+        nhtsa_standin.delay = 0.3
+        ticks = []
+        # A full collection of the suite's heap mid-run would stall the ticker too
+        gc.collect()
+
+        async def ticker():
+            for _ in range(20):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        async def run():
+            results = await asyncio.gather(
+                decode_vin_async(ACCORD_VIN),
+                decode_vin_async("5YJ3E1EA4MF000001"),
+                decode_vin_async("1HGCV1F33KA123456"),
+                ticker()
+            )
+            await nhtsa_api.get_nhtsa_async_client().aclose()
+            return results
+
+        started = time.monotonic()
+        results = asyncio.run(run())
+        elapsed = time.monotonic() - started
+
+        assert all(r["success"] for r in results[:3])
+        assert len(ticks) == 20
+        assert ticks[-1] - ticks[0] < 0.3
+        assert elapsed < 0.8
+
+    def test_cancelled_probe_releases_half_open_breaker(self, nhtsa_standin):
+        """Cancelling the half-open probe mid-request lets the next call probe."""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure()
+        client = AsyncResilientSession(max_retries=0, breaker=breaker)
+        nhtsa_standin.delay = 0.5
+
+        async def run():
+            probe = asyncio.ensure_future(client.get(f"{nhtsa_standin.url}/vehicles/DecodeVin/{ACCORD_VIN}"))
+            await asyncio.sleep(0.1)
+            probe.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await probe
+            await client.aclose()
+
+        asyncio.run(run())
+
+        assert breaker.state == "half_open"
+        assert breaker.allow() == True
+
+    def test_async_spent_deadline_raises_timeout(self):
+        """The async path raises asyncio.TimeoutError when no attempt could go out."""
+        client = AsyncResilientSession(deadline=0.0)
+
+        async def run():
+            try:
+                with pytest.raises(asyncio.TimeoutError, match="Deadline of 0.0s"):
+                    await client.get("http://upstream.invalid/")
+            finally:
+                await client.aclose()
+
+        asyncio.run(run())
+
+    def test_async_rejects_garbage_locally(self, nhtsa_standin, vin_cache, monkeypatch):
+        """Local checks run before any network call."""
+        assert asyncio.run(decode_vin_async("1HGCV1F3IJA123456"))["success"] == False
+        monkeypatch.setattr(nhtsa_api, "STRICT_CHECK_DIGIT", True)
+        assert asyncio.run(decode_vin_async("1HGCV1F31JA123456"))["success"] == False
+        assert nhtsa_standin.requests == []
+
+
+class TestDecodedVehicle:
+    """Test the compact decode record and field projection."""
+
+    def test_flat_row_keeps_only_informative_values(self):
+        """Empty and "Not Applicable" values are dropped; core fields aren't duplicated."""
+        record = DecodedVehicle.from_flat(ACCORD_VIN, {
+            "VIN": ACCORD_VIN, "Make": "HONDA", "Model": "Accord", "Trim": "",
+            "ErrorCode": "0", "Doors": "4", "ABS": "", "TPMS": "Not Applicable"
+        })
+
+        assert record.make == "HONDA"
+        assert record.trim == "Unknown"
+        assert record.extra == (("ErrorCode", "0"), ("Doors", "4"))
+        assert record.full_data() == {"Make": "HONDA", "Model": "Accord", "ErrorCode": "0", "Doors": "4"}
+
+    def test_projection(self, nhtsa_standin, vin_cache):
+        """Callers get only the fields they ask for; full_data is opt-in."""
+        result = decode_vin(ACCORD_VIN, fields=("make", "model", "year"))
+
+        assert result == {"success": True, "vin": ACCORD_VIN, "make": "HONDA", "model": "Accord", "year": "2018"}
+        assert "full_data" not in decode_vin(ACCORD_VIN, fields=SUMMARY_FIELDS)
+        assert decode_vin(ACCORD_VIN)["full_data"]["Doors"] == "4"
+        with pytest.raises(ValueError):
+            decode_vin(ACCORD_VIN, fields=("color",))
+
+    def test_cache_stores_compact_record(self, nhtsa_standin, vin_cache):
+        """Cached entries hold each value once, without a full_data copy."""
+        decode_vin(ACCORD_VIN)
+        cached = vin_cache.get(ACCORD_VIN)
+
+        assert "full_data" not in cached
+        assert cached["make"] == "HONDA"
+        assert cached["extra"] == {"ErrorCode": "0", "Doors": "4"}
+        assert DecodedVehicle.from_compact(cached).to_dict() == decode_vin(ACCORD_VIN)
+
+    def test_results_are_fresh_dicts(self, nhtsa_standin, vin_cache):
+        """Results are fresh dicts, so mutating one never leaks into another."""
+        first = decode_vin(ACCORD_VIN)
+        first["full_data"]["Make"] = "CHANGED"
+        first["make"] = "CHANGED"
+
+        assert decode_vin(ACCORD_VIN)["make"] == "HONDA"
+        assert decode_vin(ACCORD_VIN)["full_data"]["Make"] == "HONDA"
+
+
+class TestRequestCoalescing:
+    """Test singleflight coalescing of concurrent decodes."""
+
+    def test_concurrent_threads_share_one_call(self, nhtsa_standin, vin_cache):
+        """A burst of threads decoding one VIN makes a single vPIC call."""
+        nhtsa_standin.delay = 0.2
+        barrier = threading.Barrier(8)
+        results = []
+
+        def worker():
+            barrier.wait()
+            results.append(decode_vin(ACCORD_VIN))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(nhtsa_standin.requests) == 1
+        assert all(r["model"] == "Accord" for r in results)
+        assert len({id(r) for r in results}) == 8
+
+    def test_concurrent_coroutines_share_one_call(self, nhtsa_standin, vin_cache):
+        """A burst of coroutines decoding one VIN makes a single vPIC call."""
+        nhtsa_standin.delay = 0.1
+
+        async def run():
+            results = await asyncio.gather(*[decode_vin_async(ACCORD_VIN) for _ in range(8)])
+            await nhtsa_api.get_nhtsa_async_client().aclose()
+            return results
+
+        results = asyncio.run(run())
+
+        assert len(nhtsa_standin.requests) == 1
+        assert all(r["model"] == "Accord" for r in results)
+
+    def test_errors_reach_every_waiter_and_key_is_released(self):
+        """Followers see the leader's error; the next call runs fresh."""
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def failing():
+            calls.append(1)
+            started.set()
+            release.wait()
+            raise ValueError("boom")
+
+        errors = []
+
+        def call():
+            try:
+                flight.do("key", failing)
+            except ValueError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=call)
+        follower.start()
+        while flight.stats()["coalesced"] == 0:
+            time.sleep(0.001)
+        release.set()
+        leader.join()
+        follower.join()
+
+        assert len(errors) == 2
+        assert len(calls) == 1
+        assert flight.do("key", lambda: "fresh") == "fresh"
+        assert flight.stats()["in_flight"] == 0
+
+    def test_cancelled_leader_does_not_fail_followers(self):
+        """Followers still get the result when the leader is cancelled."""
+        flight = SingleFlight(clone=dict)
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"value": 1}
+
+        async def run():
+            leader = asyncio.ensure_future(flight.do_async("key", work))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flight.do_async("key", work))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return leader, await follower
+
+        leader, result = asyncio.run(run())
+
+        assert leader.cancelled()
+        assert result == {"value": 1}
+        assert len(calls) == 1
+        assert flight.stats()["in_flight"] == 0
+
+    def test_call_is_cancelled_once_every_caller_is(self):
+        """The shared call stops when nobody is waiting for it; the key is released."""
+        flight = SingleFlight()
+        stopped = []
+
+        async def work():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                stopped.append(1)
+                raise
+
+        async def run():
+            callers = [asyncio.ensure_future(flight.do_async("key", work)) for _ in range(2)]
+            await asyncio.sleep(0)
+            for caller in callers:
+                caller.cancel()
+            await asyncio.gather(*callers, return_exceptions=True)
+            return await flight.do_async("key", lambda: asyncio.sleep(0, "fresh"))
+
+        assert asyncio.run(run()) == "fresh"
+        assert stopped == [1]
+        assert flight.stats()["in_flight"] == 0
@@ -0,0 +1,149 @@
+"""
+Tests for the resumable bulk VIN enrichment job.
+
+Runs against the local NHTSA stand-in from conftest.py.
+"""
+
+import sys
+import os
+import csv
+import json
+
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.nhtsa_api import decode_vin
+from tools.vin_enrich import AimdLimiter, enrich_csv, load_checkpoint
+
+
+VINS = [
+    "1HGCV1F35JA123456",
+    "5YJ3E1EA4MF000001",
+    "NOT-A-VIN",
+    "1HGCV1F30JA987654",
+    "1HGCV1F33KA123456"
+]
+
+
+def _write_csv(path, vins):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["vin", "mileage"])
+        writer.writeheader()
+        for i, vin in enumerate(vins):
+            writer.writerow({"vin": vin, "mileage": str(1000 * i)})
+
+
+def _read_jsonl(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f]
+
+
+class TestBulkEnrichment:
+    """Test enrich_csv output, checkpoints and cache prewarming."""
+
+    def test_enriches_rows_in_order(self, nhtsa_standin, vin_cache, tmp_path):
+        """Each input row comes back with its decode columns, in input order."""
+        source = tmp_path / "vins.csv"
+        output = tmp_path / "out.jsonl"
+        _write_csv(source, VINS)
+
+        summary = enrich_csv(str(source), str(output), batch_size=2)
+        rows = _read_jsonl(output)
+
+        assert [r["vin"] for r in rows] == VINS
+        assert rows[0]["vpic_make"] == "HONDA"
+        assert rows[1]["vpic_model"] == "Model 3"
+        assert rows[2]["vpic_success"] == False
+        assert rows[2]["mileage"] == "2000"
+        assert summary["decoded"] == 4
+        assert summary["failed"] == 1
+
+    def test_prewarms_interactive_cache(self, nhtsa_standin, vin_cache, tmp_path):
+        """After a run, decode_vin for an enriched VIN makes no network call."""
+        source = tmp_path / "vins.csv"
+        _write_csv(source, VINS)
+        enrich_csv(str(source), str(tmp_path / "out.jsonl"))
+        nhtsa_standin.reset()
+
+        assert decode_vin("5YJ3E1EA4MF000001")["make"] == "TESLA"
+        assert nhtsa_standin.requests == []
+
+    def test_resumes_from_checkpoint(self, nhtsa_standin, vin_cache, tmp_path):
+        """An interrupted run picks up after the last flushed window, discarding partial output."""
+        source = tmp_path / "vins.csv"
+        output = tmp_path / "out.jsonl"
+        _write_csv(source, VINS)
+
+        first = enrich_csv(str(source), str(output), batch_size=2, max_rows=2)
+        assert first["rows_done"] == 2
+
+        # Simulate a crash after a write that was never checkpointed
+        with open(output, "a") as f:
+            f.write('{"vin": "half-written"')
+
+        second = enrich_csv(str(source), str(output), batch_size=2)
+        rows = _read_jsonl(output)
+
+        assert second["rows"] == 3
+        assert [r["vin"] for r in rows] == VINS
+        assert load_checkpoint(str(output) + ".checkpoint.json")["rows_done"] == len(VINS)
+
+    def test_resume_refuses_another_input(self, nhtsa_standin, vin_cache, tmp_path):
+        """A checkpoint only resumes the input it was written for, unchanged."""
+        source = tmp_path / "vins.csv"
+        other = tmp_path / "other.csv"
+        output = tmp_path / "out.jsonl"
+        _write_csv(source, VINS)
+        _write_csv(other, VINS)
+        enrich_csv(str(source), str(output), batch_size=2, max_rows=2)
+
+        with pytest.raises(ValueError, match="Checkpoint"):
+            enrich_csv(str(other), str(output), batch_size=2)
+
+        _write_csv(source, VINS + ["1HGCV1F35JA654321"])
+        with pytest.raises(ValueError, match="Checkpoint"):
+            enrich_csv(str(source), str(output), batch_size=2)
+        assert load_checkpoint(str(output) + ".checkpoint.json")["rows_done"] == 2
+
+    def test_parquet_requires_pyarrow(self, nhtsa_standin, vin_cache, tmp_path):
+        """Parquet output writes part files, or explains that pyarrow is missing."""
+        source = tmp_path / "vins.csv"
+        _write_csv(source, VINS)
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            with pytest.raises(ImportError, match="pyarrow"):
+                enrich_csv(str(source), str(tmp_path / "parquet"), output_format="parquet")
+            return
+
+        enrich_csv(str(source), str(tmp_path / "parquet"), output_format="parquet")
+        assert os.listdir(tmp_path / "parquet")
+
+
+class TestAimdLimiter:
+    """Test adaptive concurrency."""
+
+    def test_additive_increase_multiplicative_decrease(self):
+        """Healthy windows add one; slow or failing windows halve the limit."""
+        limiter = AimdLimiter(initial=4, max_limit=6, target_latency=1.0, error_threshold=0.1)
+
+        assert limiter.record(0.2, 0.0) == 5
+        assert limiter.record(0.2, 0.0) == 6
+        assert limiter.record(0.2, 0.0) == 6
+        assert limiter.record(3.0, 0.0) == 3
+        assert limiter.record(0.2, 0.5) == 1
+        assert limiter.record(0.2, 0.5) == 1
+
+    def test_upstream_errors_reduce_concurrency(self, nhtsa_standin, vin_cache, tmp_path):
+        """A failing vPIC drives the job's concurrency down."""
+        source = tmp_path / "vins.csv"
+        _write_csv(source, ["1HGCV1F39JA000002", "5YJ3E1EA4MF000001"])
+        nhtsa_standin.fail_next = 100
+
+        limiter = AimdLimiter(initial=8)
+        summary = enrich_csv(str(source), str(tmp_path / "out.jsonl"), limiter=limiter)
+
+        assert summary["transport_errors"] == 2
+        assert limiter.limit == 4
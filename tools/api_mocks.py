@@ -3,41 +3,323 @@ Mock API tools for KBB, CarGurus, and other third-party services.
 Uses pre-cached demo data for fast, reliable demos.
 """
 
-import json
-import os
-from typing import Dict, Any, Optional
+import asyncio
+import threading
+from typing import Dict, Any, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from tools.comp_similarity import ComparableIndex, resolve_weights
+from tools.geo import haversine_miles, zip_location
+from tools.listing_dedup import ListingDedupIndex, dedupe_listings
+from tools.market_client import get_market_http_client, http_providers
+from tools.market_columns import ColumnarMarketStore
+from tools.market_providers import (
+    ERROR,
+    LATE,
+    OK,
+    TIMEOUT,
+    CallableProvider,
+    MarketProvider,
+    MarketRequest,
+    fan_out,
+    provenance
+)
+from tools.market_store import (
+    FrozenDict,
+    FrozenList,
+    JsonMarketBackend,
+    MarketSnapshot,
+    entry_region,
+    freeze,
+    get_market_backend,
+    get_market_store,
+    locate_comparable
+)
+from tools.market_summary import MarketSummaryAggregator
+from tools.nhtsa_api import decode_vin
+from tools.outliers import MIN_SEGMENT_SIZE, filter_outliers_batch, ragged
+from tools.price_model import PriceModel
+from tools.quantile_sketch import SegmentSketches
+from tools.segment_snapshots import get_segment_snapshot_store
+from tools.singleflight import SingleFlight
+
+
+# Concurrent lookups for the same VIN/location share one market query.
+# Nested market data is an immutable snapshot, so followers only need
+# their own top-level dict.
+_market_flight = SingleFlight(clone=dict)
+
+# Default comparable search radius around the customer's zip code
+DEFAULT_RADIUS_MILES = 25.0
+
+# Similarity search also considers listings this many model years either side
+SIMILARITY_YEAR_WINDOW = 1
+
+# Max market entries read per model year when building a similarity pool
+SIMILARITY_POOL_VEHICLES = 1000
+
+
+def load_mock_market_data() -> MarketSnapshot:
+    """
+    Return the mock market comparables, keyed by VIN.
+
+    The JSON file is parsed once per change (see tools/market_store.py);
+    every call returns the same read-only snapshot.
+    """
+    return get_market_store().snapshot()
+
+
+# Structures built from the market data: name -> (source, structure)
+_derived: Dict[str, Tuple[Any, Any]] = {}
+_derived_lock = threading.Lock()
+
+
+def _market_source() -> Any:
+    """
+    The market data derived structures are built from.
+
+    The JSON backend's current snapshot, so they are rebuilt whenever it is
+    reloaded; any other backend is read through itself, so a deployment
+    that only has a JSONL or SQLite store never parses MARKET_DATA_PATH.
+    """
+    backend = get_market_backend()
+    return backend.snapshot() if isinstance(backend, JsonMarketBackend) else backend
+
+
+def _entries(source: Any) -> Any:
+    """Market entries of a source returned by _market_source()."""
+    return source if isinstance(source, Mapping) else source.entries()
+
+
+def _from_snapshot(name: str, build, source: Any = None) -> Any:
+    """
+    Return build(source) for the current source, rebuilt when it changes.
+
+    source defaults to _market_source(), so the structure is rebuilt
+    whenever the snapshot is reloaded or the backend replaced.
+    """
+    if source is None:
+        source = _market_source()
+    cached = _derived.get(name)
+    if cached is None or cached[0] is not source:
+        with _derived_lock:
+            cached = _derived.get(name)
+            if cached is None or cached[0] is not source:
+                cached = _derived[name] = (source, build(source))
+    return cached[1]
+
+
+def get_segment_sketches() -> SegmentSketches:
+    """
+    Price quantile sketches over the current market data.
+
+    Built from the selected backend (a columnar one from its mapped
+    columns) and rebuilt whenever the snapshot is reloaded; seeded so bands
+    are stable between rebuilds of the same data.
+    """
+    source = _market_source()
+    if isinstance(source, ColumnarMarketStore):
+        return _from_snapshot("sketches", lambda source: SegmentSketches.from_columns(source, seed=0), source)
+    return _from_snapshot("sketches", lambda source: SegmentSketches.from_entries(_entries(source), seed=0), source)
+
+
+def get_price_model() -> PriceModel:
+    """
+    Mileage/age price model fitted over the current market data.
+
+    A columnar backend is fitted from its mapped columns, without parsing
+    any entries.
+    """
+    source = _market_source()
+    if isinstance(source, ColumnarMarketStore):
+        return _from_snapshot("price_model", PriceModel.from_columns, source)
+    return _from_snapshot("price_model", lambda source: PriceModel.from_entries(_entries(source)), source)
 
 
-def load_mock_market_data() -> Dict[str, Any]:
-    """Load mock market comparables from JSON file."""
-    data_path = os.path.join(
-        os.path.dirname(os.path.dirname(__file__)),
-        "data",
-        "mock_market_comps.json"
+def get_market_summaries() -> MarketSummaryAggregator:
+    """
+    Running market summaries over the current market data.
+
+    Seeded from every entry's comparables and reseeded whenever the snapshot
+    is reloaded; listing updates fed to it (add_listing / remove_listing)
+    show up in the next market_summary served for that VIN.
+    """
+    return _from_snapshot(
+        "summaries", lambda source: MarketSummaryAggregator.from_entries(_entries(source))
+    )
+
+
+def _price_bands(vehicle_info: Mapping[str, Any], region: Optional[str]) -> Optional[Dict[str, Any]]:
+    """p10/p50/p90 listing price bands for a vehicle's segment (None if unknown)."""
+    backend = get_market_backend()
+    bands = backend if isinstance(backend, ColumnarMarketStore) else get_segment_sketches()
+    return bands.price_bands(vehicle_info["make"], vehicle_info["model"], vehicle_info["year"], region)
+
+
+def _add_segment_insights(response: Dict[str, Any], vehicle_info: Mapping[str, Any], region: Optional[str]) -> None:
+    """
+    Add segment_snapshot, price_bands and market_value to a response.
+
+    With a published segment snapshot, the segment's precomputed row also
+    replaces the market_summary statistics and the snapshot's price model
+    gives the market value, so nothing is aggregated or fitted per request.
+    Without one, bands come from the live quantile sketches and the value
+    from the live price model.
+    """
+    snapshot = get_segment_snapshot_store().current()
+    row = None
+    if snapshot is not None:
+        row = snapshot.lookup(
+            vehicle_info["make"], vehicle_info["model"], vehicle_info["year"], vehicle_info.get("trim"), region
+        )
+
+    if row is not None:
+        response["segment_snapshot"] = row
+        response["market_summary"] = {
+            "avg_price": round(float(row["avg_price"])) if row["avg_price"] is not None else None,
+            "min_price": row["min_price"],
+            "max_price": row["max_price"],
+            "total_comparables": row["comp_count"],
+            "outliers_removed": row["outliers_removed"]
+        }
+        response["price_bands"] = {
+            "p10": row["p10"],
+            "p50": row["p50"],
+            "p90": row["p90"],
+            "days_listed_p50": row["days_listed_median"],
+            "sample_size": row["comp_count"],
+            "region": region
+        }
+        model = snapshot.price_model
+    else:
+        bands = _price_bands(vehicle_info, region)
+        if bands is not None:
+            response["price_bands"] = bands
+        model = get_price_model()
+
+    value = _market_value(model, vehicle_info)
+    if value is not None:
+        response["market_value"] = value
+
+
+def _market_value(model: Optional[PriceModel], vehicle_info: Mapping[str, Any]) -> Optional[Dict[str, Any]]:
+    """Mileage-adjusted market value for a vehicle (None without mileage, a model or a segment fit)."""
+    if model is None or vehicle_info.get("mileage") is None:
+        return None
+    return model.predict(
+        vehicle_info["make"], vehicle_info["model"], vehicle_info["year"], vehicle_info["mileage"]
     )
-    with open(data_path, 'r') as f:
-        return json.load(f)
 
 
-def get_kbb_instant_cash_offer(vin: str) -> Dict[str, Any]:
+def _vehicle_segment(
+    vin: str,
+    make: Optional[str] = None,
+    model: Optional[str] = None,
+    year: Optional[int] = None,
+    trim: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Work out the (make, model, year, trim) segment for a VIN with no market entry.
+
+    Uses the caller's make/model/year when given, otherwise decodes the VIN
+    (malformed VINs are rejected locally without a network call).
+
+    Returns:
+        Segment dictionary, or None if it can't be determined
+    """
+    if not (make and model and year):
+        decoded = decode_vin(vin, fields=("make", "model", "year", "trim"))
+        if not decoded["success"]:
+            return None
+        make, model, year = decoded["make"], decoded["model"], decoded["year"]
+        trim = trim or (decoded["trim"] if decoded["trim"] != "Unknown" else None)
+        if "Unknown" in (make, model, year):
+            return None
+
+    try:
+        year = int(year)
+    except (TypeError, ValueError):
+        return None
+    return {"make": make, "model": model, "year": year, "trim": trim}
+
+
+def _segment_search(search, segment: Dict[str, Any], **kwargs: Any) -> Tuple[list, Dict[str, Any]]:
+    """
+    Run a backend segment query, dropping the trim if it finds nothing.
+
+    Returns:
+        (results, match) where match describes the segment actually used
+    """
+    for trim in ([segment["trim"], None] if segment["trim"] else [None]):
+        results = search(segment["make"], segment["model"], segment["year"], trim, **kwargs)
+        if results:
+            break
+    return results, {"type": "segment", **segment, "trim": trim}
+
+
+def _summarize_prices(prices: np.ndarray) -> Dict[str, Any]:
+    """Build a market_summary from listing prices (e.g. a columnar store's price column)."""
+    batch = filter_outliers_batch(prices, np.array([0, len(prices)]))
+    low, high = float(prices.min()), float(prices.max())
+    return {
+        "avg_price": round(float(batch["avg"][0])),
+        "min_price": int(low) if low.is_integer() else low,
+        "max_price": int(high) if high.is_integer() else high,
+        "total_comparables": len(prices),
+        "outliers_removed": int(batch["outliers_removed"][0])
+    }
+
+
+def _summarize_comparables(comparables: list) -> Dict[str, Any]:
+    """Build a market_summary for comparables found by segment search."""
+    return _summarize_prices(np.array([comp["price"] for comp in comparables], dtype=np.float64))
+
+
+def get_kbb_instant_cash_offer(
+    vin: str,
+    make: Optional[str] = None,
+    model: Optional[str] = None,
+    year: Optional[int] = None,
+    trim: Optional[str] = None
+) -> Dict[str, Any]:
     """
     Mock KBB Instant Cash Offer API.
 
+    VINs without their own market entry are valued from another vehicle of
+    the same make/model/year (and trim, when one matches).
+
     Args:
         vin: Vehicle Identification Number
+        make: Vehicle make (optional, for fallback; decoded from the VIN otherwise)
+        model: Vehicle model (optional, for fallback)
+        year: Vehicle year (optional, for fallback)
+        trim: Vehicle trim (optional, for fallback)
 
     Returns:
         Dictionary with KBB valuation data
     """
-    mock_data = load_mock_market_data()
+    backend = get_market_backend()
+    vehicle_data = backend.get_vehicle(vin)
 
-    if vin in mock_data:
+    if vehicle_data is not None:
         return {
             "success": True,
             "vin": vin,
-            "data": mock_data[vin]["kbb_data"]
+            "data": vehicle_data["kbb_data"]
         }
 
+    segment = _vehicle_segment(vin, make, model, year, trim)
+    if segment is not None:
+        vehicles, match = _segment_search(backend.find_vehicles, segment, limit=1)
+        if vehicles:
+            return {
+                "success": True,
+                "vin": vin,
+                "data": vehicles[0]["kbb_data"],
+                "match": match
+            }
+
     # Fallback for unknown VINs
     return {
         "success": False,
@@ -46,72 +328,257 @@ def get_kbb_instant_cash_offer(vin: str) -> Dict[str, Any]:
     }
 
 
+def _local_comparables(
+    comparables: list,
+    origin: Optional[Tuple[float, float]],
+    radius_miles: float
+) -> Tuple[list, bool]:
+    """
+    Re-measure a VIN's own listings from the search origin.
+
+    Returns:
+        (listings within radius_miles, nearest first; expanded). When none
+        are in range, every listing is returned and expanded is True.
+        Without an origin the listings are returned unchanged.
+    """
+    if origin is None:
+        return list(comparables), False
+
+    located = []
+    for comp in comparables:
+        location = zip_location(comp.get("dealer_zip"))
+        if location is not None:
+            comp = locate_comparable(comp, haversine_miles(*origin, *location))
+        located.append(comp)
+    located.sort(key=lambda comp: comp.get("distance_miles", 0))
+
+    within = [comp for comp in located if comp.get("distance_miles", 0) <= radius_miles]
+    if within:
+        return within, False
+    return located, True
+
+
+def _dedupe_comparables(comparables: list) -> Tuple[list, int]:
+    """
+    Collapse the same car listed on several sites (see tools/listing_dedup.py).
+
+    Returns:
+        (read-only listings, nearest copy of each car first; duplicates removed)
+    """
+    kept, duplicates = dedupe_listings(comparables)
+    return [comp if isinstance(comp, FrozenDict) else freeze(comp) for comp in kept], duplicates
+
+
+def _search_params(
+    zip_code: str,
+    radius_miles: float,
+    origin: Optional[Tuple[float, float]],
+    expanded: bool,
+    duplicates_removed: int = 0
+) -> Dict[str, Any]:
+    """Describe how comparables were located."""
+    params = {
+        "zip_code": zip_code,
+        "radius_miles": radius_miles,
+        "zip_located": origin is not None
+    }
+    if expanded:
+        params["radius_expanded"] = True
+    if duplicates_removed:
+        params["duplicates_removed"] = duplicates_removed
+    return params
+
+
 def get_cargurus_comparables(
     vin: str,
     make: Optional[str] = None,
     model: Optional[str] = None,
     year: Optional[int] = None,
-    zip_code: str = "33130"
+    zip_code: str = "33130",
+    trim: Optional[str] = None,
+    region: Optional[str] = None,
+    radius_miles: float = DEFAULT_RADIUS_MILES
 ) -> Dict[str, Any]:
     """
     Mock CarGurus comparable listings API.
 
+    Listings are measured from the zip code's centroid and limited to
+    radius_miles, nearest first. If nothing is in range the nearest listings
+    are returned instead (search_params.radius_expanded). Zip codes missing
+    from the centroid table fall back to the listings' recorded distances.
+    The same car listed on several sites is returned once, tagged with
+    also_listed_on (search_params.duplicates_removed counts the copies).
+
+    VINs without their own market entry are answered with listings for the
+    same make/model/year (and trim, when any match).
+
     Args:
         vin: Vehicle Identification Number
-        make: Vehicle make (optional, for fallback)
+        make: Vehicle make (optional, for fallback; decoded from the VIN otherwise)
         model: Vehicle model (optional, for fallback)
         year: Vehicle year (optional, for fallback)
         zip_code: Search location zip code
+        trim: Vehicle trim (optional, for fallback)
+        region: Only use listings from this region (optional, for fallback)
+        radius_miles: Search radius around zip_code
 
     Returns:
         Dictionary with comparable vehicle listings
     """
-    mock_data = load_mock_market_data()
+    backend = get_market_backend()
+    return _comparables_response(
+        backend, vin, backend.get_vehicle(vin), make, model, year, zip_code, trim, region, radius_miles
+    )
+
 
-    if vin in mock_data:
-        vehicle_data = mock_data[vin]
+def _comparables_response(
+    backend: Any,
+    vin: str,
+    vehicle_data: Optional[Mapping[str, Any]],
+    make: Optional[str],
+    model: Optional[str],
+    year: Optional[int],
+    zip_code: str,
+    trim: Optional[str],
+    region: Optional[str],
+    radius_miles: float
+) -> Dict[str, Any]:
+    """Build the get_cargurus_comparables result for an already looked-up VIN."""
+    origin = zip_location(zip_code)
+
+    if vehicle_data is not None:
+        comparables, expanded = _local_comparables(vehicle_data["comparables"], origin, radius_miles)
+        comparables, duplicates = _dedupe_comparables(comparables)
+        market_summary = None
+        if len(comparables) == len(vehicle_data["comparables"]):
+            market_summary = get_market_summaries().summary(vin)
+        if market_summary is None:
+            market_summary = _summarize_comparables(comparables)
         return {
             "success": True,
             "vin": vin,
             "vehicle_info": vehicle_data["vehicle_info"],
-            "comparables": vehicle_data["comparables"],
-            "market_summary": vehicle_data["market_summary"],
-            "search_params": {
-                "zip_code": zip_code,
-                "radius_miles": 25
-            }
+            "comparables": FrozenList(comparables),
+            "market_summary": market_summary,
+            "search_params": _search_params(zip_code, radius_miles, origin, expanded, duplicates)
         }
 
+    segment = _vehicle_segment(vin, make, model, year, trim)
+    if segment is not None:
+        expanded = False
+        comparables, match = _segment_search(
+            backend.find_comparables, segment, region=region, near=origin, radius_miles=radius_miles
+        )
+        if not comparables and origin is not None:
+            comparables, match = _segment_search(backend.find_comparables, segment, region=region)
+            expanded = bool(comparables)
+        if comparables:
+            comparables, duplicates = _dedupe_comparables(comparables)
+            return {
+                "success": True,
+                "vin": vin,
+                "vehicle_info": {"vin": vin, **{k: match[k] for k in ("make", "model", "year", "trim")}},
+                "comparables": FrozenList(comparables),
+                "market_summary": _summarize_comparables(comparables),
+                "search_params": _search_params(zip_code, radius_miles, origin, expanded, duplicates),
+                "match": match
+            }
+
     # Fallback for unknown VINs
     return {
         "success": False,
         "error": "VIN not found in demo data",
         "vin": vin,
-        "note": "For production, would search by make/model/year"
+        "note": "No comparables found for this make/model/year either"
     }
 
 
-def get_market_intelligence(vin: str, zip_code: str = "33130") -> Dict[str, Any]:
+def get_market_intelligence(
+    vin: str,
+    zip_code: str = "33130",
+    radius_miles: float = DEFAULT_RADIUS_MILES,
+    k: Optional[int] = None,
+    weights: Optional[Mapping[str, float]] = None
+) -> Dict[str, Any]:
     """
     Combined market intelligence from multiple sources.
 
+    Comparables are local to zip_code (see get_cargurus_comparables). VINs
+    without their own market entry are answered by make/model/year segment
+    search. Concurrent calls for the same VIN and location are coalesced
+    into one lookup.
+
+    When k is given, comparables are instead the k listings most similar to
+    the vehicle (see tools/comp_similarity.py), drawn from every listing in
+    range for its model and neighbouring model years, and the market summary
+    is computed over those k.
+
+    price_bands gives p10/p50/p90 listing prices for the vehicle's segment
+    and region (every region for VINs without an entry), read from
+    quantile sketches rather than the full price list. When a nightly
+    segment snapshot is published (see tools/segment_snapshots.py), its
+    precomputed row for the segment is returned as segment_snapshot, with
+    its version, and the bands are read from it. market_value is the
+    segment's price at the vehicle's own mileage and model year, with a 90%
+    confidence interval (see tools/price_model.py); it is left out when the
+    mileage is unknown.
+
     Args:
         vin: Vehicle Identification Number
         zip_code: Search location
+        radius_miles: Search radius around zip_code
+        k: Number of most similar comparables to select (None keeps the
+            VIN's own listings)
+        weights: Similarity weights by feature (year, mileage, trim,
+            distance, days_listed); unlisted features keep their defaults
 
     Returns:
         Comprehensive market data combining KBB, CarGurus, and other sources
     """
-    mock_data = load_mock_market_data()
+    if k is not None:
+        try:
+            if k < 1:
+                raise ValueError("k must be at least 1")
+            weights = resolve_weights(weights)
+        except ValueError as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "vin": vin
+            }
+
+    key = (vin, zip_code, radius_miles, k, tuple(sorted(weights.items())) if weights else None)
+    return _market_flight.do(
+        key, _build_market_intelligence, vin, zip_code, radius_miles, k, weights
+    )
+
 
-    if vin not in mock_data:
+def _build_market_intelligence(
+    vin: str,
+    zip_code: str,
+    radius_miles: float,
+    k: Optional[int] = None,
+    weights: Optional[Dict[str, float]] = None
+) -> Dict[str, Any]:
+    """Gather market intelligence for one VIN (see get_market_intelligence)."""
+    backend = get_market_backend()
+    vehicle_data = backend.get_vehicle(vin)
+    comps = _comparables_response(
+        backend, vin, vehicle_data, None, None, None, zip_code, None, None, radius_miles
+    )
+
+    if not comps["success"]:
         return {
             "success": False,
             "error": "VIN not found in demo data",
             "vin": vin
         }
 
-    vehicle_data = mock_data[vin]
+    if k is not None:
+        comps = _similar_comparables(backend, comps, zip_code, radius_miles, k, weights)
+
+    if vehicle_data is None:
+        return _build_segment_intelligence(vin, comps)
 
     # Compile comprehensive market intelligence
     response = {
@@ -119,10 +586,13 @@ def get_market_intelligence(vin: str, zip_code: str = "33130") -> Dict[str, Any]
         "vin": vin,
         "vehicle_info": vehicle_data["vehicle_info"],
         "kbb_valuation": vehicle_data["kbb_data"],
-        "comparables": vehicle_data["comparables"],
-        "market_summary": vehicle_data["market_summary"]
+        "comparables": comps["comparables"],
+        "market_summary": comps["market_summary"],
+        "search_params": comps["search_params"]
     }
 
+    _add_segment_insights(response, vehicle_data["vehicle_info"], entry_region(vehicle_data))
+
     # Add regional data if available
     if "regional_data" in vehicle_data:
         response["regional_insights"] = vehicle_data["regional_data"]
@@ -134,13 +604,343 @@ def get_market_intelligence(vin: str, zip_code: str = "33130") -> Dict[str, Any]
     return response
 
 
-def filter_outliers(comparables: list, std_dev_threshold: float = 2.0) -> Dict[str, Any]:
+def _similar_comparables(
+    backend: Any,
+    comps: Dict[str, Any],
+    zip_code: str,
+    radius_miles: float,
+    k: int,
+    weights: Dict[str, float]
+) -> Dict[str, Any]:
+    """
+    Replace a comparables response's listings with the k most similar in its pool.
+
+    The pool is every in-range listing recorded for the same make/model
+    within SIMILARITY_YEAR_WINDOW model years, plus the response's own
+    listings. Each listing is tagged with the year and trim of the entry it
+    came from, so those features can be scored.
+    """
+    origin = zip_location(zip_code)
+    if isinstance(backend, ColumnarMarketStore):
+        comparables, candidates, prices = _similar_from_columns(backend, comps, origin, radius_miles, k, weights)
+    else:
+        comparables, candidates = _similar_from_entries(backend, comps, origin, radius_miles, k, weights)
+        prices = np.array([comp["price"] for comp in comparables], dtype=np.float64)
+
+    return {
+        **comps,
+        "comparables": comparables,
+        "market_summary": _summarize_prices(prices),
+        "search_params": {
+            **comps["search_params"],
+            "k": k,
+            "weights": weights,
+            "candidates": candidates
+        }
+    }
+
+
+def _similar_from_entries(
+    backend: Any,
+    comps: Dict[str, Any],
+    origin: Optional[Tuple[float, float]],
+    radius_miles: float,
+    k: int,
+    weights: Dict[str, float]
+) -> Tuple[FrozenList, int]:
+    """k most similar listings and the pool size, pooled from market entries."""
+    info = comps["vehicle_info"]
+    year = int(info["year"])
+
+    pool = []
+    seen = ListingDedupIndex()
+
+    def add(listings, entry_info):
+        for comp in listings:
+            if seen.add(comp)[1]:
+                pool.append({**comp, "year": int(entry_info["year"]), "trim": entry_info.get("trim")})
+
+    for candidate_year in range(year - SIMILARITY_YEAR_WINDOW, year + SIMILARITY_YEAR_WINDOW + 1):
+        for entry in backend.find_vehicles(info["make"], info["model"], candidate_year, limit=SIMILARITY_POOL_VEHICLES):
+            listings, expanded = _local_comparables(entry["comparables"], origin, radius_miles)
+            if not expanded:
+                add(listings, entry["vehicle_info"])
+    # The response's own listings (already in range, or the expanded nearest)
+    add(comps["comparables"], info)
+
+    index = ComparableIndex.from_listings(pool)
+    nearest = index.top_k(k, info["year"], info.get("mileage"), info.get("trim"), weights)
+    comparables = FrozenList(
+        freeze({**comp, "similarity_distance": round(distance, 3)}) for distance, comp in nearest
+    )
+    return comparables, len(pool)
+
+
+def _similar_from_columns(
+    store: ColumnarMarketStore,
+    comps: Dict[str, Any],
+    origin: Optional[Tuple[float, float]],
+    radius_miles: float,
+    k: int,
+    weights: Dict[str, float]
+) -> Tuple[FrozenList, int, np.ndarray]:
+    """
+    k most similar listings, the pool size and their prices, from a columnar store.
+
+    The pool is scored over the store's mapped columns; only the k listings
+    returned are materialized, and their prices are read from the price
+    column.
+    """
+    info = comps["vehicle_info"]
+    index = store.comparable_index(
+        info["make"], info["model"], info["year"],
+        year_window=SIMILARITY_YEAR_WINDOW, near=origin, radius_miles=radius_miles
+    )
+    nearest = index.top_k(k, info["year"], info.get("mileage"), info.get("trim"), weights)
+    candidates = len(index)
+    own = []
+    if comps["search_params"].get("radius_expanded"):
+        # The response's own listings are all out of range: score them too
+        own = [{**comp, "year": int(info["year"]), "trim": info.get("trim")} for comp in comps["comparables"]]
+        candidates += len(own)
+        own_index = ComparableIndex.from_listings(own)
+        nearest += own_index.top_k(k, info["year"], info.get("mileage"), info.get("trim"), weights)
+        nearest = sorted(nearest, key=lambda pair: pair[0])[:k]
+
+    rows = np.array([item for _, item in nearest if not isinstance(item, Mapping)], dtype=np.int64)
+    comparables = FrozenList(
+        freeze({
+            **(item if isinstance(item, Mapping) else store.pool_listing(int(item), origin)),
+            "similarity_distance": round(distance, 3)
+        })
+        for distance, item in nearest
+    )
+    prices = np.concatenate([
+        store.column("price")[rows],
+        np.array([item["price"] for _, item in nearest if isinstance(item, Mapping)], dtype=np.float64)
+    ])
+    return comparables, candidates, prices
+
+
+def _build_segment_intelligence(vin: str, comps: Dict[str, Any]) -> Dict[str, Any]:
+    """Market intelligence for a VIN with no entry of its own, from its segment."""
+    match = comps["match"]
+    response = {
+        "success": True,
+        "vin": vin,
+        "vehicle_info": comps["vehicle_info"],
+        "comparables": comps["comparables"],
+        "market_summary": comps["market_summary"],
+        "search_params": comps["search_params"],
+        "match": match
+    }
+
+    # Unknown region: bands span every region's listings
+    _add_segment_insights(response, match, None)
+
+    kbb = get_kbb_instant_cash_offer(vin, match["make"], match["model"], match["year"], match["trim"])
+    if kbb["success"]:
+        response["kbb_valuation"] = kbb["data"]
+
+    return response
+
+
+def _kbb_source(request: MarketRequest) -> Dict[str, Any]:
+    return get_kbb_instant_cash_offer(request.vin, request.make, request.model, request.year, request.trim)
+
+
+class _ListingSearch:
+    """
+    One comparables search shared by the listing-site providers of a fan-out.
+
+    Every site's provider is asked about the same request; the first to
+    ask runs get_cargurus_comparables and the rest reuse its result, so the
+    search runs once per request rather than once per site.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last: Optional[Tuple[MarketRequest, Dict[str, Any]]] = None
+
+    def __call__(self, request: MarketRequest) -> Dict[str, Any]:
+        with self._lock:
+            if self._last is None or self._last[0] != request:
+                self._last = (request, get_cargurus_comparables(
+                    request.vin, request.make, request.model, request.year,
+                    request.zip_code, request.trim, None, request.radius_miles
+                ))
+            return self._last[1]
+
+
+def _listing_source(source: str, search: _ListingSearch):
+    """Comparables source that answers with one listing site's share of a shared search."""
+    def fetch(request: MarketRequest) -> Dict[str, Any]:
+        result = search(request)
+        if not result["success"]:
+            return result
+        listings = [comp for comp in result["comparables"] if comp.get("source") == source]
+        if not listings:
+            return {"success": False, "error": f"No {source} listings", "vin": request.vin}
+        return {**result, "comparables": FrozenList(listings)}
+    return fetch
+
+
+def _insights_source(request: MarketRequest) -> Dict[str, Any]:
+    entry = get_market_backend().get_vehicle(request.vin)
+    if entry is None:
+        return {"success": False, "error": "No market insights for VIN", "vin": request.vin}
+    return {key: entry[key] for key in ("regional_data", "demand_insights") if key in entry}
+
+
+def default_providers() -> List[MarketProvider]:
+    """
+    The demo market sources as concurrent providers.
+
+    KBB, CarGurus and AutoTrader are required; regional and demand
+    insights are optional and dropped if they're slower than the rest.
+    When MARKET_PROVIDER_URL is set, KBB, CarGurus and AutoTrader are
+    queried over HTTP (see tools/market_client.py) instead of in-process.
+    """
+    client = get_market_http_client()
+    if client is not None:
+        sources = http_providers(client)
+    else:
+        search = _ListingSearch()
+        sources = [
+            CallableProvider("kbb", _kbb_source),
+            CallableProvider("cargurus", _listing_source("cargurus", search)),
+            CallableProvider("autotrader", _listing_source("autotrader", search))
+        ]
+    return sources + [CallableProvider("market_insights", _insights_source, required=False)]
+
+
+async def get_market_intelligence_async(
+    vin: str,
+    zip_code: str = "33130",
+    radius_miles: float = DEFAULT_RADIUS_MILES,
+    providers: Optional[List[MarketProvider]] = None
+) -> Dict[str, Any]:
+    """
+    Market intelligence gathered from every provider concurrently.
+
+    Sources are queried in parallel with per-source timeouts (see
+    tools/market_providers.py), so latency tracks the slowest required
+    source. If some sources fail or are late the rest are still returned:
+    partial is True and sources reports each one's status and latency.
+    Comparables carry their source. With every source answering the result
+    matches get_market_intelligence; with partial results market_summary is
+    recomputed over the listings that arrived.
+
+    Args:
+        vin: Vehicle Identification Number
+        zip_code: Search location
+        radius_miles: Search radius around zip_code
+        providers: Sources to query (default: default_providers())
+
+    Returns:
+        Dictionary shaped like get_market_intelligence, plus sources and partial
+    """
+    request = MarketRequest(vin, zip_code, radius_miles)
+    if providers is not None:
+        return await _assemble_market_intelligence(vin, await fan_out(providers, request))
+
+    async def gather() -> Dict[str, Any]:
+        return await _assemble_market_intelligence(vin, await fan_out(default_providers(), request))
+
+    return await _market_flight.do_async(("async", vin, zip_code, radius_miles), gather)
+
+
+def _merged_summary(listings: List[Dict[str, Any]], comparables: list, partial: bool) -> Dict[str, Any]:
+    """
+    market_summary for merged listing-site results.
+
+    When every source answered and the sites report one summary (they are
+    slices of the same search), that summary stands, as it does on the sync
+    path; otherwise it is recomputed over the listings that arrived.
+    """
+    summaries = [data.get("market_summary") for data in listings]
+    if not partial and summaries[0] is not None and all(summary == summaries[0] for summary in summaries):
+        return summaries[0]
+    return _summarize_comparables(comparables)
+
+
+async def _assemble_market_intelligence(vin: str, outcomes: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge provider outcomes into one market intelligence response.
+
+    Segment insights can build sketches or fit the price model, so they run
+    in a worker thread rather than on the event loop.
+    """
+    sources = provenance(outcomes)
+    partial = any(outcome["status"] in (TIMEOUT, LATE, ERROR) for outcome in outcomes.values())
+    answered = {name: outcome["data"] for name, outcome in outcomes.items() if outcome["status"] == OK}
+    listings = [data for data in answered.values() if "comparables" in data]
+
+    if not listings:
+        return {
+            "success": False,
+            "error": "Market sources unavailable" if partial else "VIN not found in demo data",
+            "vin": vin,
+            "sources": sources,
+            "partial": partial
+        }
+
+    primary = listings[0]
+    comparables, duplicates = _dedupe_comparables(sorted(
+        (comp for data in listings for comp in data["comparables"]),
+        key=lambda comp: comp.get("distance_miles", 0)
+    ))
+    search_params = primary["search_params"]
+    # The in-process sources are slices of one deduplicated result, so their counts overlap
+    duplicates += max(data["search_params"].get("duplicates_removed", 0) for data in listings)
+    if duplicates:
+        search_params = {**search_params, "duplicates_removed": duplicates}
+    response = {
+        "success": True,
+        "vin": vin,
+        "vehicle_info": primary["vehicle_info"],
+        "comparables": FrozenList(comparables),
+        "market_summary": _merged_summary(listings, comparables, partial),
+        "search_params": search_params,
+        "sources": sources,
+        "partial": partial
+    }
+    if "match" in primary:
+        response["match"] = primary["match"]
+
+    if "kbb" in answered:
+        response["kbb_valuation"] = answered["kbb"]["data"]
+
+    insights = answered.get("market_insights", {})
+    if "regional_data" in insights:
+        response["regional_insights"] = insights["regional_data"]
+    if "demand_insights" in insights:
+        response["demand_insights"] = insights["demand_insights"]
+
+    region = None if "match" in primary else entry_region(insights)
+    await asyncio.to_thread(_add_segment_insights, response, primary["vehicle_info"], region)
+
+    return response
+
+
+def filter_outliers(
+    comparables: list,
+    std_dev_threshold: float = 2.0,
+    method: str = "zscore",
+    threshold: Optional[float] = None
+) -> Dict[str, Any]:
     """
     Filter outlier listings from comparable vehicles.
 
+    Uses the vectorized rules in tools/outliers.py; to filter many
+    comparable sets in one call, use filter_outliers_batch there directly.
+
     Args:
         comparables: List of comparable vehicle dictionaries
         std_dev_threshold: Number of standard deviations for outlier detection
+        method: "zscore" (default), or the robust "mad" or "iqr" rules
+        threshold: Threshold for the chosen method (default: std_dev_threshold
+            for zscore, DEFAULT_THRESHOLDS otherwise)
 
     Returns:
         Filtered comparables and statistics
@@ -152,34 +952,25 @@ def filter_outliers(comparables: list, std_dev_threshold: float = 2.0) -> Dict[s
             "avg_price": 0
         }
 
-    import statistics
+    prices, offsets = ragged([[comp["price"] for comp in comparables]])
+    if threshold is None and method == "zscore":
+        threshold = std_dev_threshold
+    batch = filter_outliers_batch(prices, offsets, method, threshold)
 
-    prices = [comp["price"] for comp in comparables]
-
-    if len(prices) < 3:
+    if len(prices) < MIN_SEGMENT_SIZE:
         # Not enough data for outlier detection
         return {
             "filtered_comparables": comparables,
             "outliers_removed": 0,
-            "avg_price": statistics.mean(prices)
+            "avg_price": float(batch["original_avg"][0])
         }
 
-    mean_price = statistics.mean(prices)
-    std_dev = statistics.stdev(prices)
-
-    # Filter outliers
-    filtered = [
-        comp for comp in comparables
-        if abs(comp["price"] - mean_price) <= (std_dev_threshold * std_dev)
-    ]
-
-    outliers_removed = len(comparables) - len(filtered)
-    new_avg = statistics.mean([c["price"] for c in filtered]) if filtered else 0
+    filtered = [comp for comp, keep in zip(comparables, batch["keep"]) if keep]
 
     return {
         "filtered_comparables": filtered,
-        "outliers_removed": outliers_removed,
-        "avg_price": new_avg,
-        "original_avg": mean_price,
-        "std_dev": std_dev
+        "outliers_removed": int(batch["outliers_removed"][0]),
+        "avg_price": float(batch["avg"][0]),
+        "original_avg": float(batch["original_avg"][0]),
+        "std_dev": float(batch["std_dev"][0])
     }
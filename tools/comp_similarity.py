@@ -0,0 +1,254 @@
+"""
+k-nearest-neighbour comparable selection.
+
+Scores candidate listings against the vehicle being appraised on year,
+mileage, trim, distance and days listed. Each feature is divided by a scale
+(one year, 10,000 miles, ...) so a unit difference means roughly the same
+thing across features, then weighted. A listing's similarity distance is the
+weighted Euclidean distance over those scaled differences; 0 is an
+identical vehicle listed next door today.
+
+Candidates are held as a NumPy feature matrix, so scoring a pool of
+hundreds of thousands of listings is a handful of vectorized operations
+and a partial sort for the top k.
+"""
+
+import math
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+FEATURES = ("year", "mileage", "trim", "distance", "days_listed")
+
+# How much each feature counts. Year and mileage drive price the most.
+DEFAULT_WEIGHTS: Dict[str, float] = {
+    "year": 1.0,
+    "mileage": 1.0,
+    "trim": 0.5,
+    "distance": 0.5,
+    "days_listed": 0.25
+}
+
+# Difference that counts as one unit of dissimilarity for each feature
+FEATURE_SCALES: Dict[str, float] = {
+    "year": 1.0,
+    "mileage": 10000.0,
+    "trim": 1.0,
+    "distance": 25.0,
+    "days_listed": 30.0
+}
+
+# Scaled difference charged for a candidate missing a feature
+MISSING_PENALTY = 1.0
+
+DEFAULT_K = 5
+
+
+def resolve_weights(weights: Optional[Mapping[str, float]] = None) -> Dict[str, float]:
+    """
+    Merge caller weights over DEFAULT_WEIGHTS.
+
+    Args:
+        weights: Per-feature weights; features left out keep their default
+
+    Returns:
+        A weight for every feature
+
+    Raises:
+        ValueError: For an unknown feature or a negative weight
+    """
+    resolved = dict(DEFAULT_WEIGHTS)
+    for feature, weight in (weights or {}).items():
+        if feature not in resolved:
+            raise ValueError(f"Unknown similarity feature: {feature}")
+        if weight < 0:
+            raise ValueError(f"Similarity weight for {feature} must be >= 0")
+        resolved[feature] = float(weight)
+    return resolved
+
+
+def _normalize_trim(trim: Any) -> Optional[str]:
+    if trim is None:
+        return None
+    trim = str(trim).strip().lower()
+    return trim if trim and trim != "unknown" else None
+
+
+def _number(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class ComparableIndex:
+    """
+    Feature matrix over a pool of candidate listings.
+
+    Build it once per pool and query it with different subjects, k and
+    weights. Trims are stored as integer codes so trim matching is a
+    vectorized comparison too.
+    """
+
+    def __init__(
+        self,
+        items: Sequence[Any],
+        year: np.ndarray,
+        mileage: np.ndarray,
+        trim: Sequence[Optional[str]],
+        distance: np.ndarray,
+        days_listed: np.ndarray,
+        trim_names: Optional[Sequence[Optional[str]]] = None
+    ):
+        """
+        Args:
+            items: Candidate objects, returned by top_k (a NumPy array is
+                kept as it is)
+            year: Model year per candidate (NaN when unknown)
+            mileage: Odometer miles per candidate (NaN when unknown)
+            trim: Trim per candidate (None when unknown), or with trim_names
+                an integer array of indexes into trim_names (-1 when unknown)
+            distance: Miles from the search location (NaN when unknown)
+            days_listed: Days on market (NaN when unknown)
+            trim_names: Trim vocabulary for coded trims, so large pools
+                skip per-candidate string handling
+        """
+        self._items = items if isinstance(items, np.ndarray) else list(items)
+        self._trim_codes: Dict[str, int] = {}
+        if trim_names is not None:
+            # A trailing -1 so unknown (-1) indexes map to unknown
+            lookup = np.array(
+                [self._trim_codes.setdefault(t, len(self._trim_codes)) if t is not None else -1
+                 for t in map(_normalize_trim, trim_names)] + [-1],
+                dtype=np.int64
+            )
+            codes = lookup[np.asarray(trim, dtype=np.int64)]
+        else:
+            codes = np.array(
+                [self._trim_codes.setdefault(t, len(self._trim_codes)) if t is not None else -1
+                 for t in map(_normalize_trim, trim)],
+                dtype=np.int64
+            )
+        self._columns = {
+            "year": np.asarray(year, dtype=np.float64),
+            "mileage": np.asarray(mileage, dtype=np.float64),
+            "distance": np.asarray(distance, dtype=np.float64),
+            "days_listed": np.asarray(days_listed, dtype=np.float64)
+        }
+        self._trim = codes
+        for name, column in self._columns.items():
+            if len(column) != len(self._items):
+                raise ValueError(f"{name} has {len(column)} values for {len(self._items)} candidates")
+        if len(codes) != len(self._items):
+            raise ValueError(f"trim has {len(codes)} values for {len(self._items)} candidates")
+
+    @classmethod
+    def from_listings(
+        cls,
+        listings: Iterable[Mapping[str, Any]],
+        year: Any = None,
+        trim: Optional[str] = None
+    ) -> "ComparableIndex":
+        """
+        Build an index from comparable listings shaped like mock_market_comps.json.
+
+        Args:
+            listings: Listings with mileage, distance_miles, days_listed and
+                optionally year and trim
+            year: Year for listings without one (usually the segment's)
+            trim: Trim for listings without one
+
+        Returns:
+            The index; top_k returns the listings themselves
+        """
+        listings = list(listings)
+        return cls(
+            listings,
+            np.array([_number(item.get("year", year)) for item in listings]),
+            np.array([_number(item.get("mileage")) for item in listings]),
+            [item.get("trim", trim) for item in listings],
+            np.array([_number(item.get("distance_miles")) for item in listings]),
+            np.array([_number(item.get("days_listed")) for item in listings])
+        )
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def scores(
+        self,
+        year: Any = None,
+        mileage: Any = None,
+        trim: Optional[str] = None,
+        weights: Optional[Mapping[str, float]] = None
+    ) -> np.ndarray:
+        """
+        Similarity distance from the subject vehicle to every candidate.
+
+        Subject features that are unknown (None) are left out of the score.
+        Distance and days listed are measured against an ideal of 0: nearer
+        and fresher listings are better evidence of today's local price.
+
+        Args:
+            year: Subject model year
+            mileage: Subject odometer miles
+            trim: Subject trim
+            weights: Per-feature weights (see DEFAULT_WEIGHTS)
+
+        Returns:
+            Array of distances, one per candidate (lower is more similar)
+        """
+        weights = resolve_weights(weights)
+        subject = {
+            "year": _number(year),
+            "mileage": _number(mileage),
+            "distance": 0.0,
+            "days_listed": 0.0
+        }
+
+        total = np.zeros(len(self._items), dtype=np.float64)
+        for name, column in self._columns.items():
+            if weights[name] == 0 or math.isnan(subject[name]):
+                continue
+            diff = (column - subject[name]) / FEATURE_SCALES[name]
+            total += weights[name] * np.nan_to_num(diff, nan=MISSING_PENALTY) ** 2
+
+        trim_key = _normalize_trim(trim)
+        if weights["trim"] and trim_key is not None:
+            code = self._trim_codes.get(trim_key, -2)
+            mismatch = np.where(self._trim == -1, MISSING_PENALTY, (self._trim != code).astype(np.float64))
+            total += weights["trim"] * mismatch ** 2
+
+        return np.sqrt(total)
+
+    def top_k(
+        self,
+        k: int = DEFAULT_K,
+        year: Any = None,
+        mileage: Any = None,
+        trim: Optional[str] = None,
+        weights: Optional[Mapping[str, float]] = None
+    ) -> List[Tuple[float, Any]]:
+        """
+        Find the k candidates most similar to the subject vehicle.
+
+        Args:
+            k: Number of candidates to return
+            year: Subject model year
+            mileage: Subject odometer miles
+            trim: Subject trim
+            weights: Per-feature weights (see DEFAULT_WEIGHTS)
+
+        Returns:
+            (similarity_distance, item) pairs, most similar first
+        """
+        if k <= 0 or not len(self._items):
+            return []
+        distances = self.scores(year, mileage, trim, weights)
+        if k < len(distances):
+            # Partial sort: O(n) to find the k best, then order just those
+            nearest = np.argpartition(distances, k - 1)[:k]
+            nearest = nearest[np.lexsort((nearest, distances[nearest]))]
+        else:
+            nearest = np.argsort(distances, kind="stable")
+        return [(float(distances[i]), self._items[i]) for i in nearest]
@@ -0,0 +1,186 @@
+"""
+Zip-code geography for local comparable searches.
+
+A bundled table (data/zip_centroids.csv) maps zip codes to approximate
+centroids for the metros we appraise in. GeoGridIndex buckets points into a
+fixed lat/lon grid, so a radius query only measures points in the handful
+of cells that overlap the search circle.
+"""
+
+import csv
+import math
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+DEFAULT_ZIP_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "data",
+    "zip_centroids.csv"
+)
+
+EARTH_RADIUS_MILES = 3958.8
+
+# Miles per degree of latitude (and of longitude at the equator)
+MILES_PER_DEGREE = 69.09
+
+
+def haversine_miles(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points, in miles."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    h = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(h))
+
+
+def haversine_miles_array(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Distances in miles from one point to arrays of points."""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    h = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def bounding_box(lat: float, lon: float, radius_miles: float) -> Tuple[float, float, float, float]:
+    """
+    Lat/lon box that contains every point within radius_miles.
+
+    Returns:
+        (min_lat, max_lat, min_lon, max_lon)
+    """
+    dlat = radius_miles / MILES_PER_DEGREE
+    dlon = radius_miles / (MILES_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+
+def load_zip_centroids(path: str = DEFAULT_ZIP_PATH) -> Dict[str, Tuple[float, float]]:
+    """
+    Load the bundled zip -> (lat, lon) table.
+
+    Args:
+        path: CSV with zip, lat and lon columns
+
+    Returns:
+        Centroids keyed by 5-digit zip code
+    """
+    with open(path, "r", newline="") as f:
+        return {
+            row["zip"].strip().zfill(5): (float(row["lat"]), float(row["lon"]))
+            for row in csv.DictReader(f)
+        }
+
+
+_zip_centroids: Optional[Dict[str, Tuple[float, float]]] = None
+_zip_centroids_lock = threading.Lock()
+
+
+def get_zip_centroids() -> Dict[str, Tuple[float, float]]:
+    """Return the bundled zip centroid table, loading it on first use."""
+    global _zip_centroids
+    if _zip_centroids is None:
+        with _zip_centroids_lock:
+            if _zip_centroids is None:
+                _zip_centroids = load_zip_centroids()
+    return _zip_centroids
+
+
+def zip_location(zip_code: Any) -> Optional[Tuple[float, float]]:
+    """
+    Look up a zip code's centroid.
+
+    Args:
+        zip_code: 5-digit zip (ZIP+4 and integers are accepted)
+
+    Returns:
+        (lat, lon), or None if the zip isn't in the table
+    """
+    if zip_code is None:
+        return None
+    key = str(zip_code).strip().split("-")[0].zfill(5)
+    return get_zip_centroids().get(key)
+
+
+class GeoGridIndex:
+    """
+    Fixed-grid spatial index over (lat, lon) points.
+
+    Points are bucketed into cells of cell_degrees on a side. A radius query
+    visits only the cells overlapping the circle's bounding box and measures
+    exact distances for the points in them with one vectorized haversine.
+    """
+
+    def __init__(self, points: Iterable[Tuple[Any, float, float]], cell_degrees: float = 0.1):
+        """
+        Args:
+            points: (item, lat, lon) triples; item is returned by queries
+            cell_degrees: Grid cell size (0.1 degrees is ~7 miles)
+        """
+        self.cell_degrees = cell_degrees
+        self._items: List[Any] = []
+        lats: List[float] = []
+        lons: List[float] = []
+        cells: Dict[Tuple[int, int], List[int]] = {}
+
+        for item, lat, lon in points:
+            cells.setdefault(self._cell(lat, lon), []).append(len(self._items))
+            self._items.append(item)
+            lats.append(lat)
+            lons.append(lon)
+
+        self._lats = np.array(lats, dtype=np.float64)
+        self._lons = np.array(lons, dtype=np.float64)
+        self._cells = {cell: np.array(ids, dtype=np.int64) for cell, ids in cells.items()}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees)
+
+    def query_radius(self, lat: float, lon: float, radius_miles: float) -> List[Tuple[float, Any]]:
+        """
+        Find every point within radius_miles, nearest first.
+
+        Args:
+            lat: Search center latitude
+            lon: Search center longitude
+            radius_miles: Search radius
+
+        Returns:
+            (distance_miles, item) pairs sorted by distance
+        """
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_miles)
+        low = self._cell(min_lat, min_lon)
+        high = self._cell(max_lat, max_lon)
+
+        span = (high[0] - low[0] + 1) * (high[1] - low[1] + 1)
+        if span <= len(self._cells):
+            candidates = [
+                self._cells[(i, j)]
+                for i in range(low[0], high[0] + 1)
+                for j in range(low[1], high[1] + 1)
+                if (i, j) in self._cells
+            ]
+        else:
+            # Wide searches over a sparse grid: walk the occupied cells instead
+            candidates = [
+                ids for (i, j), ids in self._cells.items()
+                if low[0] <= i <= high[0] and low[1] <= j <= high[1]
+            ]
+        if not candidates:
+            return []
+
+        ids = np.concatenate(candidates)
+        distances = haversine_miles_array(lat, lon, self._lats[ids], self._lons[ids])
+        inside = distances <= radius_miles
+        ids, distances = ids[inside], distances[inside]
+        order = np.argsort(distances, kind="stable")
+        return [(float(distances[k]), self._items[ids[k]]) for k in order]
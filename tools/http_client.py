@@ -0,0 +1,560 @@
+"""
+Pooled, resilient HTTP client for third-party API calls.
+
+Wraps a keep-alive requests.Session with bounded retries (full-jitter
+exponential backoff), a per-call deadline that caps the total time spent
+across all attempts, and a circuit breaker that fails fast while an
+upstream is degraded instead of stalling every caller on timeouts.
+
+AsyncResilientSession applies the same policy on httpx.AsyncClient for
+callers running inside an event loop (e.g. ADK tools), and can share a
+breaker with the synchronous session.
+
+A 429 is retried after the upstream's Retry-After (when it sends one) and
+is not counted toward opening the breaker: throttling means the upstream
+is up and asking for less traffic, not that it is failing.
+"""
+
+import asyncio
+import email.utils
+import random
+import threading
+import time
+import weakref
+from typing import Dict, Any, Mapping, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Responses worth retrying: throttling and transient upstream failures
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Throttling: retried after Retry-After, not counted as an upstream failure
+THROTTLED_STATUS = 429
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Seconds to wait according to a response's Retry-After header.
+
+    Returns:
+        The delay (0 for a date in the past), or None when the header is
+        missing or unreadable
+    """
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without a network call while the circuit breaker is open."""
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """Raised when retries run out of time before the call's deadline."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed -> open after `failure_threshold` consecutive failures.
+    open -> half_open once `reset_timeout` seconds have passed; one probe
+    call is let through. A successful probe closes the breaker, a failed
+    one re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold: Consecutive failures that open the breaker.
+            reset_timeout: Seconds to stay open before allowing a probe.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._times_opened = 0
+        self._rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = "half_open"
+            self._probe_in_flight = False
+        return self._state
+
+    def allow(self) -> bool:
+        """Return True if a call may go out now."""
+        return self.admit() is not None
+
+    def admit(self) -> Optional[bool]:
+        """
+        Let a call go out if one may go out now.
+
+        Returns:
+            None if the call is rejected, otherwise whether it holds the
+            half-open probe (pass that to release())
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == "closed":
+                return False
+            if state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self._rejected += 1
+            return None
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                if self._state != "open":
+                    self._times_opened += 1
+                self._state = "open"
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def release(self, probe: bool = True) -> None:
+        """
+        Give back an allowed call that ended without a verdict on upstream health.
+
+        Args:
+            probe: Whether the call holds the half-open probe (see admit());
+                other calls leave the probe to its holder
+        """
+        if not probe:
+            return
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "consecutive_failures": self._failures,
+                "times_opened": self._times_opened,
+                "rejected_calls": self._rejected
+            }
+
+
+class ResilientSession:
+    """
+    Keep-alive session with retries, deadlines and a circuit breaker.
+
+    Safe to share across threads; one instance per upstream API.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 20,
+        max_retries: int = 2,
+        backoff_base: float = 0.2,
+        backoff_max: float = 2.0,
+        attempt_timeout: float = 5.0,
+        deadline: float = 10.0,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        """
+        Args:
+            pool_size: Max keep-alive connections per host.
+            max_retries: Retries after the first attempt.
+            backoff_base: Backoff ceiling for the first retry, doubled per retry.
+            backoff_max: Upper bound on any single backoff sleep.
+            attempt_timeout: Connect/read timeout for a single attempt.
+            deadline: Default total time budget per call, across all attempts.
+            breaker: Circuit breaker to use (a default one is created if omitted).
+        """
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        # Retries are handled here, not by urllib3, so they respect the deadline
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+
+        self._lock = threading.Lock()
+        self._counters = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "failures": 0,
+            "deadline_exceeded": 0,
+            "circuit_rejections": 0,
+            "throttled": 0
+        }
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def _backoff(self, retry: int) -> float:
+        """Full-jitter backoff: uniform between 0 and the capped exponential."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** retry)))
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        deadline: Optional[float] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        **kwargs: Any
+    ) -> requests.Response:
+        """
+        Send a request with retries inside a deadline.
+
+        Args:
+            method: HTTP method
+            url: Request URL
+            deadline: Total seconds allowed for this call (defaults to the session's)
+            breaker: Circuit breaker of the upstream this call goes to (defaults
+                to the session's), so one pool can serve several upstreams
+            **kwargs: Passed through to requests.Session.request
+
+        Returns:
+            The final response (non-retryable statuses are returned as-is)
+
+        Raises:
+            CircuitOpenError: The breaker is open; no request was sent.
+            DeadlineExceeded: Time ran out before a successful attempt.
+            requests.exceptions.RequestException: The last attempt's error.
+        """
+        self._count("calls")
+        budget = self.deadline if deadline is None else deadline
+        expires_at = time.monotonic() + budget
+        last_error: Optional[Exception] = None
+        breaker = breaker or self.breaker
+
+        for attempt in range(self.max_retries + 1):
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                break
+
+            probe = breaker.admit()
+            if probe is None:
+                self._count("circuit_rejections")
+                raise CircuitOpenError(f"Circuit breaker open for {url}")
+
+            if attempt > 0:
+                self._count("retries")
+            self._count("attempts")
+
+            throttled, retry_after = False, None
+            try:
+                response = self.session.request(
+                    method,
+                    url,
+                    timeout=min(self.attempt_timeout, remaining),
+                    **kwargs
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                last_error = e
+            except BaseException:
+                # A bad URL, a broken body or an interrupt says nothing about
+                # upstream health, but a half-open probe must not stay taken
+                breaker.release(probe)
+                raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                last_error = requests.exceptions.HTTPError(
+                    f"{response.status_code} Server Error for url: {url}",
+                    response=response
+                )
+                if response.status_code == THROTTLED_STATUS:
+                    throttled, retry_after = True, retry_after_seconds(response.headers)
+                response.close()
+
+            self._count("failures")
+            if throttled:
+                # The upstream is up and asking for less traffic, not failing
+                self._count("throttled")
+                breaker.release(probe)
+            else:
+                breaker.record_failure()
+
+            if attempt < self.max_retries:
+                remaining = expires_at - time.monotonic()
+                if retry_after is not None and retry_after >= remaining:
+                    # Asked to wait past the deadline: give up now
+                    break
+                sleep_for = min(self._backoff(attempt) if retry_after is None else retry_after, remaining)
+                if sleep_for > 0:
+                    time.sleep(sleep_for)
+
+        if last_error is None:
+            # The deadline was spent before the first attempt went out
+            self._count("deadline_exceeded")
+            raise DeadlineExceeded(f"Deadline of {budget:.1f}s exceeded before any attempt for {url}")
+        if time.monotonic() >= expires_at:
+            self._count("deadline_exceeded")
+            raise DeadlineExceeded(f"Deadline of {budget:.1f}s exceeded for {url}") from last_error
+        raise last_error
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Report call counters, connection reuse and breaker state.
+
+        Returns:
+            Dictionary with call/attempt/retry counters, connections opened
+            vs. reused from the keep-alive pool, and circuit breaker stats
+        """
+        opened = 0
+        pooled_requests = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                pooled_requests += pool.num_requests
+
+        with self._lock:
+            counters = dict(self._counters)
+
+        return {
+            **counters,
+            "connections_opened": opened,
+            "connections_reused": max(0, pooled_requests - opened),
+            "breaker": self.breaker.stats()
+        }
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncResilientSession:
+    """
+    Async counterpart of ResilientSession built on httpx.AsyncClient.
+
+    An httpx client is bound to the event loop it was created in, so one
+    pooled client is kept per running loop.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 20,
+        max_retries: int = 2,
+        backoff_base: float = 0.2,
+        backoff_max: float = 2.0,
+        attempt_timeout: float = 5.0,
+        deadline: float = 10.0,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        """
+        Args:
+            pool_size: Max keep-alive connections per event loop.
+            max_retries: Retries after the first attempt.
+            backoff_base: Backoff ceiling for the first retry, doubled per retry.
+            backoff_max: Upper bound on any single backoff sleep.
+            attempt_timeout: Connect/read timeout for a single attempt.
+            deadline: Default total time budget per call, across all attempts.
+            breaker: Circuit breaker to use (share one with ResilientSession
+                to get a single view of upstream health).
+        """
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker()
+
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+        self._counters = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "failures": 0,
+            "deadline_exceeded": 0,
+            "circuit_rejections": 0,
+            "throttled": 0
+        }
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size
+                )
+            )
+            self._clients[loop] = client
+        return client
+
+    def _backoff(self, retry: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** retry)))
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        deadline: Optional[float] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        **kwargs: Any
+    ) -> httpx.Response:
+        """
+        Send a request with retries inside a deadline, without blocking the loop.
+
+        Args:
+            method: HTTP method
+            url: Request URL
+            deadline: Total seconds allowed for this call (defaults to the session's)
+            breaker: Circuit breaker of the upstream this call goes to (defaults
+                to the session's), so one pool can serve several upstreams
+            **kwargs: Passed through to httpx.AsyncClient.request
+
+        Returns:
+            The final response (non-retryable statuses are returned as-is)
+
+        Raises:
+            CircuitOpenError: The breaker is open; no request was sent.
+            DeadlineExceeded: Time ran out before a successful attempt.
+            asyncio.TimeoutError: The deadline was spent before any attempt.
+            httpx.HTTPError: The last attempt's error.
+        """
+        self._count("calls")
+        budget = self.deadline if deadline is None else deadline
+        expires_at = time.monotonic() + budget
+        last_error: Optional[Exception] = None
+        breaker = breaker or self.breaker
+        client = self._client()
+
+        for attempt in range(self.max_retries + 1):
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                break
+
+            probe = breaker.admit()
+            if probe is None:
+                self._count("circuit_rejections")
+                raise CircuitOpenError(f"Circuit breaker open for {url}")
+
+            if attempt > 0:
+                self._count("retries")
+            self._count("attempts")
+
+            throttled, retry_after = False, None
+            try:
+                response = await asyncio.wait_for(
+                    client.request(method, url, timeout=self.attempt_timeout, **kwargs),
+                    timeout=remaining
+                )
+            except (httpx.TransportError, asyncio.TimeoutError) as e:
+                last_error = e
+            except BaseException:
+                # Cancellation, decode errors and redirect loops are not a
+                # verdict on upstream health; free a half-open probe regardless
+                breaker.release(probe)
+                raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                last_error = httpx.HTTPStatusError(
+                    f"{response.status_code} Server Error for url: {url}",
+                    request=response.request,
+                    response=response
+                )
+                if response.status_code == THROTTLED_STATUS:
+                    throttled, retry_after = True, retry_after_seconds(response.headers)
+
+            self._count("failures")
+            if throttled:
+                # The upstream is up and asking for less traffic, not failing
+                self._count("throttled")
+                breaker.release(probe)
+            else:
+                breaker.record_failure()
+
+            if attempt < self.max_retries:
+                remaining = expires_at - time.monotonic()
+                if retry_after is not None and retry_after >= remaining:
+                    # Asked to wait past the deadline: give up now
+                    break
+                sleep_for = min(self._backoff(attempt) if retry_after is None else retry_after, remaining)
+                if sleep_for > 0:
+                    await asyncio.sleep(sleep_for)
+
+        if last_error is None:
+            # The deadline was spent before the first attempt went out
+            self._count("deadline_exceeded")
+            raise asyncio.TimeoutError(f"Deadline of {budget:.1f}s exceeded before any attempt for {url}")
+        if time.monotonic() >= expires_at:
+            self._count("deadline_exceeded")
+            raise DeadlineExceeded(f"Deadline of {budget:.1f}s exceeded for {url}") from last_error
+        raise last_error
+
+    async def get(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Report call counters and breaker state.
+
+        Returns:
+            Dictionary with call/attempt/retry counters, open event-loop
+            clients and circuit breaker stats
+        """
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            **counters,
+            "loop_clients": len(self._clients),
+            "breaker": self.breaker.stats()
+        }
+
+    async def aclose(self) -> None:
+        """Close the client bound to the running event loop."""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
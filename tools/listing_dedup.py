@@ -0,0 +1,252 @@
+"""
+Cross-source listing deduplication.
+
+The same car is often listed on CarGurus and AutoTrader at once. Counted
+twice it inflates total_comparables, pulls avg_price towards that car and
+repeats it in every response. ListingDedupIndex collapses such duplicates
+as listings are added:
+    - Listings with the same comparable_vin are the same car (a dict hit).
+    - Listings without a VIN (or matched against one without) fall back to
+      a fuzzy key: the same dealer, with price and mileage within
+      PRICE_TOLERANCE and MILEAGE_TOLERANCE. Prices and mileages are
+      bucketed by those tolerances, so a lookup probes the 3x3
+      neighbouring buckets instead of scanning the dealer's stock.
+    - Two listings with different VINs are never merged, however alike.
+
+The first listing of each car is kept (callers add nearest first) and
+tagged with also_listed_on, the other sources it was seen on.
+
+The index keeps every listing it has seen, so it suits one response's
+comparables, not a whole market. SeenVins remembers VINs across a whole
+market in fixed memory (a Bloom filter), at the cost of a small share of
+never-seen VINs reported as seen.
+"""
+
+import hashlib
+import math
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from tools.vin_check import normalize_vin
+
+
+# Listings from the same dealer this close in price and mileage are one car
+PRICE_TOLERANCE = 250
+MILEAGE_TOLERANCE = 500
+
+# SeenVins sizing: VINs it is built for, and the false-positive rate at that many
+SEEN_VINS_CAPACITY = 1_000_000
+SEEN_VINS_ERROR_RATE = 0.001
+
+
+@lru_cache(maxsize=65536)
+def normalize_dealer(name: Any) -> Optional[str]:
+    """Dealer name reduced to lowercase letters and digits, or None if blank."""
+    if name is None:
+        return None
+    key = "".join(ch for ch in str(name).lower() if ch.isalnum())
+    return key or None
+
+
+class ListingDedupIndex:
+    """
+    Incremental index that groups listings of the same car.
+
+    Each group of duplicates is a cluster, numbered in the order its first
+    listing was added.
+    """
+
+    def __init__(self, price_tolerance: float = PRICE_TOLERANCE, mileage_tolerance: float = MILEAGE_TOLERANCE):
+        """
+        Args:
+            price_tolerance: Max price difference for a fuzzy match
+            mileage_tolerance: Max mileage difference for a fuzzy match
+        """
+        if price_tolerance <= 0 or mileage_tolerance <= 0:
+            raise ValueError("Dedup tolerances must be positive")
+        self.price_tolerance = price_tolerance
+        self.mileage_tolerance = mileage_tolerance
+        self.duplicates = 0
+        self._by_vin: Dict[str, int] = {}
+        # (dealer, price bucket, mileage bucket) -> [(cluster, price, mileage)]
+        self._by_dealer: Dict[Tuple[str, int, int], List[Tuple[int, float, float]]] = {}
+        # The same, for listings added without a VIN: the only candidates
+        # for a listing that has one, so big dealers aren't rescanned
+        self._by_dealer_unvinned: Dict[Tuple[str, int, int], List[Tuple[int, float, float]]] = {}
+        self._listings: List[Mapping[str, Any]] = []
+        # VIN of each cluster (one at most: a listing with a VIN only joins
+        # a cluster by fuzzy match if the cluster has none)
+        self._vins: List[Optional[str]] = []
+        # Sources of clusters seen on more than one listing
+        self._sources: Dict[int, List[str]] = {}
+
+    def _fuzzy_key(self, listing: Mapping[str, Any]) -> Optional[Tuple[str, int, int]]:
+        dealer = normalize_dealer(listing.get("dealer_name"))
+        price, mileage = listing.get("price"), listing.get("mileage")
+        if dealer is None or price is None or mileage is None:
+            return None
+        return dealer, int(price // self.price_tolerance), int(mileage // self.mileage_tolerance)
+
+    def find(self, listing: Mapping[str, Any]) -> Optional[int]:
+        """
+        Return the cluster of an already added listing of the same car.
+
+        Returns:
+            Cluster number, or None if the listing is a new car
+        """
+        vin = normalize_vin(listing.get("comparable_vin")) or None
+        return self._find(listing, vin, self._fuzzy_key(listing))
+
+    def _find(self, listing: Mapping[str, Any], vin: Optional[str], key: Optional[Tuple[str, int, int]]) -> Optional[int]:
+        if vin is not None and vin in self._by_vin:
+            return self._by_vin[vin]
+
+        buckets = self._by_dealer if vin is None else self._by_dealer_unvinned
+        if key is None or not buckets:
+            return None
+        dealer, price_bucket, mileage_bucket = key
+        price, mileage = listing["price"], listing["mileage"]
+        for dp in (-1, 0, 1):
+            for dm in (-1, 0, 1):
+                for cluster, other_price, other_mileage in buckets.get((dealer, price_bucket + dp, mileage_bucket + dm), ()):
+                    if vin is not None and self._vins[cluster] is not None:
+                        # The cluster's VINs didn't match above: a different car
+                        continue
+                    if abs(price - other_price) <= self.price_tolerance and abs(mileage - other_mileage) <= self.mileage_tolerance:
+                        return cluster
+        return None
+
+    def add(self, listing: Mapping[str, Any]) -> Tuple[int, bool]:
+        """
+        Add a listing, merging it into a matching cluster if there is one.
+
+        Returns:
+            (cluster, is_new): is_new is False when the listing was a duplicate
+        """
+        vin = normalize_vin(listing.get("comparable_vin")) or None
+        key = self._fuzzy_key(listing)
+        cluster = self._find(listing, vin, key)
+        is_new = cluster is None
+        if is_new:
+            cluster = len(self._listings)
+            self._listings.append(listing)
+            self._vins.append(vin)
+        else:
+            self.duplicates += 1
+            sources = self._sources.setdefault(cluster, [])
+            for source in (self._listings[cluster].get("source"), listing.get("source")):
+                if source is not None and source not in sources:
+                    sources.append(source)
+            if vin is not None and self._vins[cluster] is None:
+                self._vins[cluster] = vin
+
+        if vin is not None:
+            self._by_vin.setdefault(vin, cluster)
+        if key is not None:
+            member = (cluster, listing["price"], listing["mileage"])
+            self._by_dealer.setdefault(key, []).append(member)
+            if vin is None:
+                self._by_dealer_unvinned.setdefault(key, []).append(member)
+        return cluster, is_new
+
+    def add_many(self, listings: Iterable[Mapping[str, Any]]) -> "ListingDedupIndex":
+        """Add listings in order. Returns self."""
+        for listing in listings:
+            self.add(listing)
+        return self
+
+    def listings(self) -> List[Mapping[str, Any]]:
+        """
+        One listing per car, in the order first added.
+
+        A listing also seen on other sources is returned as a copy with
+        also_listed_on set to those sources.
+        """
+        kept = list(self._listings)
+        for cluster, sources in self._sources.items():
+            listing = kept[cluster]
+            others = [source for source in sources if source != listing.get("source")]
+            if others:
+                kept[cluster] = {**listing, "also_listed_on": others}
+        return kept
+
+    def __len__(self) -> int:
+        return len(self._listings)
+
+
+class SeenVins:
+    """
+    Fixed-memory set of VINs (a Bloom filter).
+
+    Never forgets a VIN it was given; a VIN it was not given is reported
+    as seen with probability about error_rate while at most capacity VINs
+    have been added, and more often past that. Memory is about
+    1.44 * log2(1 / error_rate) bits per VIN of capacity (1.8 MB for the
+    defaults).
+    """
+
+    def __init__(self, capacity: int = SEEN_VINS_CAPACITY, error_rate: float = SEEN_VINS_ERROR_RATE):
+        """
+        Args:
+            capacity: Number of VINs the filter is sized for
+            error_rate: False-positive rate at capacity
+
+        Raises:
+            ValueError: If capacity isn't positive or error_rate isn't in (0, 1)
+        """
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError("SeenVins needs a positive capacity and an error rate between 0 and 1")
+        self.bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self._bitmap = np.zeros((self.bits + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, vin: str) -> np.ndarray:
+        # Double hashing: position i is h1 + i * h2 (Kirsch & Mitzenmacher)
+        digest = hashlib.blake2b(vin.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return np.array([(h1 + i * h2) % self.bits for i in range(self.hashes)], dtype=np.int64)
+
+    def add(self, vin: Any) -> bool:
+        """
+        Remember a VIN.
+
+        Returns:
+            True if it was (probably) not seen before; False for a blank VIN
+        """
+        vin = normalize_vin(vin)
+        if not vin:
+            return False
+        positions = self._positions(vin)
+        masks = (1 << (positions % 8)).astype(np.uint8)
+        seen = bool(np.all(self._bitmap[positions // 8] & masks))
+        np.bitwise_or.at(self._bitmap, positions // 8, masks)
+        return not seen
+
+    def __contains__(self, vin: Any) -> bool:
+        vin = normalize_vin(vin)
+        if not vin:
+            return False
+        positions = self._positions(vin)
+        return bool(np.all(self._bitmap[positions // 8] & (1 << (positions % 8)).astype(np.uint8)))
+
+
+def dedupe_listings(
+    listings: Iterable[Mapping[str, Any]],
+    price_tolerance: float = PRICE_TOLERANCE,
+    mileage_tolerance: float = MILEAGE_TOLERANCE
+) -> Tuple[List[Mapping[str, Any]], int]:
+    """
+    Collapse duplicate listings, keeping the first of each car.
+
+    Args:
+        listings: Comparable listings (comparable_vin, dealer_name, price, mileage, source)
+        price_tolerance: Max price difference for a fuzzy match
+        mileage_tolerance: Max mileage difference for a fuzzy match
+
+    Returns:
+        (one listing per car, number of duplicates removed)
+    """
+    index = ListingDedupIndex(price_tolerance, mileage_tolerance).add_many(listings)
+    return index.listings(), index.duplicates
@@ -0,0 +1,171 @@
+"""
+HTTP client for the market provider APIs.
+
+Talks to the stand-in server in tools/market_standin.py (or anything that
+serves the same endpoints) through the pooled, retrying clients in
+tools/http_client.py, and returns the same dictionaries as the in-process
+mocks in tools/api_mocks.py. http_providers() wraps it as MarketProviders
+for the concurrent fan-out in get_market_intelligence_async.
+
+Configuration (environment variables):
+    MARKET_PROVIDER_URL: Base URL of the provider APIs; when set, the
+                         market fan-out queries them over HTTP.
+    MARKET_PROVIDER_MAX_RETRIES: Retries per call after the first attempt (default: 1).
+    MARKET_PROVIDER_DEADLINE_SECONDS: Total time budget per call (default: 3).
+"""
+
+import os
+from typing import Any, Dict, List, Optional
+
+from tools.http_client import AsyncResilientSession, CircuitBreaker, ResilientSession
+from tools.market_providers import CallableProvider, MarketProvider, MarketRequest
+
+
+ENDPOINTS = {
+    "kbb": "/kbb/v1/instant-cash-offer",
+    "cargurus": "/cargurus/v1/listings",
+    "autotrader": "/autotrader/v1/listings"
+}
+
+
+def _params(request: MarketRequest) -> Dict[str, Any]:
+    params = {
+        "vin": request.vin,
+        "zip": request.zip_code,
+        "radius": request.radius_miles,
+        "make": request.make,
+        "model": request.model,
+        "year": request.year,
+        "trim": request.trim
+    }
+    return {key: value for key, value in params.items() if value is not None}
+
+
+class MarketHttpClient:
+    """
+    Sync and async access to the provider APIs.
+
+    404 answers (vehicle not found) come back as the API's
+    {"success": False, ...} body. Transport failures, 429s and 5xxs that
+    outlast the retries raise, so the fan-out reports the source as failed.
+
+    Both sessions share one connection pool per host but each provider has
+    its own circuit breaker, so one failing provider doesn't cut off the
+    others.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        session: Optional[ResilientSession] = None,
+        async_session: Optional[AsyncResilientSession] = None
+    ):
+        """
+        Args:
+            base_url: Provider API root, e.g. http://127.0.0.1:8765
+            session: Sync HTTP session (default: one built from MARKET_PROVIDER_*)
+            async_session: Async HTTP session (default: one sharing the sync
+                session's retry policy)
+        """
+        self.base_url = base_url.rstrip("/")
+        self.session = session or ResilientSession(
+            max_retries=int(os.getenv("MARKET_PROVIDER_MAX_RETRIES", "1")),
+            deadline=float(os.getenv("MARKET_PROVIDER_DEADLINE_SECONDS", "3"))
+        )
+        self.async_session = async_session or AsyncResilientSession(
+            max_retries=self.session.max_retries,
+            backoff_base=self.session.backoff_base,
+            backoff_max=self.session.backoff_max,
+            attempt_timeout=self.session.attempt_timeout,
+            deadline=self.session.deadline
+        )
+        # One breaker per provider, shared by the sync and async paths
+        self.breakers = {provider: CircuitBreaker() for provider in ENDPOINTS}
+
+    def _url(self, provider: str) -> str:
+        if provider not in ENDPOINTS:
+            raise ValueError(f"Unknown market provider: {provider}")
+        return f"{self.base_url}{ENDPOINTS[provider]}"
+
+    def fetch(self, provider: str, request: MarketRequest) -> Dict[str, Any]:
+        """
+        Query one provider.
+
+        Raises:
+            requests.RequestException: If the provider didn't answer usefully
+        """
+        response = self.session.get(
+            self._url(provider), params=_params(request), breaker=self.breakers[provider]
+        )
+        if response.status_code != 404:
+            response.raise_for_status()
+        return response.json()
+
+    async def fetch_async(self, provider: str, request: MarketRequest) -> Dict[str, Any]:
+        """
+        Query one provider without blocking the event loop.
+
+        Raises:
+            httpx.HTTPError: If the provider didn't answer usefully
+        """
+        response = await self.async_session.get(
+            self._url(provider), params=_params(request), breaker=self.breakers[provider]
+        )
+        if response.status_code != 404:
+            response.raise_for_status()
+        return response.json()
+
+    def kbb_instant_cash_offer(self, request: MarketRequest) -> Dict[str, Any]:
+        """Same result as api_mocks.get_kbb_instant_cash_offer, over HTTP."""
+        return self.fetch("kbb", request)
+
+    def listings(self, provider: str, request: MarketRequest) -> Dict[str, Any]:
+        """One listing site's comparables, shaped like api_mocks.get_cargurus_comparables."""
+        return self.fetch(provider, request)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Call and retry counters for both sessions, and each provider's breaker."""
+        return {
+            "sync": self.session.metrics(),
+            "async": self.async_session.metrics(),
+            "breakers": {provider: breaker.stats() for provider, breaker in self.breakers.items()}
+        }
+
+
+def http_providers(
+    client: MarketHttpClient,
+    timeout: Optional[float] = None,
+    required: bool = True
+) -> List[MarketProvider]:
+    """
+    KBB, CarGurus and AutoTrader as fan-out providers over HTTP.
+
+    Args:
+        client: Client for the provider APIs
+        timeout: Per-source timeout (default: MARKET_SOURCE_TIMEOUT_SECONDS)
+        required: Whether the fan-out waits for these sources
+    """
+    def provider(name: str) -> MarketProvider:
+        async def fetch(request: MarketRequest) -> Dict[str, Any]:
+            return await client.fetch_async(name, request)
+        return CallableProvider(name, fetch, timeout=timeout, required=required)
+
+    return [provider(name) for name in ENDPOINTS]
+
+
+_default_client: Optional[MarketHttpClient] = None
+
+
+def get_market_http_client() -> Optional[MarketHttpClient]:
+    """
+    Return the client for MARKET_PROVIDER_URL, or None when it isn't set.
+
+    The client is rebuilt if MARKET_PROVIDER_URL changes.
+    """
+    global _default_client
+    base_url = os.getenv("MARKET_PROVIDER_URL")
+    if not base_url:
+        return None
+    if _default_client is None or _default_client.base_url != base_url.rstrip("/"):
+        _default_client = MarketHttpClient(base_url)
+    return _default_client
@@ -0,0 +1,694 @@
+"""
+Columnar, memory-mapped market store.
+
+mock_market_comps.json is parsed whole into Python dicts, so startup time
+and resident memory grow with every listing. This store keeps the same data
+as a directory of NumPy .npy columns that are memory-mapped when it opens:
+nothing is read until a query touches it, and the pages a query touches are
+shared with every other process serving the same files.
+
+Layout (one row per listing, grouped by vehicle, vehicles sorted by
+(make, model, year, trim, region) segment):
+    price, mileage, distance_miles, days_listed: float64, NaN when missing
+    source, comparable_vin, listing_url, dealer_name, dealer_zip: int32
+        codes into the string dictionary, -1 when missing
+    lat, lon: dealer location (float64, NaN when the zip is unknown)
+    vehicle: row of the market entry the listing is recorded under
+    first_listing: True for the first listing of each car (see
+        tools/listing_dedup.py), so statistics count a car once
+Segment table (one row per segment): segment_make, segment_model,
+segment_trim and segment_region codes, segment_year, and CSR-style
+segment_listings / segment_vehicles offsets. Vehicle table: vehicle_listings
+offsets, each entry's other fields as a JSON document in vehicles.bin, and a
+sorted VIN index for binary search. Strings live once each in strings.bin.
+
+Because a segment's listings are contiguous, segment_columns() hands out
+views of the mapped columns (no copy), and ragged() gives the whole price
+column with segment offsets in the form tools/outliers.py filters in one
+batch. PriceModel.from_columns fits tools/price_model.py straight from the
+columns and comparable_index() feeds tools/comp_similarity.py.
+
+Only the segment table (one row per segment, not per listing) is decoded
+when the store opens. The store answers the same queries as
+JsonMarketBackend and SqliteMarketStore. It is built offline and replaced
+whole; build or refresh one from the JSON file with:
+    python tools/market_columns.py data/mock_market_comps.json .cache/market_columns
+"""
+
+import json
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Allow running as a script from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.comp_similarity import ComparableIndex
+from tools.geo import haversine_miles_array, zip_location
+from tools.listing_dedup import ListingDedupIndex
+from tools.market_store import DEFAULT_REGION, FrozenDict, entry_region, freeze, locate_comparable, segment_key
+from tools.quantile_sketch import PRICE_BANDS
+
+
+DEFAULT_MARKET_COLUMNS_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ".cache",
+    "market_columns"
+)
+
+# Bump when the layout changes so old stores are rebuilt
+FORMAT_VERSION = 1
+
+NUMERIC_FIELDS = ("price", "mileage", "distance_miles", "days_listed")
+STRING_FIELDS = ("source", "comparable_vin", "listing_url", "dealer_name", "dealer_zip")
+
+# Listing fields stored, in the order listings are returned
+LISTING_FIELDS = (
+    "source", "comparable_vin", "price", "mileage", "distance_miles",
+    "days_listed", "listing_url", "dealer_name", "dealer_zip"
+)
+
+LISTING_COLUMNS = NUMERIC_FIELDS + STRING_FIELDS + ("lat", "lon", "vehicle", "first_listing")
+SEGMENT_COLUMNS = (
+    "segment_make", "segment_model", "segment_year", "segment_trim", "segment_region",
+    "segment_listings", "segment_vehicles"
+)
+VEHICLE_COLUMNS = ("vehicle_listings", "vehicle_offsets", "vin_index", "vin_rows")
+
+META_FILE = "meta.json"
+STRINGS_FILE = "strings.bin"
+VEHICLES_FILE = "vehicles.bin"
+
+
+class _StringTable:
+    """String dictionary built while writing: one code per distinct string."""
+
+    def __init__(self):
+        self._codes: Dict[str, int] = {}
+
+    def code(self, value: Any) -> int:
+        if value is None:
+            return -1
+        return self._codes.setdefault(str(value), len(self._codes))
+
+    def write(self, directory: str) -> np.ndarray:
+        """Write strings.bin and return the string offsets."""
+        encoded = [value.encode("utf-8") for value in self._codes]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        with open(os.path.join(directory, STRINGS_FILE), "wb") as f:
+            f.write(b"".join(encoded))
+        return offsets
+
+
+def _offsets(counts: Sequence[int]) -> np.ndarray:
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def _float(value: Any) -> float:
+    return np.nan if value is None else float(value)
+
+
+def write_market_columns(
+    entries: Mapping[str, Mapping[str, Any]],
+    directory: str,
+    default_region: str = DEFAULT_REGION
+) -> Dict[str, int]:
+    """
+    Write market entries shaped like mock_market_comps.json as a columnar store.
+
+    The store is written next to directory and swapped in with renames, so
+    a reader never opens a half-written store. Processes that already have
+    the old one open keep reading it until they reopen.
+
+    Args:
+        entries: Market entries keyed by VIN
+        directory: Store location (replaced if it exists)
+        default_region: Region for entries without regional_data
+
+    Returns:
+        Dictionary with vehicle, comparable and segment counts
+    """
+    vehicles = []
+    for vin, entry in entries.items():
+        info = entry["vehicle_info"]
+        make, model, year, trim = segment_key(info["make"], info["model"], info["year"], info.get("trim"))
+        vehicles.append(((make, model, year, trim or "", entry_region(entry, default_region)), vin, entry))
+    vehicles.sort(key=lambda vehicle: vehicle[0])
+
+    strings = _StringTable()
+    listings: Dict[str, list] = {name: [] for name in LISTING_COLUMNS}
+    segments: Dict[str, list] = {name: [] for name in SEGMENT_COLUMNS}
+    vehicle_counts, payloads = [], []
+    seen = ListingDedupIndex()
+    previous = None
+    for row, (key, vin, entry) in enumerate(vehicles):
+        if key != previous:
+            make, model, year, trim, region = key
+            segments["segment_make"].append(strings.code(make))
+            segments["segment_model"].append(strings.code(model))
+            segments["segment_year"].append(year)
+            segments["segment_trim"].append(strings.code(trim or None))
+            segments["segment_region"].append(strings.code(region))
+            segments["segment_listings"].append(0)
+            segments["segment_vehicles"].append(0)
+            previous = key
+
+        comparables = entry.get("comparables", [])
+        for comp in comparables:
+            for field in NUMERIC_FIELDS:
+                listings[field].append(_float(comp.get(field)))
+            for field in STRING_FIELDS:
+                listings[field].append(strings.code(comp.get(field)))
+            lat, lon = zip_location(comp.get("dealer_zip")) or (np.nan, np.nan)
+            listings["lat"].append(lat)
+            listings["lon"].append(lon)
+            listings["vehicle"].append(row)
+            listings["first_listing"].append(seen.add(comp)[1])
+        segments["segment_listings"][-1] += len(comparables)
+        segments["segment_vehicles"][-1] += 1
+        vehicle_counts.append(len(comparables))
+        # Placeholder keeps the entry's key order when comparables are put back
+        payloads.append(json.dumps(
+            {name: ([] if name == "comparables" else value) for name, value in entry.items()}
+        ).encode("utf-8"))
+
+    vins = np.array([vin.encode("utf-8") for _, vin, _ in vehicles] if vehicles else [], dtype=bytes)
+    order = np.argsort(vins, kind="stable")
+    arrays = {
+        **{field: np.array(listings[field], dtype=np.float64) for field in NUMERIC_FIELDS + ("lat", "lon")},
+        **{field: np.array(listings[field], dtype=np.int32) for field in STRING_FIELDS + ("vehicle",)},
+        "first_listing": np.array(listings["first_listing"], dtype=bool),
+        **{name: np.array(segments[name], dtype=np.int32) for name in SEGMENT_COLUMNS[:5]},
+        "segment_listings": _offsets(segments["segment_listings"]),
+        "segment_vehicles": _offsets(segments["segment_vehicles"]),
+        "vehicle_listings": _offsets(vehicle_counts),
+        "vehicle_offsets": _offsets([len(payload) for payload in payloads]),
+        "vin_index": vins[order],
+        "vin_rows": order.astype(np.int32)
+    }
+
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".market_columns-", dir=parent)
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(staging, f"{name}.npy"), array)
+        arrays["string_offsets"] = strings.write(staging)
+        np.save(os.path.join(staging, "string_offsets.npy"), arrays["string_offsets"])
+        with open(os.path.join(staging, VEHICLES_FILE), "wb") as f:
+            f.write(b"".join(payloads))
+        counts = {
+            "vehicles": len(vehicles),
+            "comparables": len(arrays["price"]),
+            "segments": len(arrays["segment_year"])
+        }
+        # Written last: a directory without meta.json is incomplete
+        with open(os.path.join(staging, META_FILE), "w") as f:
+            json.dump({"format": FORMAT_VERSION, **counts}, f)
+
+        if os.path.exists(directory):
+            retired = staging + ".old"
+            os.rename(directory, retired)
+            os.rename(staging, directory)
+            shutil.rmtree(retired, ignore_errors=True)
+        else:
+            os.rename(staging, directory)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return counts
+
+
+def _map_bytes(path: str) -> Any:
+    """Read-only mapping of a whole file (empty bytes for an empty file)."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _number(value: float) -> Any:
+    """A stored float as JSON had it: None for NaN, int when whole."""
+    if np.isnan(value):
+        return None
+    return int(value) if value.is_integer() else float(value)
+
+
+class ColumnarMarketStore:
+    """
+    Market backend over memory-mapped column files.
+
+    Answers the same queries as JsonMarketBackend (get_vehicle,
+    find_vehicles, find_comparables) and returns the same read-only
+    shapes, and serves segments as column slices for vectorized code.
+    """
+
+    def __init__(self, path: str = DEFAULT_MARKET_COLUMNS_PATH):
+        """
+        Args:
+            path: Store directory written by write_market_columns
+
+        Raises:
+            OSError: If the store is missing or incomplete
+            ValueError: If it was written in another format version
+        """
+        self.path = path
+        with open(os.path.join(path, META_FILE), "r") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Columnar market store {path} has format {self.meta.get('format')}, expected {FORMAT_VERSION}")
+
+        self._columns: Dict[str, np.ndarray] = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in LISTING_COLUMNS + SEGMENT_COLUMNS + VEHICLE_COLUMNS + ("string_offsets",)
+        }
+        self._strings = _map_bytes(os.path.join(path, STRINGS_FILE))
+        self._payloads = _map_bytes(os.path.join(path, VEHICLES_FILE))
+
+        # The segment table is small (one row per segment): decode it now
+        columns = self._columns
+        self._segment_make = [self.string(code) for code in columns["segment_make"]]
+        self._segment_model = [self.string(code) for code in columns["segment_model"]]
+        self._segment_trim = [self.string(code) for code in columns["segment_trim"]]
+        self._segment_region = [self.string(code) for code in columns["segment_region"]]
+        # (make, model, year) -> range of segment rows (sorted, so contiguous)
+        self._segment_ranges: Dict[Tuple[str, str, int], Tuple[int, int]] = {}
+        for segment, year in enumerate(columns["segment_year"].tolist()):
+            key = (self._segment_make[segment], self._segment_model[segment], year)
+            first, _ = self._segment_ranges.get(key, (segment, segment))
+            self._segment_ranges[key] = (first, segment + 1)
+
+    def string(self, code: int) -> Optional[str]:
+        """Decode a string dictionary code (None for -1)."""
+        if code < 0:
+            return None
+        offsets = self._columns["string_offsets"]
+        return self._strings[offsets[code]:offsets[code + 1]].decode("utf-8")
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        A whole listing column, memory-mapped and read-only.
+
+        Raises:
+            KeyError: For an unknown column
+        """
+        if name not in LISTING_COLUMNS:
+            raise KeyError(f"Unknown listing column: {name}")
+        return self._columns[name]
+
+    def segments(self) -> Dict[str, Any]:
+        """
+        The segment table.
+
+        Returns:
+            Dictionary with make, model, trim and region (lists of
+            normalized strings, trim None when unknown), year, and
+            listings / vehicles offsets (segment i owns listing rows
+            listings[i]:listings[i + 1])
+        """
+        return {
+            "make": self._segment_make,
+            "model": self._segment_model,
+            "year": self._columns["segment_year"],
+            "trim": self._segment_trim,
+            "region": self._segment_region,
+            "listings": self._columns["segment_listings"],
+            "vehicles": self._columns["segment_vehicles"]
+        }
+
+    def ragged(self, field: str = "price") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        A listing column with segment offsets, for tools/outliers.py.
+
+        Both arrays are the mapped files themselves: filtering every
+        segment's prices copies nothing in.
+        """
+        return self.column(field), self._columns["segment_listings"]
+
+    def _matching_segments(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str] = None,
+        region: Optional[str] = None
+    ) -> List[int]:
+        make_key, model_key, year_key, trim_key = segment_key(make, model, year, trim)
+        first, stop = self._segment_ranges.get((make_key, model_key, year_key), (0, 0))
+        return [
+            segment for segment in range(first, stop)
+            if (trim_key is None or self._segment_trim[segment] == trim_key)
+            and (region is None or self._segment_region[segment] == region)
+        ]
+
+    def segment_slices(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str] = None,
+        region: Optional[str] = None
+    ) -> List[slice]:
+        """
+        Listing rows of a segment, as slices.
+
+        A (make, model, year) segment, optionally narrowed by trim, or by
+        trim and region, is one slice; narrowing by region alone can give
+        one slice per trim.
+        """
+        offsets = self._columns["segment_listings"]
+        slices: List[slice] = []
+        for segment in self._matching_segments(make, model, year, trim, region):
+            start, stop = int(offsets[segment]), int(offsets[segment + 1])
+            if slices and slices[-1].stop == start:
+                slices[-1] = slice(slices[-1].start, stop)
+            else:
+                slices.append(slice(start, stop))
+        return slices
+
+    def _rows(self, slices: List[slice]) -> np.ndarray:
+        if not slices:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.arange(s.start, s.stop) for s in slices])
+
+    def segment_columns(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str] = None,
+        region: Optional[str] = None,
+        fields: Iterable[str] = NUMERIC_FIELDS
+    ) -> Dict[str, np.ndarray]:
+        """
+        A segment's listing columns.
+
+        Args:
+            make: Vehicle make
+            model: Vehicle model
+            year: Model year
+            trim: Also match trim (None matches any)
+            region: Also match region (None matches any)
+            fields: Listing columns to return
+
+        Returns:
+            Column name -> values. When the segment is one slice (see
+            segment_slices) these are read-only views of the mapped files.
+        """
+        slices = self.segment_slices(make, model, year, trim, region)
+        if len(slices) == 1:
+            return {field: self.column(field)[slices[0]] for field in fields}
+        return {field: self.column(field)[self._rows(slices)] for field in fields}
+
+    def _listing(self, row: int) -> Dict[str, Any]:
+        columns = self._columns
+        listing = {}
+        for field in LISTING_FIELDS:
+            if field in NUMERIC_FIELDS:
+                value = _number(float(columns[field][row]))
+            else:
+                value = self.string(int(columns[field][row]))
+            if value is not None:
+                listing[field] = value
+        return listing
+
+    def listing(self, row: int) -> FrozenDict:
+        """Materialize one listing row as a read-only dict."""
+        return FrozenDict(self._listing(row))
+
+    def _vehicle(self, row: int) -> FrozenDict:
+        offsets = self._columns["vehicle_offsets"]
+        entry = json.loads(self._payloads[offsets[row]:offsets[row + 1]])
+        if "comparables" in entry:
+            listings = self._columns["vehicle_listings"]
+            entry["comparables"] = [self._listing(i) for i in range(int(listings[row]), int(listings[row + 1]))]
+        return freeze(entry)
+
+    def entries(self) -> Iterator[FrozenDict]:
+        """
+        Every market entry in row order, materialized one at a time.
+
+        For structures seeded from whole entries (the running market
+        summaries); price bands and the price model read the columns
+        directly instead.
+        """
+        for row in range(len(self._columns["vehicle_offsets"]) - 1):
+            yield self._vehicle(row)
+
+    def get_vehicle(self, vin: str) -> Optional[Mapping[str, Any]]:
+        """
+        Look up the market entry recorded for a VIN.
+
+        Returns:
+            Read-only entry (vehicle_info, kbb_data, comparables,
+            market_summary, ...), or None
+        """
+        index = self._columns["vin_index"]
+        key = vin.encode("utf-8")
+        if not len(index) or len(key) > index.dtype.itemsize:
+            return None
+        position = int(np.searchsorted(index, key))
+        if position >= len(index) or index[position] != key:
+            return None
+        return self._vehicle(int(self._columns["vin_rows"][position]))
+
+    def find_vehicles(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str] = None,
+        region: Optional[str] = None,
+        limit: int = 10
+    ) -> List[Mapping[str, Any]]:
+        """
+        Find market entries for vehicles in a segment.
+
+        Same arguments and result as JsonMarketBackend.find_vehicles.
+        """
+        offsets = self._columns["segment_vehicles"]
+        matches = []
+        for segment in self._matching_segments(make, model, year, trim, region):
+            for row in range(int(offsets[segment]), int(offsets[segment + 1])):
+                if len(matches) >= limit:
+                    return matches
+                matches.append(self._vehicle(row))
+        return matches
+
+    def _nearest_distinct(self, rows: np.ndarray, distances: np.ndarray, limit: int) -> np.ndarray:
+        """Positions of the nearest listing of each car, nearest first, at most limit."""
+        order = np.argsort(distances, kind="stable")
+        vins = self._columns["comparable_vin"][rows[order]].astype(np.int64)
+        # Listings without a VIN are each their own car
+        vins = np.where(vins < 0, -2 - order, vins)
+        _, first = np.unique(vins, return_index=True)
+        return order[np.sort(first)[:limit]]
+
+    def find_comparables(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str] = None,
+        region: Optional[str] = None,
+        limit: int = 100,
+        near: Optional[Tuple[float, float]] = None,
+        radius_miles: float = 25.0
+    ) -> List[Mapping[str, Any]]:
+        """
+        Find comparable listings in a segment, nearest first.
+
+        Same arguments and result as JsonMarketBackend.find_comparables.
+        Distances and de-duplication are computed over the segment's
+        columns; only the listings returned are materialized.
+        """
+        rows = self._rows(self.segment_slices(make, model, year, trim, region))
+        if near is None:
+            distances = np.nan_to_num(self._columns["distance_miles"][rows], nan=0.0)
+            return [self.listing(int(rows[k])) for k in self._nearest_distinct(rows, distances, limit)]
+
+        distances = haversine_miles_array(
+            near[0], near[1], self._columns["lat"][rows], self._columns["lon"][rows]
+        )
+        within = np.flatnonzero(distances <= radius_miles)
+        rows, distances = rows[within], distances[within]
+        return [
+            locate_comparable(self.listing(int(rows[k])), float(distances[k]))
+            for k in self._nearest_distinct(rows, distances, limit)
+        ]
+
+    def price_bands(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        region: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        p10/p50/p90 price bands and median days listed for a segment.
+
+        Same result as SegmentSketches.price_bands, but exact: each car
+        counts once and quantiles are the listing values at those ranks.
+        """
+        columns = self.segment_columns(make, model, year, None, region, ("price", "days_listed", "first_listing"))
+        prices = columns["price"][columns["first_listing"]]
+        prices = prices[~np.isnan(prices)]
+        if not len(prices):
+            return None
+        p10, p50, p90 = np.quantile(prices, PRICE_BANDS, method="inverted_cdf")
+        days = columns["days_listed"][columns["first_listing"]]
+        days = days[~np.isnan(days)]
+        return {
+            "p10": _number(float(p10)),
+            "p50": _number(float(p50)),
+            "p90": _number(float(p90)),
+            "days_listed_p50": _number(float(np.quantile(days, 0.5, method="inverted_cdf"))) if len(days) else None,
+            "sample_size": len(prices),
+            "region": region
+        }
+
+    def comparable_index(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str] = None,
+        region: Optional[str] = None,
+        year_window: int = 0,
+        near: Optional[Tuple[float, float]] = None,
+        radius_miles: float = 25.0
+    ) -> ComparableIndex:
+        """
+        k-nearest-neighbour index over a segment's listings.
+
+        Each car counts once. year_window takes in the segments that many
+        model years either side, each listing scored with its own segment's
+        year. With near, distances are re-measured from it and only listings
+        within radius_miles are kept; listings with an unknown dealer
+        location keep their recorded distance. The index's items are
+        listing rows: pass the rows top_k returns to listing() or
+        pool_listing() for the listings themselves.
+        """
+        year_key = segment_key(make, model, year)[2]
+        segments = [
+            segment
+            for candidate_year in range(year_key - year_window, year_key + year_window + 1)
+            for segment in self._matching_segments(make, model, candidate_year, trim, region)
+        ]
+        offsets = self._columns["segment_listings"]
+        counts = [int(offsets[segment + 1] - offsets[segment]) for segment in segments]
+        rows = self._rows([slice(int(offsets[segment]), int(offsets[segment + 1])) for segment in segments])
+        trims = np.repeat(np.arange(len(segments)), counts)
+        years = np.repeat(self._columns["segment_year"][segments].astype(np.float64), counts)
+        distances = self._columns["distance_miles"][rows]
+        keep = self._columns["first_listing"][rows]
+        if near is not None:
+            measured = np.round(haversine_miles_array(
+                near[0], near[1], self._columns["lat"][rows], self._columns["lon"][rows]
+            ), 1)
+            distances = np.where(np.isnan(measured), distances, measured)
+            keep = keep & (np.nan_to_num(distances, nan=0.0) <= radius_miles)
+        rows, trims, years, distances = rows[keep], trims[keep], years[keep], distances[keep]
+        return ComparableIndex(
+            rows,
+            years,
+            self._columns["mileage"][rows],
+            trims,
+            distances,
+            self._columns["days_listed"][rows],
+            trim_names=[self._segment_trim[segment] for segment in segments]
+        )
+
+    def pool_listing(self, row: int, near: Optional[Tuple[float, float]] = None) -> FrozenDict:
+        """
+        A listing row tagged with the year and trim of the entry it is recorded under.
+
+        The shape similarity pools use (see comparable_index). With near,
+        distance_miles is re-measured from it when the dealer location is
+        known.
+        """
+        listing = self._listing(row)
+        lat, lon = float(self._columns["lat"][row]), float(self._columns["lon"][row])
+        if near is not None and not np.isnan(lat):
+            listing["distance_miles"] = round(float(haversine_miles_array(near[0], near[1], lat, lon)), 1)
+        vehicle = int(self._columns["vehicle"][row])
+        offsets = self._columns["vehicle_offsets"]
+        info = json.loads(self._payloads[offsets[vehicle]:offsets[vehicle + 1]])["vehicle_info"]
+        return freeze({**listing, "year": int(info["year"]), "trim": info.get("trim")})
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report store size.
+
+        Returns:
+            Dictionary with vehicle, comparable and segment counts and the
+            store path
+        """
+        return {
+            "vehicles": self.meta["vehicles"],
+            "comparables": self.meta["comparables"],
+            "segments": self.meta["segments"],
+            "path": self.path
+        }
+
+    def close(self) -> None:
+        """Release the string and vehicle mappings (columns unmap when collected)."""
+        for mapped in (self._strings, self._payloads):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+
+def open_market_columns(
+    path: str,
+    json_path: str,
+    default_region: str = DEFAULT_REGION
+) -> ColumnarMarketStore:
+    """
+    Open a columnar market store, (re)building it from the JSON file if needed.
+
+    The store is rebuilt when it is missing, incomplete or in an older
+    format, or when the JSON file is newer than it.
+
+    Args:
+        path: Store directory
+        json_path: Market comps JSON to build from
+        default_region: Region for entries without regional_data
+
+    Returns:
+        The open store
+    """
+    meta_path = os.path.join(path, META_FILE)
+    stale = (
+        not os.path.exists(meta_path)
+        or (os.path.exists(json_path) and os.path.getmtime(json_path) > os.path.getmtime(meta_path))
+    )
+    if not stale:
+        try:
+            return ColumnarMarketStore(path)
+        except (OSError, ValueError):
+            pass
+    with open(json_path, "r") as f:
+        write_market_columns(json.load(f), path, default_region)
+    return ColumnarMarketStore(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python tools/market_columns.py <market_comps.json> <market_columns_dir>")
+        sys.exit(1)
+
+    with open(sys.argv[1], "r") as f:
+        data = json.load(f)
+    counts = write_market_columns(data, sys.argv[2])
+    print(
+        f"Wrote {counts['vehicles']} vehicles, {counts['comparables']} comparables "
+        f"and {counts['segments']} segments to {sys.argv[2]}"
+    )
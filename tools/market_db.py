@@ -0,0 +1,381 @@
+"""
+Indexed SQLite market store.
+
+Holds the same data as data/mock_market_comps.json in two tables:
+vehicles (one row per appraised VIN, with its KBB data and summaries) and
+comparables (one row per listing, carrying its segment, region and dealer
+location). VIN, (make, model, year, trim), region and segment-plus-latitude
+lookups are all index seeks, so the store answers in about the same time at
+a few entries or millions of listings.
+
+Build or refresh a store from the JSON file with:
+    python tools/market_db.py data/mock_market_comps.json .cache/market.sqlite
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+from typing import Dict, Any, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+# Allow running as a script from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.geo import bounding_box, haversine_miles_array, zip_location
+from tools.market_store import DEFAULT_REGION, entry_region, freeze, locate_comparable, segment_key
+
+
+DEFAULT_MARKET_DB_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ".cache",
+    "market.sqlite"
+)
+
+# Bump when the table layout changes so old stores are rebuilt
+SCHEMA_VERSION = 2
+
+# Most VINs bound into one "subject_vin IN (...)" query (SQLite's default
+# limit on host parameters was 999 before 3.32)
+MAX_IN_PARAMS = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vehicles (
+    vin TEXT PRIMARY KEY,
+    make_key TEXT NOT NULL,
+    model_key TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    trim_key TEXT,
+    region TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_vehicles_segment ON vehicles (make_key, model_key, year, trim_key);
+CREATE INDEX IF NOT EXISTS idx_vehicles_region ON vehicles (region);
+
+CREATE TABLE IF NOT EXISTS comparables (
+    id INTEGER PRIMARY KEY,
+    subject_vin TEXT NOT NULL,
+    comparable_vin TEXT NOT NULL,
+    make_key TEXT NOT NULL,
+    model_key TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    trim_key TEXT,
+    region TEXT NOT NULL,
+    distance_miles REAL,
+    lat REAL,
+    lon REAL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_comparables_subject ON comparables (subject_vin);
+CREATE INDEX IF NOT EXISTS idx_comparables_vin ON comparables (comparable_vin);
+CREATE INDEX IF NOT EXISTS idx_comparables_segment ON comparables (make_key, model_key, year, trim_key, distance_miles);
+CREATE INDEX IF NOT EXISTS idx_comparables_region ON comparables (region, make_key, model_key, year);
+CREATE INDEX IF NOT EXISTS idx_comparables_location ON comparables (make_key, model_key, year, lat);
+"""
+
+
+class SqliteMarketStore:
+    """
+    Market backend over indexed SQLite tables.
+
+    Answers the same queries as JsonMarketBackend (get_vehicle,
+    find_vehicles, find_comparables) and returns the same read-only shapes.
+    """
+
+    def __init__(self, path: str = DEFAULT_MARKET_DB_PATH):
+        """
+        Args:
+            path: SQLite file location, or ":memory:" for a process-local store
+        """
+        self.path = path
+        self._lock = threading.RLock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._init_schema()
+
+    def _init_schema(self) -> None:
+        """Create tables, dropping a store written by an older schema version."""
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS vehicles")
+            self._conn.execute("DROP TABLE IF EXISTS comparables")
+        self._conn.executescript(SCHEMA)
+        self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.commit()
+
+    def import_entries(
+        self,
+        entries: Mapping[str, Mapping[str, Any]],
+        default_region: str = DEFAULT_REGION,
+        replace: bool = True
+    ) -> int:
+        """
+        Load market entries shaped like mock_market_comps.json.
+
+        Args:
+            entries: Market entries keyed by VIN
+            default_region: Region for entries without regional_data
+            replace: Drop existing rows first
+
+        Returns:
+            Number of comparable listings written
+        """
+        vehicle_rows = []
+        comparable_rows = []
+        for vin, entry in entries.items():
+            info = entry["vehicle_info"]
+            make, model, year, trim = segment_key(info["make"], info["model"], info["year"], info.get("trim"))
+            region = entry_region(entry, default_region)
+            payload = {key: value for key, value in entry.items() if key != "comparables"}
+            vehicle_rows.append((vin, make, model, year, trim, region, json.dumps(payload)))
+            for comp in entry.get("comparables", []):
+                lat, lon = zip_location(comp.get("dealer_zip")) or (None, None)
+                comparable_rows.append((
+                    vin, comp["comparable_vin"], make, model, year, trim, region,
+                    comp.get("distance_miles"), lat, lon, json.dumps(comp)
+                ))
+
+        with self._lock:
+            if replace:
+                self._conn.execute("DELETE FROM vehicles")
+                self._conn.execute("DELETE FROM comparables")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vehicles VALUES (?, ?, ?, ?, ?, ?, ?)", vehicle_rows
+            )
+            self._conn.executemany(
+                "INSERT INTO comparables (subject_vin, comparable_vin, make_key, model_key, year, "
+                "trim_key, region, distance_miles, lat, lon, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                comparable_rows
+            )
+            self._conn.commit()
+        return len(comparable_rows)
+
+    def _query(self, sql: str, params: Iterable[Any]) -> List[Tuple[Any, ...]]:
+        with self._lock:
+            return self._conn.execute(sql, tuple(params)).fetchall()
+
+    @staticmethod
+    def _segment_filter(
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str],
+        region: Optional[str]
+    ) -> Tuple[str, List[Any]]:
+        """Build the WHERE clause for a segment query."""
+        make_key, model_key, year_key, trim_key = segment_key(make, model, year, trim)
+        clauses = ["make_key = ?", "model_key = ?", "year = ?"]
+        params: List[Any] = [make_key, model_key, year_key]
+        if trim_key is not None:
+            clauses.append("trim_key = ?")
+            params.append(trim_key)
+        if region is not None:
+            clauses.append("region = ?")
+            params.append(region)
+        return " AND ".join(clauses), params
+
+    def get_vehicle(self, vin: str) -> Optional[Mapping[str, Any]]:
+        """
+        Look up the market entry recorded for a VIN.
+
+        Returns:
+            Read-only entry (vehicle_info, kbb_data, comparables,
+            market_summary, ...), or None
+        """
+        rows = self._query("SELECT vin, payload FROM vehicles WHERE vin = ?", (vin,))
+        return self._assemble(rows)[0] if rows else None
+
+    def _assemble(self, vehicle_rows: List[Tuple[str, str]]) -> List[Mapping[str, Any]]:
+        """
+        Attach listings to (vin, payload) vehicle rows.
+
+        Listings for all the rows are read with set-based queries
+        (subject_vin IN (...)) and grouped by subject VIN here, rather than
+        with a query per vehicle.
+        """
+        vins = [vin for vin, _ in vehicle_rows]
+        listings: Dict[str, List[Dict[str, Any]]] = {vin: [] for vin in vins}
+        for start in range(0, len(vins), MAX_IN_PARAMS):
+            chunk = vins[start:start + MAX_IN_PARAMS]
+            rows = self._query(
+                f"SELECT subject_vin, payload FROM comparables WHERE subject_vin IN ({', '.join('?' * len(chunk))}) "
+                "ORDER BY id",
+                chunk
+            )
+            for subject_vin, payload in rows:
+                listings[subject_vin].append(json.loads(payload))
+
+        entries = []
+        for vin, payload in vehicle_rows:
+            entry = json.loads(payload)
+            entry["comparables"] = listings[vin]
+            entries.append(freeze(entry))
+        return entries
+
+    def find_vehicles(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str] = None,
+        region: Optional[str] = None,
+        limit: int = 10
+    ) -> List[Mapping[str, Any]]:
+        """
+        Find market entries for vehicles in a segment.
+
+        Same arguments and result as JsonMarketBackend.find_vehicles.
+        """
+        where, params = self._segment_filter(make, model, year, trim, region)
+        rows = self._query(f"SELECT vin, payload FROM vehicles WHERE {where} LIMIT ?", [*params, limit])
+        return self._assemble(rows)
+
+    def find_comparables(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str] = None,
+        region: Optional[str] = None,
+        limit: int = 100,
+        near: Optional[Tuple[float, float]] = None,
+        radius_miles: float = 25.0
+    ) -> List[Mapping[str, Any]]:
+        """
+        Find comparable listings in a segment, nearest first.
+
+        Same arguments and result as JsonMarketBackend.find_comparables.
+        """
+        where, params = self._segment_filter(make, model, year, trim, region)
+        if near is not None:
+            return self._find_comparables_near(where, params, limit, near, radius_miles)
+
+        # SQLite returns the payload of the MIN() row for each listing
+        rows = self._query(
+            f"SELECT payload, MIN(distance_miles) AS distance FROM comparables WHERE {where} "
+            "GROUP BY comparable_vin ORDER BY distance LIMIT ?",
+            [*params, limit]
+        )
+        return [freeze(json.loads(payload)) for payload, _ in rows]
+
+    def _find_comparables_near(
+        self,
+        where: str,
+        params: List[Any],
+        limit: int,
+        near: Tuple[float, float],
+        radius_miles: float
+    ) -> List[Mapping[str, Any]]:
+        """Bounding-box seek on the location index, then exact distances."""
+        min_lat, max_lat, min_lon, max_lon = bounding_box(near[0], near[1], radius_miles)
+        rows = self._query(
+            f"SELECT comparable_vin, lat, lon, payload FROM comparables WHERE {where} "
+            "AND lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?",
+            [*params, min_lat, max_lat, min_lon, max_lon]
+        )
+        if not rows:
+            return []
+
+        distances = haversine_miles_array(
+            near[0], near[1],
+            np.array([row[1] for row in rows]), np.array([row[2] for row in rows])
+        )
+        seen = set()
+        comparables = []
+        for k in np.argsort(distances, kind="stable"):
+            if distances[k] > radius_miles:
+                break
+            comparable_vin, _, _, payload = rows[k]
+            if comparable_vin in seen:
+                continue
+            seen.add(comparable_vin)
+            comparables.append(locate_comparable(json.loads(payload), float(distances[k])))
+            if len(comparables) >= limit:
+                break
+        return comparables
+
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        """
+        Every market entry, in VIN order.
+
+        Two ordered scans (vehicles, and comparables by subject VIN) merged
+        in Python, for building structures over the whole market (price
+        bands, the price model) without a query per vehicle.
+        """
+        vehicles = self._query("SELECT vin, payload FROM vehicles ORDER BY vin", ())
+        comparables = self._query("SELECT subject_vin, payload FROM comparables ORDER BY subject_vin, id", ())
+        position = 0
+        for vin, payload in vehicles:
+            entry = json.loads(payload)
+            while position < len(comparables) and comparables[position][0] < vin:
+                position += 1
+            entry["comparables"] = []
+            while position < len(comparables) and comparables[position][0] == vin:
+                entry["comparables"].append(json.loads(comparables[position][1]))
+                position += 1
+            yield entry
+
+    def query_plan(self, sql: str, params: Iterable[Any] = ()) -> List[str]:
+        """Return SQLite's plan for a query (used to check index use)."""
+        return [row[-1] for row in self._query(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report store size.
+
+        Returns:
+            Dictionary with vehicle and comparable counts and the file path
+        """
+        vehicles = self._query("SELECT COUNT(*) FROM vehicles", ())[0][0]
+        comparables = self._query("SELECT COUNT(*) FROM comparables", ())[0][0]
+        return {"vehicles": vehicles, "comparables": comparables, "path": self.path}
+
+    def close(self) -> None:
+        """Close the underlying SQLite connection."""
+        with self._lock:
+            self._conn.close()
+
+
+def open_market_db(db_path: str, json_path: str, default_region: str = DEFAULT_REGION) -> SqliteMarketStore:
+    """
+    Open a SQLite market store, (re)building it from the JSON file if needed.
+
+    The store is rebuilt when it is missing or empty, or when the JSON file
+    is newer than it.
+
+    Args:
+        db_path: SQLite store location
+        json_path: Market comps JSON to import from
+        default_region: Region for entries without regional_data
+
+    Returns:
+        The open store
+    """
+    stale = (
+        not os.path.exists(db_path)
+        or (os.path.exists(json_path) and os.path.getmtime(json_path) > os.path.getmtime(db_path))
+    )
+    store = SqliteMarketStore(db_path)
+    if os.path.exists(json_path) and (stale or store.stats()["vehicles"] == 0):
+        with open(json_path, "r") as f:
+            store.import_entries(json.load(f), default_region)
+    return store
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python tools/market_db.py <market_comps.json> <market.sqlite>")
+        sys.exit(1)
+
+    with open(sys.argv[1], "r") as f:
+        data = json.load(f)
+    store = SqliteMarketStore(sys.argv[2])
+    written = store.import_entries(data)
+    print(f"Imported {len(data)} vehicles and {written} comparables into {sys.argv[2]}")
+    store.close()
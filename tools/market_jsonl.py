@@ -0,0 +1,375 @@
+"""
+JSONL market store with a byte-offset sidecar index.
+
+For deployments that keep the comps as text: one market entry per line
+(its VIN is vehicle_info.vin), plus a sidecar index directory next to the
+file (<file>.idx) holding NumPy arrays:
+    record_offsets: byte offset of every record, and the file size at the end
+    vin_index / vin_records: sorted VINs and the record each one is on
+    segment_keys / segment_offsets / segment_records: sorted
+        "make|model|year|trim|region" keys with CSR-style offsets into the
+        record numbers of each segment (in file order)
+
+The file and the index are memory-mapped. A VIN lookup is a binary search
+over the mapped VIN array and one json.loads of the record's bytes, so it
+costs about the same for a file of kilobytes or gigabytes; only the pages
+touched are read. Segment queries parse just the records in the segment.
+
+The index records the file's size and mtime and is rebuilt (one pass over
+the file) when either changes. Convert a JSON comps file and index it with:
+    python tools/market_jsonl.py data/mock_market_comps.json .cache/market.jsonl
+"""
+
+import json
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+# Allow running as a script from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.geo import haversine_miles, zip_location
+from tools.market_store import DEFAULT_REGION, entry_region, freeze, locate_comparable, segment_key
+
+
+DEFAULT_MARKET_JSONL_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ".cache",
+    "market.jsonl"
+)
+
+# Bump when the index layout changes so old indexes are rebuilt
+INDEX_FORMAT_VERSION = 1
+
+INDEX_ARRAYS = (
+    "record_offsets", "vin_index", "vin_records", "segment_keys", "segment_offsets", "segment_records"
+)
+
+META_FILE = "meta.json"
+
+
+def index_path(path: str) -> str:
+    """Sidecar index directory of a JSONL comps file."""
+    return path + ".idx"
+
+
+def _segment_label(entry: Mapping[str, Any], default_region: str) -> bytes:
+    info = entry["vehicle_info"]
+    make, model, year, trim = segment_key(info["make"], info["model"], info["year"], info.get("trim"))
+    return f"{make}|{model}|{year}|{trim or ''}|{entry_region(entry, default_region)}".encode("utf-8")
+
+
+def _file_signature(path: str) -> Dict[str, int]:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _records(path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """(byte offset, entry) for every non-blank line of a JSONL file."""
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield offset, json.loads(line)
+            offset += len(line)
+
+
+def _sorted_bytes(values: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    """Values as a fixed-width bytes array in sorted order, and the sort order."""
+    array = np.array(values, dtype=bytes) if values else np.zeros(0, dtype="S1")
+    order = np.argsort(array, kind="stable")
+    return array[order], order
+
+
+def build_jsonl_index(path: str, default_region: str = DEFAULT_REGION) -> Dict[str, int]:
+    """
+    Index a JSONL comps file (one pass) and publish the sidecar index.
+
+    The index is written to a staging directory and swapped in with renames.
+
+    Args:
+        path: JSONL comps file
+        default_region: Region for entries without regional_data
+
+    Returns:
+        Dictionary with record and segment counts
+
+    Raises:
+        ValueError: If a line is not valid JSON or not a market entry
+    """
+    signature = _file_signature(path)
+    offsets, vins, labels = [], [], []
+    for offset, entry in _records(path):
+        offsets.append(offset)
+        vins.append(entry["vehicle_info"]["vin"].encode("utf-8"))
+        labels.append(_segment_label(entry, default_region))
+    offsets.append(signature["size"])
+
+    vin_index, vin_records = _sorted_bytes(vins)
+    sorted_labels, segment_records = _sorted_bytes(labels)
+    segment_keys, first = np.unique(sorted_labels, return_index=True)
+    arrays = {
+        "record_offsets": np.array(offsets, dtype=np.int64),
+        "vin_index": vin_index,
+        "vin_records": vin_records.astype(np.int64),
+        "segment_keys": segment_keys,
+        "segment_offsets": np.append(first, len(labels)).astype(np.int64),
+        "segment_records": segment_records.astype(np.int64)
+    }
+
+    target = index_path(path)
+    parent = os.path.dirname(os.path.abspath(target))
+    staging = tempfile.mkdtemp(prefix=".market_jsonl_index-", dir=parent)
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(staging, f"{name}.npy"), array)
+        counts = {"records": len(vins), "segments": len(segment_keys)}
+        with open(os.path.join(staging, META_FILE), "w") as f:
+            json.dump({"format": INDEX_FORMAT_VERSION, "source": signature, **counts}, f)
+
+        if os.path.exists(target):
+            retired = staging + ".old"
+            os.rename(target, retired)
+            os.rename(staging, target)
+            shutil.rmtree(retired, ignore_errors=True)
+        else:
+            os.rename(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return counts
+
+
+def write_market_jsonl(
+    entries: Mapping[str, Mapping[str, Any]],
+    path: str,
+    default_region: str = DEFAULT_REGION
+) -> Dict[str, int]:
+    """
+    Write market entries shaped like mock_market_comps.json as indexed JSONL.
+
+    Args:
+        entries: Market entries keyed by VIN
+        path: JSONL file to write (replaced atomically)
+        default_region: Region for entries without regional_data
+
+    Returns:
+        Dictionary with record and segment counts
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    staging = f"{path}.tmp-{os.getpid()}"
+    with open(staging, "w") as f:
+        for vin, entry in entries.items():
+            entry = {**entry, "vehicle_info": {**entry["vehicle_info"], "vin": vin}}
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+    os.replace(staging, path)
+    return build_jsonl_index(path, default_region)
+
+
+def index_is_current(path: str) -> bool:
+    """True if the sidecar index exists, is in this format and matches the file."""
+    try:
+        with open(os.path.join(index_path(path), META_FILE), "r") as f:
+            meta = json.load(f)
+        return meta.get("format") == INDEX_FORMAT_VERSION and meta.get("source") == _file_signature(path)
+    except (OSError, ValueError):
+        return False
+
+
+class JsonlMarketStore:
+    """
+    Market backend over an indexed JSONL file.
+
+    Answers the same queries as JsonMarketBackend (get_vehicle,
+    find_vehicles, find_comparables) and returns the same read-only shapes,
+    parsing only the records a query needs.
+    """
+
+    def __init__(self, path: str = DEFAULT_MARKET_JSONL_PATH, default_region: str = DEFAULT_REGION):
+        """
+        Args:
+            path: JSONL comps file; its index is built or rebuilt if stale
+            default_region: Region for entries without regional_data
+        """
+        self.path = path
+        self.default_region = default_region
+        if not index_is_current(path):
+            build_jsonl_index(path, default_region)
+        directory = index_path(path)
+        with open(os.path.join(directory, META_FILE), "r") as f:
+            self.meta = json.load(f)
+        self._index = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in INDEX_ARRAYS
+        }
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.meta["source"]["size"] else b""
+
+    def _record(self, record: int) -> Dict[str, Any]:
+        offsets = self._index["record_offsets"]
+        return json.loads(self._data[offsets[record]:offsets[record + 1]])
+
+    def get_vehicle(self, vin: str) -> Optional[Mapping[str, Any]]:
+        """
+        Look up the market entry recorded for a VIN.
+
+        Returns:
+            Read-only entry (vehicle_info, kbb_data, comparables,
+            market_summary, ...), or None
+        """
+        index = self._index["vin_index"]
+        key = vin.encode("utf-8")
+        if not len(index) or len(key) > index.dtype.itemsize:
+            return None
+        position = int(np.searchsorted(index, key))
+        if position >= len(index) or index[position] != key:
+            return None
+        return freeze(self._record(int(self._index["vin_records"][position])))
+
+    def _segment_records(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str],
+        region: Optional[str]
+    ) -> List[int]:
+        """Records in a segment, in file order."""
+        make_key, model_key, year_key, trim_key = segment_key(make, model, year, trim)
+        prefix = f"{make_key}|{model_key}|{year_key}|".encode("utf-8")
+        keys = self._index["segment_keys"]
+        offsets = self._index["segment_offsets"]
+        records: List[int] = []
+        # Keys of the (make, model, year) sort together; no UTF-8 byte is 0xff
+        first = int(np.searchsorted(keys, prefix))
+        stop = int(np.searchsorted(keys, prefix + b"\xff"))
+        for segment in range(first, stop):
+            segment_trim, segment_region = keys[segment][len(prefix):].decode("utf-8").split("|", 1)
+            if trim_key is not None and segment_trim != trim_key:
+                continue
+            if region is not None and segment_region != region:
+                continue
+            records.extend(self._index["segment_records"][offsets[segment]:offsets[segment + 1]].tolist())
+        return sorted(records)
+
+    def find_vehicles(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str] = None,
+        region: Optional[str] = None,
+        limit: int = 10
+    ) -> List[Mapping[str, Any]]:
+        """
+        Find market entries for vehicles in a segment.
+
+        Same arguments and result as JsonMarketBackend.find_vehicles.
+        """
+        return [freeze(self._record(record)) for record in self._segment_records(make, model, year, trim, region)[:limit]]
+
+    def find_comparables(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str] = None,
+        region: Optional[str] = None,
+        limit: int = 100,
+        near: Optional[Tuple[float, float]] = None,
+        radius_miles: float = 25.0
+    ) -> List[Mapping[str, Any]]:
+        """
+        Find comparable listings in a segment, nearest first.
+
+        Same arguments and result as JsonMarketBackend.find_comparables.
+        """
+        listings = [
+            comp
+            for record in self._segment_records(make, model, year, trim, region)
+            for comp in self._record(record).get("comparables", [])
+        ]
+        if near is not None:
+            located = []
+            for comp in listings:
+                location = zip_location(comp.get("dealer_zip"))
+                if location is not None:
+                    distance = haversine_miles(near[0], near[1], *location)
+                    if distance <= radius_miles:
+                        located.append((distance, comp))
+            located.sort(key=lambda pair: pair[0])
+            listings = [locate_comparable(comp, distance) for distance, comp in located]
+        else:
+            listings.sort(key=lambda comp: comp.get("distance_miles", 0))
+
+        seen = set()
+        comparables = []
+        for comp in listings:
+            if comp["comparable_vin"] in seen:
+                continue
+            seen.add(comp["comparable_vin"])
+            comparables.append(comp if near is not None else freeze(comp))
+            if len(comparables) >= limit:
+                break
+        return comparables
+
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        """
+        Every market entry in file order, parsed one record at a time.
+
+        For building structures over the whole market (price bands, the
+        price model) without holding the file as one parsed document.
+        """
+        for record in range(self.meta["records"]):
+            yield self._record(record)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report index size.
+
+        Returns:
+            Dictionary with record and segment counts and the file path
+        """
+        return {"vehicles": self.meta["records"], "segments": self.meta["segments"], "path": self.path}
+
+    def close(self) -> None:
+        """Release the file mapping."""
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+
+def open_market_jsonl(
+    path: str,
+    json_path: Optional[str] = None,
+    default_region: str = DEFAULT_REGION
+) -> JsonlMarketStore:
+    """
+    Open a JSONL market store, converting the JSON comps file if it's missing.
+
+    Args:
+        path: JSONL comps file
+        json_path: Market comps JSON to convert when path doesn't exist
+        default_region: Region for entries without regional_data
+
+    Returns:
+        The open store (its index is rebuilt if stale)
+    """
+    if not os.path.exists(path) and json_path is not None:
+        with open(json_path, "r") as f:
+            write_market_jsonl(json.load(f), path, default_region)
+    return JsonlMarketStore(path, default_region)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python tools/market_jsonl.py <market_comps.json> <market.jsonl>")
+        sys.exit(1)
+
+    with open(sys.argv[1], "r") as f:
+        data = json.load(f)
+    counts = write_market_jsonl(data, sys.argv[2])
+    print(f"Wrote {counts['records']} records in {counts['segments']} segments to {sys.argv[2]}")
@@ -0,0 +1,133 @@
+"""
+Budgeted projection of market intelligence for LLM tools.
+
+get_market_intelligence returns every comparable with its VIN, listing
+URL, dealer and zip, plus per-source latencies. The market agent needs
+none of that to reason about price, yet it is sent on every call and then
+repeated through {market_intelligence_data} into the vision and pricing
+prompts. project_for_llm() trims a result to what the agents use:
+    - the vehicle, KBB valuation, market summary, market value and price
+      bands, which already aggregate every comparable
+    - the top comparables (in the result's own order: nearest, or most
+      similar when k was given) with source, price, mileage, distance and
+      days listed only
+    - source statuses instead of full provenance
+    - the segment snapshot's version, headline statistics and KBB anchors
+and then fits it to a token budget, estimated from compact JSON size.
+Comparables are dropped from the end first (down to MIN_COMPARABLES),
+then the optional sections in DROPPABLE_SECTIONS, then the remaining
+comparables. The projection records what it left out in
+comparables_omitted and omitted_sections.
+
+Non-LLM callers (UI, batch jobs) keep calling get_market_intelligence for
+the full payload.
+
+Configuration (environment variables):
+    MARKET_TOOL_MAX_TOKENS: Token budget for the projection (default: 1000).
+    MARKET_TOOL_MAX_COMPARABLES: Comparables kept before budgeting (default: 10).
+"""
+
+import json
+import math
+import os
+from typing import Any, Dict, List, Mapping, Optional
+
+
+DEFAULT_MAX_TOKENS = int(os.getenv("MARKET_TOOL_MAX_TOKENS", "1000"))
+DEFAULT_MAX_COMPARABLES = int(os.getenv("MARKET_TOOL_MAX_COMPARABLES", "10"))
+
+# Rough size of a token in compact JSON
+BYTES_PER_TOKEN = 4
+
+# Comparables kept before optional sections are given up
+MIN_COMPARABLES = 3
+
+COMPARABLE_FIELDS = ("source", "price", "mileage", "distance_miles", "days_listed")
+VEHICLE_FIELDS = ("make", "model", "year", "trim", "mileage")
+MARKET_VALUE_FIELDS = ("value", "low", "high", "level", "per_1k_miles", "per_model_year", "sample_size")
+SEARCH_FIELDS = ("zip_code", "radius_miles", "radius_expanded")
+SNAPSHOT_FIELDS = ("version", "segment", "comp_count", "avg_price", "p50", "days_listed_median", "kbb_anchors")
+
+# Sections passed through unchanged when present
+SECTIONS = ("kbb_valuation", "market_summary", "price_bands", "regional_insights", "demand_insights")
+
+# Optional sections, in the order they are dropped to meet the budget
+DROPPABLE_SECTIONS = ("search_params", "segment_snapshot", "demand_insights", "regional_insights", "price_bands")
+
+
+def estimate_tokens(payload: Any) -> int:
+    """Approximate token count of a JSON payload."""
+    return math.ceil(len(json.dumps(payload, separators=(",", ":"))) / BYTES_PER_TOKEN)
+
+
+def _pick(data: Mapping[str, Any], fields) -> Dict[str, Any]:
+    return {field: data[field] for field in fields if field in data}
+
+
+def project_for_llm(
+    result: Mapping[str, Any],
+    max_tokens: Optional[int] = None,
+    max_comparables: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Project a market intelligence result for an LLM, within a token budget.
+
+    Args:
+        result: get_market_intelligence (or _async) result
+        max_tokens: Token budget (default: MARKET_TOOL_MAX_TOKENS)
+        max_comparables: Comparables kept before budgeting
+            (default: MARKET_TOOL_MAX_COMPARABLES)
+
+    Returns:
+        A plain, JSON-serializable dictionary. Failed lookups are returned
+        as they are. The budget is exceeded only if the vehicle, valuation
+        and summaries alone don't fit.
+    """
+    if not result.get("success"):
+        return dict(result)
+    max_tokens = DEFAULT_MAX_TOKENS if max_tokens is None else max_tokens
+    max_comparables = DEFAULT_MAX_COMPARABLES if max_comparables is None else max_comparables
+
+    projection: Dict[str, Any] = {
+        "success": True,
+        "vin": result["vin"],
+        "vehicle_info": _pick(result["vehicle_info"], VEHICLE_FIELDS)
+    }
+    for section in SECTIONS:
+        if section in result:
+            projection[section] = result[section]
+    if "market_value" in result:
+        projection["market_value"] = _pick(result["market_value"], MARKET_VALUE_FIELDS)
+    if "segment_snapshot" in result:
+        projection["segment_snapshot"] = _pick(result["segment_snapshot"], SNAPSHOT_FIELDS)
+    if "match" in result:
+        projection["match"] = result["match"]
+    if "search_params" in result:
+        projection["search_params"] = _pick(result["search_params"], SEARCH_FIELDS)
+    if "sources" in result:
+        projection["partial"] = result.get("partial", False)
+        projection["sources"] = {name: source["status"] for name, source in result["sources"].items()}
+
+    comparables: List[Dict[str, Any]] = [
+        _pick(comp, COMPARABLE_FIELDS) for comp in result.get("comparables", [])[:max_comparables]
+    ]
+    total = len(result.get("comparables", []))
+
+    def fits() -> bool:
+        projection["comparables"] = comparables
+        if len(comparables) < total:
+            projection["comparables_omitted"] = total - len(comparables)
+        return estimate_tokens(projection) <= max_tokens
+
+    while not fits() and len(comparables) > MIN_COMPARABLES:
+        comparables.pop()
+    omitted = []
+    for section in DROPPABLE_SECTIONS:
+        if fits():
+            break
+        if projection.pop(section, None) is not None:
+            omitted.append(section)
+            projection["omitted_sections"] = omitted
+    while not fits() and comparables:
+        comparables.pop()
+    return projection
@@ -0,0 +1,176 @@
+"""
+Concurrent market data providers.
+
+Each market source (KBB, CarGurus, AutoTrader, ...) is a MarketProvider
+with its own timeout. fan_out() queries every provider at once on the
+event loop, so market latency tracks the slowest required source instead
+of the sum of all of them:
+    - Each provider is cut off at its own timeout.
+    - Once every required provider has answered (or timed out), optional
+      providers get a short grace period, then any still running are
+      abandoned and reported as "late".
+    - Failures never raise; every source gets a status and latency, so
+      callers can return partial results with clear provenance.
+
+Configuration (environment variables):
+    MARKET_SOURCE_TIMEOUT_SECONDS: Default per-source timeout (default: 3).
+"""
+
+import asyncio
+import inspect
+import os
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Optional
+
+
+DEFAULT_SOURCE_TIMEOUT = float(os.getenv("MARKET_SOURCE_TIMEOUT_SECONDS", "3"))
+
+# How long optional sources may run past the last required one
+OPTIONAL_GRACE_SECONDS = 0.05
+
+# Source statuses
+OK = "ok"              # Answered with data
+NO_DATA = "no_data"    # Answered, but had nothing for this vehicle
+TIMEOUT = "timeout"    # Didn't answer within its own timeout
+LATE = "late"          # Optional, still running when the required sources finished
+ERROR = "error"        # Raised an exception
+
+
+@dataclass(frozen=True)
+class MarketRequest:
+    """What every provider is asked about."""
+
+    vin: str
+    zip_code: str = "33130"
+    radius_miles: float = 25.0
+    make: Optional[str] = None
+    model: Optional[str] = None
+    year: Optional[int] = None
+    trim: Optional[str] = None
+
+
+class MarketProvider(ABC):
+    """
+    One market data source.
+
+    Subclasses implement fetch(); a provider without it can't be created. A result dict with success False counts
+    as no_data; anything else is the source's data.
+    """
+
+    def __init__(self, name: str, timeout: Optional[float] = None, required: bool = True):
+        """
+        Args:
+            name: Source name used in provenance
+            timeout: Seconds to wait for this source (default: MARKET_SOURCE_TIMEOUT_SECONDS)
+            required: Whether the fan-out waits for this source
+        """
+        self.name = name
+        self.timeout = DEFAULT_SOURCE_TIMEOUT if timeout is None else timeout
+        self.required = required
+
+    @abstractmethod
+    async def fetch(self, request: MarketRequest) -> Dict[str, Any]:
+        """Ask the source about a request; returns the source's result dict."""
+
+
+class CallableProvider(MarketProvider):
+    """
+    Provider backed by a function of the request.
+
+    Coroutine functions are awaited; plain functions (e.g. blocking HTTP
+    clients) run in a worker thread so they don't stall the event loop.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[MarketRequest], Any],
+        timeout: Optional[float] = None,
+        required: bool = True
+    ):
+        """
+        Args:
+            name: Source name used in provenance
+            fn: Function taking a MarketRequest and returning a dict
+            timeout: Seconds to wait for this source
+            required: Whether the fan-out waits for this source
+        """
+        super().__init__(name, timeout, required)
+        self._fn = fn
+
+    async def fetch(self, request: MarketRequest) -> Dict[str, Any]:
+        if inspect.iscoroutinefunction(self._fn):
+            return await self._fn(request)
+        return await asyncio.to_thread(self._fn, request)
+
+
+async def _run(provider: MarketProvider, request: MarketRequest) -> Dict[str, Any]:
+    """Query one provider and describe the outcome; never raises."""
+    started = time.perf_counter()
+    outcome: Dict[str, Any] = {"required": provider.required}
+    try:
+        data = await asyncio.wait_for(provider.fetch(request), provider.timeout)
+        if isinstance(data, dict) and data.get("success") is False:
+            outcome.update(status=NO_DATA, error=data.get("error"))
+        else:
+            outcome.update(status=OK, data=data)
+    except asyncio.TimeoutError:
+        outcome.update(status=TIMEOUT, error=f"No response within {provider.timeout}s")
+    except Exception as e:
+        outcome.update(status=ERROR, error=f"{type(e).__name__}: {e}")
+    outcome["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return outcome
+
+
+async def fan_out(
+    providers: Iterable[MarketProvider],
+    request: MarketRequest,
+    grace: float = OPTIONAL_GRACE_SECONDS
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Query providers concurrently.
+
+    Args:
+        providers: Sources to query (names must be unique)
+        request: The vehicle and location to ask about
+        grace: Seconds optional sources may run after the required ones finish
+
+    Returns:
+        Outcome per source name: status (ok, no_data, timeout, late or
+        error), latency_ms, required, and data (when ok) or error
+    """
+    providers = list(providers)
+    started = time.perf_counter()
+    tasks = {provider.name: asyncio.create_task(_run(provider, request)) for provider in providers}
+    if len(tasks) != len(providers):
+        for task in tasks.values():
+            task.cancel()
+        raise ValueError("Market provider names must be unique")
+
+    required = [tasks[provider.name] for provider in providers if provider.required]
+    await asyncio.wait(required or list(tasks.values()))
+    pending = [task for task in tasks.values() if not task.done()]
+    if pending and grace > 0:
+        await asyncio.wait(pending, timeout=grace)
+
+    outcomes = {}
+    for provider in providers:
+        task = tasks[provider.name]
+        if task.done():
+            outcomes[provider.name] = task.result()
+        else:
+            task.cancel()
+            outcomes[provider.name] = {
+                "required": False,
+                "status": LATE,
+                "error": "Still running after required sources finished",
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1)
+            }
+    return outcomes
+
+
+def provenance(outcomes: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Per-source status, latency and error, without the data."""
+    return {name: {key: value for key, value in outcome.items() if key != "data"} for name, outcome in outcomes.items()}
@@ -0,0 +1,374 @@
+"""
+Local HTTP stand-in for the KBB, CarGurus and AutoTrader APIs.
+
+Serves the market dataset (through the same lookups as tools/api_mocks.py)
+over real HTTP, with a fault profile per provider, so caching, retries
+and concurrency can be load-tested offline:
+    - latency drawn from a fixed, uniform, lognormal or exponential distribution
+    - a share of requests answered with 503
+    - a token-bucket rate limit answered with 429 and Retry-After
+    - a slow tail: a share of requests stalled for much longer
+
+Endpoints:
+    GET /kbb/v1/instant-cash-offer?vin=...[&make=&model=&year=&trim=]
+    GET /cargurus/v1/listings?vin=...[&zip=&radius=&make=&model=&year=&trim=]
+    GET /autotrader/v1/listings?vin=...[&zip=&radius=&make=&model=&year=&trim=]
+    GET /health
+    GET /stats
+
+A missing vin, a radius that isn't a non-negative number or a year that
+isn't a whole number is answered with a 400 JSON error.
+
+Run it with:
+    python tools/market_standin.py --port 8765 --profiles profiles.json
+
+where profiles.json maps provider names (or "default") to FaultProfile
+fields, e.g. {"cargurus": {"latency_ms": 250, "latency_distribution":
+"lognormal", "latency_spread": 0.5, "error_rate": 0.02}}. Point the market
+tools at it with MARKET_PROVIDER_URL=http://127.0.0.1:8765.
+"""
+
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Mapping, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+# Allow running as a script from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.api_mocks import DEFAULT_RADIUS_MILES, get_cargurus_comparables, get_kbb_instant_cash_offer
+from tools.market_store import FrozenList
+
+
+PROVIDERS = ("kbb", "cargurus", "autotrader")
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal", "exponential")
+
+
+@dataclass
+class FaultProfile:
+    """How one stand-in provider misbehaves."""
+
+    # Typical latency: the fixed value, the uniform centre, the lognormal
+    # median or the exponential mean
+    latency_ms: float = 0.0
+    latency_distribution: str = "fixed"
+    # Uniform: +/- this many ms. Lognormal: sigma of the underlying normal.
+    latency_spread: float = 0.0
+    # Share of requests answered with 503
+    error_rate: float = 0.0
+    # Sustained requests per second (None = unlimited) and burst size
+    rate_limit: Optional[float] = None
+    burst: int = 10
+    # Share of requests stalled for slow_tail_ms on top of their latency
+    slow_tail_rate: float = 0.0
+    slow_tail_ms: float = 0.0
+
+    def __post_init__(self):
+        if self.latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {self.latency_distribution}")
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "FaultProfile":
+        known = {field.name for field in fields(cls)}
+        unknown = set(data) - known
+        if unknown:
+            raise ValueError(f"Unknown fault profile fields: {', '.join(sorted(unknown))}")
+        return cls(**data)
+
+    def sample_latency(self, rng: random.Random) -> float:
+        """Seconds to wait before answering one request, excluding the slow tail."""
+        if self.latency_distribution == "uniform":
+            ms = rng.uniform(self.latency_ms - self.latency_spread, self.latency_ms + self.latency_spread)
+        elif self.latency_distribution == "lognormal":
+            ms = rng.lognormvariate(math.log(self.latency_ms), self.latency_spread) if self.latency_ms > 0 else 0.0
+        elif self.latency_distribution == "exponential":
+            ms = rng.expovariate(1 / self.latency_ms) if self.latency_ms > 0 else 0.0
+        else:
+            ms = self.latency_ms
+        return max(0.0, ms) / 1000
+
+
+class _TokenBucket:
+    """Rate limiter; take() returns 0 when allowed, else seconds until a token frees up."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+class MarketStandIn:
+    """
+    The stand-in server and its per-provider fault state.
+
+    Profiles can be changed while the server runs (set_profile), so a load
+    test can degrade one provider mid-run.
+    """
+
+    def __init__(
+        self,
+        profiles: Optional[Mapping[str, FaultProfile]] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            profiles: FaultProfile per provider name; "default" applies to the rest
+            host: Interface to bind
+            port: Port to bind (0 picks a free one)
+            seed: Seed for latency and error draws
+        """
+        profiles = dict(profiles or {})
+        default = profiles.pop("default", FaultProfile())
+        self._profiles = {name: profiles.get(name, default) for name in PROVIDERS}
+        self._buckets: Dict[str, Optional[_TokenBucket]] = {}
+        for name, profile in self._profiles.items():
+            self._buckets[name] = self._bucket(profile)
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {name: {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0, "slow_tail": 0} for name in PROVIDERS}
+        self.server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _bucket(profile: FaultProfile) -> Optional[_TokenBucket]:
+        return _TokenBucket(profile.rate_limit, profile.burst) if profile.rate_limit else None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def profile(self, provider: str) -> FaultProfile:
+        return self._profiles[provider]
+
+    def set_profile(self, provider: str, profile: FaultProfile) -> None:
+        """Swap a provider's fault profile (resets its rate limiter)."""
+        self._profiles[provider] = profile
+        self._buckets[provider] = self._bucket(profile)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Requests, successes, injected errors, 429s and slow-tail stalls per provider."""
+        with self._stats_lock:
+            return {name: dict(counts) for name, counts in self._stats.items()}
+
+    def _count(self, provider: str, *names: str) -> None:
+        with self._stats_lock:
+            for name in names:
+                self._stats[provider][name] += 1
+
+    def admit(self, provider: str) -> Tuple[int, float]:
+        """
+        Apply a provider's fault profile to one request.
+
+        Returns:
+            (status, retry_after): 200 to serve the request normally, 429
+            with seconds to wait, or 503 for an injected error
+        """
+        profile = self._profiles[provider]
+        self._count(provider, "requests")
+
+        bucket = self._buckets[provider]
+        if bucket is not None:
+            wait = bucket.take()
+            if wait > 0:
+                self._count(provider, "rate_limited")
+                return 429, wait
+
+        with self._rng_lock:
+            delay = profile.sample_latency(self._rng)
+            stalled = profile.slow_tail_rate > 0 and self._rng.random() < profile.slow_tail_rate
+            failed = profile.error_rate > 0 and self._rng.random() < profile.error_rate
+        if stalled:
+            delay += profile.slow_tail_ms / 1000
+            self._count(provider, "slow_tail")
+        if delay:
+            time.sleep(delay)
+        if failed:
+            self._count(provider, "errors")
+            return 503, 0.0
+        self._count(provider, "ok")
+        return 200, 0.0
+
+    def start(self) -> "MarketStandIn":
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def __enter__(self) -> "MarketStandIn":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+
+def _query_error(query: Dict[str, str]) -> Optional[str]:
+    """Why a request's query can't be answered (None if it can)."""
+    if not query.get("vin"):
+        return "vin is required"
+    if "radius" in query:
+        try:
+            radius = float(query["radius"])
+        except ValueError:
+            radius = math.nan
+        if not math.isfinite(radius) or radius < 0:
+            return f"radius must be a non-negative number of miles, got {query['radius']!r}"
+    year = query.get("year")
+    if year and not year.isdigit():
+        return f"year must be a whole number, got {year!r}"
+    return None
+
+
+def _vehicle_args(query: Dict[str, str]) -> Dict[str, Any]:
+    year = query.get("year")
+    return {
+        "make": query.get("make"),
+        "model": query.get("model"),
+        "year": int(year) if year and year.isdigit() else None,
+        "trim": query.get("trim")
+    }
+
+
+def _listings(provider: str, query: Dict[str, str]) -> Tuple[int, Dict[str, Any]]:
+    """One listing site's comparables, shaped like get_cargurus_comparables."""
+    result = get_cargurus_comparables(
+        query["vin"],
+        zip_code=query.get("zip", "33130"),
+        radius_miles=float(query.get("radius", DEFAULT_RADIUS_MILES)),
+        **_vehicle_args(query)
+    )
+    if not result["success"]:
+        return 404, result
+    listings = [comp for comp in result["comparables"] if comp.get("source") == provider]
+    if not listings:
+        return 404, {"success": False, "error": f"No {provider} listings", "vin": query["vin"]}
+    return 200, {**result, "comparables": FrozenList(listings)}
+
+
+def _kbb(query: Dict[str, str]) -> Tuple[int, Dict[str, Any]]:
+    result = get_kbb_instant_cash_offer(query["vin"], **_vehicle_args(query))
+    return (200 if result["success"] else 404), result
+
+
+ROUTES = {
+    "/kbb/v1/instant-cash-offer": ("kbb", _kbb),
+    "/cargurus/v1/listings": ("cargurus", lambda query: _listings("cargurus", query)),
+    "/autotrader/v1/listings": ("autotrader", lambda query: _listings("autotrader", query))
+}
+
+
+def _make_handler(state: MarketStandIn):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None) -> None:
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+
+            if parsed.path == "/health":
+                self._send_json(200, {"status": "ok"})
+                return
+            if parsed.path == "/stats":
+                self._send_json(200, state.stats())
+                return
+
+            route = ROUTES.get(parsed.path.rstrip("/"))
+            if route is None:
+                self._send_json(404, {"success": False, "error": "Unknown endpoint"})
+                return
+            error = _query_error(query)
+            if error is not None:
+                self._send_json(400, {"success": False, "error": error})
+                return
+
+            provider, handler = route
+            status, retry_after = state.admit(provider)
+            if status == 429:
+                self._send_json(429, {"success": False, "error": "Rate limit exceeded"},
+                                {"Retry-After": str(max(1, math.ceil(retry_after)))})
+                return
+            if status == 503:
+                self._send_json(503, {"success": False, "error": f"{provider} unavailable"})
+                return
+
+            status, payload = handler(query)
+            self._send_json(status, payload)
+
+    return Handler
+
+
+def load_profiles(path: str) -> Dict[str, FaultProfile]:
+    """Read {provider: FaultProfile fields} from a JSON file."""
+    with open(path, "r") as f:
+        return {name: FaultProfile.from_dict(data) for name, data in json.load(f).items()}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve stand-in KBB/CarGurus/AutoTrader APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--profiles", help="JSON file of fault profiles by provider")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Default fixed latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Default share of 503s")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    profiles = {"default": FaultProfile(latency_ms=args.latency_ms, error_rate=args.error_rate)}
+    if args.profiles:
+        profiles.update(load_profiles(args.profiles))
+
+    standin = MarketStandIn(profiles, args.host, args.port, args.seed)
+    print(f"Market stand-in listening on {standin.url}")
+    for name in PROVIDERS:
+        print(f"  {name}: {asdict(standin.profile(name))}")
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        standin.server.server_close()
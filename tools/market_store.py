@@ -0,0 +1,490 @@
+"""
+Process-wide market data store.
+
+Parses data/mock_market_comps.json once and hands every reader the same
+immutable snapshot, so a market lookup is a dict hit instead of a full
+re-parse. The file is re-read only when its mtime or size changes (checked
+at most once per MARKET_DATA_CHECK_SECONDS) or when invalidate() is called.
+A rewrite that fails to parse leaves the previous snapshot in service.
+
+Snapshots are built from FrozenDict / FrozenList, which behave like dict and
+list (JSON serialization, pandas, ==) but reject mutation. copy.copy,
+copy.deepcopy and pickle return plain, mutable containers for callers that
+need to edit a copy.
+
+Lookups go through a market backend: JsonMarketBackend serves the snapshot
+above with an in-memory segment index, SqliteMarketStore (see
+tools/market_db.py) serves the same queries from indexed SQLite tables for
+datasets too large to hold as one JSON file, ColumnarMarketStore (see
+tools/market_columns.py) serves them from memory-mapped column files, and
+JsonlMarketStore (see tools/market_jsonl.py) from a JSONL file through a
+byte-offset index. All answer by VIN and by (make, model, year, trim)
+segment, optionally filtered by region.
+
+Configuration (environment variables):
+    MARKET_DATA_PATH: Market comps JSON (default: data/mock_market_comps.json).
+    MARKET_DATA_CHECK_SECONDS: Min seconds between file change checks (default: 1).
+    MARKET_STORE: Backend, "json" (default), "sqlite", "columnar" or "jsonl".
+    MARKET_DB_PATH: SQLite market store (default: .cache/market.sqlite). Built
+                    from MARKET_DATA_PATH when missing or older than it.
+    MARKET_COLUMNS_PATH: Columnar market store directory (default:
+                         .cache/market_columns). Built from MARKET_DATA_PATH
+                         when missing or older than it.
+    MARKET_JSONL_PATH: JSONL market file (default: .cache/market.jsonl).
+                       Converted from MARKET_DATA_PATH when missing; its
+                       index is rebuilt whenever the file changes.
+    MARKET_DEFAULT_REGION: Region for entries without regional_data (default: Southeast).
+"""
+
+import copy
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, List, Mapping, Optional, Tuple
+
+from tools.geo import GeoGridIndex, zip_location
+
+
+DEFAULT_MARKET_DATA_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "data",
+    "mock_market_comps.json"
+)
+
+# The bundled demo comps are all Miami-area listings
+DEFAULT_REGION = os.getenv("MARKET_DEFAULT_REGION", "Southeast")
+
+
+def segment_key(
+    make: str,
+    model: str,
+    year: Any,
+    trim: Optional[str] = None
+) -> Tuple[str, str, int, Optional[str]]:
+    """
+    Normalize a (make, model, year, trim) segment for indexing and lookup.
+
+    Case and surrounding whitespace are ignored, so "HONDA" from vPIC matches
+    "Honda" in the market data.
+
+    Raises:
+        ValueError: If year is not a number
+    """
+    return (
+        make.strip().lower(),
+        model.strip().lower(),
+        int(year),
+        trim.strip().lower() if trim else None
+    )
+
+
+def entry_region(entry: Mapping[str, Any], default: str = DEFAULT_REGION) -> str:
+    """Region a market entry belongs to (regional_data.current_region, else default)."""
+    return (entry.get("regional_data") or {}).get("current_region") or default
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError(f"{type(self).__name__} is read-only; copy it to make changes")
+
+
+class FrozenDict(dict):
+    """A dict that rejects mutation. Copies are plain dicts."""
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self) -> Dict[Any, Any]:
+        return dict(self)
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> Dict[Any, Any]:
+        return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class FrozenList(list):
+    """A list that rejects mutation. Copies are plain lists."""
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = remove = pop = clear = sort = reverse = _read_only
+
+    def __copy__(self) -> list:
+        return list(self)
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> list:
+        return [copy.deepcopy(value, memo) for value in self]
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def freeze(value: Any) -> Any:
+    """Recursively convert parsed JSON into FrozenDict / FrozenList."""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(item) for item in value)
+    return value
+
+
+class MarketSnapshot(FrozenDict):
+    """Immutable market data keyed by VIN, tagged with the load it came from."""
+
+    __slots__ = ("version", "loaded_at", "source_mtime")
+
+    def __init__(self, data: Dict[str, Any], version: int, source_mtime: float):
+        super().__init__((key, freeze(value)) for key, value in data.items())
+        self.version = version
+        self.loaded_at = time.time()
+        self.source_mtime = source_mtime
+
+
+class MarketDataStore:
+    """
+    Load-once, change-aware holder for the market comps file.
+
+    Readers never block on a reload: they keep using the snapshot they hold
+    while a new one is parsed, and the swap is a single reference update.
+    """
+
+    def __init__(self, path: str = DEFAULT_MARKET_DATA_PATH, check_interval: float = 1.0):
+        """
+        Args:
+            path: Market comps JSON file
+            check_interval: Min seconds between file change checks (0 checks every call)
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot: Optional[MarketSnapshot] = None
+        self._signature: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+        self._stale = False
+        self._counters = {"loads": 0, "checks": 0, "reload_errors": 0}
+
+    def _file_signature(self) -> Tuple[int, int]:
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def snapshot(self) -> MarketSnapshot:
+        """
+        Return the current snapshot, reloading first if the file changed.
+
+        Returns:
+            The shared, immutable MarketSnapshot
+
+        Raises:
+            OSError, ValueError: If the file can't be loaded and no earlier
+                snapshot exists
+        """
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and not self._stale and now - self._checked_at < self.check_interval:
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is not None and not self._stale and now - self._checked_at < self.check_interval:
+                return self._snapshot
+            self._checked_at = now
+            self._counters["checks"] += 1
+            try:
+                signature = self._file_signature()
+                if self._snapshot is None or self._stale or signature != self._signature:
+                    self._load(signature)
+            except (OSError, ValueError):
+                if self._snapshot is None:
+                    raise
+                self._counters["reload_errors"] += 1
+            return self._snapshot
+
+    def _load(self, signature: Tuple[int, int]) -> None:
+        """Parse the file and publish a new snapshot (caller holds the lock)."""
+        with open(self.path, "r") as f:
+            data = json.load(f)
+        version = self._snapshot.version + 1 if self._snapshot is not None else 1
+        self._snapshot = MarketSnapshot(data, version, signature[0] / 1e9)
+        self._signature = signature
+        self._stale = False
+        self._counters["loads"] += 1
+
+    def invalidate(self) -> None:
+        """Force a reload on the next read, even if the file looks unchanged."""
+        with self._lock:
+            self._stale = True
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report load activity.
+
+        Returns:
+            Dictionary with loads, checks, reload_errors, the current
+            snapshot version and entry count, and the file path
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            return {
+                **self._counters,
+                "version": snapshot.version if snapshot is not None else None,
+                "entries": len(snapshot) if snapshot is not None else 0,
+                "path": self.path
+            }
+
+
+def locate_comparable(comp: Mapping[str, Any], distance_miles: float) -> FrozenDict:
+    """Copy a listing with its distance measured from the search origin."""
+    return freeze({**comp, "distance_miles": round(distance_miles, 1)})
+
+
+class _SnapshotIndex:
+    """Segment and per-segment spatial indexes built over one snapshot."""
+
+    __slots__ = ("segments", "geo")
+
+    def __init__(self, snapshot: MarketSnapshot):
+        self.segments: Dict[Tuple[str, str, int], List[str]] = {}
+        listings: Dict[Tuple[str, str, int], list] = {}
+        for vin, entry in snapshot.items():
+            info = entry["vehicle_info"]
+            make, model, year, _ = segment_key(info["make"], info["model"], info["year"])
+            self.segments.setdefault((make, model, year), []).append(vin)
+            for comp in entry["comparables"]:
+                location = zip_location(comp.get("dealer_zip"))
+                if location is not None:
+                    listings.setdefault((make, model, year), []).append(((vin, comp), *location))
+        # One grid per segment, so a radius query never touches other models
+        self.geo = {segment: GeoGridIndex(points) for segment, points in listings.items()}
+
+
+class JsonMarketBackend:
+    """
+    Market queries over the in-memory JSON snapshot.
+
+    VIN lookups are dict hits. Segment lookups use an index from
+    (make, model, year) to VINs and radius searches use a grid index over
+    dealer locations; both are rebuilt whenever the snapshot is reloaded.
+    """
+
+    def __init__(self, store: Optional[MarketDataStore] = None, default_region: str = DEFAULT_REGION):
+        """
+        Args:
+            store: Snapshot source (default: the process-wide store)
+            default_region: Region for entries without regional_data
+        """
+        self._store = store
+        self.default_region = default_region
+        self._lock = threading.Lock()
+        self._indexed: Optional[MarketSnapshot] = None
+        self._index: Optional[_SnapshotIndex] = None
+
+    def snapshot(self) -> MarketSnapshot:
+        """The snapshot queries are answered from (reloaded if the file changed)."""
+        return (self._store or get_market_store()).snapshot()
+
+    def _indexes(self, snapshot: MarketSnapshot) -> _SnapshotIndex:
+        if self._indexed is not snapshot:
+            with self._lock:
+                if self._indexed is not snapshot:
+                    self._index = _SnapshotIndex(snapshot)
+                    self._indexed = snapshot
+        return self._index
+
+    def _matches(self, entry: Mapping[str, Any], trim_key: Optional[str], region: Optional[str]) -> bool:
+        if trim_key is not None and entry["vehicle_info"].get("trim", "").strip().lower() != trim_key:
+            return False
+        return region is None or entry_region(entry, self.default_region) == region
+
+    def get_vehicle(self, vin: str) -> Optional[Mapping[str, Any]]:
+        """
+        Look up the market entry recorded for a VIN.
+
+        Returns:
+            Read-only entry (vehicle_info, kbb_data, comparables,
+            market_summary, ...), or None
+        """
+        return self.snapshot().get(vin)
+
+    def find_vehicles(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str] = None,
+        region: Optional[str] = None,
+        limit: int = 10
+    ) -> List[Mapping[str, Any]]:
+        """
+        Find market entries for vehicles in a segment.
+
+        Args:
+            make: Vehicle make
+            model: Vehicle model
+            year: Model year
+            trim: Also match trim (None matches any)
+            region: Also match region (None matches any)
+            limit: Max entries returned
+
+        Returns:
+            Read-only entries shaped like get_vehicle()
+        """
+        snapshot = self.snapshot()
+        make_key, model_key, year_key, trim_key = segment_key(make, model, year, trim)
+        matches = []
+        for vin in self._indexes(snapshot).segments.get((make_key, model_key, year_key), ()):
+            entry = snapshot[vin]
+            if not self._matches(entry, trim_key, region):
+                continue
+            matches.append(entry)
+            if len(matches) >= limit:
+                break
+        return matches
+
+    def find_comparables(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str] = None,
+        region: Optional[str] = None,
+        limit: int = 100,
+        near: Optional[Tuple[float, float]] = None,
+        radius_miles: float = 25.0
+    ) -> List[Mapping[str, Any]]:
+        """
+        Find comparable listings in a segment, nearest first.
+
+        Listings that appear under several entries are returned once.
+
+        Args:
+            make: Vehicle make
+            model: Vehicle model
+            year: Model year
+            trim: Also match trim (None matches any)
+            region: Also match region (None matches any)
+            limit: Max listings returned
+            near: (lat, lon) search origin; when given, only listings within
+                radius_miles are returned, with distance_miles measured from it
+            radius_miles: Search radius used with near
+
+        Returns:
+            Read-only comparable listings
+        """
+        if near is not None:
+            return self._find_comparables_near(make, model, year, trim, region, limit, near, radius_miles)
+
+        seen = set()
+        comparables = []
+        for entry in self.find_vehicles(make, model, year, trim, region, limit=len(self.snapshot())):
+            for comp in entry["comparables"]:
+                if comp["comparable_vin"] not in seen:
+                    seen.add(comp["comparable_vin"])
+                    comparables.append(comp)
+        comparables.sort(key=lambda comp: comp.get("distance_miles", 0))
+        return comparables[:limit]
+
+    def _find_comparables_near(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str],
+        region: Optional[str],
+        limit: int,
+        near: Tuple[float, float],
+        radius_miles: float
+    ) -> List[Mapping[str, Any]]:
+        """Radius search over the dealer-location index, filtered to a segment."""
+        snapshot = self.snapshot()
+        index = self._indexes(snapshot)
+        make_key, model_key, year_key, trim_key = segment_key(make, model, year, trim)
+        geo = index.geo.get((make_key, model_key, year_key))
+        if geo is None:
+            return []
+
+        seen = set()
+        comparables = []
+        for distance, (vin, comp) in geo.query_radius(near[0], near[1], radius_miles):
+            if comp["comparable_vin"] in seen:
+                continue
+            if not self._matches(snapshot[vin], trim_key, region):
+                continue
+            seen.add(comp["comparable_vin"])
+            comparables.append(locate_comparable(comp, distance))
+            if len(comparables) >= limit:
+                break
+        return comparables
+
+
+_default_store: Optional[MarketDataStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_market_store() -> MarketDataStore:
+    """Return the process-wide market data store, creating it on first use."""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = MarketDataStore(
+                    path=os.getenv("MARKET_DATA_PATH", DEFAULT_MARKET_DATA_PATH),
+                    check_interval=float(os.getenv("MARKET_DATA_CHECK_SECONDS", "1"))
+                )
+    return _default_store
+
+
+def set_market_store(store: Optional[MarketDataStore]) -> None:
+    """Replace the process-wide store (None recreates it from the environment on next use)."""
+    global _default_store
+    with _default_store_lock:
+        _default_store = store
+
+
+_default_backend: Any = None
+
+
+def get_market_backend() -> Any:
+    """
+    Return the process-wide market backend selected by MARKET_STORE.
+
+    Returns:
+        JsonMarketBackend (default), SqliteMarketStore, ColumnarMarketStore
+        or JsonlMarketStore
+    """
+    global _default_backend
+    if _default_backend is None:
+        with _default_store_lock:
+            if _default_backend is None:
+                kind = os.getenv("MARKET_STORE", "json").lower()
+                if kind == "sqlite":
+                    from tools.market_db import DEFAULT_MARKET_DB_PATH, open_market_db
+                    _default_backend = open_market_db(
+                        os.getenv("MARKET_DB_PATH", DEFAULT_MARKET_DB_PATH),
+                        os.getenv("MARKET_DATA_PATH", DEFAULT_MARKET_DATA_PATH)
+                    )
+                elif kind == "columnar":
+                    from tools.market_columns import DEFAULT_MARKET_COLUMNS_PATH, open_market_columns
+                    _default_backend = open_market_columns(
+                        os.getenv("MARKET_COLUMNS_PATH", DEFAULT_MARKET_COLUMNS_PATH),
+                        os.getenv("MARKET_DATA_PATH", DEFAULT_MARKET_DATA_PATH)
+                    )
+                elif kind == "jsonl":
+                    from tools.market_jsonl import DEFAULT_MARKET_JSONL_PATH, open_market_jsonl
+                    _default_backend = open_market_jsonl(
+                        os.getenv("MARKET_JSONL_PATH", DEFAULT_MARKET_JSONL_PATH),
+                        os.getenv("MARKET_DATA_PATH", DEFAULT_MARKET_DATA_PATH)
+                    )
+                else:
+                    _default_backend = JsonMarketBackend()
+    return _default_backend
+
+
+def set_market_backend(backend: Any) -> None:
+    """Replace the process-wide market backend (None re-selects it from the environment)."""
+    global _default_backend
+    with _default_store_lock:
+        _default_backend = backend
@@ -0,0 +1,343 @@
+"""
+Incrementally maintained market summaries.
+
+The market_summary blocks in mock_market_comps.json are computed once and
+frozen. MarketSummaryAggregator keeps them current as listings arrive and
+sell: each key (a VIN or a make/model/year segment) holds its listing
+prices plus running count, mean, variance (Welford's algorithm, which
+also runs in reverse for removals), min and max, so every update is O(1).
+
+Outlier filtering needs a pass over a key's prices, so it is done lazily:
+an update only marks the key dirty, and outliers_removed / avg_price are
+recomputed when the summary is next read. refresh() recomputes every dirty
+key in a single vectorized batch (see tools/outliers.py). The same pass
+re-anchors the running mean and variance so removals never accumulate
+floating-point drift.
+
+A VIN seeded from an entry that carries a market_summary serves that
+recorded summary until one of its listings changes; from then on it is
+computed from the running statistics.
+
+A segment key counts each car once even when several VINs list it as a
+comparable; the car leaves the segment only when the last of those VINs
+drops it.
+
+tools/api_mocks.py serves every VIN's market_summary from the aggregator
+of the current market data (get_market_summaries()), so listing updates fed
+to it show up in the next response.
+"""
+
+import threading
+from typing import Any, Dict, Hashable, Iterable, List, Mapping, Optional, Set, Tuple, Union
+
+import numpy as np
+
+from tools.market_store import segment_key
+from tools.outliers import filter_outliers_batch
+
+
+class RunningStats:
+    """Count, mean, variance, min and max under inserts and deletes."""
+
+    __slots__ = (
+        "prices", "count", "mean", "m2", "min", "max",
+        "_extremes_dirty", "_outliers_dirty", "avg_price", "outliers_removed"
+    )
+
+    def __init__(self):
+        self.prices: Dict[Hashable, float] = {}
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self._extremes_dirty = False
+        self._outliers_dirty = True
+        self.avg_price = 0.0
+        self.outliers_removed = 0
+
+    def add(self, listing_id: Hashable, price: float) -> None:
+        """Add a listing, replacing any earlier price for the same listing."""
+        if listing_id in self.prices:
+            self.remove(listing_id)
+        self.prices[listing_id] = price
+        self.count += 1
+        delta = float(price) - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (float(price) - self.mean)
+        if not self._extremes_dirty:
+            self.min = price if self.min is None else min(self.min, price)
+            self.max = price if self.max is None else max(self.max, price)
+        self._outliers_dirty = True
+
+    def remove(self, listing_id: Hashable) -> bool:
+        """
+        Remove a listing.
+
+        Returns:
+            False if the listing wasn't present
+        """
+        price = self.prices.pop(listing_id, None)
+        if price is None:
+            return False
+        if self.count == 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+        else:
+            mean = (self.count * self.mean - price) / (self.count - 1)
+            self.m2 = max(0.0, self.m2 - (price - mean) * (price - self.mean))
+            self.mean = mean
+            self.count -= 1
+        # Only a removed extreme needs a rescan, and only when next read
+        if price == self.min or price == self.max:
+            self._extremes_dirty = True
+        self._outliers_dirty = True
+        return True
+
+    @property
+    def variance(self) -> float:
+        """Sample variance (ddof=1); 0 below two listings."""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def extremes(self) -> Tuple[Optional[float], Optional[float]]:
+        """(min, max) price, rescanning only after an extreme was removed."""
+        if self._extremes_dirty:
+            self.min = min(self.prices.values()) if self.prices else None
+            self.max = max(self.prices.values()) if self.prices else None
+            self._extremes_dirty = False
+        return self.min, self.max
+
+    @property
+    def outliers_dirty(self) -> bool:
+        return self._outliers_dirty
+
+    def apply_outliers(self, avg_price: float, outliers_removed: int, mean: float, std_dev: float) -> None:
+        """Store a lazy outlier pass and re-anchor the running moments to it."""
+        self.avg_price = avg_price
+        self.outliers_removed = outliers_removed
+        if self.count > 1:
+            self.mean = mean
+            self.m2 = std_dev ** 2 * (self.count - 1)
+        self._outliers_dirty = False
+
+
+class MarketSummaryAggregator:
+    """
+    Live market summaries keyed by VIN, segment or any other hashable key.
+
+    Thread-safe; updates and reads take one lock.
+    """
+
+    def __init__(self, method: str = "zscore", threshold: Optional[float] = None):
+        """
+        Args:
+            method: Outlier rule for the lazy pass ("zscore", "mad" or "iqr")
+            threshold: Rule threshold (default: the rule's default)
+        """
+        self.method = method
+        self.threshold = threshold
+        self._keys: Dict[Hashable, RunningStats] = {}
+        # Entries' market_summary blocks, served until the key changes
+        self._recorded: Dict[Hashable, Dict[str, Any]] = {}
+        # VINs listing each (segment key, comparable_vin)
+        self._listed_by: Dict[Tuple[Hashable, Hashable], Set[str]] = {}
+        self._lock = threading.Lock()
+        self._counters = {"updates": 0, "outlier_passes": 0}
+
+    @classmethod
+    def from_entries(
+        cls,
+        entries: Union[Mapping[str, Mapping[str, Any]], Iterable[Mapping[str, Any]]],
+        **kwargs: Any
+    ) -> "MarketSummaryAggregator":
+        """
+        Seed an aggregator from market entries shaped like mock_market_comps.json.
+
+        entries is keyed by VIN, or any iterable of entries such as a
+        market backend's entries() (keyed by vehicle_info.vin). Every
+        comparable is added under its entry's VIN and under the entry's
+        segment key (see add_listing); the entry's market_summary, if any,
+        is kept as that VIN's summary until its listings change.
+        """
+        aggregator = cls(**kwargs)
+        items = entries.items() if isinstance(entries, Mapping) else (
+            (entry["vehicle_info"]["vin"], entry) for entry in entries
+        )
+        for vin, entry in items:
+            info = entry["vehicle_info"]
+            for comp in entry.get("comparables", []):
+                aggregator.add_listing(vin, info, comp)
+            if entry.get("market_summary") is not None:
+                aggregator._recorded[vin] = dict(entry["market_summary"])
+        return aggregator
+
+    @staticmethod
+    def segment(vehicle_info: Mapping[str, Any]) -> Tuple[str, str, str, int]:
+        """Summary key for a vehicle's make/model/year segment."""
+        make, model, year, _ = segment_key(vehicle_info["make"], vehicle_info["model"], vehicle_info["year"])
+        return "segment", make, model, year
+
+    def add(self, key: Hashable, listing_id: Hashable, price: float) -> None:
+        """Add (or re-price) one listing under one key."""
+        with self._lock:
+            self._add_locked(key, listing_id, price)
+
+    def remove(self, key: Hashable, listing_id: Hashable) -> bool:
+        """
+        Remove one listing from one key.
+
+        Returns:
+            False if the key or listing wasn't present
+        """
+        with self._lock:
+            return self._remove_locked(key, listing_id)
+
+    def _add_locked(self, key: Hashable, listing_id: Hashable, price: float) -> None:
+        self._keys.setdefault(key, RunningStats()).add(listing_id, price)
+        self._recorded.pop(key, None)
+        self._counters["updates"] += 1
+
+    def _remove_locked(self, key: Hashable, listing_id: Hashable) -> bool:
+        stats = self._keys.get(key)
+        if stats is None or not stats.remove(listing_id):
+            return False
+        if stats.count == 0:
+            del self._keys[key]
+        self._recorded.pop(key, None)
+        self._counters["updates"] += 1
+        return True
+
+    def add_listing(self, vin: str, vehicle_info: Mapping[str, Any], listing: Mapping[str, Any]) -> None:
+        """
+        Record a comparable listing for a VIN and for its segment.
+
+        Args:
+            vin: VIN the listing is a comparable for
+            vehicle_info: That VIN's vehicle_info (make, model, year)
+            listing: Comparable listing with comparable_vin and price
+        """
+        segment = self.segment(vehicle_info)
+        comparable_vin = listing["comparable_vin"]
+        with self._lock:
+            self._add_locked(vin, comparable_vin, listing["price"])
+            self._add_locked(segment, comparable_vin, listing["price"])
+            self._listed_by.setdefault((segment, comparable_vin), set()).add(vin)
+
+    def remove_listing(self, vin: str, vehicle_info: Mapping[str, Any], comparable_vin: str) -> bool:
+        """
+        Drop a comparable listing (e.g. it sold) from a VIN and its segment.
+
+        The listing stays in the segment while any other VIN still lists it.
+
+        Returns:
+            False if the VIN didn't list it
+        """
+        segment = self.segment(vehicle_info)
+        with self._lock:
+            removed = self._remove_locked(vin, comparable_vin)
+            listed_by = self._listed_by.get((segment, comparable_vin))
+            if listed_by is None or vin not in listed_by:
+                return removed
+            listed_by.discard(vin)
+            if not listed_by:
+                del self._listed_by[(segment, comparable_vin)]
+                self._remove_locked(segment, comparable_vin)
+            return True
+
+    def refresh(self, keys: Optional[Iterable[Hashable]] = None) -> int:
+        """
+        Recompute outlier statistics for dirty keys in one vectorized batch.
+
+        Args:
+            keys: Keys to refresh (default: every dirty key)
+
+        Returns:
+            Number of keys recomputed
+        """
+        with self._lock:
+            return self._refresh_locked(self._keys if keys is None else keys)
+
+    def _refresh_locked(self, keys: Iterable[Hashable]) -> int:
+        dirty: List[RunningStats] = [
+            self._keys[key] for key in keys if key in self._keys and self._keys[key].outliers_dirty
+        ]
+        if not dirty:
+            return 0
+
+        offsets = np.zeros(len(dirty) + 1, dtype=np.int64)
+        np.cumsum([stats.count for stats in dirty], out=offsets[1:])
+        values = np.fromiter(
+            (price for stats in dirty for price in stats.prices.values()), dtype=np.float64, count=int(offsets[-1])
+        )
+        batch = filter_outliers_batch(values, offsets, self.method, self.threshold)
+
+        for i, stats in enumerate(dirty):
+            stats.apply_outliers(
+                float(batch["avg"][i]),
+                int(batch["outliers_removed"][i]),
+                float(batch["original_avg"][i]),
+                float(batch["std_dev"][i]) if stats.count > 1 else 0.0
+            )
+        self._counters["outlier_passes"] += 1
+        return len(dirty)
+
+    def stats(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """
+        Running statistics for a key, always current without a rescan.
+
+        Returns:
+            Dictionary with count, mean, variance, std_dev, min and max,
+            or None for an unknown key
+        """
+        with self._lock:
+            stats = self._keys.get(key)
+            if stats is None:
+                return None
+            low, high = stats.extremes()
+            return {
+                "count": stats.count,
+                "mean": stats.mean,
+                "variance": stats.variance,
+                "std_dev": stats.variance ** 0.5,
+                "min": low,
+                "max": high
+            }
+
+    def summary(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """
+        market_summary for a key, shaped like the one in mock_market_comps.json.
+
+        A recorded summary (see from_entries) is returned as is; otherwise
+        outlier-dependent fields are recomputed here if the key changed
+        since they were last computed.
+
+        Returns:
+            Dictionary with avg_price (outliers excluded), min_price,
+            max_price, total_comparables and outliers_removed, or None for
+            an unknown key
+        """
+        with self._lock:
+            if key in self._recorded:
+                return dict(self._recorded[key])
+            stats = self._keys.get(key)
+            if stats is None:
+                return None
+            self._refresh_locked([key])
+            low, high = stats.extremes()
+            return {
+                "avg_price": round(float(stats.avg_price)),
+                "min_price": low,
+                "max_price": high,
+                "total_comparables": stats.count,
+                "outliers_removed": stats.outliers_removed
+            }
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def counters(self) -> Dict[str, int]:
+        """Updates applied and lazy outlier passes run."""
+        with self._lock:
+            return dict(self._counters)
@@ -4,67 +4,367 @@ This is a FREE real API with no authentication required.
 https://vpic.nhtsa.dot.gov/api/
 """
 
+import asyncio
+import os
+import threading
+import httpx
 import requests
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterable, List, Optional, Union
 
+from tools.http_client import AsyncResilientSession, CircuitBreaker, ResilientSession
+from tools.singleflight import SingleFlight
+from tools.vehicle_record import DecodedVehicle
+from tools.vin_cache import VinCache, get_vin_cache
+from tools.vpic_snapshot import get_vpic_snapshot
+from tools.vin_check import check_vin, check_vins, normalize_vin
 
-def decode_vin(vin: str) -> Dict[str, Any]:
+
+# Base URL for the vPIC API (override to point at a local stand-in)
+NHTSA_API_URL = os.getenv("NHTSA_API_URL", "https://vpic.nhtsa.dot.gov/api")
+
+# Reject VINs whose check digit doesn't compute before any decode (snapshot,
+# cache or live API). Off by default: vPIC itself decodes such VINs and only
+# flags them, so they keep decoding unless a deployment opts in.
+STRICT_CHECK_DIGIT = os.getenv("VIN_STRICT_CHECK_DIGIT", "false").lower() == "true"
+
+# DecodeVINValuesBatch accepts at most 50 VINs per request
+BATCH_SIZE = 50
+
+# Concurrent decodes of the same VIN share one cache lookup / vPIC call.
+# Records are immutable and error dicts are copied by _render, so the
+# outcome is shared as-is.
+_decode_flight = SingleFlight()
+
+_client: Optional[ResilientSession] = None
+_client_lock = threading.Lock()
+
+
+def get_nhtsa_client() -> ResilientSession:
+    """
+    Return the shared pooled HTTP client for vPIC calls.
+
+    Configuration (environment variables):
+        NHTSA_POOL_SIZE: Keep-alive connections to vPIC (default: 20).
+        NHTSA_MAX_RETRIES: Retries per call after the first attempt (default: 2).
+        NHTSA_DEADLINE_SECONDS: Total time budget per call (default: 10).
+        NHTSA_BREAKER_THRESHOLD: Consecutive failures that open the breaker (default: 5).
+        NHTSA_BREAKER_RESET_SECONDS: Seconds before a probe is let through (default: 30).
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ResilientSession(
+                    pool_size=int(os.getenv("NHTSA_POOL_SIZE", "20")),
+                    max_retries=int(os.getenv("NHTSA_MAX_RETRIES", "2")),
+                    deadline=float(os.getenv("NHTSA_DEADLINE_SECONDS", "10")),
+                    breaker=CircuitBreaker(
+                        failure_threshold=int(os.getenv("NHTSA_BREAKER_THRESHOLD", "5")),
+                        reset_timeout=float(os.getenv("NHTSA_BREAKER_RESET_SECONDS", "30"))
+                    )
+                )
+    return _client
+
+
+def set_nhtsa_client(client: Optional[ResilientSession]) -> None:
+    """Replace the shared vPIC client (used by tests and custom setups)."""
+    global _client
+    with _client_lock:
+        _client = client
+
+
+_async_client: Optional[AsyncResilientSession] = None
+
+
+def get_nhtsa_async_client() -> AsyncResilientSession:
+    """
+    Return the shared async vPIC client.
+
+    Uses the same NHTSA_* settings as get_nhtsa_client() and shares its
+    circuit breaker, so sync and async callers see one view of vPIC health.
+    """
+    global _async_client
+    if _async_client is None:
+        sync_client = get_nhtsa_client()
+        with _client_lock:
+            if _async_client is None:
+                _async_client = AsyncResilientSession(
+                    pool_size=int(os.getenv("NHTSA_POOL_SIZE", "20")),
+                    max_retries=sync_client.max_retries,
+                    backoff_base=sync_client.backoff_base,
+                    backoff_max=sync_client.backoff_max,
+                    attempt_timeout=sync_client.attempt_timeout,
+                    deadline=sync_client.deadline,
+                    breaker=sync_client.breaker
+                )
+    return _async_client
+
+
+def set_nhtsa_async_client(client: Optional[AsyncResilientSession]) -> None:
+    """Replace the shared async vPIC client (used by tests and custom setups)."""
+    global _async_client
+    with _client_lock:
+        _async_client = client
+
+
+def get_nhtsa_metrics() -> Dict[str, Any]:
+    """
+    Report vPIC client and decode cache health.
+
+    Returns:
+        Dictionary with HTTP client metrics (connection reuse, retries,
+        circuit breaker state) and VIN cache stats
+    """
+    cache = get_vin_cache()
+    return {
+        "http": get_nhtsa_client().metrics(),
+        "cache": cache.stats() if cache is not None else None
+    }
+
+
+# A decode in flight: a record on success, an error dictionary otherwise
+_Outcome = Union[DecodedVehicle, Dict[str, Any]]
+
+
+def decode_vin(
+    vin: str,
+    use_cache: bool = True,
+    use_snapshot: bool = True,
+    fields: Optional[Iterable[str]] = None
+) -> Dict[str, Any]:
     """
     Decode a VIN using the free NHTSA API.
 
+    VINs covered by the local vPIC snapshot are decoded offline; the live API
+    is the fallback for patterns the snapshot doesn't cover. Successful
+    decodes are cached (in memory and on disk), so repeat lookups for the
+    same VIN never touch the network. A VIN whose build pattern (squish VIN)
+    has already been decoded cleanly is also served locally.
+
+    Live calls go through a pooled client with retries, a deadline and a
+    circuit breaker. If vPIC fails or the breaker is open, an expired cache
+    entry is returned (marked "stale") rather than an error.
+
+    Malformed VINs are rejected locally. With VIN_STRICT_CHECK_DIGIT=true,
+    so are VINs failing the position-9 check digit (where it is mandatory);
+    the check comes before the snapshot, cache or live API is consulted.
+
+    Concurrent calls for the same VIN are coalesced: one thread does the
+    lookup and the others wait for its result.
+
+    Args:
+        vin: Vehicle Identification Number (17 characters)
+        use_cache: Read from and write to the VIN decode cache
+        use_snapshot: Decode from the local vPIC snapshot when it covers the VIN
+        fields: Result fields to return (e.g. ("make", "model", "year")).
+            None returns every field, including full_data; leave full_data
+            out to keep the result small.
+
+    Returns:
+        Dictionary with vehicle specifications
+    """
+    return _render(decode_vehicle(vin, use_cache, use_snapshot), vin, fields)
+
+
+def decode_vehicle(vin: str, use_cache: bool = True, use_snapshot: bool = True) -> _Outcome:
+    """
+    Decode a VIN into a compact DecodedVehicle record.
+
+    Same lookup order as decode_vin, without rendering a result dictionary.
+
+    Args:
+        vin: Vehicle Identification Number (17 characters)
+        use_cache: Read from and write to the VIN decode cache
+        use_snapshot: Decode from the local vPIC snapshot when it covers the VIN
+
+    Returns:
+        The record, or an error dictionary (success False) if the VIN could
+        not be decoded
+    """
+    local = _decode_locally(vin, use_snapshot)
+    if local is not None:
+        return local
+    return _decode_flight.do((normalize_vin(vin), use_cache), _decode_remote, vin, use_cache)
+
+
+def _render(outcome: _Outcome, vin: str, fields: Optional[Iterable[str]]) -> Dict[str, Any]:
+    """Turn a decode outcome into a fresh decode_vin result for the caller's VIN."""
+    if isinstance(outcome, DecodedVehicle):
+        return outcome.with_vin(vin).to_dict(fields)
+    return {**outcome, "vin": vin}
+
+
+def _decode_remote(vin: str, use_cache: bool) -> _Outcome:
+    """Cache tiers, then the live API, then stale cache entries."""
+    cache = get_vin_cache() if use_cache else None
+    key = normalize_vin(vin)
+
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is None:
+            cached = cache.get_pattern(key)
+            if cached is not None:
+                cache.put(key, cached)
+        if cached is not None:
+            return DecodedVehicle.from_compact(cached, vin=key)
+
+    result = _fetch_vin(key)
+
+    if cache is not None and isinstance(result, DecodedVehicle):
+        compact = result.to_compact()
+        cache.put(key, compact)
+        if result.is_clean():
+            cache.put_pattern(key, compact)
+    elif cache is not None:
+        stale = _serve_stale(cache, key)
+        if stale is not None:
+            return stale
+
+    return result
+
+
+async def decode_vin_async(
+    vin: str,
+    use_cache: bool = True,
+    use_snapshot: bool = True,
+    fields: Optional[Iterable[str]] = None
+) -> Dict[str, Any]:
+    """
+    Decode a VIN without blocking the running event loop.
+
+    Same lookup order and result as decode_vin (local checks, snapshot,
+    cache tiers, live API, stale fallback), but the live call uses the async
+    pooled client and SQLite cache access runs in worker threads. Use this
+    from ADK tools and other coroutines. Concurrent calls for the same VIN
+    on one event loop are coalesced.
+
     Args:
         vin: Vehicle Identification Number (17 characters)
+        use_cache: Read from and write to the VIN decode cache
+        use_snapshot: Decode from the local vPIC snapshot when it covers the VIN
+        fields: Result fields to return; None returns every field
 
     Returns:
         Dictionary with vehicle specifications
     """
-    if not vin or len(vin) != 17:
+    local = _decode_locally(vin, use_snapshot)
+    if local is None:
+        local = await _decode_flight.do_async(
+            (normalize_vin(vin), use_cache), _decode_remote_async, vin, use_cache
+        )
+    return _render(local, vin, fields)
+
+
+async def _decode_remote_async(vin: str, use_cache: bool) -> _Outcome:
+    """Async cache tiers, then the live API, then stale cache entries."""
+    cache = get_vin_cache() if use_cache else None
+    key = normalize_vin(vin)
+
+    if cache is not None:
+        cached = await cache.aget(key)
+        if cached is None:
+            cached = await cache.aget_pattern(key)
+            if cached is not None:
+                await cache.aput(key, cached)
+        if cached is not None:
+            return DecodedVehicle.from_compact(cached, vin=key)
+
+    result = await _fetch_vin_async(key)
+
+    if cache is not None and isinstance(result, DecodedVehicle):
+        compact = result.to_compact()
+        await cache.aput(key, compact)
+        if result.is_clean():
+            await cache.aput_pattern(key, compact)
+    elif cache is not None:
+        stale = await asyncio.to_thread(_serve_stale, cache, key)
+        if stale is not None:
+            return stale
+
+    return result
+
+
+def _decode_locally(vin: str, use_snapshot: bool) -> Optional[_Outcome]:
+    """
+    Answer a decode without the cache or network, where possible.
+
+    Returns:
+        A local rejection (malformed VIN, bad check digit) or an offline
+        snapshot decode; None when the cache/live API must be consulted
+    """
+    check = check_vin(vin)
+    if not check["structure_valid"]:
+        return {
+            "success": False,
+            "error": check["errors"][0],
+            "vin": vin
+        }
+
+    if STRICT_CHECK_DIGIT and not check["valid"]:
         return {
             "success": False,
-            "error": "Invalid VIN format. VIN must be 17 characters.",
+            "error": check["errors"][0],
             "vin": vin
         }
 
-    # NHTSA VIN Decoder API endpoint
-    url = f"https://vpic.nhtsa.dot.gov/api/vehicles/DecodeVin/{vin}?format=json"
+    snapshot = get_vpic_snapshot() if use_snapshot else None
+    if snapshot is not None:
+        return snapshot.decode_record(vin)
+
+    return None
+
+
+def _serve_stale(cache: VinCache, vin: str) -> Optional[DecodedVehicle]:
+    """
+    Fall back to an expired cache entry when vPIC is unavailable.
+
+    Returns:
+        The stale decode (rendered with "stale": True), or None
+    """
+    stale = cache.get(vin, allow_stale=True) or cache.get_pattern(vin, allow_stale=True)
+    if stale is None:
+        return None
+    return DecodedVehicle.from_compact(stale, vin=vin).mark_stale()
+
+
+def _fetch_vin(vin: str) -> _Outcome:
+    """Decode a single VIN over the network, bypassing the cache."""
+    # Flat DecodeVinValues returns one row instead of ~140 Variable/Value rows
+    url = f"{NHTSA_API_URL}/vehicles/DecodeVinValues/{vin}?format=json"
 
     try:
-        response = requests.get(url, timeout=10)
+        response = get_nhtsa_client().get(url)
         response.raise_for_status()
 
         data = response.json()
+        return _parse_flat_response(vin, data.get("Results", []))
+
+    except requests.exceptions.RequestException as e:
+        return {
+            "success": False,
+            "error": f"API request failed: {str(e)}",
+            "vin": vin
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Failed to decode VIN: {str(e)}",
+            "vin": vin
+        }
 
-        # Extract key vehicle information
-        results = data.get("Results", [])
 
-        # Parse results into a clean dictionary
-        vehicle_info = {}
-        for item in results:
-            variable = item.get("Variable", "")
-            value = item.get("Value", "")
+async def _fetch_vin_async(vin: str) -> _Outcome:
+    """Decode a single VIN over the network with the async client, bypassing the cache."""
+    url = f"{NHTSA_API_URL}/vehicles/DecodeVinValues/{vin}?format=json"
 
-            # Only include non-null values
-            if value and value not in ["", "Not Applicable"]:
-                vehicle_info[variable] = value
+    try:
+        response = await get_nhtsa_async_client().get(url)
+        response.raise_for_status()
 
-        # Extract commonly used fields
-        return {
-            "success": True,
-            "vin": vin,
-            "make": vehicle_info.get("Make", "Unknown"),
-            "model": vehicle_info.get("Model", "Unknown"),
-            "year": vehicle_info.get("Model Year", "Unknown"),
-            "trim": vehicle_info.get("Trim", "Unknown"),
-            "body_class": vehicle_info.get("Body Class", "Unknown"),
-            "engine": vehicle_info.get("Engine Model", "Unknown"),
-            "fuel_type": vehicle_info.get("Fuel Type - Primary", "Unknown"),
-            "manufacturer": vehicle_info.get("Manufacturer Name", "Unknown"),
-            "plant_city": vehicle_info.get("Plant City", "Unknown"),
-            "vehicle_type": vehicle_info.get("Vehicle Type", "Unknown"),
-            "full_data": vehicle_info  # Include all decoded fields
-        }
+        data = response.json()
+        return _parse_flat_response(vin, data.get("Results", []))
 
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, httpx.HTTPError) as e:
         return {
             "success": False,
             "error": f"API request failed: {str(e)}",
@@ -78,16 +378,184 @@ def decode_vin(vin: str) -> Dict[str, Any]:
         }
 
 
-def validate_vin(vin: str) -> Dict[str, Any]:
+def _parse_flat_response(vin: str, results: List[Dict[str, Any]]) -> _Outcome:
+    """Parse a single-VIN DecodeVinValues response."""
+    if not results:
+        return {
+            "success": False,
+            "error": "Empty response from vPIC",
+            "vin": vin
+        }
+    return DecodedVehicle.from_flat(vin, results[0])
+
+
+def decode_vins(
+    vins: Iterable[str],
+    use_cache: bool = True,
+    use_snapshot: bool = True,
+    batch_size: int = BATCH_SIZE,
+    fields: Optional[Iterable[str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Decode many VINs using the NHTSA DecodeVINValuesBatch endpoint.
+
+    The whole input is screened with the vectorized local validator first,
+    so malformed VINs (and, with VIN_STRICT_CHECK_DIGIT=true, bad check
+    digits) never reach the snapshot, cache or network. VINs covered by the local vPIC snapshot or the cache
+    (exact or same build) are answered locally; the rest are de-duplicated
+    and sent in chunks of up to 50 per request. Successful decodes are
+    written to the same cache used by decode_vin.
+
+    Args:
+        vins: Vehicle Identification Numbers to decode
+        use_cache: Read from and write to the VIN decode cache
+        use_snapshot: Decode from the local vPIC snapshot when it covers a VIN
+        batch_size: Max VINs per batch request (NHTSA allows 50)
+        fields: Result fields to return; None returns every field
+
+    Returns:
+        One result per input VIN, in input order, each shaped like the
+        decode_vin result. Invalid VINs and failed chunks get per-VIN errors.
+    """
+    vins = list(vins)
+    fields = tuple(fields) if fields is not None else None
+    screened = check_vins(vins)
+    snapshot = get_vpic_snapshot() if use_snapshot else None
+    cache = get_vin_cache() if use_cache else None
+    resolved: Dict[str, _Outcome] = {}
+    pending: List[str] = []
+    seen = set()
+
+    for i, vin in enumerate(vins):
+        if not screened["structure_valid"][i]:
+            continue
+        key = normalize_vin(vin)
+        if key in seen:
+            continue
+        seen.add(key)
+
+        if STRICT_CHECK_DIGIT and not screened["valid"][i]:
+            continue
+        record = snapshot.decode_record(key) if snapshot is not None else None
+        if record is None and cache is not None:
+            cached = cache.get(key)
+            if cached is None:
+                cached = cache.get_pattern(key)
+                if cached is not None:
+                    cache.put(key, cached)
+            if cached is not None:
+                record = DecodedVehicle.from_compact(cached, vin=key)
+
+        if record is not None:
+            resolved[key] = record
+        else:
+            pending.append(key)
+
+    size = max(1, min(batch_size, BATCH_SIZE))
+    for start in range(0, len(pending), size):
+        chunk = pending[start:start + size]
+        for key, result in _fetch_vin_batch(chunk).items():
+            if cache is not None and isinstance(result, DecodedVehicle):
+                compact = result.to_compact()
+                cache.put(key, compact)
+                if result.is_clean():
+                    cache.put_pattern(key, compact)
+            elif cache is not None:
+                result = _serve_stale(cache, key) or result
+            resolved[key] = result
+
+    results = []
+    for i, vin in enumerate(vins):
+        key = normalize_vin(vin) if screened["structure_valid"][i] else None
+        if key not in resolved:
+            results.append({
+                "success": False,
+                "error": check_vin(vin)["errors"][0],
+                "vin": vin
+            })
+            continue
+        results.append(_render(resolved[key], vin, fields))
+
+    return results
+
+
+def _fetch_vin_batch(vins: List[str]) -> Dict[str, _Outcome]:
+    """
+    Decode one chunk of VINs with a single batch request, bypassing the cache.
+
+    Returns:
+        Records (or error dictionaries) keyed by normalized VIN; every input
+        VIN gets an entry
+    """
+    url = f"{NHTSA_API_URL}/vehicles/DecodeVINValuesBatch/"
+
+    try:
+        response = get_nhtsa_client().post(
+            url,
+            data={"format": "json", "data": ";".join(vins)},
+            deadline=30
+        )
+        response.raise_for_status()
+        rows = response.json().get("Results", [])
+    except requests.exceptions.RequestException as e:
+        error = f"API request failed: {str(e)}"
+        return {vin: {"success": False, "error": error, "vin": vin} for vin in vins}
+    except Exception as e:
+        error = f"Failed to decode VIN batch: {str(e)}"
+        return {vin: {"success": False, "error": error, "vin": vin} for vin in vins}
+
+    requested = set(vins)
+    results: Dict[str, _Outcome] = {}
+    for row in rows:
+        key = normalize_vin(row.get("VIN") or "")
+        if key in requested:
+            results[key] = DecodedVehicle.from_flat(key, row)
+
+    for vin in vins:
+        if vin not in results:
+            results[vin] = {
+                "success": False,
+                "error": "VIN missing from batch response",
+                "vin": vin
+            }
+
+    return results
+
+
+def validate_vin(vin: str, local_only: bool = False) -> Dict[str, Any]:
     """
     Validate a VIN and return basic vehicle info.
 
     Args:
         vin: Vehicle Identification Number
+        local_only: Answer from the local pre-decoder (check digit, WMI
+            table, model-year code) without the network. Model and trim
+            are then "Unknown".
 
     Returns:
-        Validation result with basic vehicle info
+        Validation result with basic vehicle info and check_digit_valid (a
+        bad check digit is flagged, and only rejected when
+        VIN_STRICT_CHECK_DIGIT is on)
     """
+    check = check_vin(vin)
+    if local_only:
+        if not check["structure_valid"] or (STRICT_CHECK_DIGIT and not check["valid"]):
+            return {
+                "valid": False,
+                "error": check["errors"][0],
+                "vin": vin
+            }
+        return {
+            "valid": True,
+            "vin": vin,
+            "make": check["make"],
+            "model": "Unknown",
+            "year": str(check["model_year"]) if check["model_year"] else "Unknown",
+            "trim": "Unknown",
+            "check_digit_valid": check["check_digit_valid"],
+            "country": check["country"]
+        }
+
     result = decode_vin(vin)
 
     if not result["success"]:
@@ -114,7 +582,8 @@ def validate_vin(vin: str) -> Dict[str, Any]:
         "make": make,
         "model": model,
         "year": result.get("year", "Unknown"),
-        "trim": result.get("trim", "Unknown")
+        "trim": result.get("trim", "Unknown"),
+        "check_digit_valid": check["check_digit_valid"]
     }
 
 
@@ -0,0 +1,218 @@
+"""
+Vectorized outlier filtering over many comparable sets at once.
+
+Price sets are passed as one ragged array: a flat array of values plus
+CSR-style offsets, so segment i is values[offsets[i]:offsets[i + 1]]. Every
+statistic is computed for all segments together with bincount / sorted
+index arithmetic; nothing loops over segments in Python.
+
+Rules (a value is kept when it passes):
+    zscore: |x - mean| <= threshold * stdev (sample stdev, ddof=1)
+    mad:    0.6745 * |x - median| <= threshold * MAD (modified z-score);
+            |x - median| <= threshold * 1.2533 * mean absolute deviation
+            when MAD is 0 (more than half the values are equal)
+    iqr:    Q1 - threshold * IQR <= x <= Q3 + threshold * IQR (Tukey fences)
+
+Segments with fewer than MIN_SEGMENT_SIZE values are kept whole, as there
+isn't enough data to call anything an outlier.
+"""
+
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+METHODS = ("zscore", "mad", "iqr")
+
+DEFAULT_THRESHOLDS: Dict[str, float] = {
+    "zscore": 2.0,
+    "mad": 3.5,
+    "iqr": 1.5
+}
+
+MIN_SEGMENT_SIZE = 3
+
+# Scales the MAD to match the standard deviation for normal data
+MAD_SCALE = 0.6745
+
+# Scales the mean absolute deviation to match the standard deviation for normal data
+MEAN_AD_SCALE = 1.2533
+
+
+def ragged(groups: Sequence[Sequence[float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pack a list of value lists into (values, offsets).
+
+    Returns:
+        Flat float64 values and int64 offsets of length len(groups) + 1
+    """
+    counts = np.fromiter((len(group) for group in groups), dtype=np.int64, count=len(groups))
+    offsets = np.zeros(len(groups) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    values = np.fromiter(
+        (value for group in groups for value in group), dtype=np.float64, count=int(offsets[-1])
+    )
+    return values, offsets
+
+
+def _segment_ids(offsets: np.ndarray) -> np.ndarray:
+    """Segment number of every value."""
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def _segment_quantile(sorted_values: np.ndarray, offsets: np.ndarray, q: float) -> np.ndarray:
+    """
+    Per-segment quantile with linear interpolation (numpy's default method).
+
+    sorted_values must be sorted within each segment. Empty segments get NaN.
+    """
+    counts = np.diff(offsets)
+    result = np.full(len(counts), np.nan)
+    present = counts > 0
+    position = q * (counts[present] - 1)
+    low = np.floor(position).astype(np.int64)
+    high = np.ceil(position).astype(np.int64)
+    starts = offsets[:-1][present]
+    low_values = sorted_values[starts + low]
+    result[present] = low_values + (sorted_values[starts + high] - low_values) * (position - low)
+    return result
+
+
+def segment_quantiles(values: np.ndarray, offsets: np.ndarray, qs: Sequence[float]) -> np.ndarray:
+    """
+    Several quantiles of every segment, with one sort.
+
+    Args:
+        values: Flat values of every segment
+        offsets: Segment boundaries (len = segments + 1, offsets[0] == 0)
+        qs: Quantiles in [0, 1]
+
+    Returns:
+        Array of shape (len(qs), segments); NaN for empty segments
+    """
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    sorted_values = _sort_within_segments(values, _segment_ids(offsets))
+    return np.array([_segment_quantile(sorted_values, offsets, q) for q in qs]).reshape(len(qs), len(offsets) - 1)
+
+
+def _sort_within_segments(values: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Sort values inside each segment (one global sort, then a stable radix sort by segment)."""
+    order = np.argsort(values)
+    order = order[np.argsort(ids[order], kind="stable")]
+    return values[order]
+
+
+def _segment_mean(values: np.ndarray, ids: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Per-segment mean (0 for empty segments)."""
+    return np.bincount(ids, weights=values, minlength=len(counts)) / np.maximum(counts, 1)
+
+
+def outlier_mask(
+    values: np.ndarray,
+    offsets: np.ndarray,
+    method: str = "zscore",
+    threshold: Optional[float] = None
+) -> np.ndarray:
+    """
+    Flag the values each segment's rule keeps.
+
+    Args:
+        values: Flat values of every segment
+        offsets: Segment boundaries (len = segments + 1, offsets[0] == 0)
+        method: "zscore", "mad" or "iqr"
+        threshold: Rule threshold (default: DEFAULT_THRESHOLDS[method])
+
+    Returns:
+        Boolean array, True for values that are kept
+
+    Raises:
+        ValueError: For an unknown method or malformed offsets
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown outlier method: {method} (expected one of {', '.join(METHODS)})")
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if len(offsets) == 0 or offsets[0] != 0 or offsets[-1] != len(values) or np.any(np.diff(offsets) < 0):
+        raise ValueError("offsets must rise from 0 to len(values)")
+    if threshold is None:
+        threshold = DEFAULT_THRESHOLDS[method]
+
+    counts = np.diff(offsets)
+    ids = _segment_ids(offsets)
+
+    if method == "zscore":
+        mean = _segment_mean(values, ids, counts)
+        deviation = np.abs(values - mean[ids])
+        squares = np.bincount(ids, weights=deviation ** 2, minlength=len(counts))
+        std = np.sqrt(squares / np.maximum(counts - 1, 1))
+        keep = deviation <= threshold * std[ids]
+    elif method == "mad":
+        median = _segment_quantile(_sort_within_segments(values, ids), offsets, 0.5)
+        deviation = np.abs(values - median[ids])
+        mad = _segment_quantile(_sort_within_segments(deviation, ids), offsets, 0.5)
+        # A MAD of 0 would drop every value off the median; fall back to the
+        # mean absolute deviation there
+        mean_ad = _segment_mean(deviation, ids, counts)
+        keep = np.where(
+            (mad > 0)[ids],
+            MAD_SCALE * deviation <= threshold * mad[ids],
+            deviation <= threshold * MEAN_AD_SCALE * mean_ad[ids]
+        )
+    else:
+        ordered = _sort_within_segments(values, ids)
+        q1 = _segment_quantile(ordered, offsets, 0.25)
+        q3 = _segment_quantile(ordered, offsets, 0.75)
+        spread = threshold * (q3 - q1)
+        keep = (values >= (q1 - spread)[ids]) & (values <= (q3 + spread)[ids])
+
+    # Too few values to judge: keep the whole segment
+    keep |= (counts < MIN_SEGMENT_SIZE)[ids]
+    return keep
+
+
+def filter_outliers_batch(
+    values: np.ndarray,
+    offsets: np.ndarray,
+    method: str = "zscore",
+    threshold: Optional[float] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Filter outliers from every segment and summarize what's left.
+
+    Args:
+        values: Flat values of every segment (e.g. listing prices)
+        offsets: Segment boundaries (len = segments + 1, offsets[0] == 0)
+        method: "zscore", "mad" or "iqr"
+        threshold: Rule threshold (default: DEFAULT_THRESHOLDS[method])
+
+    Returns:
+        Dictionary of arrays:
+            keep: Per value, True if kept
+            counts: Values per segment
+            outliers_removed: Values dropped per segment
+            avg: Mean of the kept values per segment (0 for empty segments)
+            original_avg: Mean of all values per segment
+            std_dev: Sample standard deviation per segment (NaN below 2 values)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    keep = outlier_mask(values, offsets, method, threshold)
+
+    counts = np.diff(offsets)
+    ids = _segment_ids(offsets)
+    original_avg = _segment_mean(values, ids, counts)
+    squares = np.bincount(ids, weights=(values - original_avg[ids]) ** 2, minlength=len(counts))
+    std_dev = np.where(counts > 1, np.sqrt(squares / np.maximum(counts - 1, 1)), np.nan)
+
+    kept = np.bincount(ids, weights=keep, minlength=len(counts)).astype(np.int64)
+    avg = _segment_mean(np.where(keep, values, 0.0), ids, kept)
+
+    return {
+        "keep": keep,
+        "counts": counts,
+        "outliers_removed": counts - kept,
+        "avg": avg,
+        "original_avg": original_avg,
+        "std_dev": std_dev
+    }
@@ -0,0 +1,342 @@
+"""
+Mileage- and age-adjusted market value per segment.
+
+market_summary.avg_price is the plain mean of the comparables, so a
+vehicle with 20k more miles than its comps is priced as if it had the same.
+PriceModel fits, for every (make, model) segment,
+
+    price = a + b * (mileage - mean mileage) + c * (model year - mean year)
+
+by least squares over the segment's listings, pooled across model years so
+age has an effect, and predicts the price at the subject's own mileage and
+year with a confidence interval.
+
+Every segment is fitted in one pass: per-segment sums come from
+np.bincount over a segment id per listing, and the 2x2 normal equations
+of all segments are solved together with a batched pseudo-inverse. A
+segment whose listings share one model year (or one mileage) gets a zero
+slope for that feature rather than a singular matrix, and predict() gives
+no value for a vehicle off that year (or mileage), as the data says
+nothing about it. Refitting millions of listings is a handful of
+vectorized passes.
+"""
+
+import math
+from statistics import NormalDist
+from typing import Any, Dict, Hashable, Iterable, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from tools.listing_dedup import ListingDedupIndex
+from tools.market_store import segment_key
+
+
+# Segments with fewer listings get no model
+MIN_LISTINGS = 3
+
+# Default confidence level of the interval around the predicted value
+DEFAULT_LEVEL = 0.9
+
+# Mileage coefficients are per this many miles
+MILEAGE_UNIT = 1000.0
+
+# Offsets (in MILEAGE_UNITs / model years) below this along a direction the
+# listings don't vary in count as no offset at all
+EXTRAPOLATION_TOLERANCE = 1e-6
+
+
+def _t_quantile(p: float, dof: float) -> float:
+    """
+    Student t quantile.
+
+    Exact for 1 and 2 degrees of freedom, Cornish-Fisher expansion of the
+    normal quantile otherwise (within 0.5% from 3 degrees of freedom).
+    """
+    if dof == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if dof == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    z = NormalDist().inv_cdf(p)
+    return (
+        z
+        + (z ** 3 + z) / (4 * dof)
+        + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * dof ** 2)
+        + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * dof ** 3)
+    )
+
+
+def fit_segments(
+    segment_ids: Sequence[int],
+    prices: Sequence[float],
+    mileages: Sequence[float],
+    years: Sequence[float],
+    num_segments: Optional[int] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Fit price against mileage and model year for many segments at once.
+
+    Args:
+        segment_ids: Segment number (0..num_segments-1) of each listing
+        prices: Listing prices
+        mileages: Listing mileages
+        years: Listing model years
+        num_segments: Number of segments (default: max(segment_ids) + 1)
+
+    Returns:
+        Arrays indexed by segment: count, mean_price, mean_mileage (in
+        MILEAGE_UNITs), mean_year, slopes (per MILEAGE_UNIT, per model
+        year), gram_inv (pseudo-inverse of the centered normal matrix),
+        dof (residual degrees of freedom) and residual_var (nan when dof < 1)
+
+    Raises:
+        ValueError: If the inputs differ in length
+    """
+    ids = np.asarray(segment_ids, dtype=np.intp)
+    y = np.asarray(prices, dtype=float)
+    m = np.asarray(mileages, dtype=float) / MILEAGE_UNIT
+    t = np.asarray(years, dtype=float)
+    if not (len(ids) == len(y) == len(m) == len(t)):
+        raise ValueError("segment_ids, prices, mileages and years must have the same length")
+    if num_segments is None:
+        num_segments = int(ids.max()) + 1 if len(ids) else 0
+
+    def segment_sum(values: np.ndarray) -> np.ndarray:
+        return np.bincount(ids, weights=values, minlength=num_segments)
+
+    count = np.bincount(ids, minlength=num_segments).astype(float)
+    safe = np.maximum(count, 1)
+    mean_y, mean_m, mean_t = (segment_sum(values) / safe for values in (y, m, t))
+
+    # Center within each segment so the intercept is the mean price
+    dy, dm, dt = y - mean_y[ids], m - mean_m[ids], t - mean_t[ids]
+    gram = np.empty((num_segments, 2, 2))
+    gram[:, 0, 0] = segment_sum(dm * dm)
+    gram[:, 0, 1] = gram[:, 1, 0] = segment_sum(dm * dt)
+    gram[:, 1, 1] = segment_sum(dt * dt)
+    xty = np.stack([segment_sum(dm * dy), segment_sum(dt * dy)], axis=1)
+
+    gram_inv = np.linalg.pinv(gram, rcond=1e-10, hermitian=True)
+    slopes = np.einsum("sij,sj->si", gram_inv, xty)
+    rank = np.linalg.matrix_rank(gram, hermitian=True) if num_segments else np.zeros(0)
+    rss = np.maximum(segment_sum(dy * dy) - np.einsum("si,si->s", slopes, xty), 0.0)
+    dof = count - 1 - rank
+    with np.errstate(invalid="ignore", divide="ignore"):
+        residual_var = np.where(dof > 0, rss / dof, np.nan)
+
+    return {
+        "count": count,
+        "mean_price": mean_y,
+        "mean_mileage": mean_m,
+        "mean_year": mean_t,
+        "slopes": slopes,
+        "gram_inv": gram_inv,
+        "dof": dof,
+        "residual_var": residual_var
+    }
+
+
+class PriceModel:
+    """
+    Fitted mileage/age price model for every (make, model) segment.
+
+    Build with fit() from listing arrays or from_entries() from market
+    entries, then ask predict() for a vehicle's adjusted market value.
+    """
+
+    def __init__(self, keys: Sequence[Hashable], fitted: Dict[str, np.ndarray]):
+        """
+        Args:
+            keys: Segment key of each fitted segment, in segment number order
+            fitted: Result of fit_segments
+        """
+        self._rows = {key: row for row, key in enumerate(keys)}
+        self._fitted = fitted
+
+    @staticmethod
+    def key(make: str, model: str) -> Tuple[str, str]:
+        """Segment key for a make and model."""
+        return make.strip().lower(), model.strip().lower()
+
+    @classmethod
+    def fit(
+        cls,
+        keys: Sequence[Hashable],
+        prices: Sequence[float],
+        mileages: Sequence[float],
+        years: Sequence[float]
+    ) -> "PriceModel":
+        """
+        Fit every segment from per-listing arrays.
+
+        Args:
+            keys: Segment key of each listing (see key())
+            prices: Listing prices
+            mileages: Listing mileages
+            years: Listing model years
+        """
+        rows: Dict[Hashable, int] = {}
+        ids = np.fromiter((rows.setdefault(key, len(rows)) for key in keys), dtype=np.intp, count=len(keys))
+        return cls(list(rows), fit_segments(ids, prices, mileages, years, len(rows)))
+
+    @classmethod
+    def from_entries(
+        cls,
+        entries: Union[Mapping[str, Mapping[str, Any]], Iterable[Mapping[str, Any]]]
+    ) -> "PriceModel":
+        """
+        Fit from market entries shaped like mock_market_comps.json.
+
+        entries is keyed by VIN, or any iterable of entries such as a
+        market backend's entries(). Each listing takes its model year from
+        the entry it is recorded under. A car listed under several entries
+        or sites is counted once; listings without a price or mileage are
+        skipped.
+        """
+        seen = ListingDedupIndex()
+        keys, prices, mileages, years = [], [], [], []
+        for entry in entries.values() if isinstance(entries, Mapping) else entries:
+            info = entry["vehicle_info"]
+            key = cls.key(info["make"], info["model"])
+            for comp in entry.get("comparables", []):
+                if comp.get("price") is None or comp.get("mileage") is None or not seen.add(comp)[1]:
+                    continue
+                keys.append(key)
+                prices.append(comp["price"])
+                mileages.append(comp["mileage"])
+                years.append(segment_key(info["make"], info["model"], info["year"])[2])
+        return cls.fit(keys, prices, mileages, years)
+
+    @classmethod
+    def from_columns(cls, store: Any) -> "PriceModel":
+        """
+        Fit from a columnar market store (see tools/market_columns.py).
+
+        Reads the store's mapped price and mileage columns directly; each
+        listing takes its model year from its segment, and a car listed
+        more than once is counted once.
+        """
+        segments = store.segments()
+        rows: Dict[Hashable, int] = {}
+        segment_rows = np.fromiter(
+            (rows.setdefault((make, model), len(rows)) for make, model in zip(segments["make"], segments["model"])),
+            dtype=np.intp,
+            count=len(segments["make"])
+        )
+        counts = np.diff(segments["listings"])
+        prices, mileages = store.column("price"), store.column("mileage")
+        keep = store.column("first_listing") & ~np.isnan(prices) & ~np.isnan(mileages)
+        return cls(list(rows), fit_segments(
+            np.repeat(segment_rows, counts)[keep],
+            prices[keep],
+            mileages[keep],
+            np.repeat(segments["year"], counts)[keep],
+            len(rows)
+        ))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-friendly form, e.g. to publish with a segment snapshot."""
+        return {
+            "keys": [list(key) for key in self._rows],
+            "fitted": {name: values.tolist() for name, values in self._fitted.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "PriceModel":
+        """Rebuild a model written by to_dict."""
+        return cls(
+            [tuple(key) for key in data["keys"]],
+            {name: np.asarray(values, dtype=float) for name, values in data["fitted"].items()}
+        )
+
+    def _row(self, make: str, model: str) -> Optional[int]:
+        row = self._rows.get(self.key(make, model))
+        if row is None or self._fitted["count"][row] < MIN_LISTINGS or self._fitted["dof"][row] < 1:
+            return None
+        return row
+
+    def coefficients(self, make: str, model: str) -> Optional[Dict[str, Any]]:
+        """
+        A segment's fitted slopes.
+
+        Returns:
+            per_1k_miles, per_model_year, residual_std and sample_size, or
+            None if the segment has too few listings for a model
+        """
+        row = self._row(make, model)
+        if row is None:
+            return None
+        fitted = self._fitted
+        per_mileage, per_year = fitted["slopes"][row]
+        return {
+            "per_1k_miles": round(float(per_mileage) * 1000 / MILEAGE_UNIT, 2),
+            "per_model_year": round(float(per_year), 2),
+            "residual_std": round(math.sqrt(float(fitted["residual_var"][row]))),
+            "sample_size": int(fitted["count"][row])
+        }
+
+    def predict(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        mileage: float,
+        level: float = DEFAULT_LEVEL
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Market value of a vehicle at its own mileage and model year.
+
+        Args:
+            make: Vehicle make
+            model: Vehicle model
+            year: Vehicle model year
+            mileage: Vehicle mileage
+            level: Confidence level of the interval
+
+        Returns:
+            value, low and high (the interval for the segment's mean price
+            at this mileage and year), level, mileage, the segment's
+            coefficients and sample_size; None if the segment has too few
+            listings for a model, or if its listings don't vary in a
+            direction the vehicle is off them in (e.g. every listing is
+            one model year and the vehicle is another)
+
+        Raises:
+            ValueError: If level is not between 0 and 1
+        """
+        if not 0 < level < 1:
+            raise ValueError("level must be between 0 and 1")
+        row = self._row(make, model)
+        if row is None:
+            return None
+
+        fitted = self._fitted
+        offset = np.array([
+            mileage / MILEAGE_UNIT - fitted["mean_mileage"][row],
+            int(year) - fitted["mean_year"][row]
+        ])
+        # The pseudo-inverse is zero along directions the listings don't vary
+        # in; a slope of 0 there is a placeholder, not an estimate, so don't
+        # extrapolate along them with a falsely narrow interval
+        gram_inv = fitted["gram_inv"][row]
+        eigenvalues, eigenvectors = np.linalg.eigh(gram_inv)
+        unidentified = eigenvalues <= 1e-12 * max(eigenvalues.max(), 0.0)
+        if np.any(np.abs(offset @ eigenvectors[:, unidentified]) > EXTRAPOLATION_TOLERANCE):
+            return None
+
+        # Plain floats from here on, so the rounded prices are Python ints
+        value = float(fitted["mean_price"][row]) + float(fitted["slopes"][row] @ offset)
+        leverage = 1 / float(fitted["count"][row]) + float(offset @ gram_inv @ offset)
+        margin = _t_quantile(0.5 + level / 2, float(fitted["dof"][row])) * math.sqrt(
+            float(fitted["residual_var"][row]) * leverage
+        )
+        return {
+            "value": round(value),
+            "low": round(value - margin),
+            "high": round(value + margin),
+            "level": level,
+            "mileage": mileage,
+            **self.coefficients(make, model)
+        }
+
+    def __len__(self) -> int:
+        return len(self._rows)
@@ -0,0 +1,383 @@
+"""
+Mergeable quantile sketches for market price bands.
+
+KLLSketch (Karnin, Lang & Liberty) answers quantile queries over a stream
+in memory bounded by its accuracy parameter k, whatever the stream's
+length. Items sit in a stack of compactors: when a level fills up it is
+sorted and every other item (random offset) moves up a level with double
+the weight. With the default k=200 rank error is around 1%. Sketches
+of the same k merge by stacking their levels and compacting, so shards
+and time windows can be built separately and combined.
+
+SegmentSketches keeps one price and one days-listed sketch per
+(make, model, year, region) segment and answers p10/p50/p90 bands.
+"""
+
+import bisect
+import math
+import random
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from tools.listing_dedup import SEEN_VINS_CAPACITY, ListingDedupIndex, SeenVins
+from tools.market_store import DEFAULT_REGION, entry_region, segment_key
+from tools.vin_check import normalize_vin
+
+
+DEFAULT_K = 200
+
+# Each level below the top gets this fraction of the capacity of the one above
+CAPACITY_DECAY = 2 / 3
+
+PRICE_BANDS = (0.1, 0.5, 0.9)
+
+
+class KLLSketch:
+    """Streaming quantile sketch; see the module docstring."""
+
+    def __init__(self, k: int = DEFAULT_K, seed: Optional[int] = None):
+        """
+        Args:
+            k: Accuracy parameter (memory is about 3k items)
+            seed: Seed for the compaction coin flips, for reproducible sketches
+        """
+        if k < 8:
+            raise ValueError("k must be at least 8")
+        self.k = k
+        self.count = 0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self._levels: List[List[float]] = [[]]
+        self._random = random.Random(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self._levels) - level - 1
+        return max(2, math.ceil(self.k * CAPACITY_DECAY ** depth))
+
+    def _max_size(self) -> int:
+        return sum(self._capacity(level) for level in range(len(self._levels)))
+
+    def _size(self) -> int:
+        return sum(len(items) for items in self._levels)
+
+    def update(self, value: float) -> None:
+        """Add one value."""
+        self._levels[0].append(value)
+        self._track(value, value, 1)
+        if len(self._levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def update_many(self, values: Iterable[float]) -> None:
+        """Add many values."""
+        values = list(values)
+        if not values:
+            return
+        self._levels[0].extend(values)
+        self._track(min(values), max(values), len(values))
+        self._compress()
+
+    def _track(self, low: float, high: float, count: int) -> None:
+        self.count += count
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def _compress(self) -> None:
+        """Compact full levels until the sketch is back within its memory bound."""
+        while self._size() > self._max_size() or len(self._levels[0]) >= self._capacity(0):
+            for level in range(len(self._levels)):
+                items = self._levels[level]
+                if len(items) < self._capacity(level):
+                    continue
+                if level + 1 == len(self._levels):
+                    self._levels.append([])
+                items.sort()
+                # An odd item out stays behind at this level
+                keep = [items.pop()] if len(items) % 2 else []
+                self._levels[level + 1].extend(items[self._random.randint(0, 1)::2])
+                self._levels[level] = keep
+                break
+            else:
+                return
+
+    def merge(self, other: "KLLSketch") -> "KLLSketch":
+        """
+        Fold another sketch into this one.
+
+        Returns:
+            self, for chaining
+
+        Raises:
+            ValueError: If the sketches were built with different k
+        """
+        if other.k != self.k:
+            raise ValueError(f"Can't merge sketches with k={self.k} and k={other.k}")
+        if other.count == 0:
+            return self
+        while len(self._levels) < len(other._levels):
+            self._levels.append([])
+        for level, items in enumerate(other._levels):
+            self._levels[level].extend(items)
+        self._track(other.min, other.max, other.count)
+        self._compress()
+        return self
+
+    def _weighted(self) -> Tuple[List[float], List[int]]:
+        """Retained items sorted by value, with cumulative weights."""
+        pairs = sorted((item, 1 << level) for level, items in enumerate(self._levels) for item in items)
+        items, cumulative, total = [], [], 0
+        for item, weight in pairs:
+            total += weight
+            items.append(item)
+            cumulative.append(total)
+        return items, cumulative
+
+    def quantiles(self, qs: Sequence[float]) -> List[Optional[float]]:
+        """
+        Approximate quantiles.
+
+        Args:
+            qs: Quantiles in [0, 1]
+
+        Returns:
+            One value per quantile (None for an empty sketch). 0 and 1 give
+            the exact min and max.
+        """
+        if self.count == 0:
+            return [None for _ in qs]
+        items, cumulative = self._weighted()
+        total = cumulative[-1]
+        results = []
+        for q in qs:
+            if not 0 <= q <= 1:
+                raise ValueError(f"Quantile must be in [0, 1]: {q}")
+            if q == 0:
+                results.append(self.min)
+            elif q == 1:
+                results.append(self.max)
+            else:
+                results.append(items[bisect.bisect_left(cumulative, q * total)])
+        return results
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Approximate value at quantile q (see quantiles)."""
+        return self.quantiles([q])[0]
+
+    def rank(self, value: float) -> float:
+        """Approximate share of values <= value."""
+        if self.count == 0:
+            return 0.0
+        items, cumulative = self._weighted()
+        index = bisect.bisect_right(items, value)
+        return cumulative[index - 1] / cumulative[-1] if index else 0.0
+
+    def retained(self) -> int:
+        """Number of items held in memory."""
+        return self._size()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize for storage or shipping between shards (JSON-safe)."""
+        return {
+            "k": self.k,
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "levels": [list(items) for items in self._levels]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any], seed: Optional[int] = None) -> "KLLSketch":
+        """Rebuild a sketch written by to_dict."""
+        sketch = cls(data["k"], seed)
+        sketch.count = data["count"]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+        sketch._levels = [list(items) for items in data["levels"]] or [[]]
+        return sketch
+
+
+SegmentKey = Tuple[str, str, int, str]
+
+
+class SegmentSketches:
+    """Price and days-listed sketches per (make, model, year, region)."""
+
+    def __init__(self, k: int = DEFAULT_K, seed: Optional[int] = None):
+        """
+        Args:
+            k: Accuracy parameter for every sketch
+            seed: Seed for reproducible sketches
+        """
+        self.k = k
+        self._seed = seed
+        self._sketches: Dict[SegmentKey, Dict[str, KLLSketch]] = {}
+
+    @staticmethod
+    def key(make: str, model: str, year: Any, region: str) -> SegmentKey:
+        make, model, year, _ = segment_key(make, model, year)
+        return make, model, year, region
+
+    def _segment(self, key: SegmentKey) -> Dict[str, KLLSketch]:
+        sketches = self._sketches.get(key)
+        if sketches is None:
+            sketches = self._sketches[key] = {
+                "price": KLLSketch(self.k, self._seed),
+                "days_listed": KLLSketch(self.k, self._seed)
+            }
+        return sketches
+
+    def add_listing(self, make: str, model: str, year: Any, region: str, listing: Mapping[str, Any]) -> None:
+        """Add one listing's price (and days listed, when present)."""
+        sketches = self._segment(self.key(make, model, year, region))
+        sketches["price"].update(listing["price"])
+        if listing.get("days_listed") is not None:
+            sketches["days_listed"].update(listing["days_listed"])
+
+    @classmethod
+    def from_entries(
+        cls,
+        entries: Union[Mapping[str, Mapping[str, Any]], Iterable[Mapping[str, Any]]],
+        default_region: str = DEFAULT_REGION,
+        dedup_capacity: int = SEEN_VINS_CAPACITY,
+        **kwargs: Any
+    ) -> "SegmentSketches":
+        """
+        Build sketches from market entries shaped like mock_market_comps.json.
+
+        entries is keyed by VIN, or any iterable of entries such as a
+        market backend's entries(). A car listed on several sites under one
+        entry (see tools/listing_dedup.py) is counted once; so is a car
+        that appears under several entries with the same comparable_vin.
+
+        Memory stays fixed however large the market: duplicates are
+        collapsed within each entry's comparables, and VINs are remembered
+        across entries in a SeenVins Bloom filter sized for dedup_capacity
+        cars. The trade-off: about 0.1% of distinct cars (more past
+        dedup_capacity) are taken for repeats and left out of their
+        segment's sketches, a thinning well inside the sketches' ~1% rank
+        error; and VIN-less copies of one car under different entries are
+        no longer matched by dealer, price and mileage.
+        """
+        sketches = cls(**kwargs)
+        seen_vins = SeenVins(dedup_capacity)
+        for entry in entries.values() if isinstance(entries, Mapping) else entries:
+            info = entry["vehicle_info"]
+            region = entry_region(entry, default_region)
+            index = ListingDedupIndex()
+            for comp in entry.get("comparables", []):
+                if not index.add(comp)[1]:
+                    continue
+                vin = normalize_vin(comp.get("comparable_vin"))
+                if vin and not seen_vins.add(vin):
+                    continue
+                sketches.add_listing(info["make"], info["model"], info["year"], region, comp)
+        return sketches
+
+    @classmethod
+    def from_columns(cls, store: Any, **kwargs: Any) -> "SegmentSketches":
+        """
+        Build sketches from a columnar market store (see tools/market_columns.py).
+
+        Reads each segment's mapped price and days-listed columns; a car
+        listed more than once is counted once, as in from_entries.
+        """
+        sketches = cls(**kwargs)
+        segments = store.segments()
+        offsets = segments["listings"]
+        first_listing = store.column("first_listing")
+        columns = {metric: store.column(metric) for metric in ("price", "days_listed")}
+        for segment, (make, model, region) in enumerate(zip(segments["make"], segments["model"], segments["region"])):
+            rows = slice(int(offsets[segment]), int(offsets[segment + 1]))
+            ours = sketches._segment(cls.key(make, model, segments["year"][segment], region))
+            for metric, column in columns.items():
+                values = column[rows][first_listing[rows]]
+                # Whole numbers back as ints, like the parsed JSON
+                ours[metric].update_many(
+                    int(value) if value.is_integer() else value for value in values[~np.isnan(values)].tolist()
+                )
+        return sketches
+
+    def merge(self, other: "SegmentSketches") -> "SegmentSketches":
+        """Fold in sketches from another shard or time window. Returns self."""
+        for key, theirs in other._sketches.items():
+            ours = self._segment(key)
+            for metric, sketch in theirs.items():
+                ours[metric].merge(sketch)
+        return self
+
+    def sketch(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        region: Optional[str] = None,
+        metric: str = "price"
+    ) -> KLLSketch:
+        """
+        Sketch for a segment; region None merges every region.
+
+        Returns:
+            A sketch (empty if the segment has no listings). The merged
+            all-region sketch is a new object, so callers may update it.
+        """
+        if region is not None:
+            found = self._sketches.get(self.key(make, model, year, region))
+            return found[metric] if found else KLLSketch(self.k, self._seed)
+
+        merged = KLLSketch(self.k, self._seed)
+        make_key, model_key, year_key, _ = segment_key(make, model, year)
+        for (seg_make, seg_model, seg_year, _), sketches in self._sketches.items():
+            if (seg_make, seg_model, seg_year) == (make_key, model_key, year_key):
+                merged.merge(sketches[metric])
+        return merged
+
+    def price_bands(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        region: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        p10/p50/p90 price bands and median days listed for a segment.
+
+        Returns:
+            Dictionary with p10, p50, p90, days_listed_p50 and sample_size,
+            or None if the segment has no listings
+        """
+        prices = self.sketch(make, model, year, region, "price")
+        if prices.count == 0:
+            return None
+        p10, p50, p90 = prices.quantiles(PRICE_BANDS)
+        return {
+            "p10": p10,
+            "p50": p50,
+            "p90": p90,
+            "days_listed_p50": self.sketch(make, model, year, region, "days_listed").quantile(0.5),
+            "sample_size": prices.count,
+            "region": region
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize every segment (JSON-safe)."""
+        return {
+            "k": self.k,
+            "segments": [
+                {"key": list(key), **{metric: sketch.to_dict() for metric, sketch in sketches.items()}}
+                for key, sketches in self._sketches.items()
+            ]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any], seed: Optional[int] = None) -> "SegmentSketches":
+        """Rebuild sketches written by to_dict."""
+        sketches = cls(data["k"], seed)
+        for segment in data["segments"]:
+            key = tuple(segment["key"])
+            sketches._sketches[key] = {
+                metric: KLLSketch.from_dict(segment[metric], seed) for metric in ("price", "days_listed")
+            }
+        return sketches
+
+    def __len__(self) -> int:
+        return len(self._sketches)
@@ -0,0 +1,431 @@
+"""
+Versioned, precomputed market snapshots per segment.
+
+A nightly batch job (build_segment_snapshots + write_segment_snapshots, or
+this file as a script) aggregates the full listing set into one compact row
+per (make, model, year, trim, region) segment:
+    - comp_count, avg_price (outliers removed, like market_summary) and
+      outliers_removed
+    - median, p10/p25/p75/p90, min and max listing price
+    - days-on-market median and average
+    - KBB anchors: the median instant cash offer, trade-in range, private
+      party and retail values of the segment's appraised vehicles
+The snapshot also carries the mileage/age price model (see
+tools/price_model.py) fitted over the same listings, so an appraisal served
+from a snapshot does no aggregation or fitting of its own.
+Rows are also rolled up over every trim and/or every region ("*"), so a
+lookup falls back from the exact segment to the broader ones.
+
+All segments are aggregated together as ragged arrays (see
+tools/outliers.py), so the job scales to millions of listings. Each run is
+written as segments-<version>.json, where the version is the build time
+plus a hash of the rows, and a CURRENT file names the version to serve.
+At request time get_market_intelligence reads one row from the current
+snapshot instead of aggregating comps, and reports its version so an
+appraisal can record what it was priced against. Older versions are kept
+(SEGMENT_SNAPSHOT_KEEP) and can be loaded by version to replay an appraisal.
+
+Run the nightly job with:
+    python tools/segment_snapshots.py [market_comps.json] [snapshot_dir]
+
+Configuration (environment variables):
+    SEGMENT_SNAPSHOT_DIR: Snapshot directory (default: .cache/segment_snapshots).
+    SEGMENT_SNAPSHOT_KEEP: Versions kept on disk (default: 7).
+    SEGMENT_SNAPSHOT_CHECK_SECONDS: Min seconds between checks for a new
+                                    version (default: 60).
+"""
+
+import hashlib
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+# Allow running as a script from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.listing_dedup import ListingDedupIndex
+from tools.market_store import (
+    DEFAULT_MARKET_DATA_PATH,
+    DEFAULT_REGION,
+    FrozenDict,
+    entry_region,
+    freeze,
+    segment_key
+)
+from tools.outliers import filter_outliers_batch, segment_quantiles
+from tools.price_model import PriceModel
+
+
+DEFAULT_SNAPSHOT_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ".cache",
+    "segment_snapshots"
+)
+
+# Stands for "every trim" / "every region" in a segment key
+ANY = "*"
+
+PRICE_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+CURRENT_FILE = "CURRENT"
+
+
+def snapshot_key(make: str, model: str, year: Any, trim: Optional[str] = None, region: Optional[str] = None) -> str:
+    """
+    Row key for a segment; trim or region None means every trim or region.
+
+    Raises:
+        ValueError: If year is not a number
+    """
+    make_key, model_key, year_key, trim_key = segment_key(make, model, year, trim)
+    region_key = region.strip().lower() if region else ANY
+    return "|".join((make_key, model_key, str(year_key), trim_key or ANY, region_key))
+
+
+@lru_cache(maxsize=65536)
+def _rollups(make: str, model: str, year: Any, trim: Optional[str], region: str) -> Tuple[str, ...]:
+    """The exact segment key and its every-trim / every-region rollups."""
+    keys = {snapshot_key(make, model, year, t, r) for t in (trim, None) for r in (region, None)}
+    return tuple(sorted(keys))
+
+
+def _median(values: List[float]) -> Optional[float]:
+    return statistics.median(values) if values else None
+
+
+def _kbb_anchors(valuations: List[Mapping[str, Any]]) -> Dict[str, Any]:
+    """Median KBB values over a segment's appraised vehicles."""
+    ranges = [kbb.get("trade_in_range") or {} for kbb in valuations]
+    return {
+        "instant_cash_offer": _median([kbb["instant_cash_offer"] for kbb in valuations if kbb.get("instant_cash_offer") is not None]),
+        "trade_in_low": _median([r["low"] for r in ranges if r.get("low") is not None]),
+        "trade_in_high": _median([r["high"] for r in ranges if r.get("high") is not None]),
+        "private_party": _median([kbb["private_party"] for kbb in valuations if kbb.get("private_party") is not None]),
+        "retail": _median([kbb["retail"] for kbb in valuations if kbb.get("retail") is not None]),
+        "vehicles": len(valuations)
+    }
+
+
+def _grouped(ids: np.ndarray, values: np.ndarray, groups: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Regroup (segment id, value) pairs into ragged (values, offsets)."""
+    order = np.argsort(ids, kind="stable")
+    offsets = np.zeros(groups + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ids, minlength=groups), out=offsets[1:])
+    return values[order], offsets
+
+
+def _number(value: float) -> Optional[float]:
+    """JSON-friendly statistic: None for NaN, rounded to cents."""
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+class SegmentSnapshot:
+    """
+    One version of the precomputed segment rows.
+
+    Rows are read-only; lookup() is a dict hit per fallback level.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        built_at: str,
+        source: str,
+        segments: Mapping[str, Mapping[str, Any]],
+        price_model: Optional[PriceModel] = None
+    ):
+        self.version = version
+        self.built_at = built_at
+        self.source = source
+        self.segments: FrozenDict = freeze(dict(segments))
+        self.price_model = price_model
+
+    def lookup(
+        self,
+        make: str,
+        model: str,
+        year: Any,
+        trim: Optional[str] = None,
+        region: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Return the row for a segment, falling back to every trim, then every
+        region, then both.
+
+        Returns:
+            The row plus segment (the key actually used) and version, or None
+        """
+        for t, r in ((trim, region), (None, region), (trim, None), (None, None)):
+            try:
+                key = snapshot_key(make, model, year, t, r)
+            except (TypeError, ValueError):
+                return None
+            row = self.segments.get(key)
+            if row is not None:
+                return {**row, "segment": key, "version": self.version}
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "version": self.version,
+            "built_at": self.built_at,
+            "source": self.source,
+            "segments": self.segments
+        }
+        if self.price_model is not None:
+            data["price_model"] = self.price_model.to_dict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "SegmentSnapshot":
+        price_model = PriceModel.from_dict(data["price_model"]) if data.get("price_model") else None
+        return cls(data["version"], data["built_at"], data.get("source", ""), data["segments"], price_model)
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+
+def build_segment_snapshots(
+    entries: Mapping[str, Mapping[str, Any]],
+    default_region: str = DEFAULT_REGION,
+    source: str = "",
+    built_at: Optional[datetime] = None
+) -> SegmentSnapshot:
+    """
+    Aggregate market entries into one row per segment and rollup.
+
+    Each listing belongs to the segment of the entry it is recorded under;
+    a car listed under several entries or sites is counted once.
+
+    Args:
+        entries: Market entries shaped like mock_market_comps.json
+        default_region: Region for entries without regional_data
+        source: Description of the input, stored with the snapshot
+        built_at: Build time (default: now, UTC)
+
+    Returns:
+        A new SegmentSnapshot, versioned by build time and content
+    """
+    keys: Dict[str, int] = {}
+    entry_segments: List[List[int]] = []
+    listing_entries: List[int] = []
+    prices: List[float] = []
+    days: List[float] = []
+    valuations: Dict[int, List[Mapping[str, Any]]] = {}
+    seen = ListingDedupIndex()
+
+    for entry in entries.values():
+        info = entry["vehicle_info"]
+        segment_ids = [
+            keys.setdefault(key, len(keys))
+            for key in _rollups(info["make"], info["model"], info["year"], info.get("trim"), entry_region(entry, default_region))
+        ]
+        if entry.get("kbb_data"):
+            for key_id in segment_ids:
+                valuations.setdefault(key_id, []).append(entry["kbb_data"])
+        entry_index = len(entry_segments)
+        entry_segments.append(segment_ids)
+        for comp in entry.get("comparables", []):
+            if comp.get("price") is None or not seen.add(comp)[1]:
+                continue
+            listing_entries.append(entry_index)
+            prices.append(comp["price"])
+            days.append(np.nan if comp.get("days_listed") is None else comp["days_listed"])
+
+    # Every listing counts towards each of its entry's segment keys
+    groups = len(keys)
+    segment_counts = np.fromiter((len(ids) for ids in entry_segments), dtype=np.int64, count=len(entry_segments))
+    segment_starts = np.cumsum(segment_counts) - segment_counts
+    flat_segments = np.fromiter((i for ids in entry_segments for i in ids), dtype=np.int64, count=int(segment_counts.sum()))
+    listing_entries_array = np.asarray(listing_entries, dtype=np.int64)
+    per_listing = segment_counts[listing_entries_array]
+    listing_index = np.repeat(np.arange(len(listing_entries)), per_listing)
+    within = np.arange(len(listing_index)) - np.repeat(np.cumsum(per_listing) - per_listing, per_listing)
+    ids = flat_segments[segment_starts[listing_entries_array][listing_index] + within]
+    listing_prices = np.asarray(prices, dtype=np.float64)[listing_index]
+    listing_days = np.asarray(days, dtype=np.float64)[listing_index]
+
+    price_values, price_offsets = _grouped(ids, listing_prices, groups)
+    filtered = filter_outliers_batch(price_values, price_offsets)
+    quantiles = segment_quantiles(price_values, price_offsets, (0.0, *PRICE_QUANTILES, 1.0))
+    has_days = ~np.isnan(listing_days)
+    days_values, days_offsets = _grouped(ids[has_days], listing_days[has_days], groups)
+    days_median = segment_quantiles(days_values, days_offsets, (0.5,))[0]
+    days_counts = np.diff(days_offsets)
+    days_total = np.bincount(ids[has_days], weights=listing_days[has_days], minlength=groups)
+    days_avg = np.where(days_counts > 0, days_total / np.maximum(days_counts, 1), np.nan)
+
+    segments = {}
+    for key, i in keys.items():
+        count = int(filtered["counts"][i])
+        segments[key] = {
+            "comp_count": count,
+            "avg_price": _number(filtered["avg"][i]) if count else None,
+            "outliers_removed": int(filtered["outliers_removed"][i]),
+            "min_price": _number(quantiles[0][i]),
+            **{f"p{round(q * 100)}": _number(quantiles[j + 1][i]) for j, q in enumerate(PRICE_QUANTILES)},
+            "max_price": _number(quantiles[-1][i]),
+            "days_listed_median": _number(days_median[i]),
+            "days_listed_avg": _number(days_avg[i]),
+            "kbb_anchors": _kbb_anchors(valuations.get(i, []))
+        }
+
+    price_model = PriceModel.from_entries(entries)
+    built_at = built_at or datetime.now(timezone.utc)
+    content = {"segments": segments, "price_model": price_model.to_dict()}
+    digest = hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()[:8]
+    return SegmentSnapshot(
+        f"{built_at:%Y%m%dT%H%M%SZ}-{digest}",
+        built_at.isoformat(),
+        source,
+        segments,
+        price_model
+    )
+
+
+def write_segment_snapshots(snapshot: SegmentSnapshot, directory: str, keep: Optional[int] = None) -> str:
+    """
+    Publish a snapshot as the current version.
+
+    The version file and then CURRENT are each written to a temporary file
+    and renamed into place, so readers see either the old version or the
+    new one, never a partial file. Versions beyond the newest keep are
+    deleted.
+
+    Args:
+        snapshot: Snapshot to publish
+        directory: Snapshot directory (created if missing)
+        keep: Versions to keep (default: SEGMENT_SNAPSHOT_KEEP)
+
+    Returns:
+        Path of the written version file
+    """
+    keep = int(os.getenv("SEGMENT_SNAPSHOT_KEEP", "7")) if keep is None else keep
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"segments-{snapshot.version}.json")
+    _write_atomic(path, json.dumps(snapshot.to_dict()))
+    _write_atomic(os.path.join(directory, CURRENT_FILE), snapshot.version)
+
+    versions = sorted(name for name in os.listdir(directory) if name.startswith("segments-") and name.endswith(".json"))
+    for name in versions[:-keep] if keep > 0 else []:
+        if name != os.path.basename(path):
+            os.remove(os.path.join(directory, name))
+    return path
+
+
+def _write_atomic(path: str, text: str) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class SegmentSnapshotStore:
+    """
+    Serves the current segment snapshot from a snapshot directory.
+
+    CURRENT is checked at most once per check_interval; a new version is
+    loaded once and then shared by every reader. If no snapshot has been
+    published, current() returns None and callers fall back to live data.
+    """
+
+    def __init__(self, directory: str = DEFAULT_SNAPSHOT_DIR, check_interval: float = 60.0):
+        """
+        Args:
+            directory: Snapshot directory written by write_segment_snapshots
+            check_interval: Min seconds between checks of CURRENT (0 checks every call)
+        """
+        self.directory = directory
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._current: Optional[SegmentSnapshot] = None
+        self._checked_at: Optional[float] = None
+
+    def current(self) -> Optional[SegmentSnapshot]:
+        """
+        Return the published snapshot, loading a newly published version first.
+
+        A version that can't be read leaves the previous one in service.
+        """
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return self._current
+
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return self._current
+            self._checked_at = now
+            try:
+                with open(os.path.join(self.directory, CURRENT_FILE), "r") as f:
+                    version = f.read().strip()
+                if self._current is None or self._current.version != version:
+                    self._current = self.load(version)
+            except (OSError, ValueError, KeyError):
+                pass
+            return self._current
+
+    def load(self, version: str) -> SegmentSnapshot:
+        """
+        Load a specific version, e.g. to replay an appraisal.
+
+        Raises:
+            OSError: If the version isn't on disk
+            ValueError: If its file can't be parsed
+        """
+        with open(os.path.join(self.directory, f"segments-{version}.json"), "r") as f:
+            return SegmentSnapshot.from_dict(json.load(f))
+
+    def versions(self) -> List[str]:
+        """Versions on disk, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            name[len("segments-"):-len(".json")]
+            for name in os.listdir(self.directory)
+            if name.startswith("segments-") and name.endswith(".json")
+        )
+
+
+_default_store: Optional[SegmentSnapshotStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_segment_snapshot_store() -> SegmentSnapshotStore:
+    """Return the process-wide snapshot store, creating it on first use."""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = SegmentSnapshotStore(
+                    directory=os.getenv("SEGMENT_SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR),
+                    check_interval=float(os.getenv("SEGMENT_SNAPSHOT_CHECK_SECONDS", "60"))
+                )
+    return _default_store
+
+
+def set_segment_snapshot_store(store: Optional[SegmentSnapshotStore]) -> None:
+    """Replace the process-wide store (None recreates it from the environment on next use)."""
+    global _default_store
+    with _default_store_lock:
+        _default_store = store
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else os.getenv("MARKET_DATA_PATH", DEFAULT_MARKET_DATA_PATH)
+    directory = sys.argv[2] if len(sys.argv) > 2 else os.getenv("SEGMENT_SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR)
+
+    started = time.perf_counter()
+    with open(source, "r") as f:
+        entries = json.load(f)
+    snapshot = build_segment_snapshots(entries, source=os.path.abspath(source))
+    path = write_segment_snapshots(snapshot, directory)
+    print(f"Built {len(snapshot)} segment rows from {len(entries)} vehicles in {time.perf_counter() - started:.2f}s")
+    print(f"Published version {snapshot.version} to {path}")
@@ -0,0 +1,198 @@
+"""
+In-flight request coalescing ("singleflight").
+
+When several callers ask for the same key at once, only the first does the
+work; the others wait for and share its result. Once the call finishes the
+key is released, so later callers start a fresh call (caching is a separate
+concern). Works for threads (do) and for coroutines (do_async).
+"""
+
+import asyncio
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    """A call in flight on behalf of one or more threads."""
+
+    __slots__ = ("event", "result", "error", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class _AsyncCall:
+    """A call in flight on behalf of one or more coroutines."""
+
+    __slots__ = ("task", "waiters", "awaiting")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        # Callers (leader included) still awaiting the task
+        self.awaiting = 1
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key.
+
+    Followers receive `clone(result)` so they never share a mutable object
+    with the leader (pass clone=None to share the object itself).
+    """
+
+    def __init__(self, clone: Optional[Callable[[Any], Any]] = None):
+        """
+        Args:
+            clone: Applied to the leader's result before handing it to each follower.
+        """
+        self.clone = clone
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._async_calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Hashable, _AsyncCall]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._counters = {"executions": 0, "coalesced": 0}
+
+    def _share(self, result: Any) -> Any:
+        return self.clone(result) if self.clone is not None else result
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Run fn(*args, **kwargs) unless a call for `key` is already in flight.
+
+        Args:
+            key: Identifies equivalent calls
+            fn: Function doing the work
+
+        Returns:
+            The leader's result (cloned for followers)
+
+        Raises:
+            Whatever the leader's call raised
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._counters["coalesced"] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._counters["executions"] += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return self._share(call.result)
+
+        result = None
+        try:
+            result = fn(*args, **kwargs)
+            return result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                waiters = call.waiters
+            # Followers clone from a private copy, so the leader's caller is
+            # free to mutate the object it gets back
+            if waiters and call.error is None:
+                call.result = self._share(result)
+            call.event.set()
+
+    async def do_async(
+        self,
+        key: Hashable,
+        fn: Callable[..., Awaitable[Any]],
+        *args: Any,
+        **kwargs: Any
+    ) -> Any:
+        """
+        Await fn(*args, **kwargs) unless a call for `key` is already in flight
+        on this event loop.
+
+        Cancelling one caller does not cancel the call while others still
+        wait for it.
+
+        Args:
+            key: Identifies equivalent calls
+            fn: Coroutine function doing the work
+
+        Returns:
+            The leader's result (cloned for followers)
+
+        Raises:
+            Whatever the leader's call raised
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            calls = self._async_calls.setdefault(loop, {})
+            call = calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                call.awaiting += 1
+                self._counters["coalesced"] += 1
+                leader = False
+            else:
+                call = _AsyncCall()
+                calls[key] = call
+                self._counters["executions"] += 1
+                leader = True
+
+        async def run() -> Any:
+            try:
+                result = await fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    if calls.get(key) is call:
+                        del calls[key]
+                    waiters = call.waiters
+            # Followers clone from a private copy, so the leader's caller is
+            # free to mutate the object it gets back
+            return result, self._share(result) if waiters else None
+
+        if leader:
+            call.task = loop.create_task(run())
+
+        # The work runs in its own task and every caller awaits it through a
+        # shield: a cancelled caller, leader or follower, stops waiting
+        # without cancelling the call for the others. The task is cancelled
+        # only once nobody is left waiting for it.
+        try:
+            result, shared = await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.done():
+                with self._lock:
+                    call.awaiting -= 1
+                    abandoned = call.awaiting == 0
+                    if abandoned and calls.get(key) is call:
+                        # Later callers start a fresh call rather than join a cancelled one
+                        del calls[key]
+                if abandoned:
+                    call.task.cancel()
+                    # Let the work unwind before reporting the cancellation
+                    await asyncio.wait([call.task])
+            raise
+        return result if leader else self._share(shared)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Report how much work was collapsed.
+
+        Returns:
+            executions (calls that did the work), coalesced (calls that
+            waited on another) and in_flight (keys currently running)
+        """
+        with self._lock:
+            in_flight = len(self._calls) + sum(len(c) for c in self._async_calls.values())
+            return {**self._counters, "in_flight": in_flight}
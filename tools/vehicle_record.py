@@ -0,0 +1,191 @@
+"""
+Compact decoded-vehicle record.
+
+vPIC answers a decode with ~140 variables, of which the appraisal flow uses
+about ten. DecodedVehicle keeps those ten as slotted attributes and stores
+the remaining non-empty values as a tuple of (key, value) pairs, so a cached
+or in-flight decode is a few hundred bytes. The full_data dictionary is only
+built when a caller asks for it, and callers can project just the fields
+they need before a result is handed to an LLM or written to session state.
+"""
+
+from dataclasses import dataclass, replace
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+
+UNKNOWN = "Unknown"
+
+# Record attribute -> flat DecodeVinValues key
+FLAT_FIELDS = {
+    "make": "Make",
+    "model": "Model",
+    "year": "ModelYear",
+    "trim": "Trim",
+    "body_class": "BodyClass",
+    "engine": "EngineModel",
+    "fuel_type": "FuelTypePrimary",
+    "manufacturer": "Manufacturer",
+    "plant_city": "PlantCity",
+    "vehicle_type": "VehicleType"
+}
+
+# Fields a projection may name; "full_data" is assembled on demand
+RESULT_FIELDS = (*FLAT_FIELDS, "full_data")
+
+# Everything except full_data: enough for agents and UI summaries
+SUMMARY_FIELDS = tuple(FLAT_FIELDS)
+
+# vPIC placeholders that carry no information
+_EMPTY_VALUES = ("", "Not Applicable")
+
+# Flat keys that duplicate the record's own attributes
+_SKIPPED_KEYS = frozenset(FLAT_FIELDS.values()) | {"VIN"}
+
+
+@dataclass(frozen=True, slots=True)
+class DecodedVehicle:
+    """
+    One decoded VIN.
+
+    Instances are immutable, so a single record can be shared between
+    concurrent callers and cache tiers without copying.
+    """
+
+    vin: str
+    make: str = UNKNOWN
+    model: str = UNKNOWN
+    year: str = UNKNOWN
+    trim: str = UNKNOWN
+    body_class: str = UNKNOWN
+    engine: str = UNKNOWN
+    fuel_type: str = UNKNOWN
+    manufacturer: str = UNKNOWN
+    plant_city: str = UNKNOWN
+    vehicle_type: str = UNKNOWN
+    # Remaining non-empty DecodeVinValues entries as (key, value) pairs
+    extra: Tuple[Tuple[str, str], ...] = ()
+    # Served from an expired cache entry because vPIC was unavailable
+    stale: bool = False
+
+    @classmethod
+    def from_flat(cls, vin: str, row: Dict[str, Any]) -> "DecodedVehicle":
+        """
+        Build a record from a flat DecodeVinValues row.
+
+        Args:
+            vin: Vehicle Identification Number
+            row: One element of the response's "Results" list
+
+        Returns:
+            The compact record
+        """
+        core = {}
+        for field, key in FLAT_FIELDS.items():
+            value = row.get(key)
+            if value and value not in _EMPTY_VALUES:
+                core[field] = str(value)
+
+        extra = tuple(
+            (key, str(value)) for key, value in row.items()
+            if key not in _SKIPPED_KEYS and value and value not in _EMPTY_VALUES
+        )
+        return cls(vin=vin, extra=extra, **core)
+
+    @classmethod
+    def from_compact(cls, data: Dict[str, Any], vin: Optional[str] = None) -> "DecodedVehicle":
+        """
+        Rebuild a record from its to_compact() form.
+
+        Args:
+            data: Dictionary produced by to_compact()
+            vin: VIN to attach (pattern-tier entries carry none of their own)
+
+        Returns:
+            The record
+        """
+        core = {field: data[field] for field in FLAT_FIELDS if field in data}
+        extra = tuple((key, value) for key, value in data.get("extra", {}).items())
+        return cls(vin=vin or data.get("vin", ""), extra=extra, **core)
+
+    def to_compact(self) -> Dict[str, Any]:
+        """
+        Serialize for storage, omitting unknown fields and the stale flag.
+
+        Returns:
+            JSON-compatible dictionary
+        """
+        data: Dict[str, Any] = {"vin": self.vin}
+        for field in FLAT_FIELDS:
+            value = getattr(self, field)
+            if value != UNKNOWN:
+                data[field] = value
+        if self.extra:
+            data["extra"] = dict(self.extra)
+        return data
+
+    @property
+    def error_code(self) -> str:
+        """vPIC's ErrorCode for this decode ("0" means a clean decode)."""
+        for key, value in self.extra:
+            if key == "ErrorCode":
+                return value.split(",")[0].strip()
+        return "0"
+
+    def is_clean(self) -> bool:
+        """
+        Check whether the decode can be shared with other VINs of the same build.
+
+        Decodes that vPIC flagged (e.g. a bad check digit) or that did not
+        resolve make/model describe this VIN only.
+        """
+        return self.error_code == "0" and self.make != UNKNOWN and self.model != UNKNOWN
+
+    def full_data(self) -> Dict[str, str]:
+        """
+        Assemble every non-empty decoded value, keyed by flat vPIC name.
+
+        Returns:
+            A new dictionary on each call
+        """
+        data = {
+            key: getattr(self, field)
+            for field, key in FLAT_FIELDS.items()
+            if getattr(self, field) != UNKNOWN
+        }
+        data.update(self.extra)
+        return data
+
+    def to_dict(self, fields: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        Render the record in the decode_vin result shape.
+
+        Args:
+            fields: Result fields to include (see RESULT_FIELDS). None means
+                all of them, including full_data.
+
+        Returns:
+            Dictionary with success, vin, the requested fields and, for
+            stale records, "stale": True
+
+        Raises:
+            ValueError: If a requested field is not in RESULT_FIELDS
+        """
+        selected = RESULT_FIELDS if fields is None else tuple(fields)
+        unknown = [name for name in selected if name not in RESULT_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown decode fields: {', '.join(unknown)}")
+
+        result: Dict[str, Any] = {"success": True, "vin": self.vin}
+        for name in selected:
+            result[name] = self.full_data() if name == "full_data" else getattr(self, name)
+        if self.stale:
+            result["stale"] = True
+        return result
+
+    def with_vin(self, vin: str) -> "DecodedVehicle":
+        """Return this decode attached to another VIN of the same build."""
+        return self if vin == self.vin else replace(self, vin=vin)
+
+    def mark_stale(self) -> "DecodedVehicle":
+        """Return a copy flagged as served from an expired cache entry."""
+        return replace(self, stale=True)
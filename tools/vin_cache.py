@@ -0,0 +1,428 @@
+"""
+Two-tier cache for decoded VINs.
+
+Decoded specs for a VIN never change, so successful NHTSA decodes are kept in
+an in-process LRU that sits in front of a SQLite file. The file survives
+process restarts, so re-appraisals and repeat decodes from the UI cost zero
+network round trips.
+
+Beneath the exact-VIN tier sits a pattern tier keyed on the "squish VIN"
+(positions 1-8 plus 10-11). VINs that differ only in their serial number
+share a build, so one clean decode serves every later VIN of that build.
+
+Configuration (environment variables):
+    ENABLE_CACHING: Set to "false" to disable the cache entirely.
+    VIN_CACHE_PATH: SQLite file location (default: .cache/vin_cache.sqlite).
+    VIN_CACHE_TTL_DAYS: Days before a cached decode is refreshed (default: 90).
+    VIN_CACHE_MEMORY_SIZE: Max entries held in each in-process LRU (default: 2048).
+    VIN_CACHE_MAX_ENTRIES: Max entries kept on disk per tier (default: 500000).
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from tools.vin_check import normalize_vin
+
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ".cache",
+    "vin_cache.sqlite"
+)
+
+# Bump when the shape of cached records changes so stale rows are dropped
+SCHEMA_VERSION = 3
+
+# Fields that belong to one specific VIN rather than to its build pattern
+VIN_SPECIFIC_FIELDS = ("vin",)
+
+
+def squish_vin(vin: str) -> str:
+    """
+    Reduce a VIN to its "squish VIN" build pattern.
+
+    NHTSA decodes depend on the WMI/VDS (positions 1-8), the model-year
+    character (10) and the plant code (11), not on the check digit (9) or
+    the serial number (12-17).
+
+    Args:
+        vin: Vehicle Identification Number (17 characters)
+
+    Returns:
+        The 10-character pattern key
+    """
+    key = normalize_vin(vin)
+    return key[:8] + key[9:11]
+
+
+class _Tier:
+    """One cache tier: an LRU dict in front of a SQLite table."""
+
+    def __init__(self, table: str, memory_size: int):
+        self.table = table
+        self.memory_size = memory_size
+        self.memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.disk_count = 0
+
+    def remember(self, key: str, created_at: float, payload: str) -> None:
+        """Insert into the LRU, evicting the least recently used entry."""
+        self.memory[key] = (created_at, payload)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+
+class VinCache:
+    """
+    Decoded-VIN cache with an exact-VIN tier and a build-pattern tier.
+
+    Each tier is an in-process LRU in front of a SQLite table. The exact tier
+    is keyed by normalized VIN; the pattern tier is keyed by squish VIN so a
+    new VIN of an already-seen build can be answered without an API call.
+
+    Records are stored as JSON so every hit returns a fresh copy that callers
+    are free to mutate.
+
+    The LRUs and counters have their own lock, separate from the one that
+    serializes SQLite, and it is never held across I/O: an LRU hit (aget on
+    the event loop included) does not wait behind a slow disk write.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl_seconds: float = 90 * 24 * 3600,
+        memory_size: int = 2048,
+        max_disk_entries: int = 500_000
+    ):
+        """
+        Args:
+            path: SQLite file location, or ":memory:" for a process-local store.
+            ttl_seconds: Age after which an entry is treated as a miss.
+            memory_size: Max entries held in each in-process LRU.
+            max_disk_entries: Max entries kept on disk per tier before the oldest are evicted.
+        """
+        self.path = path or DEFAULT_CACHE_PATH
+        self.ttl_seconds = ttl_seconds
+        self.memory_size = memory_size
+        self.max_disk_entries = max_disk_entries
+
+        self._lock = threading.RLock()
+        self._memory_lock = threading.Lock()
+        self._exact = _Tier("vin_decodes", memory_size)
+        self._pattern = _Tier("vin_patterns", memory_size)
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "pattern_hits": 0,
+            "pattern_misses": 0,
+            "expired": 0,
+            "puts": 0,
+            "pattern_puts": 0,
+            "evictions": 0
+        }
+
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._init_schema()
+
+    def _init_schema(self) -> None:
+        """Create tables, dropping rows written by an older schema version."""
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        for tier in (self._exact, self._pattern):
+            if version != SCHEMA_VERSION:
+                self._conn.execute(f"DROP TABLE IF EXISTS {tier.table}")
+            self._conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {tier.table} (
+                    key TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    payload TEXT NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{tier.table}_created ON {tier.table} (created_at)"
+            )
+            tier.disk_count = self._conn.execute(f"SELECT COUNT(*) FROM {tier.table}").fetchone()[0]
+
+        self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.commit()
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return (time.time() - created_at) <= self.ttl_seconds
+
+    def _lookup(self, tier: _Tier, key: str, allow_stale: bool = False) -> Tuple[Optional[str], str]:
+        """
+        Read a payload from one tier.
+
+        Expired entries are kept (until replaced or evicted) so they can be
+        served when the upstream API is unavailable.
+
+        Returns:
+            (payload or None, "memory" | "disk" | "miss")
+        """
+        payload = self._memory_only(tier, key, allow_stale)
+        if payload is not None:
+            return payload, "memory"
+
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT created_at, payload FROM {tier.table} WHERE key = ?",
+                (key,)
+            ).fetchone()
+
+            if row is None:
+                return None, "miss"
+
+            created_at, payload = row
+            if not allow_stale and not self._is_fresh(created_at):
+                self._count("expired")
+                return None, "miss"
+
+            with self._memory_lock:
+                tier.remember(key, created_at, payload)
+        return payload, "disk"
+
+    def _store(self, tier: _Tier, key: str, payload: str) -> None:
+        """Write a payload to both levels of one tier."""
+        created_at = time.time()
+        with self._lock:
+            exists = self._conn.execute(
+                f"SELECT 1 FROM {tier.table} WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {tier.table} (key, created_at, payload) VALUES (?, ?, ?)",
+                (key, created_at, payload)
+            )
+            if not exists:
+                tier.disk_count += 1
+            self._evict_disk(tier)
+            self._conn.commit()
+            # Still under the SQLite lock so the LRU and the table agree on the last write
+            with self._memory_lock:
+                tier.remember(key, created_at, payload)
+
+    def _count(self, name: str) -> None:
+        with self._memory_lock:
+            self._counters[name] += 1
+
+    def _evict_disk(self, tier: _Tier) -> None:
+        """Drop the oldest rows of a tier once the on-disk cap is exceeded."""
+        if tier.disk_count <= self.max_disk_entries:
+            return
+
+        # Evict a slice at a time so we don't pay for a DELETE on every put
+        overflow = tier.disk_count - self.max_disk_entries
+        batch = max(overflow, self.max_disk_entries // 10, 1)
+        cursor = self._conn.execute(
+            f"""
+            DELETE FROM {tier.table} WHERE key IN (
+                SELECT key FROM {tier.table} ORDER BY created_at LIMIT ?
+            )
+            """,
+            (batch,)
+        )
+        tier.disk_count -= cursor.rowcount
+        with self._memory_lock:
+            self._counters["evictions"] += cursor.rowcount
+
+    def get(self, vin: str, allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Look up a decoded VIN in the exact-VIN tier.
+
+        Args:
+            vin: Vehicle Identification Number (any case/whitespace)
+            allow_stale: Also return entries older than the TTL
+
+        Returns:
+            A copy of the cached decode, or None on a miss
+        """
+        payload, source = self._lookup(self._exact, normalize_vin(vin), allow_stale)
+        if payload is None:
+            self._count("misses")
+            return None
+        self._count(f"{source}_hits")
+        return json.loads(payload)
+
+    def put(self, vin: str, record: Dict[str, Any]) -> None:
+        """
+        Store a decoded VIN in the exact-VIN tier.
+
+        Args:
+            vin: Vehicle Identification Number
+            record: Compact decode (DecodedVehicle.to_compact())
+        """
+        payload = json.dumps(record, separators=(",", ":"))
+        self._store(self._exact, normalize_vin(vin), payload)
+        self._count("puts")
+
+    def get_pattern(self, vin: str, allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Look up a decode for any VIN sharing this VIN's build pattern.
+
+        Args:
+            vin: Vehicle Identification Number (17 characters)
+            allow_stale: Also return entries older than the TTL
+
+        Returns:
+            A copy of the pattern's decode with VIN-specific fields removed,
+            or None on a miss
+        """
+        payload, _ = self._lookup(self._pattern, squish_vin(vin), allow_stale)
+        if payload is None:
+            self._count("pattern_misses")
+            return None
+        self._count("pattern_hits")
+        return json.loads(payload)
+
+    def put_pattern(self, vin: str, record: Dict[str, Any]) -> None:
+        """
+        Store a decode under this VIN's build pattern.
+
+        Args:
+            vin: Vehicle Identification Number the record was decoded from
+            record: Compact decode (DecodedVehicle.to_compact())
+        """
+        shared = {k: v for k, v in record.items() if k not in VIN_SPECIFIC_FIELDS}
+        payload = json.dumps(shared, separators=(",", ":"))
+        self._store(self._pattern, squish_vin(vin), payload)
+        self._count("pattern_puts")
+
+    def _memory_only(self, tier: _Tier, key: str, allow_stale: bool) -> Optional[str]:
+        """Return a payload from the LRU level of a tier without touching SQLite."""
+        with self._memory_lock:
+            entry = tier.memory.get(key)
+            if entry is None or not (allow_stale or self._is_fresh(entry[0])):
+                return None
+            tier.memory.move_to_end(key)
+            return entry[1]
+
+    async def aget(self, vin: str, allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Async get(): LRU hits are answered inline, SQLite reads run in a worker thread.
+
+        Args:
+            vin: Vehicle Identification Number (any case/whitespace)
+            allow_stale: Also return entries older than the TTL
+
+        Returns:
+            A copy of the cached decode, or None on a miss
+        """
+        payload = self._memory_only(self._exact, normalize_vin(vin), allow_stale)
+        if payload is not None:
+            self._count("memory_hits")
+            return json.loads(payload)
+        return await asyncio.to_thread(self.get, vin, allow_stale)
+
+    async def aget_pattern(self, vin: str, allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+        """Async get_pattern(); see aget()."""
+        payload = self._memory_only(self._pattern, squish_vin(vin), allow_stale)
+        if payload is not None:
+            self._count("pattern_hits")
+            return json.loads(payload)
+        return await asyncio.to_thread(self.get_pattern, vin, allow_stale)
+
+    async def aput(self, vin: str, record: Dict[str, Any]) -> None:
+        """Async put(); the SQLite write runs in a worker thread."""
+        await asyncio.to_thread(self.put, vin, record)
+
+    async def aput_pattern(self, vin: str, record: Dict[str, Any]) -> None:
+        """Async put_pattern(); the SQLite write runs in a worker thread."""
+        await asyncio.to_thread(self.put_pattern, vin, record)
+
+    def clear(self) -> None:
+        """Remove every entry from both tiers."""
+        with self._lock:
+            for tier in (self._exact, self._pattern):
+                with self._memory_lock:
+                    tier.memory.clear()
+                self._conn.execute(f"DELETE FROM {tier.table}")
+                tier.disk_count = 0
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report hit/miss counters and tier sizes.
+
+        Lookups fall through exact -> pattern, so every pattern hit is a
+        network call the exact-VIN tier alone could not have saved.
+
+        Returns:
+            Dictionary with per-tier hits, misses, hit rates, network calls
+            saved by each tier, and entry counts
+        """
+        with self._memory_lock:
+            counters = dict(self._counters)
+            exact_hits = counters["memory_hits"] + counters["disk_hits"]
+            pattern_hits = counters["pattern_hits"]
+            lookups = exact_hits + counters["misses"]
+            saved = exact_hits + pattern_hits
+            return {
+                **counters,
+                "hits": exact_hits,
+                "lookups": lookups,
+                "hit_rate": round(exact_hits / lookups, 4) if lookups else 0.0,
+                "combined_hit_rate": round(saved / lookups, 4) if lookups else 0.0,
+                "network_calls_saved": {
+                    "exact": exact_hits,
+                    "pattern": pattern_hits,
+                    "total": saved,
+                    "pattern_share": round(pattern_hits / saved, 4) if saved else 0.0
+                },
+                "memory_entries": len(self._exact.memory),
+                "disk_entries": self._exact.disk_count,
+                "pattern_memory_entries": len(self._pattern.memory),
+                "pattern_disk_entries": self._pattern.disk_count,
+                "path": self.path
+            }
+
+    def close(self) -> None:
+        """Close the underlying SQLite connection."""
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache: Optional[VinCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_vin_cache() -> Optional[VinCache]:
+    """
+    Return the process-wide VIN cache, creating it on first use.
+
+    Returns:
+        The shared VinCache, or None when caching is disabled
+    """
+    global _default_cache
+
+    if os.getenv("ENABLE_CACHING", "true").lower() == "false":
+        return None
+
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = VinCache(
+                    path=os.getenv("VIN_CACHE_PATH", DEFAULT_CACHE_PATH),
+                    ttl_seconds=float(os.getenv("VIN_CACHE_TTL_DAYS", "90")) * 24 * 3600,
+                    memory_size=int(os.getenv("VIN_CACHE_MEMORY_SIZE", "2048")),
+                    max_disk_entries=int(os.getenv("VIN_CACHE_MAX_ENTRIES", "500000"))
+                )
+    return _default_cache
+
+
+def set_vin_cache(cache: Optional[VinCache]) -> None:
+    """Replace the process-wide VIN cache (used by tests and custom setups)."""
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
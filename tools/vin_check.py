@@ -0,0 +1,287 @@
+"""
+Local VIN validator and pre-decoder.
+
+Answers the questions that don't need NHTSA: is the VIN well formed, does
+its position-9 check digit compute, who made it (from a bundled WMI table)
+and which model year it encodes. check_vins() does the same for whole
+columns of VINs with NumPy, so million-row lead files can be screened in
+seconds before anything touches the network.
+"""
+
+import csv
+import os
+import threading
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+DEFAULT_WMI_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "data",
+    "wmi_codes.csv"
+)
+
+VIN_LENGTH = 17
+
+# ISO 3779 transliteration; I, O and Q are never valid in a VIN
+TRANSLITERATION = {
+    **{str(d): d for d in range(10)},
+    "A": 1, "B": 2, "C": 3, "D": 4, "E": 5, "F": 6, "G": 7, "H": 8,
+    "J": 1, "K": 2, "L": 3, "M": 4, "N": 5, "P": 7, "R": 9,
+    "S": 2, "T": 3, "U": 4, "V": 5, "W": 6, "X": 7, "Y": 8, "Z": 9
+}
+
+POSITION_WEIGHTS = (8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2)
+
+# Position-10 model-year codes in cycle order (1980/2010 first)
+MODEL_YEAR_CODES = "ABCDEFGHJKLMNPRSTVWXY123456789"
+
+# The check digit is mandatory for vehicles built for North America
+CHECK_DIGIT_REGIONS = "12345"
+
+REGIONS = (
+    ("12345", "North America"),
+    ("67", "Oceania"),
+    ("89", "South America"),
+    ("ABCDEFGH", "Africa"),
+    ("JKLMNPR", "Asia"),
+    ("STUVWXYZ", "Europe")
+)
+
+
+def _region(wmi: str) -> str:
+    first = wmi[:1]
+    for chars, name in REGIONS:
+        if first and first in chars:
+            return name
+    return "Unknown"
+
+
+def normalize_vin(vin: Any) -> str:
+    """
+    Canonical form of a VIN: stripped and uppercased ("" for None).
+
+    Every module keys VINs (caches, snapshots, listing dedup) with this.
+    """
+    return "" if vin is None else str(vin).strip().upper()
+
+
+def compute_check_digit(vin: str) -> Optional[str]:
+    """
+    Compute the expected position-9 check digit.
+
+    Args:
+        vin: Normalized 17-character VIN
+
+    Returns:
+        "0"-"9" or "X", or None if the VIN contains invalid characters
+    """
+    try:
+        total = sum(TRANSLITERATION[c] * w for c, w in zip(vin, POSITION_WEIGHTS))
+    except KeyError:
+        return None
+    remainder = total % 11
+    return "X" if remainder == 10 else str(remainder)
+
+
+def decode_model_year(vin: str) -> Tuple[Optional[int], List[int]]:
+    """
+    Decode the position-10 model-year character.
+
+    Codes repeat every 30 years. For North American light vehicles a numeric
+    position 7 means the 1980-2009 cycle and a letter means 2010-2039.
+
+    Args:
+        vin: Normalized 17-character VIN
+
+    Returns:
+        (best guess or None, every year the code could mean)
+    """
+    index = MODEL_YEAR_CODES.find(vin[9:10]) if len(vin) >= 10 else -1
+    if index < 0:
+        return None, []
+
+    candidates = [1980 + index, 2010 + index]
+    if vin[:1] in CHECK_DIGIT_REGIONS and len(vin) >= 7:
+        return (candidates[0] if vin[6].isdigit() else candidates[1]), candidates
+    return None, candidates
+
+
+def load_wmi_table(path: str = DEFAULT_WMI_PATH) -> Dict[str, Dict[str, str]]:
+    """
+    Load the bundled WMI -> manufacturer table.
+
+    Args:
+        path: CSV with wmi, make and country columns
+
+    Returns:
+        Rows keyed by WMI
+    """
+    with open(path, "r", newline="") as f:
+        return {
+            row["wmi"].strip().upper(): {"make": row["make"], "country": row["country"]}
+            for row in csv.DictReader(f)
+        }
+
+
+_wmi_table: Optional[Dict[str, Dict[str, str]]] = None
+_wmi_table_lock = threading.Lock()
+
+
+def get_wmi_table() -> Dict[str, Dict[str, str]]:
+    """Return the bundled WMI table, loading it on first use."""
+    global _wmi_table
+    if _wmi_table is None:
+        with _wmi_table_lock:
+            if _wmi_table is None:
+                _wmi_table = load_wmi_table()
+    return _wmi_table
+
+
+def check_vin(vin: str) -> Dict[str, Any]:
+    """
+    Validate and pre-decode a single VIN without the network.
+
+    Args:
+        vin: Vehicle Identification Number
+
+    Returns:
+        Dictionary with validity flags, errors, check digit, WMI
+        manufacturer and model year
+    """
+    key = normalize_vin(vin)
+    errors = []
+
+    structure_valid = True
+    if len(key) != VIN_LENGTH:
+        structure_valid = False
+        errors.append("Invalid VIN format. VIN must be 17 characters.")
+    bad_chars = sorted({c for c in key if c not in TRANSLITERATION})
+    if bad_chars:
+        structure_valid = False
+        errors.append(
+            f"Invalid VIN characters: {', '.join(bad_chars)} (I, O and Q are never used)"
+        )
+
+    expected = compute_check_digit(key) if structure_valid else None
+    check_digit_valid = expected is not None and key[8] == expected
+    check_digit_required = key[:1] in CHECK_DIGIT_REGIONS
+    if structure_valid and not check_digit_valid and check_digit_required:
+        errors.append(
+            f"VIN check digit (position 9) is '{key[8]}', expected '{expected}'"
+        )
+
+    wmi = key[:3]
+    maker = get_wmi_table().get(wmi, {})
+    model_year, candidates = decode_model_year(key) if structure_valid else (None, [])
+
+    return {
+        "vin": vin,
+        "valid": structure_valid and (check_digit_valid or not check_digit_required),
+        "structure_valid": structure_valid,
+        "check_digit": expected,
+        "check_digit_valid": check_digit_valid,
+        "check_digit_required": check_digit_required,
+        "errors": errors,
+        "wmi": wmi,
+        "make": maker.get("make", "Unknown"),
+        "country": maker.get("country", "Unknown"),
+        "region": _region(wmi),
+        "model_year": model_year,
+        "model_year_candidates": candidates
+    }
+
+
+# Lookup tables for the vectorized path, indexed by ASCII byte value
+_VALUE_TABLE = np.full(256, -1, dtype=np.int16)
+for _char, _value in TRANSLITERATION.items():
+    _VALUE_TABLE[ord(_char)] = _value
+
+_YEAR_INDEX_TABLE = np.full(256, -1, dtype=np.int16)
+for _index, _char in enumerate(MODEL_YEAR_CODES):
+    _YEAR_INDEX_TABLE[ord(_char)] = _index
+
+_WEIGHTS = np.array(POSITION_WEIGHTS, dtype=np.int32)
+_CHECK_CHARS = np.frombuffer(b"0123456789X", dtype=np.uint8)
+
+
+def check_vins(vins: Iterable[str]) -> Dict[str, np.ndarray]:
+    """
+    Validate and pre-decode many VINs at once.
+
+    Same rules as check_vin, evaluated column-wise over a (n, 17) byte
+    matrix so the cost per VIN is a handful of vector operations.
+
+    Args:
+        vins: Vehicle Identification Numbers
+
+    Returns:
+        Dictionary of length-n arrays: valid, structure_valid,
+        check_digit_valid, check_digit_required, model_year (0 when it
+        can't be decided), wmi and make
+    """
+    keys = [normalize_vin(v) for v in vins]
+    n = len(keys)
+
+    lengths = np.fromiter((len(k) for k in keys), dtype=np.int32, count=n)
+    encoded = np.array(
+        [k.encode("ascii", "replace") for k in keys],
+        dtype=f"S{VIN_LENGTH}"
+    )
+    codes = encoded.view(np.uint8).reshape(n, VIN_LENGTH)
+
+    values = _VALUE_TABLE[codes]
+    structure_valid = (lengths == VIN_LENGTH) & (values >= 0).all(axis=1)
+
+    remainders = (values.astype(np.int32) @ _WEIGHTS) % 11
+    check_digit_valid = structure_valid & (codes[:, 8] == _CHECK_CHARS[remainders])
+    check_digit_required = np.isin(codes[:, 0], np.frombuffer(CHECK_DIGIT_REGIONS.encode(), dtype=np.uint8))
+
+    year_index = _YEAR_INDEX_TABLE[codes[:, 9]]
+    later_cycle = ~((codes[:, 6] >= ord("0")) & (codes[:, 6] <= ord("9")))
+    model_year = np.where(
+        structure_valid & check_digit_required & (year_index >= 0),
+        1980 + year_index + 30 * later_cycle,
+        0
+    ).astype(np.int16)
+
+    wmi = np.ascontiguousarray(codes[:, :3]).view("S3").ravel()
+    unique_wmi, inverse = np.unique(wmi, return_inverse=True)
+    table = get_wmi_table()
+    makes = np.array(
+        [table.get(w.decode("ascii", "replace"), {}).get("make", "Unknown") for w in unique_wmi],
+        dtype=object
+    )
+
+    return {
+        "valid": structure_valid & (check_digit_valid | ~check_digit_required),
+        "structure_valid": structure_valid,
+        "check_digit_valid": check_digit_valid,
+        "check_digit_required": check_digit_required,
+        "model_year": model_year,
+        "wmi": unique_wmi.astype("U3")[inverse],
+        "make": makes[inverse]
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) < 2:
+        print("Usage: python tools/vin_check.py <file.csv> [vin_column]")
+        sys.exit(1)
+
+    column = sys.argv[2] if len(sys.argv) > 2 else "vin"
+    with open(sys.argv[1], "r", newline="") as f:
+        vins = [row[column] for row in csv.DictReader(f)]
+
+    started = time.perf_counter()
+    screened = check_vins(vins)
+    elapsed = time.perf_counter() - started
+
+    print(f"Screened {len(vins)} VINs in {elapsed:.3f}s")
+    print(f"  Valid:               {int(screened['valid'].sum())}")
+    print(f"  Malformed:           {int((~screened['structure_valid']).sum())}")
+    print(f"  Bad check digit:     {int((screened['structure_valid'] & ~screened['valid']).sum())}")
@@ -0,0 +1,348 @@
+"""
+Resumable bulk VIN enrichment.
+
+Streams a CSV shaped like data/demo_vins.csv through decode_vins and writes
+each row back out with its vPIC decode (JSONL, or Parquet when pyarrow is
+installed). Every decode also lands in the VIN cache, so running this over
+the expected trade-in pool overnight turns the interactive decode_vin path
+into a cache hit.
+
+The job is built for millions of rows:
+    - Rows are read and written a window at a time, never all at once.
+    - After each window is flushed a checkpoint records how many input rows
+      are done and how far the output got, so an interrupted run resumes
+      where it stopped (a partially written window is discarded). The
+      checkpoint also records the input's path, size and mtime, and a
+      resume against any other input is refused.
+    - Batches in a window run concurrently. The number in flight follows
+      AIMD: +1 after a healthy window, halved after a slow or failing one,
+      so the job backs off when vPIC struggles and speeds up when it doesn't.
+
+Usage:
+    python tools/vin_enrich.py <input.csv> <output.jsonl|output_dir> [--format parquet]
+"""
+
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterator, List, Optional
+
+# Allow running as a script from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.nhtsa_api import BATCH_SIZE, decode_vins
+from tools.vehicle_record import SUMMARY_FIELDS
+from tools.vin_cache import get_vin_cache
+
+
+# Prefix for decode columns, so they never collide with the input's own
+# make/model/year columns
+COLUMN_PREFIX = "vpic_"
+
+# Errors that mean vPIC (not the VIN) was the problem
+TRANSPORT_ERRORS = ("API request failed", "Failed to decode VIN batch", "VIN missing from batch response")
+
+
+class AimdLimiter:
+    """
+    Additive-increase / multiplicative-decrease concurrency limit.
+
+    A window is healthy when its slowest batch finished within
+    target_latency and its transport error rate stayed under
+    error_threshold.
+    """
+
+    def __init__(
+        self,
+        initial: int = 2,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        target_latency: float = 5.0,
+        error_threshold: float = 0.05,
+        decrease_factor: float = 0.5
+    ):
+        """
+        Args:
+            initial: Batches in flight for the first window
+            min_limit: Lower bound on batches in flight
+            max_limit: Upper bound on batches in flight
+            target_latency: Slowest acceptable batch, in seconds
+            error_threshold: Highest acceptable share of transport errors
+            decrease_factor: Multiplier applied to the limit after a bad window
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.error_threshold = error_threshold
+        self.decrease_factor = decrease_factor
+        self.limit = max(min_limit, min(initial, max_limit))
+        self.increases = 0
+        self.decreases = 0
+
+    def record(self, latency: float, error_rate: float) -> int:
+        """
+        Adjust the limit after a window.
+
+        Args:
+            latency: Slowest batch in the window, in seconds
+            error_rate: Share of the window's VINs that hit transport errors
+
+        Returns:
+            The new limit
+        """
+        if latency > self.target_latency or error_rate > self.error_threshold:
+            self.limit = max(self.min_limit, int(self.limit * self.decrease_factor))
+            self.decreases += 1
+        elif self.limit < self.max_limit:
+            self.limit += 1
+            self.increases += 1
+        return self.limit
+
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    """
+    Read a checkpoint file.
+
+    Args:
+        path: Checkpoint location
+
+    Returns:
+        The checkpoint, or a fresh one when the file doesn't exist
+    """
+    if not os.path.exists(path):
+        return {"rows_done": 0, "output_offset": 0, "parts": 0}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]) -> None:
+    """Write a checkpoint atomically (write to a temp file, then rename)."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _input_identity(path: str) -> Dict[str, Any]:
+    """Path, size and mtime of an input file, as recorded in its checkpoint."""
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _read_rows(path: str, skip: int) -> Iterator[Dict[str, str]]:
+    """Stream CSV rows, skipping the first `skip` data rows."""
+    with open(path, "r", newline="") as f:
+        for i, row in enumerate(csv.DictReader(f)):
+            if i >= skip:
+                yield row
+
+
+def _enrich_row(row: Dict[str, str], result: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge one decode result into its input row."""
+    enriched: Dict[str, Any] = dict(row)
+    enriched[f"{COLUMN_PREFIX}success"] = result["success"]
+    enriched[f"{COLUMN_PREFIX}error"] = result.get("error")
+    enriched[f"{COLUMN_PREFIX}stale"] = result.get("stale", False)
+    for field in SUMMARY_FIELDS:
+        enriched[f"{COLUMN_PREFIX}{field}"] = result.get(field)
+    return enriched
+
+
+def _is_transport_error(result: Dict[str, Any]) -> bool:
+    return not result["success"] and str(result.get("error", "")).startswith(TRANSPORT_ERRORS)
+
+
+class _JsonlWriter:
+    """Append-only JSONL output that can be truncated back to a checkpoint."""
+
+    def __init__(self, path: str, offset: int):
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        mode = "r+b" if os.path.exists(path) else "wb"
+        self._file = open(path, mode)
+        # Drop anything written after the last checkpoint
+        self._file.truncate(offset)
+        self._file.seek(offset)
+
+    def write(self, rows: List[Dict[str, Any]], checkpoint: Dict[str, Any]) -> None:
+        self._file.write(b"".join(
+            json.dumps(row, separators=(",", ":")).encode() + b"\n" for row in rows
+        ))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        checkpoint["output_offset"] = self._file.tell()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _ParquetWriter:
+    """One Parquet part file per window in an output directory."""
+
+    def __init__(self, path: str, parts: int):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow)") from e
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._dir = path
+        os.makedirs(path, exist_ok=True)
+        # Drop parts written after the last checkpoint
+        for name in os.listdir(path):
+            if name.startswith("part-") and name.endswith(".parquet"):
+                if int(name[5:-8]) > parts:
+                    os.remove(os.path.join(path, name))
+
+    def write(self, rows: List[Dict[str, Any]], checkpoint: Dict[str, Any]) -> None:
+        part = checkpoint["parts"] + 1
+        table = self._pa.Table.from_pylist(rows)
+        self._pq.write_table(table, os.path.join(self._dir, f"part-{part:06d}.parquet"))
+        checkpoint["parts"] = part
+
+    def close(self) -> None:
+        pass
+
+
+def enrich_csv(
+    input_path: str,
+    output_path: str,
+    checkpoint_path: Optional[str] = None,
+    output_format: str = "jsonl",
+    vin_column: str = "vin",
+    batch_size: int = BATCH_SIZE,
+    limiter: Optional[AimdLimiter] = None,
+    max_rows: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Decode every VIN in a CSV and write enriched rows, resuming from a checkpoint.
+
+    Args:
+        input_path: CSV with a VIN column
+        output_path: JSONL file, or a directory of Parquet parts
+        checkpoint_path: Checkpoint location (default: <output_path>.checkpoint.json)
+        output_format: "jsonl" or "parquet"
+        vin_column: Name of the VIN column
+        batch_size: VINs per decode_vins call (one vPIC request at most)
+        limiter: Concurrency controller (default: AimdLimiter())
+        max_rows: Stop after this many rows in this run (for testing/sampling)
+
+    Returns:
+        Dictionary with rows processed this run, totals, error counts,
+        the final concurrency limit and VIN cache stats
+
+    Raises:
+        ValueError: For an unknown output format, or when the checkpoint was
+            written for another input (or the input changed since)
+    """
+    if output_format not in ("jsonl", "parquet"):
+        raise ValueError(f"Unsupported output format: {output_format}")
+
+    checkpoint_path = checkpoint_path or f"{output_path.rstrip(os.sep)}.checkpoint.json"
+    limiter = limiter or AimdLimiter()
+    checkpoint = load_checkpoint(checkpoint_path)
+    identity = _input_identity(input_path)
+    if checkpoint.get("input", identity) != identity:
+        raise ValueError(
+            f"Checkpoint {checkpoint_path} was written for {checkpoint['input']}, not {identity}; "
+            "delete it (and the output) to start over"
+        )
+    checkpoint["input"] = identity
+
+    if output_format == "parquet":
+        writer = _ParquetWriter(output_path, checkpoint["parts"])
+    else:
+        writer = _JsonlWriter(output_path, checkpoint["output_offset"])
+
+    stats = {"rows": 0, "decoded": 0, "failed": 0, "transport_errors": 0, "windows": 0}
+    rows = _read_rows(input_path, checkpoint["rows_done"])
+    started = time.perf_counter()
+
+    def run_batch(batch: List[Dict[str, str]]):
+        batch_started = time.perf_counter()
+        results = decode_vins([row.get(vin_column, "") for row in batch], fields=SUMMARY_FIELDS)
+        return results, time.perf_counter() - batch_started
+
+    try:
+        with ThreadPoolExecutor(max_workers=limiter.max_limit) as pool:
+            while max_rows is None or stats["rows"] < max_rows:
+                budget = limiter.limit * batch_size
+                if max_rows is not None:
+                    budget = min(budget, max_rows - stats["rows"])
+
+                window = []
+                for row in rows:
+                    window.append(row)
+                    if len(window) >= budget:
+                        break
+                if not window:
+                    break
+
+                batches = [window[i:i + batch_size] for i in range(0, len(window), batch_size)]
+                outcomes = list(pool.map(run_batch, batches))
+
+                enriched = []
+                transport_errors = 0
+                for batch, (results, _) in zip(batches, outcomes):
+                    for row, result in zip(batch, results):
+                        enriched.append(_enrich_row(row, result))
+                        stats["decoded" if result["success"] else "failed"] += 1
+                        transport_errors += _is_transport_error(result)
+
+                writer.write(enriched, checkpoint)
+                checkpoint["rows_done"] += len(window)
+                save_checkpoint(checkpoint_path, checkpoint)
+
+                stats["rows"] += len(window)
+                stats["transport_errors"] += transport_errors
+                stats["windows"] += 1
+                limiter.record(max(latency for _, latency in outcomes), transport_errors / len(window))
+    finally:
+        writer.close()
+
+    cache = get_vin_cache()
+    return {
+        **stats,
+        "rows_done": checkpoint["rows_done"],
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
+        "concurrency": limiter.limit,
+        "concurrency_increases": limiter.increases,
+        "concurrency_decreases": limiter.decreases,
+        "cache": cache.stats() if cache is not None else None
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Decode a CSV of VINs and prewarm the VIN cache")
+    parser.add_argument("input", help="CSV with a VIN column")
+    parser.add_argument("output", help="JSONL file, or a directory for Parquet parts")
+    parser.add_argument("--format", default="jsonl", choices=("jsonl", "parquet"))
+    parser.add_argument("--vin-column", default="vin")
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--target-latency", type=float, default=5.0)
+    args = parser.parse_args()
+
+    summary = enrich_csv(
+        args.input,
+        args.output,
+        checkpoint_path=args.checkpoint,
+        output_format=args.format,
+        vin_column=args.vin_column,
+        limiter=AimdLimiter(max_limit=args.max_concurrency, target_latency=args.target_latency)
+    )
+
+    print(f"Enriched {summary['rows']} rows in {summary['elapsed_seconds']}s "
+          f"({summary['rows_done']} done in total)")
+    print(f"  Decoded:            {summary['decoded']}")
+    print(f"  Failed:             {summary['failed']}")
+    print(f"  Transport errors:   {summary['transport_errors']}")
+    print(f"  Final concurrency:  {summary['concurrency']}")
@@ -0,0 +1,173 @@
+"""
+Offline VIN decoder backed by a local vPIC pattern snapshot.
+
+The snapshot is a CSV export of vPIC decode patterns. Each row names a WMI
+(VIN positions 1-3) and a 7-character pattern over positions 4-8 and 10-11
+(the squish VIN without its WMI), where "*" matches any character. Rows are
+indexed by WMI so a decode is a dict lookup plus a short scan, with no
+network call. Lines starting with "#" are comments.
+
+No snapshot ships with the app: offline decoding is off until
+VPIC_SNAPSHOT_PATH names a real vPIC export. (tests/fixtures/vpic_snapshot.csv
+holds hand-written test fixtures, not vPIC data.)
+
+Configuration (environment variables):
+    VPIC_SNAPSHOT_PATH: Snapshot CSV location (default: unset, no offline decoding).
+"""
+
+import csv
+import os
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from tools.vehicle_record import FLAT_FIELDS, DecodedVehicle
+from tools.vin_check import normalize_vin
+
+
+PATTERN_LENGTH = 7
+WILDCARD = "*"
+
+# Snapshot columns copied into the decoded record
+SNAPSHOT_FIELDS = tuple(FLAT_FIELDS)
+
+
+def _pattern_key(vin: str) -> Tuple[str, str]:
+    """Split a normalized VIN into (WMI, positions 4-8 + 10-11)."""
+    return vin[:3], vin[3:8] + vin[9:11]
+
+
+class VpicSnapshot:
+    """
+    In-memory index over a vPIC pattern table.
+
+    Fully specified patterns go into a hash map keyed by squish VIN. Patterns
+    with wildcards are grouped by WMI and sorted most-specific first, so the
+    first match is the best one.
+    """
+
+    def __init__(self, rows: List[Dict[str, str]]):
+        """
+        Args:
+            rows: Snapshot rows with "wmi", "pattern" and SNAPSHOT_FIELDS columns
+        """
+        self._exact: Dict[str, Dict[str, str]] = {}
+        self._wildcards: Dict[str, List[Tuple[str, Dict[str, str]]]] = {}
+
+        for row in rows:
+            wmi = row["wmi"].strip().upper()
+            pattern = row["pattern"].strip().upper()
+            if len(wmi) != 3 or len(pattern) != PATTERN_LENGTH:
+                continue
+
+            fields = {
+                field: (row.get(field) or "").strip()
+                for field in SNAPSHOT_FIELDS
+            }
+
+            if WILDCARD in pattern:
+                self._wildcards.setdefault(wmi, []).append((pattern, fields))
+            else:
+                self._exact.setdefault(wmi + pattern, fields)
+
+        for patterns in self._wildcards.values():
+            patterns.sort(key=lambda item: item[0].count(WILDCARD))
+
+    @classmethod
+    def load(cls, path: str) -> "VpicSnapshot":
+        """
+        Load a snapshot CSV.
+
+        Args:
+            path: Snapshot CSV location
+
+        Returns:
+            Indexed snapshot
+        """
+        with open(path, "r", newline="") as f:
+            return cls(list(csv.DictReader(line for line in f if not line.startswith("#"))))
+
+    def __len__(self) -> int:
+        return len(self._exact) + sum(len(p) for p in self._wildcards.values())
+
+    def match(self, vin: str) -> Optional[Dict[str, str]]:
+        """
+        Find the most specific snapshot row for a VIN.
+
+        Args:
+            vin: Normalized 17-character VIN
+
+        Returns:
+            The row's fields, or None when the snapshot does not cover the VIN
+        """
+        wmi, key = _pattern_key(vin)
+
+        fields = self._exact.get(wmi + key)
+        if fields is not None:
+            return fields
+
+        for pattern, fields in self._wildcards.get(wmi, ()):
+            if all(p == WILDCARD or p == c for p, c in zip(pattern, key)):
+                return fields
+
+        return None
+
+    def decode_record(self, vin: str) -> Optional[DecodedVehicle]:
+        """
+        Decode a VIN from the snapshot into a compact record.
+
+        Args:
+            vin: Vehicle Identification Number (17 characters)
+
+        Returns:
+            The decoded record, or None when the snapshot does not cover the VIN
+        """
+        fields = self.match(normalize_vin(vin))
+        if fields is None:
+            return None
+        return DecodedVehicle(vin=vin, **{k: v for k, v in fields.items() if v})
+
+    def decode(self, vin: str) -> Optional[Dict[str, Any]]:
+        """
+        Decode a VIN from the snapshot.
+
+        Args:
+            vin: Vehicle Identification Number (17 characters)
+
+        Returns:
+            Dictionary shaped like the decode_vin result, or None when the
+            snapshot does not cover the VIN
+        """
+        record = self.decode_record(vin)
+        return record.to_dict() if record is not None else None
+
+
+_UNLOADED = object()
+_default_snapshot: Any = _UNLOADED
+_default_snapshot_lock = threading.Lock()
+
+
+def get_vpic_snapshot() -> Optional[VpicSnapshot]:
+    """
+    Return the process-wide vPIC snapshot, loading it on first use.
+
+    Returns:
+        The shared VpicSnapshot, or None when no snapshot is configured
+    """
+    global _default_snapshot
+
+    if _default_snapshot is _UNLOADED:
+        with _default_snapshot_lock:
+            if _default_snapshot is _UNLOADED:
+                path = os.getenv("VPIC_SNAPSHOT_PATH", "")
+                if path and os.path.exists(path):
+                    _default_snapshot = VpicSnapshot.load(path)
+                else:
+                    _default_snapshot = None
+    return _default_snapshot
+
+
+def set_vpic_snapshot(snapshot: Optional[VpicSnapshot]) -> None:
+    """Replace the process-wide snapshot (None disables offline decoding)."""
+    global _default_snapshot
+    with _default_snapshot_lock:
+        _default_snapshot = snapshot